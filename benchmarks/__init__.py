@@ -0,0 +1 @@
+# Empty
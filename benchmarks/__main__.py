@@ -0,0 +1,140 @@
+"""
+Benchmark suite for throughput, latency and KDF cost
+
+Usage:
+    python -m benchmarks
+    python -m benchmarks --sizes 1K,1M,64M,1G --backends all --workers 1,4
+    python -m benchmarks --output new.json --compare baseline.json
+    python -m benchmarks --ops cli_help,cli_encrypt
+    python -m benchmarks --ops aio_latency
+    python -m benchmarks --ops bundle_small_files
+    python -m benchmarks --ops records
+"""
+import sys
+import argparse
+import itertools
+
+from benchmarks import aio_bench, bundle_bench, cli_bench, crypto_bench
+from benchmarks.crypto_bench import case_id
+from benchmarks.harness import (
+    compare, default_workdir, format_size, load_results, parse_size, run_isolated, write_results
+)
+from crypto.backends import available_backends
+
+OPERATIONS = {**crypto_bench.OPERATIONS, **cli_bench.OPERATIONS, **aio_bench.OPERATIONS,
+              **bundle_bench.OPERATIONS}
+# Cases that do not vary with size, backend or container
+SINGLE_OPS = ('derive_key', 'cli_help', 'cli_encrypt', 'aio_latency', 'bundle_small_files', 'records')
+
+# The pure Python backend needs minutes per 100 MB
+PYAES_MAX_SIZE = 4 * 1024 * 1024
+ENCRYPT_DATA_MAX_SIZE = 256 * 1024 * 1024
+
+
+def _list(text: str, convert=str) -> list:
+    return [convert(item) for item in text.split(',') if item]
+
+
+def build_matrix(args) -> list:
+    """Expand the command line options into benchmark cases"""
+    backends = available_backends() if args.backends == 'all' else _list(args.backends)
+    cases = []
+
+    if 'derive_key' in args.ops:
+        cases.append({'op': 'derive_key', 'repeat': args.kdf_repeat})
+    for op in ('cli_help', 'cli_encrypt', 'aio_latency', 'bundle_small_files', 'records'):
+        if op in args.ops:
+            cases.append({'op': op, 'repeat': args.repeat, 'workdir': args.workdir})
+
+    for op, size, backend, container, chunk_size, workers, io_mode in itertools.product(
+        [op for op in args.ops if op not in SINGLE_OPS], args.sizes, backends, args.containers,
+        args.chunk_sizes, args.workers, args.io_modes
+    ):
+        if backend == 'pyaes' and size > PYAES_MAX_SIZE and not args.all:
+            continue
+        if op == 'encrypt_data':
+            if size > ENCRYPT_DATA_MAX_SIZE or (container, workers, io_mode) != (
+                    args.containers[0], args.workers[0], args.io_modes[0]):
+                continue
+            cases.append({'op': op, 'size': size, 'backend': backend,
+                          'chunk_size': chunk_size, 'repeat': args.repeat})
+            continue
+        # Workers only matter for the chunked container, mmap only for legacy
+        if container == 'legacy' and workers != args.workers[0]:
+            continue
+        if container == 'chunked' and io_mode not in (args.io_modes[0], 'pipeline'):
+            continue
+        cases.append({'op': op, 'size': size, 'backend': backend, 'container': container,
+                      'chunk_size': chunk_size, 'workers': workers, 'io_mode': io_mode,
+                      'repeat': args.repeat, 'workdir': args.workdir})
+
+    for case in cases:
+        case['id'] = case_id(case)
+    return cases
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ops', type=_list, default=list(OPERATIONS),
+                        help='Comma separated operations (default: all)')
+    parser.add_argument('--sizes', type=lambda text: _list(text, parse_size),
+                        default=_list('1K,1M,16M,128M', parse_size), help='File sizes, e.g. 1K,1M,2G')
+    parser.add_argument('--backends', default='all', help="Comma separated backends or 'all'")
+    parser.add_argument('--containers', type=_list, default=['legacy', 'chunked'])
+    parser.add_argument('--chunk-sizes', type=lambda text: _list(text, parse_size),
+                        default=_list('4M', parse_size))
+    parser.add_argument('--workers', type=lambda text: _list(text, int), default=[1])
+    parser.add_argument('--io-modes', type=_list, default=['auto'])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--kdf-repeat', type=int, default=5)
+    parser.add_argument('--workdir', default=default_workdir(), help='Scratch directory (tmpfs by default)')
+    parser.add_argument('--all', action='store_true', help='Also run slow pyaes cases on large sizes')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON results file')
+    parser.add_argument('--compare', help='Baseline JSON results to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Allowed p50 slowdown before a case counts as a regression')
+    args = parser.parse_args(argv)
+
+    unknown = set(args.ops) - set(OPERATIONS)
+    if unknown:
+        parser.error(f"Unknown operations: {', '.join(sorted(unknown))}")
+
+    results = []
+    print(f"{'case':<90} {'MB/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'RSS MB':>8}")
+    for case in build_matrix(args):
+        func = OPERATIONS[case['op']]
+        try:
+            result = {**case, **run_isolated(func, case)}
+        except Exception as e:
+            result = {**case, 'error': str(e)}
+            print(f"{case['id']:<90} error: {e}")
+            results.append(result)
+            continue
+
+        results.append(result)
+        mb_s = '-' if result['mb_s'] is None else f"{result['mb_s']:.1f}"
+        print(f"{case['id']:<90} {mb_s:>10} {result['p50_ms']:>10.2f} "
+              f"{result['p99_ms']:>10.2f} {result['peak_rss_mb']:>8.1f}")
+        if 'records_s' in result:
+            print(f"{'':<90} {result['records_s']:>10.0f} records/s encrypted, "
+                  f"{result['decrypt_records_s']:.0f} decrypted, {result['into_records_s']:.0f} with encrypt_into, "
+                  f"{result['encrypt_data_records_s']:.1f} with encrypt_data")
+
+    for result in results:
+        result.pop('workdir', None)
+    write_results(args.output, results, {'sizes': [format_size(size) for size in args.sizes]})
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        regressions = compare(results, load_results(args.compare), args.threshold)
+        for case, old, new, change in regressions:
+            print(f"REGRESSION {case}: {old:.2f} ms -> {new:.2f} ms (+{change:.0%})")
+        if regressions:
+            return 1
+        print("No regressions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import os
+import time
+import asyncio
+
+from benchmarks.crypto_bench import PASSWORD, _write_input
+from benchmarks.harness import peak_rss_mb, percentile
+
+AIO_FILES = 100
+AIO_FILE_SIZE = 256 * 1024
+# Blocking calls made straight from the loop for comparison
+BLOCKING_FILES = 5
+TICK = 0.001
+
+
+async def _ticker(lags: list, stop: asyncio.Event):
+    """Record how late a 1 ms sleep wakes up; the excess is event-loop lag"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(max(0.0, time.perf_counter() - start - TICK))
+
+
+async def _measure(work) -> tuple:
+    lags = []
+    stop = asyncio.Event()
+    ticker = asyncio.ensure_future(_ticker(lags, stop))
+    start = time.perf_counter()
+    await work()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await ticker
+    return lags, elapsed
+
+
+def bench_aio_latency(params: dict) -> dict:
+    """
+    Event-loop lag while AIO_FILES encryptions (PBKDF2 included) run through crypto.aio
+
+    p50/p99 are loop lag, not operation latency. The same figures for a
+    few FileEncryptor calls made directly on the loop are reported as
+    blocking_* to show what the facade avoids.
+    """
+    from crypto.aio import AsyncProcessor
+    from crypto.encryptor import FileEncryptor
+
+    paths = [os.path.join(params['workdir'], f"bench_aio_{os.getpid()}_{i}.bin") for i in range(AIO_FILES)]
+    for path in paths:
+        _write_input(path, AIO_FILE_SIZE)
+
+    async def run_async():
+        async with AsyncProcessor(max_concurrent=params.get('concurrency', 4)) as processor:
+            outputs = await asyncio.gather(*(processor.encrypt_file(path, PASSWORD) for path in paths))
+        for output in outputs:
+            os.remove(output)
+
+    async def run_blocking():
+        encryptor = FileEncryptor()
+        for path in paths[:BLOCKING_FILES]:
+            os.remove(encryptor.encrypt_file(path, PASSWORD))
+            await asyncio.sleep(0)
+
+    try:
+        lags, elapsed = asyncio.run(_measure(run_async))
+        blocking_lags, _ = asyncio.run(_measure(run_blocking))
+    finally:
+        for path in paths:
+            os.remove(path)
+
+    return {
+        'runs': AIO_FILES,
+        'p50_ms': round(percentile(lags, 50) * 1000, 3),
+        'p99_ms': round(percentile(lags, 99) * 1000, 3),
+        'max_lag_ms': round(max(lags, default=0.0) * 1000, 3),
+        'mean_ms': round(elapsed / AIO_FILES * 1000, 3),
+        'mb_s': round(AIO_FILES * AIO_FILE_SIZE / (1024 * 1024) / elapsed, 2),
+        'blocking_p99_ms': round(percentile(blocking_lags, 99) * 1000, 3),
+        'blocking_max_lag_ms': round(max(blocking_lags, default=0.0) * 1000, 3),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+OPERATIONS = {
+    'aio_latency': bench_aio_latency,
+}
@@ -0,0 +1,73 @@
+import os
+import time
+import shutil
+
+from benchmarks.crypto_bench import PASSWORD, _write_input
+from benchmarks.harness import peak_rss_mb
+
+BUNDLE_FILES = 2000
+BUNDLE_FILE_SIZE = 1024
+
+
+def bench_bundle_small_files(params: dict) -> dict:
+    """
+    Pack BUNDLE_FILES small files into one bundle, then list it and extract one member
+
+    The same files encrypted one output each with a batch KeySession
+    (the cheapest per-file path) are reported as per_file_* for comparison.
+    """
+    from crypto.bundle import Bundle
+    from crypto.encryptor import FileEncryptor
+
+    folder = os.path.join(params['workdir'], f"bench_bundle_{os.getpid()}")
+    bundle_path = folder + '.Wh04ami'
+    os.makedirs(folder)
+    try:
+        for i in range(BUNDLE_FILES):
+            _write_input(os.path.join(folder, f"{i}.bin"), BUNDLE_FILE_SIZE)
+
+        start = time.perf_counter()
+        with Bundle(bundle_path, PASSWORD, 'w') as bundle:
+            bundle.add_folder(folder)
+        create = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with Bundle(bundle_path, PASSWORD) as bundle:
+            listed = len(bundle.entries)
+            bundle.read(f"{BUNDLE_FILES // 2}.bin")
+        lookup = time.perf_counter() - start
+
+        encryptor = FileEncryptor(container='chunked')
+        start = time.perf_counter()
+        per_file_bytes = 0
+        with encryptor.start_session(PASSWORD) as session:
+            for i in range(BUNDLE_FILES):
+                output = encryptor.encrypt_file(os.path.join(folder, f"{i}.bin"), PASSWORD, session)
+                per_file_bytes += os.path.getsize(output)
+                os.remove(output)
+        per_file = time.perf_counter() - start
+        bundle_bytes = os.path.getsize(bundle_path)
+    finally:
+        shutil.rmtree(folder)
+        if os.path.exists(bundle_path):
+            os.remove(bundle_path)
+
+    return {
+        'runs': listed,
+        'files_s': round(BUNDLE_FILES / create, 1),
+        # One timed pass, so the percentiles are the mean time per member
+        'p50_ms': round(create / BUNDLE_FILES * 1000, 3),
+        'p99_ms': round(create / BUNDLE_FILES * 1000, 3),
+        'mean_ms': round(create / BUNDLE_FILES * 1000, 3),
+        'mb_s': round(BUNDLE_FILES * BUNDLE_FILE_SIZE / (1024 * 1024) / create, 2),
+        'open_extract_ms': round(lookup * 1000, 3),
+        'overhead_bytes': bundle_bytes - BUNDLE_FILES * BUNDLE_FILE_SIZE,
+        'per_file_files_s': round(BUNDLE_FILES / per_file, 1),
+        'per_file_overhead_bytes': per_file_bytes - BUNDLE_FILES * BUNDLE_FILE_SIZE,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+OPERATIONS = {
+    'bundle_small_files': bench_bundle_small_files,
+}
@@ -0,0 +1,67 @@
+import os
+import sys
+import subprocess
+
+from benchmarks.crypto_bench import PASSWORD, _write_input
+from benchmarks.harness import peak_rss_mb, summarize, time_runs
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+
+# Interactive-only modules that must stay out of scripted startup
+UI_MODULES = ('rich', 'pyfiglet')
+
+CLI_INPUT_SIZE = 1024
+
+
+def _run_cli(args: list, env: dict = None) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, MAIN] + args, env=env, check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def _ui_imports(args: list, env: dict = None) -> list:
+    """UI packages imported while running a CLI command"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', MAIN] + args, env=env, check=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    loaded = {line.rsplit('|', 1)[-1].strip().split('.')[0]
+              for line in result.stderr.splitlines() if line.startswith('import time:')}
+    return sorted(loaded.intersection(UI_MODULES))
+
+
+def _check_startup(args: list, env: dict = None):
+    loaded = _ui_imports(args, env)
+    if loaded:
+        raise Exception(f"CLI startup imports UI modules: {', '.join(loaded)}")
+
+
+def bench_cli_help(params: dict) -> dict:
+    """Cold start of `main.py encrypt --help` in a new interpreter"""
+    args = ['encrypt', '--help']
+    _check_startup(args)
+    times = time_runs(lambda: _run_cli(args), params['repeat'])
+    return {**summarize(times, 0), 'peak_rss_mb': peak_rss_mb()}
+
+
+def bench_cli_encrypt(params: dict) -> dict:
+    """Cold start plus a 1 KB encrypt through the CLI, PBKDF2 included"""
+    path = os.path.join(params['workdir'], f"bench_cli_{os.getpid()}.bin")
+    _write_input(path, CLI_INPUT_SIZE)
+    env = {**os.environ, 'WH04AMI_PASSWORD': PASSWORD}
+    args = ['encrypt', '-q', path]
+
+    def run():
+        _run_cli(args, env)
+        os.remove(path + '.Wh04ami')
+
+    try:
+        _check_startup(args, env)
+        os.remove(path + '.Wh04ami')
+        times = time_runs(run, params['repeat'])
+    finally:
+        os.remove(path)
+    return {**summarize(times, CLI_INPUT_SIZE), 'peak_rss_mb': peak_rss_mb()}
+
+
+OPERATIONS = {
+    'cli_help': bench_cli_help,
+    'cli_encrypt': bench_cli_encrypt,
+}
@@ -0,0 +1,151 @@
+import os
+import time
+import secrets
+
+from benchmarks.harness import peak_rss_mb, summarize, time_runs
+
+PASSWORD = 'benchmark-password'
+
+RECORD_COUNT = 20000
+RECORD_SIZE = 256
+
+
+def case_id(params: dict) -> str:
+    keys = ('op', 'size', 'backend', 'container', 'chunk_size', 'workers', 'io_mode')
+    return '/'.join(f"{key}={params[key]}" for key in keys if key in params)
+
+
+def _write_input(path: str, size: int):
+    """Random input written in 1 MiB pieces to keep the generator's memory flat"""
+    with open(path, 'wb') as file:
+        remaining = size
+        while remaining:
+            piece = min(remaining, 1024 * 1024)
+            file.write(secrets.token_bytes(piece))
+            remaining -= piece
+
+
+def bench_derive_key(params: dict) -> dict:
+    """Time _derive_key on its own (PBKDF2 cost)"""
+    from crypto.encryptor import FileEncryptor
+
+    encryptor = FileEncryptor()
+    salt = secrets.token_bytes(16)
+    times = time_runs(lambda: encryptor._derive_key(PASSWORD, salt), params['repeat'])
+    return {**summarize(times, 0), 'peak_rss_mb': peak_rss_mb()}
+
+
+def bench_encrypt_data(params: dict) -> dict:
+    from crypto.encryptor import FileEncryptor
+
+    encryptor = FileEncryptor(params['chunk_size'], params['backend'])
+    data = secrets.token_bytes(params['size'])
+    # Keep the KDF out of the cipher numbers
+    encryptor._derive_key = _fixed_key
+    times = time_runs(lambda: encryptor.encrypt_data(data, PASSWORD), params['repeat'])
+    return {**summarize(times, params['size']), 'peak_rss_mb': peak_rss_mb()}
+
+
+def bench_records(params: dict) -> dict:
+    """
+    Encrypt and decrypt RECORD_COUNT small records as one batch
+
+    Reported as records/s for encrypt_many, decrypt_many and
+    encrypt_into (one reused output buffer), each including its single
+    KDF run. encrypt_data_records_s is the per-record path (a KDF per
+    record) for comparison, timed over a few records only.
+    """
+    from crypto.decryptor import FileDecryptor
+    from crypto.encryptor import FileEncryptor
+    from crypto.keycache import KeyCache
+
+    encryptor = FileEncryptor()
+    records = [secrets.token_bytes(RECORD_SIZE) for _ in range(RECORD_COUNT)]
+
+    start = time.perf_counter()
+    encrypted = encryptor.encrypt_many(records, PASSWORD)
+    encrypt = time.perf_counter() - start
+
+    start = time.perf_counter()
+    FileDecryptor(key_cache=KeyCache()).decrypt_many(encrypted, PASSWORD)
+    decrypt = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cipher = encryptor.record_cipher(PASSWORD)
+    out = bytearray(cipher.sealed_size(RECORD_SIZE))
+    for record in records:
+        cipher.encrypt_into(record, out)
+    into = time.perf_counter() - start
+
+    single = time_runs(lambda: encryptor.encrypt_data(records[0], PASSWORD), 3)
+    return {
+        'runs': RECORD_COUNT,
+        'records_s': round(RECORD_COUNT / encrypt, 1),
+        'decrypt_records_s': round(RECORD_COUNT / decrypt, 1),
+        'into_records_s': round(RECORD_COUNT / into, 1),
+        'encrypt_data_records_s': round(len(single) / sum(single), 1),
+        # One timed pass, so the percentiles are the mean time per record
+        'p50_ms': round(encrypt / RECORD_COUNT * 1000, 4),
+        'p99_ms': round(encrypt / RECORD_COUNT * 1000, 4),
+        'mean_ms': round(encrypt / RECORD_COUNT * 1000, 4),
+        'mb_s': round(RECORD_COUNT * RECORD_SIZE / (1024 * 1024) / encrypt, 2),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def bench_encrypt_file(params: dict) -> dict:
+    from crypto.encryptor import FileEncryptor
+
+    encryptor = FileEncryptor(params['chunk_size'], params['backend'], params['container'],
+                              params['workers'], params['io_mode'])
+    encryptor._derive_key = _fixed_key
+    path = os.path.join(params['workdir'], f"bench_{os.getpid()}.bin")
+    _write_input(path, params['size'])
+
+    def run():
+        os.remove(encryptor.encrypt_file(path, PASSWORD))
+
+    try:
+        times = time_runs(run, params['repeat'])
+    finally:
+        os.remove(path)
+    return {**summarize(times, params['size']), 'peak_rss_mb': peak_rss_mb()}
+
+
+def bench_decrypt_file(params: dict) -> dict:
+    from crypto.decryptor import FileDecryptor
+    from crypto.encryptor import FileEncryptor
+
+    encryptor = FileEncryptor(params['chunk_size'], params['backend'], params['container'],
+                              params['workers'], params['io_mode'])
+    decryptor = FileDecryptor(params['chunk_size'], params['backend'], params['workers'],
+                              io_mode=params['io_mode'])
+    encryptor._derive_key = decryptor._derive_key = _fixed_key
+    path = os.path.join(params['workdir'], f"bench_{os.getpid()}.bin")
+    _write_input(path, params['size'])
+    encrypted = encryptor.encrypt_file(path, PASSWORD)
+    os.remove(path)
+
+    def run():
+        decryptor.key_cache.clear()
+        os.remove(decryptor.decrypt_file(encrypted, PASSWORD))
+
+    try:
+        times = time_runs(run, params['repeat'])
+    finally:
+        os.remove(encrypted)
+    return {**summarize(times, params['size']), 'peak_rss_mb': peak_rss_mb()}
+
+
+def _fixed_key(password: str, salt: bytes, kdf=None) -> bytes:
+    """Stand-in for _derive_key so cipher and I/O cases do not time PBKDF2"""
+    return bytes(32)
+
+
+OPERATIONS = {
+    'derive_key': bench_derive_key,
+    'encrypt_data': bench_encrypt_data,
+    'records': bench_records,
+    'encrypt_file': bench_encrypt_file,
+    'decrypt_file': bench_decrypt_file,
+}
@@ -0,0 +1,126 @@
+import os
+import sys
+import json
+import math
+import time
+import platform
+import resource
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(text: str) -> int:
+    """Parse sizes like 1K, 64M or 2G"""
+    text = text.strip().upper().rstrip('B').rstrip('I')
+    unit = text[-1] if text and text[-1] in _UNITS else ''
+    number = text[:-1] if unit else text
+    return int(float(number) * _UNITS[unit])
+
+
+def format_size(size: int) -> str:
+    for unit in ('G', 'M', 'K'):
+        if size >= _UNITS[unit] and size % _UNITS[unit] == 0:
+            return f"{size // _UNITS[unit]}{unit}"
+    return str(size)
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(times: list, nbytes: int) -> dict:
+    """Latency percentiles and throughput for a list of run times in seconds"""
+    p50 = percentile(times, 50)
+    return {
+        'runs': len(times),
+        'p50_ms': round(p50 * 1000, 3),
+        'p99_ms': round(percentile(times, 99) * 1000, 3),
+        'mean_ms': round(sum(times) / len(times) * 1000, 3),
+        'mb_s': round(nbytes / (1024 * 1024) / max(p50, 1e-9), 2) if nbytes else None,
+    }
+
+
+def time_runs(func, repeat: int) -> list:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process or any finished worker it started"""
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux reports KiB, macOS bytes
+    return round(rss / 1024 / (1024 if sys.platform == 'darwin' else 1), 1)
+
+
+def run_isolated(func, params: dict) -> dict:
+    """
+    Run one benchmark case in a fresh process
+
+    A spawned interpreter keeps the peak RSS of one case from leaking
+    into the next. Executor workers are not daemonic, so cases can start
+    their own process pools.
+    """
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(func, params).result()
+
+
+def default_workdir() -> str:
+    """Prefer tmpfs so disk speed does not dominate the numbers"""
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    import tempfile
+    return tempfile.gettempdir()
+
+
+def machine_info() -> dict:
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def write_results(path: str, results: list, meta: dict = None):
+    with open(path, 'w') as file:
+        json.dump({'meta': {**machine_info(), **(meta or {})}, 'results': results}, file, indent=2)
+
+
+def load_results(path: str) -> list:
+    with open(path) as file:
+        return json.load(file)['results']
+
+
+def compare(results: list, baseline: list, threshold: float = 0.10) -> list:
+    """
+    Flag cases that got slower than the baseline
+
+    Cases are matched by id. A regression is a p50 latency more than
+    threshold (fractional) above the baseline.
+
+    Returns:
+        list: (case id, baseline p50 ms, current p50 ms, change) tuples
+    """
+    previous = {result['id']: result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(result['id'])
+        if not old or 'p50_ms' not in old or 'p50_ms' not in result:
+            continue
+        change = result['p50_ms'] / max(old['p50_ms'], 1e-9) - 1
+        if change > threshold:
+            regressions.append((result['id'], old['p50_ms'], result['p50_ms'], change))
+    return regressions
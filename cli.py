@@ -0,0 +1,809 @@
+#!/usr/bin/env python3
+"""
+Non-interactive command line for scripts and pipelines
+
+Usage:
+    python main.py encrypt FILE... [--compress auto]
+    python main.py decrypt FILE...
+    python main.py verify FILE... [--keyless]
+    tar c dir | python main.py encrypt - > dir.tar.Wh04ami
+    python main.py batch encrypt|decrypt|verify FOLDER [--include '*.pdf'] [--incremental]
+    python main.py bundle create|append|list|extract BUNDLE [PATH...]
+    python main.py dedup encrypt|decrypt|list|stats|remove|prune STORE [PATH...]
+    python main.py rekey FILE... [--add|--remove] [--kdf SPEC]
+    python main.py watch FOLDER [--output-dir DIR] [--remove-source] [--debounce 2s]
+    python main.py info FILE
+    python main.py kdf list|calibrate [--algorithm scrypt] [--target 250ms]
+    python main.py passwd check|generate|hash
+    python main.py passwd audit [FILE...] [--breached-filter PATH]
+    python main.py passwd build-filter WORDLIST... -o PATH
+
+The password is read from --password-env (default WH04AMI_PASSWORD),
+--password-fd or --keyfile, and only prompted for on a terminal; rekey
+reads the new one from the matching --new-* options. Only
+the standard library and the crypto modules a command needs are
+imported, so startup stays fast; rich and pyfiglet are never loaded.
+"""
+import os
+import sys
+import json
+import argparse
+
+from crypto.stream import DEFAULT_CHUNK_SIZE
+
+PASSWORD_ENV = 'WH04AMI_PASSWORD'
+NEW_PASSWORD_ENV = 'WH04AMI_NEW_PASSWORD'
+BREACHED_FILTER_ENV = 'WH04AMI_BREACHED_FILTER'
+STDIO_PATH = '-'
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+
+_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+class CLIError(Exception):
+    """Error reported as a one-line message with a non-zero exit code"""
+
+
+def parse_size(text: str) -> int:
+    """Parse sizes like 512K or 4M"""
+    text = text.strip().upper().rstrip('B').rstrip('I')
+    try:
+        if text and text[-1] in _UNITS:
+            return int(float(text[:-1]) * _UNITS[text[-1]])
+        return int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: {text!r}")
+
+
+def parse_duration(text: str) -> float:
+    """Parse durations like 250ms, 0.5s or 1 (seconds)"""
+    text = text.strip().lower()
+    scale = 1.0
+    if text.endswith('ms'):
+        text, scale = text[:-2], 0.001
+    elif text.endswith('s'):
+        text = text[:-1]
+    try:
+        seconds = float(text) * scale
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid duration: {text!r}")
+    if seconds <= 0:
+        raise argparse.ArgumentTypeError("duration must be positive")
+    return seconds
+
+
+def parse_kdf_spec(text: str) -> str:
+    """Validate a --kdf spec early; the crypto modules take the string"""
+    from crypto.kdf import parse_kdf
+    try:
+        return str(parse_kdf(text))
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def read_password(args, confirm: bool = False, new: bool = False) -> str:
+    """
+    Get the password from a keyfile, file descriptor, env var or prompt
+
+    Keyfiles and descriptors are read as UTF-8 text with one trailing
+    newline removed, so `echo secret > keyfile` works as expected. With
+    new, the --new-* options are used instead (rekey).
+    """
+    prefix, label = ('new_', 'new password') if new else ('', 'password')
+    keyfile = getattr(args, prefix + 'keyfile')
+    password_fd = getattr(args, prefix + 'password_fd')
+    password_env = getattr(args, prefix + 'password_env')
+    if keyfile:
+        with open(keyfile, 'r', encoding='utf-8') as file:
+            password = _strip_newline(file.read())
+    elif password_fd is not None:
+        with os.fdopen(password_fd, 'r', encoding='utf-8', closefd=False) as file:
+            password = _strip_newline(file.readline())
+    elif os.environ.get(password_env):
+        password = os.environ[password_env]
+    elif sys.stdin.isatty():
+        import getpass
+        password = getpass.getpass(f'{label.capitalize()}: ')
+        if confirm and getpass.getpass(f'Confirm {label}: ') != password:
+            raise CLIError("Passwords don't match")
+    else:
+        option = '--' + prefix.replace('_', '-')
+        raise CLIError(f"No {label} given (use ${password_env}, {option}password-fd or {option}keyfile)")
+
+    if not password:
+        raise CLIError("Password is empty")
+    return password
+
+
+def _strip_newline(text: str) -> str:
+    if text.endswith('\r\n'):
+        return text[:-2]
+    if text.endswith('\n'):
+        return text[:-1]
+    return text
+
+
+def _tracking_options(args) -> dict:
+    return {'metrics_sink': args.metrics, 'fsync': args.fsync, 'direct_io': args.direct_io}
+
+
+def _is_stream(args) -> bool:
+    """`-` as the only path means stdin to stdout"""
+    if STDIO_PATH not in args.files:
+        return False
+    if len(args.files) > 1:
+        raise CLIError("'-' cannot be combined with other paths")
+    return True
+
+
+def cmd_encrypt(args) -> int:
+    from crypto.encryptor import FileEncryptor
+
+    stream = _is_stream(args)
+    password = read_password(args, confirm=True)
+    encryptor = FileEncryptor(args.chunk_size, args.backend, args.container, args.workers,
+                              args.io_mode, compression=args.compress, checkpoint_interval=args.checkpoint,
+                              kdf=args.kdf, **_tracking_options(args))
+    if stream:
+        encryptor.encrypt_stream(sys.stdin.buffer, sys.stdout.buffer, password)
+        sys.stdout.buffer.flush()
+        return EXIT_OK
+    session = None
+    if len(args.files) > 1:
+        session = encryptor.start_session(password)
+
+    failed = 0
+    try:
+        for path in args.files:
+            try:
+                output_path = encryptor.encrypt_file(path, password, session)
+            except Exception as e:
+                failed += 1
+                print(f"error: {path}: {e}", file=sys.stderr)
+                continue
+            if not args.quiet:
+                print(output_path)
+    finally:
+        if session is not None:
+            session.close()
+    return EXIT_FAILED if failed else EXIT_OK
+
+
+def cmd_decrypt(args) -> int:
+    from crypto.decryptor import FileDecryptor
+
+    stream = _is_stream(args)
+    password = read_password(args)
+    decryptor = FileDecryptor(args.chunk_size, args.backend, args.workers, io_mode=args.io_mode,
+                              **_tracking_options(args))
+    if stream:
+        decryptor.decrypt_stream(sys.stdin.buffer, sys.stdout.buffer, password)
+        sys.stdout.buffer.flush()
+        return EXIT_OK
+
+    failed = 0
+    for path in args.files:
+        try:
+            output_path = decryptor.decrypt_file(path, password)
+        except Exception as e:
+            failed += 1
+            print(f"error: {path}: {e}", file=sys.stderr)
+            continue
+        if not args.quiet:
+            print(output_path)
+    return EXIT_FAILED if failed else EXIT_OK
+
+
+def cmd_verify(args) -> int:
+    from crypto.batch import BatchProcessor
+
+    password = None if args.keyless else read_password(args)
+    processor = BatchProcessor(args.workers, backend=args.backend)
+    summary = processor.verify_files(args.files, password, _verify_printer(args))
+    return _report_verify(args, summary)
+
+
+def _verify_printer(args):
+    def on_result(result):
+        if not result.ok:
+            print(f"error: {result.path}: {result.error}", file=sys.stderr)
+        elif not args.quiet and not args.json:
+            print(f"{result.path}: ok")
+    return on_result
+
+
+def _report_verify(args, summary) -> int:
+    if args.json:
+        print(json.dumps(summary.to_dict(), indent=2))
+    elif not args.quiet:
+        print(f"{len(summary.succeeded)} intact, {len(summary.failed)} corrupt or unreadable, "
+              f"{summary.total_bytes / (1024 * 1024):.1f} MB in {summary.elapsed:.2f}s "
+              f"({summary.throughput:.1f} MB/s)", file=sys.stderr)
+    return EXIT_FAILED if summary.failed else EXIT_OK
+
+
+def cmd_batch(args) -> int:
+    from crypto.batch import BatchProcessor
+    from utils.file_handler import FileHandler
+
+    if not os.path.isdir(args.folder):
+        raise CLIError(f"Folder not found: {args.folder}")
+
+    decrypt = args.mode in ('decrypt', 'verify')
+    include = args.include or (['*.Wh04ami'] if decrypt else None)
+    files = FileHandler().walk_files(args.folder, include=include, exclude=args.exclude,
+                                     recursive=not args.no_recursive, skip_encrypted=not decrypt)
+
+    manifest = args.manifest
+    if args.incremental and not manifest:
+        from crypto.manifest import MANIFEST_NAME
+        manifest = os.path.join(args.folder, MANIFEST_NAME)
+    if manifest and decrypt:
+        raise CLIError("--manifest and --incremental only apply to encryption")
+    if args.keyless and args.mode != 'verify':
+        raise CLIError("--keyless only applies to batch verify")
+
+    if args.mode == 'verify':
+        password = None if args.keyless else read_password(args)
+        processor = BatchProcessor(args.workers, args.chunk_size, args.backend)
+        return _report_verify(args, processor.verify_files(files, password, _verify_printer(args)))
+
+    password = read_password(args, confirm=not decrypt)
+    processor = BatchProcessor(args.workers, args.chunk_size, args.backend, args.container,
+                               compression=args.compress, manifest=manifest,
+                               checkpoint_interval=args.checkpoint, kdf=args.kdf)
+
+    def on_result(result):
+        if not result.ok:
+            print(f"error: {result.path}: {result.error}", file=sys.stderr)
+        elif not args.quiet and not args.json:
+            print(result.output)
+
+    if decrypt:
+        summary = processor.decrypt_files(files, password, on_result)
+    else:
+        summary = processor.encrypt_files(files, password, on_result)
+
+    if args.json:
+        print(json.dumps(summary.to_dict(), indent=2))
+    elif not args.quiet:
+        print(f"{len(summary.succeeded)} succeeded ({len(summary.skipped)} unchanged), "
+              f"{len(summary.failed)} failed, "
+              f"{summary.total_bytes / (1024 * 1024):.1f} MB in {summary.elapsed:.2f}s "
+              f"({summary.throughput:.1f} MB/s)", file=sys.stderr)
+    return EXIT_FAILED if summary.failed else EXIT_OK
+
+
+def cmd_bundle(args) -> int:
+    from crypto.bundle import MODE_APPEND, MODE_READ, MODE_WRITE, Bundle, member_path
+
+    writing = args.action in ('create', 'append')
+    if writing and not args.paths:
+        raise CLIError(f"bundle {args.action} needs files or folders to add")
+    if not writing and not os.path.isfile(args.bundle):
+        raise CLIError(f"File not found: {args.bundle}")
+
+    password = read_password(args, confirm=args.action == 'create')
+    mode = {'create': MODE_WRITE, 'append': MODE_APPEND}.get(args.action, MODE_READ)
+    with Bundle(args.bundle, password, mode, args.chunk_size, args.backend, args.workers,
+                kdf=args.kdf) as bundle:
+        if writing:
+            added = 0
+            for path in args.paths:
+                if os.path.isdir(path):
+                    added += bundle.add_folder(path, recursive=not args.no_recursive)
+                else:
+                    bundle.add(path)
+                    added += 1
+            if not args.quiet:
+                print(f"{added} files added, {len(bundle.entries)} in bundle", file=sys.stderr)
+        elif args.action == 'list':
+            entries = [entry.to_dict() for entry in bundle.entries]
+            if args.json:
+                for entry in entries:
+                    del entry['nonce']
+                print(json.dumps(entries, indent=2))
+            else:
+                for entry in entries:
+                    print(f"{entry['size']:>12}  {entry['name']}")
+        else:
+            names = args.paths or bundle.names()
+            for name in names:
+                output_path = bundle.extract(name, member_path(args.output, name))
+                if not args.quiet:
+                    print(output_path)
+    return EXIT_OK
+
+
+def cmd_dedup(args) -> int:
+    from crypto.bundle import member_path
+    from crypto.dedup import DedupStats, DedupStore
+
+    if args.action in ('encrypt', 'remove') and not args.paths:
+        raise CLIError(f"dedup {args.action} needs paths")
+    creating = args.action == 'encrypt'
+    if not creating and not os.path.isdir(args.store):
+        raise CLIError(f"Store not found: {args.store}")
+
+    password = read_password(args, confirm=creating and not os.path.isdir(args.store))
+    store = DedupStore(args.store, password, create=creating, backend=args.backend, workers=args.workers,
+                       kdf=args.kdf)
+    stats = None
+    if args.action == 'encrypt':
+        stats = DedupStats()
+        for path in args.paths:
+            if os.path.isdir(path):
+                stats.add(store.encrypt_folder(path, args.prefix, recursive=not args.no_recursive))
+            else:
+                stats.add(store.encrypt_file(path, args.prefix + os.path.basename(path)))
+    elif args.action == 'decrypt':
+        names = args.paths or [name for name in store.names() if name.startswith(args.prefix)]
+        for name in names:
+            output_path = store.decrypt_file(name, member_path(args.output, name[len(args.prefix):]))
+            if not args.quiet:
+                print(output_path)
+    elif args.action == 'list':
+        recipes = [recipe for recipe in store.recipes() if recipe.name.startswith(args.prefix)]
+        if args.json:
+            print(json.dumps([{'name': recipe.name, 'size': recipe.size, 'mtime': recipe.mtime,
+                               'chunks': len(recipe.chunks)} for recipe in recipes], indent=2))
+        else:
+            for recipe in recipes:
+                print(f"{recipe.size:>12}  {recipe.name}")
+    elif args.action == 'remove':
+        for name in args.paths:
+            store.remove(name)
+    elif args.action == 'prune':
+        stats = store.prune()
+    else:
+        stats = store.stats()
+
+    if stats is not None and (args.json or not args.quiet):
+        report = stats.to_dict()
+        if args.json:
+            print(json.dumps(report, indent=2))
+        elif args.action == 'prune':
+            print(f"{report['unique_chunks']} chunks freed, {report['stored_bytes']} bytes", file=sys.stderr)
+        else:
+            ratio = f"{report['ratio']:.2f}x" if report['ratio'] is not None else 'all duplicate'
+            print(f"{report['files']} files, {report['logical_bytes']} bytes, {report['unique_bytes']} new "
+                  f"or unique, {report['saved_bytes']} saved ({ratio})", file=sys.stderr)
+    return EXIT_OK
+
+
+def cmd_rekey(args) -> int:
+    from crypto.rekey import REKEY_ADD, REKEY_CHANGE, REKEY_REMOVE, Rekeyer
+
+    action = REKEY_ADD if args.add else REKEY_REMOVE if args.remove else REKEY_CHANGE
+    password = read_password(args)
+    new_password = None if action == REKEY_REMOVE else read_password(args, confirm=True, new=True)
+    rekeyer = Rekeyer(password, new_password, action, args.kdf)
+
+    failed = 0
+    for path in args.files:
+        try:
+            slot = rekeyer.rekey_file(path)
+        except Exception as e:
+            failed += 1
+            print(f"error: {path}: {e}", file=sys.stderr)
+            continue
+        if not args.quiet:
+            print(f"{path}: key slot {slot} {'cleared' if action == REKEY_REMOVE else 'written'}")
+    return EXIT_FAILED if failed else EXIT_OK
+
+
+def cmd_watch(args) -> int:
+    import signal
+    from crypto.watch import TEMPORARY_PATTERNS, FolderWatcher
+
+    password = read_password(args, confirm=True)
+    exclude = ([] if args.no_default_excludes else TEMPORARY_PATTERNS) + (args.exclude or [])
+
+    def on_result(result, latency):
+        if not result.ok:
+            print(f"error: {result.path}: {result.error}", file=sys.stderr)
+        elif not args.quiet and not args.json:
+            print(f"{result.output} ({latency:.2f}s after arrival)", flush=True)
+
+    def on_stats(stats):
+        if args.json:
+            print(json.dumps(stats.to_dict()), flush=True)
+        else:
+            latency = stats.latency()
+            print(f"{stats.encrypted} encrypted, {stats.failed} failed, {stats.pending} settling, "
+                  f"{stats.queue_depth} queued, {stats.in_flight} in flight, "
+                  f"latency p50 {latency['p50']:.2f}s max {latency['max']:.2f}s", file=sys.stderr)
+
+    watcher = FolderWatcher(args.folder, password, output_dir=args.output_dir, debounce=args.debounce,
+                            poll=args.poll, poll_interval=args.interval, workers=args.workers,
+                            max_queue=args.queue, remove_source=args.remove_source, include=args.include,
+                            exclude=exclude, recursive=not args.no_recursive, existing=not args.new_only,
+                            chunk_size=args.chunk_size, backend=args.backend, compression=args.compress,
+                            kdf=args.kdf, on_result=on_result, on_stats=on_stats,
+                            stats_interval=args.stats_interval)
+    # Finish the files in flight on Ctrl-C or SIGTERM
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: watcher.stop())
+    if not args.quiet:
+        print(f"Watching {watcher.folder} ({watcher.backend}); Ctrl-C to stop", file=sys.stderr)
+    watcher.run()
+    if not args.quiet:
+        on_stats(watcher.stats)
+    return EXIT_OK
+
+
+def cmd_info(args) -> int:
+    from utils.file_handler import FileHandler
+
+    if not os.path.isfile(args.file):
+        raise CLIError(f"File not found: {args.file}")
+
+    info = FileHandler().get_detailed_file_info(args.file)
+    info.update(_encryption_info(args.file))
+
+    if args.json:
+        print(json.dumps(info, indent=2))
+    else:
+        width = max(len(key) for key in info)
+        for key, value in info.items():
+            print(f"{key.replace('_', ' ').title():<{width}}  {value}")
+    return EXIT_OK
+
+
+def _encryption_info(file_path: str) -> dict:
+    """Container details readable without the password"""
+    from crypto.container import (
+        CONTAINER_BUNDLE, CONTAINER_CHUNKED, CONTAINER_RECORD, PREFIX_SIZE, detect_container, read_header
+    )
+
+    file_size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as file:
+        container = detect_container(file.read(PREFIX_SIZE))
+        if container == CONTAINER_BUNDLE:
+            # Member names and sizes are in the encrypted index
+            return {'container': 'bundle'}
+        if container == CONTAINER_RECORD:
+            return {'container': 'record'}
+        if container == CONTAINER_CHUNKED:
+            file.seek(0)
+            try:
+                header = read_header(file)
+                plaintext_size = header.plaintext_size(file_size)
+            except Exception as e:
+                return {'container': 'chunked', 'container_error': str(e)}
+            from crypto.compression import CODECS
+            compression = [name for name, cls in CODECS.items() if header.flags & cls.flag]
+            return {
+                'container': 'chunked',
+                'container_version': header.version,
+                'chunk_size': header.chunk_size,
+                'per_file_key': header.file_salt is not None or header.wrapped,
+                'key_check': header.key_check is not None,
+                'kdf': str(header.kdf) if not header.wrapped else None,
+                'key_slots': [str(slot.kdf) if slot is not None else None for slot in header.slots],
+                'compression': compression[0] if compression else 'none',
+                # For compressed files this is the compressed size
+                'plaintext_size': plaintext_size,
+            }
+
+    if file_path.endswith('.Wh04ami') and file_size >= 32:
+        # Legacy files carry no magic; padding hides the exact size
+        return {'container': 'legacy', 'plaintext_size': f"{file_size - 48}-{file_size - 33} bytes"}
+    return {'container': 'none'}
+
+
+def cmd_kdf(args) -> int:
+    from crypto.kdf import KDFS, available_kdfs, calibrate
+
+    if args.action == 'list':
+        available = available_kdfs()
+        for name in KDFS:
+            print(f"{name:<14} {'available' if name in available else 'unavailable'}")
+        return EXIT_OK
+
+    kdf, elapsed = calibrate(args.algorithm, args.target, args.max_memory)
+    if args.json:
+        print(json.dumps({'kdf': str(kdf), 'seconds': round(elapsed, 4),
+                          'memory_bytes': kdf.memory_bytes}, indent=2))
+    else:
+        print(kdf)
+        if not args.quiet:
+            print(f"{elapsed * 1000:.0f} ms per derivation on this machine", file=sys.stderr)
+    return EXIT_OK
+
+
+def cmd_passwd(args) -> int:
+    from utils.validator import Validator
+
+    if args.action == 'build-filter':
+        return _build_filter(args)
+    if args.action != 'audit' and args.paths:
+        raise CLIError(f"passwd {args.action} takes no paths")
+
+    validator = Validator(args.breached_filter)
+    if args.action == 'audit':
+        return _audit_passwords(args, validator)
+    if args.action == 'generate':
+        print(validator.generate_password(args.length, not args.no_symbols, not args.no_numbers))
+        return EXIT_OK
+
+    password = read_password(args)
+    if args.action == 'hash':
+        print(validator.generate_hash(password))
+        return EXIT_OK
+
+    strength = validator.check_password_strength(password)
+    overall = strength.pop('overall')
+    if args.json:
+        print(json.dumps({**strength, 'overall': overall}, indent=2))
+    else:
+        for metric, data in strength.items():
+            print(f"{metric:<16} {'ok' if data['passed'] else 'FAIL':<5} {data['score']}")
+        print(f"Overall: {overall['rating']} ({overall['score']}/100)")
+    return EXIT_OK if validator.is_strong_password(password) else EXIT_FAILED
+
+
+def _build_filter(args) -> int:
+    from utils.breached import build_filter
+
+    if not args.paths or not args.output:
+        raise CLIError("passwd build-filter needs wordlists and -o PATH")
+    added = build_filter(args.paths, args.output, args.fp_rate, args.expected)
+    if not args.quiet:
+        print(f"{added} passwords, {os.path.getsize(args.output)} bytes", file=sys.stderr)
+    return EXIT_OK
+
+
+def _audit_passwords(args, validator) -> int:
+    def on_finding(finding):
+        if not args.json and not args.quiet:
+            print(f"{finding['source']}  {finding['rating']} ({finding['score']})  {', '.join(finding['issues'])}")
+
+    paths = [path for path in args.paths if path != STDIO_PATH]
+    if paths:
+        if len(paths) < len(args.paths):
+            raise CLIError("'-' cannot be combined with other paths")
+        audit = validator.audit_files(paths, on_finding)
+    else:
+        lines = (line.rstrip('\r\n') for line in sys.stdin)
+        audit = validator.audit_passwords((f"-:{number}", password)
+                                          for number, password in enumerate(lines, 1) if password)
+
+    report = audit.to_dict()
+    if args.json:
+        print(json.dumps(report, indent=2))
+    elif not args.quiet:
+        print(f"{report['checked']} checked, {report['weak']} weak, {report['breached']} breached "
+              f"({report['passwords_per_second']}/s)", file=sys.stderr)
+    return EXIT_FAILED if audit.weak else EXIT_OK
+
+
+def _add_password_options(parser, new: bool = False):
+    prefix, name, default = ('new-', 'new password', NEW_PASSWORD_ENV) if new else ('', 'password', PASSWORD_ENV)
+    group = parser.add_argument_group(name)
+    group.add_argument(f'--{prefix}password-env', default=default, metavar='NAME',
+                       help=f'Environment variable holding the {name} (default: {default})')
+    group.add_argument(f'--{prefix}password-fd', type=int, metavar='FD',
+                       help=f'Read the {name} from the first line of this file descriptor')
+    group.add_argument(f'--{prefix}keyfile', metavar='PATH', help=f'Read the {name} from a text file')
+
+
+def _add_cipher_options(parser, container: bool = True):
+    group = parser.add_argument_group('cipher')
+    group.add_argument('--chunk-size', type=parse_size, default=DEFAULT_CHUNK_SIZE,
+                       help='I/O and chunk size, 1M-16M (default: 4M)')
+    group.add_argument('--backend', choices=['cryptography', 'pyaes'],
+                       help='AES provider (default: fastest available)')
+    group.add_argument('--workers', type=int, help='Worker processes (default: CPU count)')
+    if container:
+        group.add_argument('--container', choices=['chunked'], default='chunked',
+                           help='Output format; legacy files can be decrypted but no longer written')
+        group.add_argument('--compress', choices=['none', 'auto', 'zstd', 'zlib', 'lz4'], default='none',
+                           help="Compress before encrypting; 'auto' picks the best codec and skips "
+                                "incompressible files")
+        group.add_argument('--checkpoint', type=parse_size, metavar='SIZE',
+                           help='Write chunked files larger than SIZE resumably, saving progress '
+                                'every SIZE bytes (0 disables; default: 256M with a manifest)')
+        _add_kdf_option(group)
+
+
+def _add_kdf_option(parser, target: str = 'new files'):
+    parser.add_argument('--kdf', type=parse_kdf_spec, metavar='SPEC',
+                        help=f"Password KDF for {target} (e.g. 'scrypt:log_n=17' or the output of "
+                             "`kdf calibrate`; default: pbkdf2-sha256:iterations=100000)")
+
+
+def _add_output_options(parser):
+    parser.add_argument('--io-mode', choices=['auto', 'stream', 'mmap', 'pipeline'], default='auto',
+                        help="'pipeline' overlaps reading, encryption and writing on separate threads")
+    parser.add_argument('--direct-io', action='store_true',
+                        help='With --io-mode pipeline, write outputs with O_DIRECT where supported')
+    parser.add_argument('--metrics', metavar='PATH', help='Append per-file timing records (JSON lines)')
+    parser.add_argument('--fsync', action='store_true', help='fsync outputs before reporting success')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Do not print output paths')
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='main.py', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+    commands.required = True
+
+    encrypt = commands.add_parser('encrypt', help='Encrypt files')
+    encrypt.add_argument('files', nargs='+', metavar='FILE', help="Files to encrypt, or - for stdin to stdout")
+    _add_cipher_options(encrypt)
+    _add_output_options(encrypt)
+    _add_password_options(encrypt)
+    encrypt.set_defaults(func=cmd_encrypt)
+
+    decrypt = commands.add_parser('decrypt', help='Decrypt .Wh04ami files (format is detected)')
+    decrypt.add_argument('files', nargs='+', metavar='FILE', help="Files to decrypt, or - for stdin to stdout")
+    _add_cipher_options(decrypt, container=False)
+    _add_output_options(decrypt)
+    _add_password_options(decrypt)
+    decrypt.set_defaults(func=cmd_decrypt)
+
+    verify = commands.add_parser('verify', help='Check encrypted files are intact without writing plaintext')
+    verify.add_argument('files', nargs='+', metavar='FILE')
+    verify.add_argument('--keyless', action='store_true',
+                        help='No password: only check headers and that lengths fit the format')
+    verify.add_argument('--backend', choices=['cryptography', 'pyaes'],
+                        help='AES provider (default: fastest available)')
+    verify.add_argument('--workers', type=int, help='Worker processes (default: CPU count)')
+    verify.add_argument('--json', action='store_true', help='Print the summary as JSON')
+    verify.add_argument('-q', '--quiet', action='store_true', help='Only report corrupt files')
+    _add_password_options(verify)
+    verify.set_defaults(func=cmd_verify)
+
+    batch = commands.add_parser('batch', help='Encrypt, decrypt or verify a folder on a process pool')
+    batch.add_argument('mode', choices=['encrypt', 'decrypt', 'verify'])
+    batch.add_argument('folder')
+    batch.add_argument('--include', action='append', metavar='PATTERN',
+                       help='Only files matching this glob (repeatable)')
+    batch.add_argument('--exclude', action='append', metavar='PATTERN',
+                       help='Skip files matching this glob (repeatable)')
+    batch.add_argument('--no-recursive', action='store_true', help='Do not descend into subfolders')
+    batch.add_argument('--manifest', metavar='PATH',
+                       help='Record encrypted files here and skip unchanged ones on later runs')
+    batch.add_argument('--incremental', action='store_true',
+                       help='Use a manifest inside the folder (.wh04ami-manifest.db)')
+    batch.add_argument('--keyless', action='store_true',
+                       help='With verify: no password, only check headers and lengths')
+    batch.add_argument('--json', action='store_true', help='Print the batch summary as JSON')
+    batch.add_argument('-q', '--quiet', action='store_true', help='Do not print output paths')
+    _add_cipher_options(batch)
+    _add_password_options(batch)
+    batch.set_defaults(func=cmd_batch)
+
+    bundle = commands.add_parser('bundle', help='Pack many files into one archive with an encrypted index')
+    bundle.add_argument('action', choices=['create', 'append', 'list', 'extract'])
+    bundle.add_argument('bundle', metavar='BUNDLE')
+    bundle.add_argument('paths', nargs='*', metavar='PATH',
+                        help='Files or folders to add, or member names to extract (default: all)')
+    bundle.add_argument('-o', '--output', default=os.curdir, help='Folder to extract into (default: .)')
+    bundle.add_argument('--no-recursive', action='store_true', help='Do not descend into subfolders')
+    bundle.add_argument('--json', action='store_true', help='List members as JSON')
+    bundle.add_argument('-q', '--quiet', action='store_true', help='Do not print progress or output paths')
+    _add_cipher_options(bundle, container=False)
+    _add_kdf_option(bundle)
+    _add_password_options(bundle)
+    bundle.set_defaults(func=cmd_bundle)
+
+    dedup = commands.add_parser('dedup', help='Deduplicating encrypted store for repeated backups')
+    dedup.add_argument('action', choices=['encrypt', 'decrypt', 'list', 'stats', 'remove', 'prune'])
+    dedup.add_argument('store', metavar='STORE')
+    dedup.add_argument('paths', nargs='*', metavar='PATH',
+                       help='Files or folders to encrypt, or names to decrypt or remove')
+    dedup.add_argument('--prefix', default='', help="Name prefix, e.g. a snapshot date 'nightly/2024-06-01/'")
+    dedup.add_argument('-o', '--output', default=os.curdir, help='Folder to decrypt into (default: .)')
+    dedup.add_argument('--no-recursive', action='store_true', help='Do not descend into subfolders')
+    dedup.add_argument('--json', action='store_true', help='Print listings and stats as JSON')
+    dedup.add_argument('-q', '--quiet', action='store_true', help='Do not print stats or output paths')
+    dedup.add_argument('--backend', choices=['cryptography', 'pyaes'],
+                       help='AES provider (default: fastest available)')
+    dedup.add_argument('--workers', type=int, help='Worker processes (default: CPU count)')
+    _add_kdf_option(dedup)
+    _add_password_options(dedup)
+    dedup.set_defaults(func=cmd_dedup)
+
+    rekey = commands.add_parser('rekey', help='Change the password of chunked files by rewriting only their headers')
+    rekey.add_argument('files', nargs='+', metavar='FILE')
+    action = rekey.add_mutually_exclusive_group()
+    action.add_argument('--add', action='store_true', help='Add the new password; the current one keeps working')
+    action.add_argument('--remove', action='store_true', help='Remove the current password (not the last one)')
+    _add_kdf_option(rekey, 'the new password')
+    rekey.add_argument('-q', '--quiet', action='store_true', help='Do not print rewritten files')
+    _add_password_options(rekey)
+    _add_password_options(rekey, new=True)
+    rekey.set_defaults(func=cmd_rekey)
+
+    watch = commands.add_parser('watch', help='Encrypt files as they are dropped into a folder')
+    watch.add_argument('folder')
+    watch.add_argument('--output-dir', metavar='DIR',
+                       help='Write encrypted files here, keeping relative paths (default: next to the source)')
+    watch.add_argument('--remove-source', action='store_true',
+                       help='Overwrite and delete each source once its encrypted copy is on disk')
+    watch.add_argument('--debounce', type=parse_duration, default=2.0, metavar='TIME',
+                       help='Quiet time after a file is closed before it is encrypted (default: 2s)')
+    watch.add_argument('--poll', action='store_true',
+                       help='Scan instead of using inotify (network filesystems; automatic where inotify is missing)')
+    watch.add_argument('--interval', type=parse_duration, default=5.0, metavar='TIME',
+                       help='Scan interval with --poll (default: 5s)')
+    watch.add_argument('--queue', type=int, default=1024, metavar='N',
+                       help='Settled files waiting for a worker before new events are held back (default: 1024)')
+    watch.add_argument('--new-only', action='store_true', help='Leave files already in the folder alone')
+    watch.add_argument('--include', action='append', metavar='PATTERN',
+                       help='Only files matching this glob (repeatable)')
+    watch.add_argument('--exclude', action='append', metavar='PATTERN',
+                       help='Skip files matching this glob (repeatable; added to the temporary-file patterns)')
+    watch.add_argument('--no-default-excludes', action='store_true',
+                       help='Do not skip dotfiles and temporary names (*.tmp, *.part, *.crdownload, ...)')
+    watch.add_argument('--no-recursive', action='store_true', help='Do not watch subfolders')
+    watch.add_argument('--stats-interval', type=parse_duration, metavar='TIME',
+                       help='Print queue depth and latency counters this often')
+    watch.add_argument('--json', action='store_true', help='Print counters as JSON lines on stdout')
+    watch.add_argument('-q', '--quiet', action='store_true', help='Only report errors')
+    _add_cipher_options(watch, container=False)
+    watch.add_argument('--compress', choices=['none', 'auto', 'zstd', 'zlib', 'lz4'], default='none',
+                       help="Compress before encrypting; 'auto' skips incompressible files")
+    _add_kdf_option(watch, 'the session key')
+    _add_password_options(watch)
+    watch.set_defaults(func=cmd_watch)
+
+    info = commands.add_parser('info', help='Show file and container details')
+    info.add_argument('file')
+    info.add_argument('--json', action='store_true')
+    info.set_defaults(func=cmd_info)
+
+    kdf = commands.add_parser('kdf', help='List password KDFs or calibrate one for this machine')
+    kdf.add_argument('action', choices=['list', 'calibrate'])
+    kdf.add_argument('--algorithm', default='pbkdf2-sha256', choices=['pbkdf2-sha256', 'scrypt', 'argon2id'],
+                     help='KDF to calibrate (default: pbkdf2-sha256)')
+    kdf.add_argument('--target', type=parse_duration, default='250ms',
+                     help='Time one derivation should take, e.g. 250ms or 1s (default: 250ms)')
+    kdf.add_argument('--max-memory', type=parse_size, default='256M',
+                     help='Memory limit for scrypt and Argon2 (default: 256M)')
+    kdf.add_argument('--json', action='store_true')
+    kdf.add_argument('-q', '--quiet', action='store_true', help='Print only the KDF spec')
+    kdf.set_defaults(func=cmd_kdf)
+
+    passwd = commands.add_parser('passwd', help='Check, generate or hash passwords')
+    passwd.add_argument('action', choices=['check', 'generate', 'hash', 'audit', 'build-filter'])
+    passwd.add_argument('paths', nargs='*', metavar='FILE',
+                        help='Password files to audit (one per line, default: stdin), or wordlists to build from')
+    passwd.add_argument('--breached-filter', metavar='PATH', default=os.environ.get(BREACHED_FILTER_ENV),
+                        help=f'Breached-password filter to check against (default: ${BREACHED_FILTER_ENV})')
+    passwd.add_argument('-o', '--output', metavar='PATH', help='Filter file written by build-filter')
+    passwd.add_argument('--fp-rate', type=float, default=0.001,
+                        help='False positive rate of a built filter (default: 0.001)')
+    passwd.add_argument('--expected', type=int, metavar='N',
+                        help='Number of wordlist entries, saves build-filter a counting pass')
+    passwd.add_argument('-q', '--quiet', action='store_true', help='Print nothing for audit and build-filter, only set the exit code')
+    passwd.add_argument('--length', type=int, default=12, help='Generated password length')
+    passwd.add_argument('--no-symbols', action='store_true')
+    passwd.add_argument('--no-numbers', action='store_true')
+    passwd.add_argument('--json', action='store_true')
+    _add_password_options(passwd)
+    passwd.set_defaults(func=cmd_passwd)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except CLIError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return EXIT_FAILED
+    except KeyboardInterrupt:
+        return 130
+    except Exception as e:
+        print(f"error: {e}", file=sys.stderr)
+        return EXIT_FAILED
+
+
+if __name__ == '__main__':
+    sys.exit(main())
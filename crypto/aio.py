@@ -0,0 +1,292 @@
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from crypto.compression import COMPRESSION_NONE
+from crypto.container import CONTAINER_CHUNKED
+from crypto.mmap_io import IO_AUTO
+from crypto.stream import DEFAULT_CHUNK_SIZE
+
+# Operations allowed to run at once per AsyncProcessor
+DEFAULT_MAX_CONCURRENT = 4
+# Encrypted pieces buffered between the worker thread and the consumer
+STREAM_QUEUE_DEPTH = 2
+
+_END = object()
+
+
+class OperationCancelled(Exception):
+    """Raised on the worker thread when the awaiting task was cancelled"""
+
+
+class _Cancel:
+    """Cancel flag checked from the progress callback after every chunk"""
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    def __call__(self, bytes_done: int, total_bytes: int, elapsed: float):
+        if self.event.is_set():
+            raise OperationCancelled()
+
+    def set(self):
+        self.event.set()
+
+    def is_set(self) -> bool:
+        return self.event.is_set()
+
+
+class _AsyncReader:
+    """Blocking reader for the worker thread, pulling from an async iterator on the loop"""
+
+    def __init__(self, loop, source, cancel: _Cancel):
+        self._loop = loop
+        self._source = source.__aiter__()
+        self._cancel = cancel
+        self._pending = memoryview(b'')
+        self._eof = False
+
+    def _fill(self) -> bool:
+        while not self._pending and not self._eof:
+            self._cancel(0, 0, 0.0)
+            try:
+                piece = asyncio.run_coroutine_threadsafe(self._source.__anext__(), self._loop).result()
+            except StopAsyncIteration:
+                self._eof = True
+                break
+            self._pending = memoryview(piece).cast('B')
+        return bool(self._pending)
+
+    def readinto(self, buffer) -> int:
+        if not self._fill():
+            return 0
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+    def read(self, size: int = -1) -> bytes:
+        if not self._fill():
+            return b''
+        if size is None or size < 0:
+            size = len(self._pending)
+        data = bytes(self._pending[:size])
+        self._pending = self._pending[len(data):]
+        return data
+
+
+class _AsyncWriter:
+    """Writer for the worker thread, handing output to the loop through a bounded queue"""
+
+    def __init__(self, loop, queue: asyncio.Queue, cancel: _Cancel):
+        self._loop = loop
+        self._queue = queue
+        self._cancel = cancel
+
+    def write(self, data) -> int:
+        self._cancel(0, 0, 0.0)
+        # The engines reuse their buffers, so the data must be copied
+        piece = bytes(data)
+        asyncio.run_coroutine_threadsafe(self._queue.put(piece), self._loop).result()
+        return len(piece)
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._queue.put(_END), self._loop).result()
+
+
+async def _aiter(source):
+    """Accept async iterables, plain iterables and bytes-like objects alike"""
+    if hasattr(source, '__aiter__'):
+        async for piece in source:
+            yield piece
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        yield source
+    else:
+        for piece in source:
+            yield piece
+
+
+async def _settle(future):
+    """Wait for an abandoned job, consuming its expected OperationCancelled"""
+    await asyncio.wait([future])
+    if not future.cancelled():
+        future.exception()
+
+
+def _discard(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class AsyncProcessor:
+    """
+    asyncio front end for FileEncryptor and FileDecryptor
+
+    Key derivation, file I/O and cipher work run on an executor so the
+    event loop stays responsive, and at most max_concurrent operations
+    run at once. Cancelling an awaiting task stops the job after its
+    current chunk and removes the partial output.
+
+    The default executor is a private thread pool. PBKDF2 and the
+    cryptography backend release the GIL, so threads run them in
+    parallel; the pure Python pyaes backend does not.
+    """
+
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE, backend=None,
+                 container: str = CONTAINER_CHUNKED, workers: int = None, io_mode: str = IO_AUTO,
+                 executor=None, max_concurrent: int = DEFAULT_MAX_CONCURRENT,
+                 compression: str = COMPRESSION_NONE):
+        self.options = {
+            'chunk_size': chunk_size,
+            'backend': backend,
+            'workers': workers,
+            'io_mode': io_mode,
+        }
+        self.container = container
+        self.compression = compression
+        self.max_concurrent = max_concurrent
+        self._own_executor = executor is None
+        # Cipher work may itself use a process pool, so threads only wait on it
+        self.executor = executor or ThreadPoolExecutor(max_workers=max_concurrent,
+                                                       thread_name_prefix='aio-crypto')
+        self._semaphore = None
+
+    def _encryptor(self, cancel: _Cancel):
+        from crypto.encryptor import FileEncryptor
+        return FileEncryptor(container=self.container, compression=self.compression,
+                             progress_callback=cancel, **self.options)
+
+    def _decryptor(self, cancel: _Cancel):
+        from crypto.decryptor import FileDecryptor
+        return FileDecryptor(progress_callback=cancel, **self.options)
+
+    @property
+    def _slots(self) -> asyncio.Semaphore:
+        # Created on first use so it belongs to the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._semaphore
+
+    async def _run(self, job, cancel: _Cancel):
+        """Run a blocking job on the executor, cancelling it with the awaiting task"""
+        async with self._slots:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, job)
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                cancel.set()
+                # Let the job stop and clean up before reporting the cancellation
+                await _settle(future)
+                raise
+
+    async def encrypt_file(self, file_path: str, password: str, output_path: str = None) -> str:
+        """Encrypt a file without blocking the event loop, see FileEncryptor.encrypt_file"""
+        cancel = _Cancel()
+        output_path = output_path or file_path + '.Wh04ami'
+
+        def job():
+            try:
+                return self._encryptor(cancel).encrypt_file(file_path, password, output_path=output_path)
+            except Exception:
+                if cancel.is_set():
+                    _discard(output_path)
+                raise
+
+        return await self._run(job, cancel)
+
+    async def decrypt_file(self, file_path: str, password: str, output_path: str = None) -> str:
+        """Decrypt a file without blocking the event loop, see FileDecryptor.decrypt_file"""
+        cancel = _Cancel()
+
+        def job():
+            decryptor = self._decryptor(cancel)
+            target = output_path or decryptor._get_output_path(file_path)
+            try:
+                return decryptor.decrypt_file(file_path, password, output_path=target)
+            except Exception:
+                if cancel.is_set():
+                    _discard(target)
+                raise
+
+        return await self._run(job, cancel)
+
+    async def encrypt_iter(self, source, password: str):
+        """
+        Encrypt an (async) iterable of bytes, yielding encrypted pieces
+
+        Memory stays bounded: the worker thread waits while the consumer
+        is behind. Closing the iterator early cancels the job.
+        """
+        async for piece in self._stream('encrypt_stream', self._encryptor, source, password):
+            yield piece
+
+    async def decrypt_iter(self, source, password: str):
+        """Decrypt an (async) iterable of encrypted bytes, yielding plaintext pieces"""
+        async for piece in self._stream('decrypt_stream', self._decryptor, source, password):
+            yield piece
+
+    async def _stream(self, method: str, factory, source, password: str):
+        loop = asyncio.get_running_loop()
+        cancel = _Cancel()
+        queue = asyncio.Queue(STREAM_QUEUE_DEPTH)
+        reader = _AsyncReader(loop, _aiter(source), cancel)
+        writer = _AsyncWriter(loop, queue, cancel)
+
+        def job():
+            try:
+                return getattr(factory(cancel), method)(reader, writer, password)
+            finally:
+                writer.close()
+
+        async with self._slots:
+            future = loop.run_in_executor(self.executor, job)
+            ended = False
+            try:
+                while True:
+                    piece = await queue.get()
+                    if piece is _END:
+                        ended = True
+                        break
+                    yield piece
+                await future
+            finally:
+                if not future.done():
+                    # Consumer stopped early: unblock the worker and wait for it
+                    cancel.set()
+                    while not ended:
+                        ended = (await queue.get()) is _END
+                    await _settle(future)
+
+    async def close(self):
+        if self._own_executor:
+            await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+_default_processor = None
+
+
+def default_processor() -> AsyncProcessor:
+    """Shared processor used by the module-level helpers"""
+    global _default_processor
+    if _default_processor is None:
+        _default_processor = AsyncProcessor()
+    return _default_processor
+
+
+async def encrypt_file(file_path: str, password: str, output_path: str = None) -> str:
+    """Encrypt a file on the shared AsyncProcessor"""
+    return await default_processor().encrypt_file(file_path, password, output_path)
+
+
+async def decrypt_file(file_path: str, password: str, output_path: str = None) -> str:
+    """Decrypt a file on the shared AsyncProcessor"""
+    return await default_processor().decrypt_file(file_path, password, output_path)
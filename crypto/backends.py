@@ -0,0 +1,272 @@
+import time
+
+BLOCK_SIZE = 16  # AES block size
+
+
+class CipherBackend:
+    """Base class for AES providers used by the encryptor and decryptor"""
+
+    name = 'base'
+    description = 'Abstract backend'
+
+    def is_available(self) -> bool:
+        """Check whether the provider can be imported"""
+        return False
+
+    def cbc(self, key: bytes, iv: bytes, decrypt: bool = False):
+        """
+        Create a chained AES-CBC cipher
+
+        The returned object keeps its state across calls and exposes
+        update(data) -> bytes and update_into(data, out) -> int. Data must
+        be a multiple of the AES block size; padding is handled by the caller.
+        """
+        raise NotImplementedError
+
+    def ctr(self, key: bytes, counter: bytes):
+        """
+        Create an AES-CTR cipher starting at a 16-byte counter block
+
+        The counter is incremented as one 128-bit big-endian integer. The
+        returned object exposes update(data) -> bytes and
+        update_into(data, out) -> int for data of any length.
+        """
+        raise NotImplementedError
+
+    def ecb(self, key: bytes):
+        """
+        Create a raw AES block encryptor (ECB, no padding)
+
+        Only meant for building CTR keystream from counter blocks when a
+        new ctr() per message costs more than the cipher work, as it does
+        for many tiny records. The returned object exposes
+        update(data) -> bytes for whole blocks and keeps no state between calls.
+        """
+        raise NotImplementedError
+
+
+class _PyAESCBC:
+    """AES-CBC on top of pyaes, one block at a time"""
+
+    def __init__(self, key: bytes, iv: bytes, decrypt: bool):
+        import pyaes
+        aes = pyaes.AESModeOfOperationCBC(key, iv=iv)
+        self._process = aes.decrypt if decrypt else aes.encrypt
+
+    def update_into(self, data, out) -> int:
+        data = memoryview(data)
+        out = memoryview(out)
+        length = len(data)
+        if length % BLOCK_SIZE:
+            raise ValueError("Data length must be a multiple of the AES block size")
+
+        process = self._process
+        for i in range(0, length, BLOCK_SIZE):
+            out[i:i + BLOCK_SIZE] = process(data[i:i + BLOCK_SIZE].tobytes())
+        return length
+
+    def update(self, data) -> bytes:
+        out = bytearray(len(data))
+        self.update_into(data, out)
+        return bytes(out)
+
+
+class _PyAESCTR:
+    """AES-CTR on top of pyaes"""
+
+    def __init__(self, key: bytes, counter: bytes):
+        import pyaes
+        initial_value = int.from_bytes(counter, 'big')
+        self._aes = pyaes.AESModeOfOperationCTR(key, counter=pyaes.Counter(initial_value))
+
+    def update_into(self, data, out) -> int:
+        length = len(data)
+        memoryview(out)[:length] = self._aes.encrypt(bytes(data))
+        return length
+
+    def update(self, data) -> bytes:
+        return self._aes.encrypt(bytes(data))
+
+
+class _PyAESECB:
+    """Raw AES block encryption on top of pyaes"""
+
+    def __init__(self, key: bytes):
+        import pyaes
+        self._encrypt = pyaes.AESModeOfOperationECB(key).encrypt
+
+    def update(self, data) -> bytes:
+        data = bytes(data)
+        if len(data) % BLOCK_SIZE:
+            raise ValueError("Data length must be a multiple of the AES block size")
+        return b''.join(self._encrypt(data[i:i + BLOCK_SIZE]) for i in range(0, len(data), BLOCK_SIZE))
+
+
+class PyAESBackend(CipherBackend):
+    """Pure Python fallback provider"""
+
+    name = 'pyaes'
+    description = 'pyaes (pure Python)'
+
+    def is_available(self) -> bool:
+        try:
+            import pyaes  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def cbc(self, key: bytes, iv: bytes, decrypt: bool = False):
+        return _PyAESCBC(key, iv, decrypt)
+
+    def ctr(self, key: bytes, counter: bytes):
+        return _PyAESCTR(key, counter)
+
+    def ecb(self, key: bytes):
+        return _PyAESECB(key)
+
+
+class _OpenSSLCBC:
+    """AES-CBC on top of the cryptography package (OpenSSL, AES-NI when present)"""
+
+    def __init__(self, context):
+        self._context = context
+
+    def update_into(self, data, out) -> int:
+        data = memoryview(data)
+        length = len(data)
+        if length % BLOCK_SIZE:
+            raise ValueError("Data length must be a multiple of the AES block size")
+
+        # OpenSSL wants block_size - 1 bytes of slack in the output buffer
+        if len(out) >= length + BLOCK_SIZE - 1 and not _overlaps(data, out):
+            return self._context.update_into(data, out)
+        memoryview(out)[:length] = self._context.update(data)
+        return length
+
+    def update(self, data) -> bytes:
+        if len(data) % BLOCK_SIZE:
+            raise ValueError("Data length must be a multiple of the AES block size")
+        return self._context.update(data)
+
+
+class _OpenSSLCTR:
+    """AES-CTR on top of the cryptography package"""
+
+    def __init__(self, context):
+        self._context = context
+
+    def update_into(self, data, out) -> int:
+        data = memoryview(data)
+        length = len(data)
+        if len(out) >= length + BLOCK_SIZE - 1 and not _overlaps(data, out):
+            return self._context.update_into(data, out)
+        memoryview(out)[:length] = self._context.update(data)
+        return length
+
+    def update(self, data) -> bytes:
+        return self._context.update(data)
+
+
+def _overlaps(data: memoryview, out) -> bool:
+    """Best effort check for in-place calls, which OpenSSL does not allow"""
+    out = memoryview(out)
+    return data.obj is out.obj
+
+
+class CryptographyBackend(CipherBackend):
+    """Accelerated provider using the cryptography package"""
+
+    name = 'cryptography'
+    description = 'cryptography (OpenSSL)'
+
+    def is_available(self) -> bool:
+        try:
+            from cryptography.hazmat.primitives.ciphers import Cipher  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def cbc(self, key: bytes, iv: bytes, decrypt: bool = False):
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+        cipher = Cipher(algorithms.AES(key), modes.CBC(iv))
+        context = cipher.decryptor() if decrypt else cipher.encryptor()
+        return _OpenSSLCBC(context)
+
+    def ctr(self, key: bytes, counter: bytes):
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+        return _OpenSSLCTR(Cipher(algorithms.AES(key), modes.CTR(counter)).encryptor())
+
+    def ecb(self, key: bytes):
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+        return Cipher(algorithms.AES(key), modes.ECB()).encryptor()
+
+
+# Providers in order of preference
+BACKENDS = {
+    'cryptography': CryptographyBackend,
+    'pyaes': PyAESBackend,
+}
+
+_default_backend = None
+
+
+def available_backends() -> list:
+    """Names of the providers that can be used on this machine"""
+    return [name for name, cls in BACKENDS.items() if cls().is_available()]
+
+
+def get_backend(name=None) -> CipherBackend:
+    """
+    Get a cipher backend
+
+    Args:
+        name: Backend name, a CipherBackend instance, or None to pick the
+            fastest available provider
+
+    Returns:
+        CipherBackend: The selected provider
+    """
+    global _default_backend
+
+    if isinstance(name, CipherBackend):
+        return name
+
+    if name is None:
+        if _default_backend is None:
+            for cls in BACKENDS.values():
+                backend = cls()
+                if backend.is_available():
+                    _default_backend = backend
+                    break
+            else:
+                raise Exception("No AES backend available. Install pyaes or cryptography")
+        return _default_backend
+
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend: {name}")
+    backend = BACKENDS[name]()
+    if not backend.is_available():
+        raise Exception(f"Backend '{name}' is not installed")
+    return backend
+
+
+def measure_throughput(backend=None, size: int = 64 * 1024) -> float:
+    """
+    Measure CBC encryption speed of a backend
+
+    Returns:
+        float: Throughput in MB/s
+    """
+    backend = get_backend(backend)
+    data = bytearray(size)
+    out = bytearray(size + BLOCK_SIZE)
+    cipher = backend.cbc(bytes(32), bytes(16))
+
+    start = time.perf_counter()
+    cipher.update_into(data, out)
+    elapsed = time.perf_counter() - start
+
+    return size / (1024 * 1024) / max(elapsed, 1e-9)
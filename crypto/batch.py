@@ -0,0 +1,371 @@
+import os
+import time
+import secrets
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from crypto.checkpoint import DEFAULT_CHECKPOINT_INTERVAL
+from crypto.chunked import default_workers
+from crypto.compression import COMPRESSION_NONE, check_compression
+from crypto.container import CONTAINER_CHUNKED, CONTAINER_LEGACY
+from crypto.kdf import DEFAULT_KDF, get_kdf
+from crypto.manifest import Manifest
+from crypto.stream import DEFAULT_CHUNK_SIZE
+
+# Files smaller than this are packed together into one worker job
+SMALL_FILE_SIZE = 1024 * 1024  # 1 MiB
+# Limits for a packed job
+PACK_BYTES = 8 * 1024 * 1024  # 8 MiB
+PACK_FILES = 64
+# Jobs in flight per worker, which caps memory and queued file lists
+QUEUE_DEPTH = 2
+
+MODE_ENCRYPT = 'encrypt'
+MODE_DECRYPT = 'decrypt'
+MODE_VERIFY = 'verify'
+
+
+class BatchResult:
+    """Outcome of one file in a batch"""
+
+    def __init__(self, path: str, size: int, output: str = None, error: str = None, elapsed: float = 0.0,
+                 skipped: bool = False, mtime_ns: int = None, digest: bytes = None):
+        self.path = path
+        self.size = size
+        self.output = output
+        self.error = error
+        self.elapsed = elapsed
+        # Unchanged since the run recorded in the manifest, output kept
+        self.skipped = skipped
+        # Source state for the manifest
+        self.mtime_ns = mtime_ns
+        self.digest = digest
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class BatchSummary:
+    """Collected results, failures and timings of a batch run"""
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.results = []
+        self.elapsed = 0.0
+
+    def add(self, result: BatchResult):
+        self.results.append(result)
+
+    @property
+    def succeeded(self) -> list:
+        return [result for result in self.results if result.ok]
+
+    @property
+    def failed(self) -> list:
+        return [result for result in self.results if not result.ok]
+
+    @property
+    def skipped(self) -> list:
+        return [result for result in self.results if result.skipped]
+
+    @property
+    def total_bytes(self) -> int:
+        """Bytes actually processed; skipped files do not count"""
+        return sum(result.size for result in self.succeeded if not result.skipped)
+
+    @property
+    def throughput(self) -> float:
+        """Processed MB/s over the wall time of the batch"""
+        return self.total_bytes / (1024 * 1024) / max(self.elapsed, 1e-9)
+
+    def slowest(self, count: int = 5) -> list:
+        return sorted(self.results, key=lambda result: result.elapsed, reverse=True)[:count]
+
+    def to_dict(self) -> dict:
+        return {
+            'mode': self.mode,
+            'files': len(self.results),
+            'succeeded': len(self.succeeded),
+            'failed': len(self.failed),
+            'skipped': len(self.skipped),
+            'total_bytes': self.total_bytes,
+            'elapsed': round(self.elapsed, 3),
+            'throughput_mb_s': round(self.throughput, 2),
+            'failures': [{'path': r.path, 'error': r.error} for r in self.failed],
+        }
+
+
+def _run_job(mode: str, files: list, password: str, options: dict, session_key: tuple = None) -> list:
+    """
+    Encrypt, decrypt or verify a list of (path, size, known) items inside a worker
+
+    known is the (digest, output) pair from the manifest for files that
+    may only have been touched, or None.
+
+    Returns:
+        list: BatchResult for every file in the job
+    """
+    from crypto.decryptor import FileDecryptor
+    from crypto.encryptor import FileEncryptor
+    from crypto.keycache import KeySession
+
+    # Files are already spread over the pool, so no nested process pools
+    if mode == MODE_ENCRYPT:
+        worker = FileEncryptor(options['chunk_size'], options['backend'], options['container'], workers=1,
+                               compression=options['compression'],
+                               checkpoint_interval=options['checkpoint_interval'], kdf=options['kdf'])
+    else:
+        worker = FileDecryptor(options['chunk_size'], options['backend'], workers=1)
+
+    hash_key = options.get('hash_key')
+    session = KeySession.from_key(*session_key) if session_key else None
+    results = []
+    try:
+        for path, size, known in files:
+            start = time.perf_counter()
+            try:
+                if mode == MODE_VERIFY:
+                    worker.verify_file(path, password)
+                    results.append(BatchResult(path, size, elapsed=time.perf_counter() - start))
+                elif mode == MODE_DECRYPT:
+                    output = worker.decrypt_file(path, password)
+                    results.append(BatchResult(path, size, output, elapsed=time.perf_counter() - start))
+                elif hash_key is None:
+                    output = worker.encrypt_file(path, password, session=session)
+                    results.append(BatchResult(path, size, output, elapsed=time.perf_counter() - start))
+                else:
+                    results.append(_encrypt_tracked(worker, path, password, session, hash_key, known, start))
+            except Exception as e:
+                results.append(BatchResult(path, size, error=str(e), elapsed=time.perf_counter() - start))
+    finally:
+        if session is not None:
+            session.close()
+    return results
+
+
+def _encrypt_tracked(worker, path: str, password: str, session, hash_key: bytes, known: tuple,
+                     start: float) -> BatchResult:
+    """Encrypt a file for a manifest run, skipping it if only its mtime changed"""
+    from crypto.manifest import content_digest
+
+    stat = os.stat(path)
+    digest = content_digest(path, hash_key)
+    if known is not None and known[0] == digest:
+        return BatchResult(path, stat.st_size, known[1], elapsed=time.perf_counter() - start,
+                           skipped=True, mtime_ns=stat.st_mtime_ns, digest=digest)
+    output = worker.encrypt_file(path, password, session=session)
+    return BatchResult(path, stat.st_size, output, elapsed=time.perf_counter() - start,
+                       mtime_ns=stat.st_mtime_ns, digest=digest)
+
+
+class BatchProcessor:
+    """
+    Encrypt or decrypt many files on a process pool
+
+    Usable as a library call or from the interactive menu. Small files are
+    packed into shared jobs and only a bounded number of jobs are queued
+    at once, so memory stays capped for very large batches.
+    """
+
+    def __init__(self, workers: int = None, chunk_size: int = DEFAULT_CHUNK_SIZE, backend=None,
+                 container: str = CONTAINER_CHUNKED, use_session: bool = True,
+                 compression: str = COMPRESSION_NONE, manifest=None, checkpoint_interval: int = None,
+                 kdf=None):
+        compression = check_compression(compression)
+        kdf = get_kdf(kdf)
+        if container == CONTAINER_LEGACY and use_session:
+            raise ValueError("Legacy files cannot use a batch session; pass use_session=False")
+        if container == CONTAINER_LEGACY and compression != COMPRESSION_NONE:
+            raise ValueError("The legacy container cannot store compressed data")
+        if container == CONTAINER_LEGACY and kdf != DEFAULT_KDF:
+            raise ValueError("The legacy container has no room for KDF parameters")
+        self.workers = workers or default_workers()
+        self.use_session = use_session
+        # Manifest object or path; unchanged files are skipped and large ones resume
+        self.manifest = manifest
+        if manifest is not None and checkpoint_interval is None:
+            checkpoint_interval = DEFAULT_CHECKPOINT_INTERVAL
+        self.options = {
+            'chunk_size': chunk_size,
+            'backend': backend if backend is None or isinstance(backend, str) else backend.name,
+            'container': container,
+            'compression': compression,
+            'checkpoint_interval': checkpoint_interval or None,
+            # Passed to workers as a spec string
+            'kdf': str(kdf),
+        }
+
+    def encrypt_files(self, files, password: str, on_result=None) -> BatchSummary:
+        """
+        Encrypt every file in an iterable of paths
+
+        With use_session (the default) the password KDF runs once for the
+        whole batch and each file gets its own HKDF-derived key; session
+        files need the chunked container.
+
+        With a manifest, files recorded by an earlier run are skipped when
+        their size and mtime are unchanged (or, if only the mtime changed,
+        their content digest matches). The manifest keeps the session salt,
+        so large files interrupted in an earlier run resume from their last
+        checkpoint.
+
+        Args:
+            files: Iterable of paths, or (path, size) pairs
+            password: Encryption password
+            on_result: Optional callback called with each BatchResult
+        """
+        from crypto.encryptor import FileEncryptor
+
+        manifest = self.manifest
+        if isinstance(manifest, str):
+            manifest = Manifest(manifest)
+        try:
+            options = dict(self.options)
+            session_key = None
+            if self.use_session or manifest is not None:
+                if manifest is not None:
+                    # Later runs must derive the same master key, so the first run's salt and KDF stick
+                    salt, options['kdf'] = manifest.key_params(options['kdf'])
+                else:
+                    salt = secrets.token_bytes(16)
+                master_key = FileEncryptor(self.options['chunk_size'], kdf=options['kdf'])._derive_key(
+                    password, salt)
+                if manifest is not None:
+                    options['hash_key'] = manifest.unlock(master_key)
+                if self.use_session:
+                    session_key = (master_key, salt)
+            return self._run(MODE_ENCRYPT, files, password, on_result, session_key, options, manifest)
+        finally:
+            if manifest is not None and manifest is not self.manifest:
+                manifest.close()
+
+    def decrypt_files(self, files, password: str, on_result=None) -> BatchSummary:
+        """
+        Decrypt every file in an iterable of paths
+
+        Args:
+            files: Iterable of paths, or (path, size) pairs
+            password: Decryption password
+            on_result: Optional callback called with each BatchResult
+        """
+        return self._run(MODE_DECRYPT, files, password, on_result, options=self.options)
+
+    def verify_files(self, files, password: str = None, on_result=None) -> BatchSummary:
+        """
+        Check many encrypted files without writing any plaintext
+
+        Each result's error names the problem of a corrupt or truncated
+        file. Without a password only structure and lengths are checked,
+        which reads just the header and trailer of each file.
+
+        Args:
+            files: Iterable of paths, or (path, size) pairs
+            password: Password to authenticate contents with, or None
+            on_result: Optional callback called with each BatchResult
+        """
+        return self._run(MODE_VERIFY, files, password, on_result, options=self.options)
+
+    def _items(self, files, manifest, skip):
+        """
+        (path, size, known) items still to process
+
+        Files the manifest shows as unchanged, with their output in
+        place, are passed to skip() instead: one stat each, no reads.
+        """
+        for item in files:
+            path, size = item if isinstance(item, tuple) else (item, _file_size(item))
+            entry = manifest.lookup(path) if manifest is not None else None
+            if entry is None or not entry.output_intact():
+                yield path, size, None
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                yield path, size, None
+                continue
+            if entry.matches_stat(stat):
+                skip(BatchResult(path, stat.st_size, entry.output, skipped=True))
+            elif entry.size == stat.st_size:
+                # Same size but touched: the worker compares content digests
+                yield path, size, (entry.digest, entry.output)
+            else:
+                yield path, size, None
+
+    def _jobs(self, items):
+        """Group items into jobs, packing small files together"""
+        pack = []
+        pack_bytes = 0
+        for item in items:
+            size = item[1]
+            if size >= SMALL_FILE_SIZE:
+                yield [item]
+                continue
+
+            pack.append(item)
+            pack_bytes += size
+            if pack_bytes >= PACK_BYTES or len(pack) >= PACK_FILES:
+                yield pack
+                pack = []
+                pack_bytes = 0
+        if pack:
+            yield pack
+
+    def _run(self, mode: str, files, password: str, on_result, session_key: tuple = None,
+             options: dict = None, manifest=None) -> BatchSummary:
+        summary = BatchSummary(mode)
+        start = time.perf_counter()
+
+        def report(result):
+            summary.add(result)
+            if on_result:
+                on_result(result)
+
+        def collect(results):
+            for result in results:
+                report(result)
+                if manifest is not None and result.ok and result.digest is not None:
+                    manifest.record(result.path, result.size, result.mtime_ns, result.digest,
+                                    result.output, os.path.getsize(result.output))
+            if manifest is not None:
+                manifest.commit()
+
+        jobs = self._jobs(self._items(files, manifest, report))
+        if self.workers <= 1:
+            for job in jobs:
+                collect(_run_job(mode, job, password, options, session_key))
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                pending = set()
+                for job in jobs:
+                    pending.add(pool.submit(_run_job, mode, job, password, options, session_key))
+                    if len(pending) >= self.workers * QUEUE_DEPTH:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            collect(future.result())
+                for future in pending:
+                    collect(future.result())
+
+        summary.elapsed = time.perf_counter() - start
+        return summary
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def encrypt_files(files, password: str, **options) -> BatchSummary:
+    """Encrypt many files on a process pool, see BatchProcessor"""
+    return BatchProcessor(**options).encrypt_files(files, password)
+
+
+def decrypt_files(files, password: str, **options) -> BatchSummary:
+    """Decrypt many files on a process pool, see BatchProcessor"""
+    return BatchProcessor(**options).decrypt_files(files, password)
+
+
+def verify_files(files, password: str = None, **options) -> BatchSummary:
+    """Verify many encrypted files on a process pool, see BatchProcessor"""
+    return BatchProcessor(**options).verify_files(files, password)
@@ -0,0 +1,441 @@
+import io
+import os
+import json
+import zlib
+import struct
+import secrets
+
+from crypto.backends import get_backend
+from crypto.chunked import (
+    decrypt_chunked_stream, default_workers, encrypt_chunked_stream, open_chunk, seal_chunk, verify_chunked_stream
+)
+from crypto.container import FLAG_KDF, MAGIC, NONCE_SIZE, TAG_SIZE, VERSION_BUNDLE, split_key
+from crypto.kdf import DEFAULT_KDF, KDF_PARAMS_SIZE, get_kdf, unpack_kdf
+from crypto.stream import DEFAULT_CHUNK_SIZE, check_chunk_size
+
+# magic, version, header size, flags, chunk size, salt; KDF parameters follow with FLAG_KDF
+_HEADER = struct.Struct('>7sBHHI16s')
+HEADER_SIZE = _HEADER.size
+# index offset, index length, index nonce, magic, version
+_TRAILER = struct.Struct('>QQ8s7sB')
+TRAILER_SIZE = _TRAILER.size
+# Read size when looking backwards for the trailer of an interrupted append
+_SCAN_SIZE = 1024 * 1024
+
+MODE_READ = 'r'
+MODE_WRITE = 'w'    # create, replacing an existing file
+MODE_APPEND = 'a'   # add members to an existing bundle (created if missing)
+
+
+def _parse_header(file) -> tuple:
+    """(header bytes, chunk size, salt, KDF) of a bundle, read from the start of file"""
+    header = file.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+        raise Exception("File is too short to be a bundle")
+    magic, version, header_size, flags, chunk_size, salt = _HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION_BUNDLE:
+        raise Exception("Not a bundle")
+    if flags & ~FLAG_KDF or header_size != HEADER_SIZE + (KDF_PARAMS_SIZE if flags else 0):
+        raise Exception("Unsupported bundle header (file written by a newer version?)")
+    kdf = DEFAULT_KDF
+    if flags & FLAG_KDF:
+        params = file.read(KDF_PARAMS_SIZE)
+        if len(params) < KDF_PARAMS_SIZE:
+            raise Exception("File is too short to be a bundle")
+        kdf = unpack_kdf(params)
+        header += params
+    return header, chunk_size, salt, kdf
+
+
+def _parse_trailer(file, file_size: int) -> tuple:
+    """(index offset, index length, index nonce) from the trailer at the end of file"""
+    if file_size < HEADER_SIZE + TRAILER_SIZE:
+        raise Exception("Bundle is truncated")
+    file.seek(file_size - TRAILER_SIZE)
+    offset, length, nonce, magic, version = _TRAILER.unpack(file.read(TRAILER_SIZE))
+    if magic != MAGIC or version != VERSION_BUNDLE or offset + length != file_size - TRAILER_SIZE:
+        raise Exception("Bundle index not found (incomplete write?)")
+    return offset, length, nonce
+
+
+def _find_trailer(file, file_size: int) -> tuple:
+    """
+    (index offset, index length, index nonce, end) of the last complete index
+
+    The trailer normally ends the file. An append that was interrupted
+    before its index was written leaves members after the previous
+    trailer, so that one is looked for backwards from the end; end is
+    where the complete part of the bundle stops.
+    """
+    try:
+        return _parse_trailer(file, file_size) + (file_size,)
+    except Exception:
+        pass
+    marker = MAGIC + bytes([VERSION_BUNDLE])
+    position = file_size
+    while position > HEADER_SIZE:
+        start = max(HEADER_SIZE, position - _SCAN_SIZE)
+        file.seek(start)
+        # Overlap the previous block so a marker across the boundary is seen
+        block = file.read(min(position + len(marker) - 1, file_size) - start)
+        index = block.rfind(marker)
+        while index >= 0:
+            end = start + index + len(marker)
+            try:
+                return _parse_trailer(file, end) + (end,)
+            except Exception:
+                index = block.rfind(marker, 0, index + len(marker) - 1)
+        position = start
+    raise Exception("Bundle index not found (incomplete write?)")
+
+
+def check_bundle_structure(file, file_size: int):
+    """Check a bundle's header and trailer without the password"""
+    file.seek(0)
+    header, _, _, _ = _parse_header(file)
+    offset, length, _ = _parse_trailer(file, file_size)
+    if offset < len(header) or length < TAG_SIZE:
+        raise Exception("Bundle index not found (incomplete write?)")
+
+
+class BundleEntry:
+    """Index record of one member"""
+
+    def __init__(self, name: str, offset: int, size: int, mtime: float, nonce: bytes):
+        self.name = name
+        self.offset = offset
+        self.size = size
+        self.mtime = mtime
+        self.nonce = nonce
+
+    def stored_size(self, chunk_size: int) -> int:
+        """Bytes taken in the bundle: plaintext plus one tag per chunk (and an empty final chunk)"""
+        return self.size + (self.size // chunk_size + 1) * TAG_SIZE
+
+    def to_dict(self) -> dict:
+        return {'name': self.name, 'offset': self.offset, 'size': self.size,
+                'mtime': self.mtime, 'nonce': self.nonce.hex()}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'BundleEntry':
+        return cls(data['name'], data['offset'], data['size'], data['mtime'], bytes.fromhex(data['nonce']))
+
+
+class _MemberScope:
+    """
+    Stands in for a ContainerHeader in the chunk functions
+
+    Chunk tags of a member cover the bundle header and the member nonce,
+    so records cannot be moved between members or bundles.
+    """
+
+    def __init__(self, header: bytes, nonce: bytes, chunk_size: int):
+        self._context = header + nonce
+        self.nonce = nonce
+        self.chunk_size = chunk_size
+
+    @property
+    def record_size(self) -> int:
+        return self.chunk_size + TAG_SIZE
+
+    def bound_fields(self) -> bytes:
+        return self._context
+
+
+class _LimitedReader:
+    """Reader that stops after length bytes of the underlying file"""
+
+    def __init__(self, file, length: int):
+        self._file = file
+        self._remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+
+def member_path(folder: str, name: str) -> str:
+    """Output path for a member name, refusing names that escape the folder"""
+    parts = name.split('/')
+    if name.startswith('/') or any(part in ('', '.', '..') for part in parts) or ':' in parts[0]:
+        raise Exception(f"Unsafe member name: {name}")
+    return os.path.join(folder, *parts)
+
+
+class Bundle:
+    """
+    Many files in one encrypted archive
+
+    Layout: header, member data, encrypted index, trailer. The password
+    KDF runs once per bundle; members are encrypted like chunked
+    container bodies with their own nonce and no padding, so a small
+    file costs only a 16 byte tag. The index (name, offset, size, mtime)
+    sits at the end and is found through the fixed-size trailer, so a
+    member can be listed or extracted without decrypting the others.
+
+    Appending writes new members after the old trailer and a new index
+    after them; the previous index and trailer become dead space but are
+    left intact. If the append is interrupted before the new index is
+    written, opening the bundle finds the previous trailer by looking
+    backwards and the members added since are discarded, so the bundle
+    reads as it was before the append. Adding a name again replaces the
+    entry, and the old data is left unreferenced.
+
+    Example:
+        with Bundle('photos.Wh04ami', password, 'w') as bundle:
+            bundle.add_folder('photos/')
+        with Bundle('photos.Wh04ami', password) as bundle:
+            bundle.extract('2024/beach.jpg', 'beach.jpg')
+    """
+
+    def __init__(self, path: str, password: str, mode: str = MODE_READ,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, backend=None, workers: int = None,
+                 decryptor=None, kdf=None):
+        if mode not in (MODE_READ, MODE_WRITE, MODE_APPEND):
+            raise ValueError(f"Unknown bundle mode: {mode}")
+        if decryptor is None:
+            from crypto.decryptor import FileDecryptor
+            decryptor = FileDecryptor(backend=backend)
+
+        self.path = path
+        self.mode = mode
+        self.backend = get_backend(backend)
+        self.workers = workers or default_workers()
+        self._entries = {}
+        self._modified = False
+
+        if mode == MODE_APPEND and not os.path.exists(path):
+            mode = MODE_WRITE
+        if mode == MODE_WRITE:
+            self.chunk_size = check_chunk_size(chunk_size)
+            self._salt = secrets.token_bytes(16)
+            self.kdf = get_kdf(kdf)
+            params = self.kdf.pack() if self.kdf != DEFAULT_KDF else b''
+            self._header = _HEADER.pack(MAGIC, VERSION_BUNDLE, HEADER_SIZE + len(params),
+                                        FLAG_KDF if params else 0, self.chunk_size, self._salt) + params
+            self._file = open(path, 'wb+')
+            self._file.write(self._header)
+            self._data_end = len(self._header)
+            self._modified = True
+        else:
+            self._file = open(path, 'rb' if mode == MODE_READ else 'rb+')
+
+        try:
+            if mode != MODE_WRITE:
+                self._read_header()
+            self._enc_key, self._mac_key = split_key(decryptor._get_key(password, self._salt, self.kdf))
+            if mode != MODE_WRITE:
+                self._read_index()
+        except Exception:
+            self._file.close()
+            raise
+
+    def _read_header(self):
+        self._header, self.chunk_size, self._salt, self.kdf = _parse_header(self._file)
+
+    def _read_index(self):
+        """Locate the index through the trailer, then verify and decrypt it"""
+        file_size = os.fstat(self._file.fileno()).st_size
+        offset, length, nonce, end = _find_trailer(self._file, file_size)
+
+        self._file.seek(offset)
+        record = self._file.read(length)
+        try:
+            data = open_chunk(self.backend.name, self._enc_key, self._mac_key, self._index_context(nonce),
+                              nonce, 0, True, record)
+        except Exception:
+            raise Exception("Cannot open bundle index (wrong password or corrupted file)")
+        for item in json.loads(zlib.decompress(data)):
+            entry = BundleEntry.from_dict(item)
+            self._entries[entry.name] = entry
+        # Appends overwrite whatever an interrupted one left after the trailer
+        self._data_end = end
+
+    def _index_context(self, nonce: bytes) -> bytes:
+        return self._header + b'index' + nonce
+
+    def _write_index(self):
+        data = zlib.compress(json.dumps([entry.to_dict() for entry in self._entries.values()],
+                                        separators=(',', ':')).encode())
+        nonce = secrets.token_bytes(NONCE_SIZE)
+        record = seal_chunk(self.backend.name, self._enc_key, self._mac_key, self._index_context(nonce),
+                            nonce, 0, True, data)
+        self._file.seek(self._data_end)
+        self._file.write(record)
+        self._file.write(_TRAILER.pack(self._data_end, len(record), nonce, MAGIC, VERSION_BUNDLE))
+        self._file.truncate()
+
+    # Reading
+
+    @property
+    def entries(self) -> list:
+        return list(self._entries.values())
+
+    def names(self) -> list:
+        return list(self._entries)
+
+    def get(self, name: str) -> BundleEntry:
+        entry = self._entries.get(name)
+        if entry is None:
+            raise Exception(f"No such member: {name}")
+        return entry
+
+    def _decrypt_member(self, entry: BundleEntry, writer) -> int:
+        self._file.seek(entry.offset)
+        reader = _LimitedReader(self._file, entry.stored_size(self.chunk_size))
+        scope = _MemberScope(self._header, entry.nonce, self.chunk_size)
+        workers = self.workers if entry.size > self.chunk_size else 1
+        total = decrypt_chunked_stream(reader, writer, self._enc_key, self._mac_key, scope,
+                                       self.backend, workers)
+        if total != entry.size:
+            raise Exception(f"Member {entry.name} is truncated")
+        return total
+
+    def verify(self) -> int:
+        """
+        Check the tags of every member without decrypting or writing anything
+
+        Returns:
+            int: Total plaintext bytes of all members
+        """
+        total = 0
+        for entry in sorted(self._entries.values(), key=lambda entry: entry.offset):
+            self._file.seek(entry.offset)
+            reader = _LimitedReader(self._file, entry.stored_size(self.chunk_size))
+            scope = _MemberScope(self._header, entry.nonce, self.chunk_size)
+            workers = self.workers if entry.size > self.chunk_size else 1
+            try:
+                size = verify_chunked_stream(reader, self._mac_key, scope, workers)
+            except Exception as e:
+                raise Exception(f"Member {entry.name}: {e}")
+            if size != entry.size:
+                raise Exception(f"Member {entry.name} is truncated")
+            total += entry.size
+        return total
+
+    def read(self, name: str) -> bytes:
+        """Decrypt one member into memory"""
+        output = io.BytesIO()
+        self._decrypt_member(self.get(name), output)
+        return output.getvalue()
+
+    def extract(self, name: str, output_path: str = None) -> str:
+        """
+        Decrypt one member to a file, restoring its mtime
+
+        Only that member's chunks are read. The default output path is
+        the member name below the current directory. The member is
+        decrypted to a temporary file that replaces output_path only once
+        it authenticated, so a failure leaves an existing file untouched.
+        """
+        from crypto.decryptor import _remove, _temp_path
+
+        entry = self.get(name)
+        output_path = output_path or member_path(os.curdir, name)
+        folder = os.path.dirname(output_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        temp_path = _temp_path(output_path)
+        try:
+            with open(temp_path, 'wb') as output:
+                self._decrypt_member(entry, output)
+            os.utime(temp_path, (entry.mtime, entry.mtime))
+            os.replace(temp_path, output_path)
+        except BaseException:
+            _remove(temp_path)
+            raise
+        return output_path
+
+    def extract_all(self, folder: str) -> list:
+        """Extract every member below a folder, returning the output paths"""
+        return [self.extract(name, member_path(folder, name)) for name in self._entries]
+
+    # Writing
+
+    def add(self, file_path: str, name: str = None) -> BundleEntry:
+        """
+        Encrypt a file into the bundle as a new member
+
+        Args:
+            file_path: File to add
+            name: Member name ('/'-separated); defaults to the file name
+        """
+        if self.mode == MODE_READ:
+            raise Exception("Bundle is open for reading")
+        name = name or os.path.basename(file_path)
+        # Refuse names that could not be extracted safely later
+        member_path(os.curdir, name)
+
+        stat = os.stat(file_path)
+        nonce = secrets.token_bytes(NONCE_SIZE)
+        scope = _MemberScope(self._header, nonce, self.chunk_size)
+        workers = self.workers if stat.st_size > self.chunk_size else 1
+
+        self._file.seek(self._data_end)
+        try:
+            with open(file_path, 'rb') as source:
+                size = encrypt_chunked_stream(source, self._file, self._enc_key, self._mac_key, scope,
+                                              self.backend, workers)
+        except Exception:
+            # Drop the partial member so the bundle stays consistent
+            self._file.truncate(self._data_end)
+            raise
+
+        entry = BundleEntry(name, self._data_end, size, stat.st_mtime, nonce)
+        self._entries[name] = entry
+        self._data_end += entry.stored_size(self.chunk_size)
+        self._modified = True
+        return entry
+
+    def add_folder(self, folder_path: str, recursive: bool = True, include=None, exclude=None) -> int:
+        """
+        Add every file below a folder, named by its path relative to the folder
+
+        Returns:
+            int: Number of files added
+        """
+        from utils.file_handler import FileHandler
+
+        count = 0
+        files = FileHandler().walk_files(folder_path, include=include, exclude=exclude,
+                                         recursive=recursive, largest_first=False)
+        for file_path, _ in files:
+            if os.path.abspath(file_path) == os.path.abspath(self.path):
+                continue
+            name = os.path.relpath(file_path, folder_path).replace(os.sep, '/')
+            self.add(file_path, name)
+            count += 1
+        return count
+
+    def close(self):
+        """Write the index if members were added"""
+        if self._file.closed:
+            return
+        try:
+            if self._modified:
+                self._write_index()
+        finally:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        # Members added before an error are complete, so the index is still written
+        self.close()
+
+
+def create_bundle(bundle_path: str, folder_path: str, password: str, **options) -> Bundle:
+    """Pack a folder into a new bundle"""
+    with Bundle(bundle_path, password, MODE_WRITE, **options) as bundle:
+        bundle.add_folder(folder_path)
+    return bundle
+
+
+def list_bundle(bundle_path: str, password: str) -> list:
+    """Members of a bundle; only the index is decrypted"""
+    with Bundle(bundle_path, password) as bundle:
+        return bundle.entries
@@ -0,0 +1,66 @@
+import os
+import json
+
+# Partial output of a resumable encryption, renamed into place when done
+PART_SUFFIX = '.part'
+# Progress record kept next to the partial output
+STATE_SUFFIX = '.ckpt'
+
+# Plaintext between checkpoints; each one costs an fsync of the output
+DEFAULT_CHECKPOINT_INTERVAL = 256 * 1024 * 1024  # 256 MiB
+
+
+class Checkpoint:
+    """
+    Progress of a resumable chunked encryption
+
+    The state names the source (size and mtime) and how many chunks of
+    the partial output were fsynced before it was saved, so a run that
+    was killed can continue after them. A changed source starts over.
+    """
+
+    def __init__(self, output_path: str):
+        self.output_path = output_path
+        self.part_path = output_path + PART_SUFFIX
+        self.state_path = self.part_path + STATE_SUFFIX
+
+    def load(self, source_stat: os.stat_result) -> int:
+        """Chunks already written for this source, or 0 when there is nothing to resume"""
+        try:
+            with open(self.state_path, 'r') as file:
+                state = json.load(file)
+            part_size = os.path.getsize(self.part_path)
+        except (OSError, ValueError):
+            return 0
+        if (state.get('source_size'), state.get('source_mtime_ns')) != (
+                source_stat.st_size, source_stat.st_mtime_ns):
+            return 0
+        if part_size < state.get('part_size', part_size + 1):
+            return 0
+        return state.get('chunks', 0)
+
+    def save(self, source_stat: os.stat_result, chunks: int, part_size: int):
+        """Record progress; call only after the partial output is fsynced"""
+        state = {
+            'source_size': source_stat.st_size,
+            'source_mtime_ns': source_stat.st_mtime_ns,
+            'chunks': chunks,
+            'part_size': part_size,
+        }
+        temp_path = self.state_path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(state, file)
+        os.replace(temp_path, self.state_path)
+
+    def commit(self):
+        """Move the finished output into place and drop the state"""
+        os.replace(self.part_path, self.output_path)
+        self.clear(keep_part=True)
+
+    def clear(self, keep_part: bool = False):
+        paths = [self.state_path] if keep_part else [self.state_path, self.part_path]
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,250 @@
+import os
+import hmac
+import time
+import struct
+import hashlib
+from collections import deque
+
+from crypto.backends import get_backend
+from crypto.container import TAG_SIZE
+from crypto.progress import NULL_TRACKER
+from crypto.stream import read_exact
+
+# At most this many chunks per worker are queued, which caps memory use
+QUEUE_DEPTH = 2
+
+MAX_CHUNKS = 2 ** 32
+
+
+def chunk_counter(nonce: bytes, index: int) -> bytes:
+    """Initial CTR block for a chunk: file nonce, chunk index, block counter"""
+    return nonce + struct.pack('>II', index, 0)
+
+
+def chunk_tag(mac_key: bytes, header: bytes, index: int, final: bool, ciphertext) -> bytes:
+    """
+    Authenticate one chunk
+
+    The header, chunk index and final flag are covered so chunks cannot be
+    reordered, moved between files or dropped from the end.
+    """
+    mac = hmac.new(mac_key, header, hashlib.sha256)
+    mac.update(struct.pack('>QB', index, final))
+    mac.update(ciphertext)
+    return mac.digest()[:TAG_SIZE]
+
+
+def seal_chunk(backend_name: str, enc_key: bytes, mac_key: bytes, header: bytes,
+               nonce: bytes, index: int, final: bool, data) -> bytes:
+    """Encrypt and tag one chunk, returning ciphertext + tag"""
+    if index >= MAX_CHUNKS:
+        raise Exception("File has too many chunks for this container")
+    cipher = get_backend(backend_name).ctr(enc_key, chunk_counter(nonce, index))
+    ciphertext = cipher.update(data)
+    return ciphertext + chunk_tag(mac_key, header, index, final, ciphertext)
+
+
+def check_chunk(mac_key: bytes, header: bytes, index: int, final: bool, record) -> memoryview:
+    """Verify one chunk record's tag and return its ciphertext"""
+    record = memoryview(record)
+    if len(record) < TAG_SIZE:
+        raise Exception("Encrypted file is truncated")
+
+    ciphertext = record[:-TAG_SIZE]
+    expected = chunk_tag(mac_key, header, index, final, ciphertext)
+    if not hmac.compare_digest(expected, record[-TAG_SIZE:]):
+        raise Exception(f"Authentication failed for chunk {index} (wrong password or corrupted file)")
+    return ciphertext
+
+
+def open_chunk(backend_name: str, enc_key: bytes, mac_key: bytes, header: bytes,
+               nonce: bytes, index: int, final: bool, record) -> bytes:
+    """Verify and decrypt one chunk record (ciphertext + tag)"""
+    ciphertext = check_chunk(mac_key, header, index, final, record)
+    cipher = get_backend(backend_name).ctr(enc_key, chunk_counter(nonce, index))
+    return cipher.update(ciphertext)
+
+
+def _checked_length(mac_key: bytes, header: bytes, index: int, final: bool, record) -> int:
+    return len(check_chunk(mac_key, header, index, final, record))
+
+
+def _call(args):
+    func, params = args
+    return func(*params)
+
+
+def ordered_map(func, params, workers: int = 1):
+    """
+    Run func over an iterable of argument tuples, yielding results in order
+
+    With more than one worker the calls run on a process pool, with only
+    workers * QUEUE_DEPTH jobs in flight at a time.
+    """
+    if workers <= 1:
+        for args in params:
+            yield func(*args)
+        return
+
+    # Imported here so single-worker runs skip loading multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for args in params:
+            pending.append(pool.submit(_call, (func, args)))
+            if len(pending) >= workers * QUEUE_DEPTH:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def _next_timed(results, tracker):
+    """
+    Next result from ordered_map, timed as cipher work
+
+    Reads (and any compression behind them) happen lazily inside the
+    same call, so their time is taken out to keep phases from overlapping.
+    """
+    others_before = sum(tracker.phases.values()) - tracker.phases['cipher']
+    start = time.perf_counter()
+    item = next(results, None)
+    waited = time.perf_counter() - start
+    others = sum(tracker.phases.values()) - tracker.phases['cipher'] - others_before
+    tracker.add('cipher', waited - others)
+    return item
+
+
+def encrypt_chunked_stream(reader, writer, enc_key: bytes, mac_key: bytes, header,
+                           backend=None, workers: int = 1, tracker=None,
+                           start_index: int = 0, on_chunk=None) -> int:
+    """
+    Encrypt a reader into a writer using the chunked container
+
+    The header must already be written. A chunk shorter than the chunk
+    size marks the end of the file; inputs that are an exact multiple of
+    the chunk size get an empty final chunk.
+
+    To resume an interrupted file, position the reader and writer after
+    the chunks already written and pass their count as start_index.
+    on_chunk is called with the number of chunks written so far after
+    every chunk, e.g. to save a checkpoint.
+
+    Returns:
+        int: Number of plaintext bytes consumed
+    """
+    tracker = tracker or NULL_TRACKER
+    backend_name = get_backend(backend).name
+    header_bytes = header.bound_fields()
+    chunk_size = header.chunk_size
+    total = 0
+    written = start_index
+
+    def jobs():
+        index = start_index
+        while True:
+            with tracker.phase('read'):
+                data = read_exact(reader, chunk_size)
+            final = len(data) < chunk_size
+            yield (backend_name, enc_key, mac_key, header_bytes,
+                   header.nonce, index, final, data)
+            if final:
+                return
+            index += 1
+
+    # Time spent waiting on the pool (or sealing inline) counts as cipher work
+    results = ordered_map(seal_chunk, jobs(), workers)
+    while True:
+        record = _next_timed(results, tracker)
+        if record is None:
+            break
+        with tracker.phase('write'):
+            writer.write(record)
+        total += len(record) - TAG_SIZE
+        tracker.advance(len(record) - TAG_SIZE)
+        written += 1
+        if on_chunk is not None:
+            on_chunk(written)
+
+    return total
+
+
+def decrypt_chunked_stream(reader, writer, enc_key: bytes, mac_key: bytes, header,
+                           backend=None, workers: int = 1, tracker=None) -> int:
+    """
+    Decrypt a chunked container body from a reader positioned after the header
+
+    Every chunk is authenticated before its plaintext is written.
+
+    Returns:
+        int: Number of plaintext bytes written
+    """
+    tracker = tracker or NULL_TRACKER
+    backend_name = get_backend(backend).name
+    header_bytes = header.bound_fields()
+    record_size = header.record_size
+    total = 0
+
+    def jobs():
+        index = 0
+        while True:
+            with tracker.phase('read'):
+                record = read_exact(reader, record_size)
+            final = len(record) < record_size
+            yield (backend_name, enc_key, mac_key, header_bytes,
+                   header.nonce, index, final, record)
+            if final:
+                return
+            index += 1
+
+    results = ordered_map(open_chunk, jobs(), workers)
+    while True:
+        data = _next_timed(results, tracker)
+        if data is None:
+            break
+        with tracker.phase('write'):
+            writer.write(data)
+        total += len(data)
+        tracker.advance(len(data))
+
+    return total
+
+
+def verify_chunked_stream(reader, mac_key: bytes, header, workers: int = 1, tracker=None) -> int:
+    """
+    Authenticate every chunk of a body from a reader positioned after the header
+
+    Only the tags are checked; nothing is decrypted or written, so this
+    costs one HMAC pass over the file. Truncation, reordering and
+    corruption are caught just as decrypt_chunked_stream() would.
+
+    Returns:
+        int: Number of plaintext bytes the chunks hold
+    """
+    tracker = tracker or NULL_TRACKER
+    header_bytes = header.bound_fields()
+    record_size = header.record_size
+
+    def jobs():
+        index = 0
+        while True:
+            with tracker.phase('read'):
+                record = read_exact(reader, record_size)
+            final = len(record) < record_size
+            yield mac_key, header_bytes, index, final, record
+            if final:
+                return
+            index += 1
+
+    total = 0
+    results = ordered_map(_checked_length, jobs(), workers)
+    while True:
+        length = _next_timed(results, tracker)
+        if length is None:
+            break
+        total += length
+        tracker.advance(length + TAG_SIZE)
+    return total
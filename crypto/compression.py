@@ -0,0 +1,389 @@
+import os
+import math
+import zlib
+from collections import Counter
+
+from crypto.container import FLAG_COMPRESS_LZ4, FLAG_COMPRESS_ZLIB, FLAG_COMPRESS_ZSTD, FLAGS_COMPRESSION
+from utils.file_handler import (
+    ARCHIVE_EXTENSIONS, AUDIO_EXTENSIONS, ENCRYPTED_EXTENSIONS, IMAGE_EXTENSIONS, VIDEO_EXTENSIONS
+)
+
+COMPRESSION_NONE = 'none'
+COMPRESSION_AUTO = 'auto'  # best available codec, skipped for incompressible input
+
+# Input sampled to estimate entropy: this many bytes from the start, middle and end
+SAMPLE_PIECE = 16 * 1024
+# Above this many bits per byte the data is treated as already compressed
+ENTROPY_THRESHOLD = 7.5
+# Largest piece a decompressor produces at once, bounding memory on huge ratios
+DECOMPRESS_LIMIT = 4 * 1024 * 1024
+
+# Zstd frames asking for a larger window than this are rejected
+ZSTD_MAX_WINDOW = 8 * 1024 * 1024
+
+# Formats that are compressed already, lower case
+COMPRESSED_EXTENSIONS = (
+    IMAGE_EXTENSIONS | VIDEO_EXTENSIONS | AUDIO_EXTENSIONS | ARCHIVE_EXTENSIONS
+    | frozenset(extension.lower() for extension in ENCRYPTED_EXTENSIONS)
+)
+
+
+class Codec:
+    """Base class for compressors used before encryption"""
+
+    name = 'base'
+    flag = 0
+
+    def is_available(self) -> bool:
+        return False
+
+    def compressor(self):
+        """Object with compress(data) -> bytes and flush() -> bytes"""
+        raise NotImplementedError
+
+    def decompress(self):
+        """
+        Generator-based decompressor
+
+        Returns a (feed, finish) pair: feed(data) yields plaintext pieces of
+        at most DECOMPRESS_LIMIT bytes where the library allows it, and
+        finish() checks that the compressed stream ended properly.
+        """
+        raise NotImplementedError
+
+
+class ZlibCodec(Codec):
+    name = 'zlib'
+    flag = FLAG_COMPRESS_ZLIB
+    level = 6
+
+    def is_available(self) -> bool:
+        return True
+
+    def compressor(self):
+        return zlib.compressobj(self.level)
+
+    def decompress(self):
+        decompressor = zlib.decompressobj()
+
+        def feed(data):
+            data = bytes(data)
+            while data:
+                piece = decompressor.decompress(data, DECOMPRESS_LIMIT)
+                data = decompressor.unconsumed_tail
+                if piece:
+                    yield piece
+
+        def finish():
+            if not decompressor.eof:
+                raise Exception("Compressed data is truncated")
+
+        return feed, finish
+
+
+class ZstdCodec(Codec):
+    name = 'zstd'
+    flag = FLAG_COMPRESS_ZSTD
+    level = 3
+
+    def is_available(self) -> bool:
+        try:
+            import zstandard  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    def compressor(self):
+        import zstandard
+        return zstandard.ZstdCompressor(level=self.level).compressobj()
+
+    def decompress(self):
+        import zstandard
+        decompressor = zstandard.ZstdDecompressor(max_window_size=ZSTD_MAX_WINDOW).decompressobj()
+        # decompressobj has no output limit, so it only ever sees whole blocks
+        frame = _ZstdFrame()
+
+        def feed(data):
+            for unit in frame.split(data):
+                piece = decompressor.decompress(unit)
+                if piece:
+                    yield piece
+
+        def finish():
+            if not frame.done:
+                raise Exception("Compressed data is truncated")
+
+        return feed, finish
+
+
+class _ZstdFrame:
+    """
+    Splits a zstd frame into its header, blocks and checksum (RFC 8878)
+
+    A block never decodes to more than 128 KiB, so handing the decompressor
+    one block at a time bounds its output however small the input is.
+    """
+
+    MAGIC = b'\x28\xb5\x2f\xfd'
+    BLOCK_HEADER = 3
+    BLOCK_RLE = 1
+    BLOCK_RESERVED = 3
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._state = 'header'
+        self._checksum = False
+        self.done = False
+
+    def split(self, data):
+        """Yield every complete unit of the frame buffered so far"""
+        buffer = self._buffer
+        buffer += data
+        offset = 0
+        while not self.done:
+            step = self._next(buffer, offset)
+            if step is None:
+                break
+            length, state = step
+            yield bytes(buffer[offset:offset + length])
+            offset += length
+            self._state = state
+            self.done = state == 'done'
+        del buffer[:offset]
+        if self.done and buffer:
+            raise Exception("Unexpected data after the compressed stream")
+
+    def _next(self, buffer, offset):
+        """(length, next state) of the unit at offset, or None if it is incomplete"""
+        available = len(buffer) - offset
+        if self._state == 'header':
+            if available < 5:
+                return None
+            if buffer[offset:offset + 4] != self.MAGIC:
+                raise Exception("Compressed data is not a zstd frame")
+            descriptor = buffer[offset + 4]
+            single_segment = descriptor & 0x20
+            content_size = (0, 2, 4, 8)[descriptor >> 6] or (1 if single_segment else 0)
+            dictionary = (0, 1, 2, 4)[descriptor & 0x03]
+            self._checksum = bool(descriptor & 0x04)
+            length = 5 + (0 if single_segment else 1) + dictionary + content_size
+            state = 'block'
+        elif self._state == 'block':
+            if available < self.BLOCK_HEADER:
+                return None
+            value = int.from_bytes(buffer[offset:offset + self.BLOCK_HEADER], 'little')
+            block_type = (value >> 1) & 0x03
+            if block_type == self.BLOCK_RESERVED:
+                raise Exception("Compressed data is corrupted")
+            # An RLE block stores one byte, repeated block size times
+            length = self.BLOCK_HEADER + (1 if block_type == self.BLOCK_RLE else value >> 3)
+            state = ('checksum' if self._checksum else 'done') if value & 0x01 else 'block'
+        else:
+            length, state = 4, 'done'
+        if available < length:
+            return None
+        return length, state
+
+
+class LZ4Codec(Codec):
+    name = 'lz4'
+    flag = FLAG_COMPRESS_LZ4
+
+    def is_available(self) -> bool:
+        try:
+            import lz4.frame  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    def compressor(self):
+        import lz4.frame
+        return _LZ4Compressor(lz4.frame.LZ4FrameCompressor())
+
+    def decompress(self):
+        import lz4.frame
+        decompressor = lz4.frame.LZ4FrameDecompressor()
+
+        def feed(data):
+            piece = decompressor.decompress(bytes(data), DECOMPRESS_LIMIT)
+            while True:
+                if piece:
+                    yield piece
+                if decompressor.needs_input or decompressor.eof:
+                    return
+                piece = decompressor.decompress(b'', DECOMPRESS_LIMIT)
+
+        def finish():
+            if not decompressor.eof:
+                raise Exception("Compressed data is truncated")
+
+        return feed, finish
+
+
+class _LZ4Compressor:
+    """compressobj-style wrapper; the frame header comes with the first output"""
+
+    def __init__(self, compressor):
+        self._compressor = compressor
+        self._header = compressor.begin()
+
+    def compress(self, data) -> bytes:
+        out = self._header + self._compressor.compress(data)
+        self._header = b''
+        return out
+
+    def flush(self) -> bytes:
+        out = self._header + self._compressor.flush()
+        self._header = b''
+        return out
+
+
+# In order of preference for COMPRESSION_AUTO
+CODECS = {
+    'zstd': ZstdCodec,
+    'zlib': ZlibCodec,
+    'lz4': LZ4Codec,
+}
+
+COMPRESSION_CHOICES = (COMPRESSION_NONE, COMPRESSION_AUTO) + tuple(CODECS)
+
+
+def available_codecs() -> list:
+    return [name for name, cls in CODECS.items() if cls().is_available()]
+
+
+def get_codec(name: str) -> Codec:
+    """Codec instance by name; COMPRESSION_AUTO picks the best available one"""
+    if name == COMPRESSION_AUTO:
+        name = available_codecs()[0]
+    if name not in CODECS:
+        raise ValueError(f"Unknown compression: {name}")
+    codec = CODECS[name]()
+    if not codec.is_available():
+        raise ValueError(f"Compression '{name}' is not installed")
+    return codec
+
+
+def codec_for_flags(flags: int):
+    """Codec recorded in container header flags, or None"""
+    flag = flags & FLAGS_COMPRESSION
+    if not flag:
+        return None
+    for cls in CODECS.values():
+        if cls.flag == flag:
+            codec = cls()
+            if not codec.is_available():
+                raise Exception(f"File is compressed with '{codec.name}', which is not installed")
+            return codec
+    raise Exception("Unsupported compression flags in header")
+
+
+def check_compression(compression: str) -> str:
+    if compression not in COMPRESSION_CHOICES:
+        raise ValueError(f"Unknown compression: {compression}")
+    if compression not in (COMPRESSION_NONE, COMPRESSION_AUTO):
+        get_codec(compression)
+    return compression
+
+
+def shannon_entropy(data) -> float:
+    """Order-0 entropy in bits per byte"""
+    total = len(data)
+    if not total:
+        return 0.0
+    counts = Counter(bytes(data)).values()
+    return -sum(count / total * math.log2(count / total) for count in counts)
+
+
+def sample_file(file_path: str, file_size: int) -> bytes:
+    """Pieces from the start, middle and end of a file"""
+    with open(file_path, 'rb') as file:
+        if file_size <= 3 * SAMPLE_PIECE:
+            return file.read()
+        pieces = []
+        for offset in (0, file_size // 2, file_size - SAMPLE_PIECE):
+            file.seek(offset)
+            pieces.append(file.read(SAMPLE_PIECE))
+        return b''.join(pieces)
+
+
+def looks_compressible(sample) -> bool:
+    return shannon_entropy(sample) < ENTROPY_THRESHOLD
+
+
+def choose_codec(compression: str, file_path: str = None, sample=None):
+    """
+    Codec to use for an input, or None to store it uncompressed
+
+    Known compressed formats (by extension) and high-entropy samples are
+    skipped so no CPU is wasted on data that will not shrink.
+    """
+    if compression == COMPRESSION_NONE:
+        return None
+    if file_path and os.path.splitext(file_path)[1].lower() in COMPRESSED_EXTENSIONS:
+        return None
+    if sample is not None and not looks_compressible(sample):
+        return None
+    return get_codec(compression)
+
+
+class CompressingReader:
+    """
+    Reader returning the compressed form of another reader
+
+    Raw reads are timed as 'read' and codec work as 'compress'; input
+    bytes are reported as progress.
+    """
+
+    def __init__(self, reader, compressor, chunk_size: int, tracker):
+        self._reader = reader
+        self._compressor = compressor
+        self._chunk_size = chunk_size
+        self._tracker = tracker
+        self._pending = memoryview(b'')
+        self._eof = False
+        self.bytes_in = 0
+
+    def read(self, size: int) -> bytes:
+        while not self._pending and not self._eof:
+            with self._tracker.phase('read'):
+                data = self._reader.read(self._chunk_size)
+            self.bytes_in += len(data)
+            with self._tracker.phase('compress'):
+                if data:
+                    out = self._compressor.compress(data)
+                else:
+                    out = self._compressor.flush()
+                    self._eof = True
+            self._tracker.advance(len(data))
+            self._pending = memoryview(out)
+
+        piece = bytes(self._pending[:size])
+        self._pending = self._pending[len(piece):]
+        return piece
+
+
+class DecompressingWriter:
+    """Writer that decompresses into another writer, timing 'decompress' and 'write'"""
+
+    def __init__(self, writer, codec: Codec, tracker):
+        self._writer = writer
+        self._feed, self._finish = codec.decompress()
+        self._tracker = tracker
+        self.bytes_out = 0
+
+    def write(self, data) -> int:
+        pieces = self._feed(data)
+        while True:
+            with self._tracker.phase('decompress'):
+                piece = next(pieces, None)
+            if piece is None:
+                break
+            with self._tracker.phase('write'):
+                self._writer.write(piece)
+            self.bytes_out += len(piece)
+        return len(data)
+
+    def close(self):
+        """Check the compressed stream is complete"""
+        self._finish()
@@ -0,0 +1,362 @@
+import hmac
+import struct
+import hashlib
+
+from crypto.kdf import DEFAULT_KDF, KDF_PARAMS_SIZE, Kdf, unpack_kdf
+
+# Container formats
+CONTAINER_LEGACY = 'legacy'    # salt + iv + AES-CBC body, no header
+CONTAINER_CHUNKED = 'chunked'  # versioned header + independently authenticated chunks
+CONTAINER_BUNDLE = 'bundle'    # many files in one archive with an encrypted index (crypto.bundle)
+CONTAINER_RECORD = 'record'    # one small in-memory record from a batch sharing a key (crypto.records)
+
+MAGIC = b'WH04AMI'
+VERSION_CHUNKED_V2 = 2  # no key check, still readable
+VERSION_CHUNKED_V3 = 3  # header ends with a key-check value, still readable
+VERSION_WRAPPED = 4     # random data key, wrapped once per password in key slots
+VERSION_CHUNKED = VERSION_WRAPPED  # written for new chunked files
+VERSION_BUNDLE = 16  # numbered apart from single-file containers
+VERSION_RECORD = 32  # in-memory records, numbered apart from files and bundles
+
+NONCE_SIZE = 8   # file nonce, combined with the chunk index into the CTR counter
+TAG_SIZE = 16    # truncated HMAC-SHA256 per chunk
+FILE_SALT_SIZE = 16
+KEY_CHECK_SIZE = 16  # truncated HMAC-SHA256 of the header under the MAC key
+DATA_KEY_SIZE = 32
+
+# v4 headers always hold KEY_SLOTS slots, used or zeroed, so rewriting
+# them never changes the header size or moves the body
+KEY_SLOTS = 4
+KEY_SLOT_SIZE = 16 + KDF_PARAMS_SIZE + DATA_KEY_SIZE + 16  # KDF salt, KDF, wrapped key, tag
+
+# Header flags
+FLAG_FILE_KEY = 0x0001  # key = HKDF(password key, file salt), used by batch sessions
+FLAG_COMPRESS_ZLIB = 0x0002  # plaintext was compressed before encryption
+FLAG_COMPRESS_ZSTD = 0x0004
+FLAG_COMPRESS_LZ4 = 0x0008
+FLAGS_COMPRESSION = FLAG_COMPRESS_ZLIB | FLAG_COMPRESS_ZSTD | FLAG_COMPRESS_LZ4
+FLAG_KDF = 0x0010  # password KDF and costs stored in the header; otherwise DEFAULT_KDF
+KNOWN_FLAGS = FLAG_FILE_KEY | FLAGS_COMPRESSION | FLAG_KDF
+# Key slots carry their own salts and KDFs
+KNOWN_FLAGS_WRAPPED = FLAGS_COMPRESSION
+
+# magic, version, header size, flags, chunk size, salt, file nonce
+_HEADER = struct.Struct('>7sBHHI16s8s')
+HEADER_SIZE = _HEADER.size
+WRAPPED_HEADER_SIZE = HEADER_SIZE + KEY_SLOTS * KEY_SLOT_SIZE + KEY_CHECK_SIZE
+MAX_HEADER_SIZE = max(HEADER_SIZE + FILE_SALT_SIZE + KDF_PARAMS_SIZE + KEY_CHECK_SIZE, WRAPPED_HEADER_SIZE)
+PREFIX_SIZE = len(MAGIC) + 1
+
+
+def _slot_keys(slot_key: bytes) -> tuple:
+    return (hkdf_sha256(slot_key, b'Wh04ami key slot wrap', DATA_KEY_SIZE),
+            hkdf_sha256(slot_key, b'Wh04ami key slot tag'))
+
+
+class KeySlot:
+    """
+    One password's copy of the data key in a v4 header
+
+    The slot key is derive_file_key(password key, header salt), so the
+    same password and KDF salt still wrap differently in every file. The
+    data key is masked with an HKDF stream of the slot key and tagged
+    with HMAC-SHA256, which also tells a wrong password from a right one.
+    """
+
+    def __init__(self, salt: bytes, kdf: Kdf, wrapped: bytes):
+        self.salt = salt
+        self.kdf = kdf
+        self.wrapped = wrapped
+
+    @classmethod
+    def wrap(cls, data_key: bytes, slot_key: bytes, salt: bytes, kdf: Kdf) -> 'KeySlot':
+        pad, mac_key = _slot_keys(slot_key)
+        masked = bytes(a ^ b for a, b in zip(data_key, pad))
+        return cls(salt, kdf, masked + cls._tag(mac_key, salt, kdf, masked))
+
+    def unwrap(self, slot_key: bytes) -> bytes:
+        """The data key, or None if slot_key is not this slot's"""
+        pad, mac_key = _slot_keys(slot_key)
+        masked, tag = self.wrapped[:DATA_KEY_SIZE], self.wrapped[DATA_KEY_SIZE:]
+        if not hmac.compare_digest(self._tag(mac_key, self.salt, self.kdf, masked), tag):
+            return None
+        return bytes(a ^ b for a, b in zip(masked, pad))
+
+    @staticmethod
+    def _tag(mac_key: bytes, salt: bytes, kdf: Kdf, masked: bytes) -> bytes:
+        return hmac.new(mac_key, salt + kdf.pack() + masked, hashlib.sha256).digest()[:16]
+
+    def pack(self) -> bytes:
+        return self.salt + self.kdf.pack() + self.wrapped
+
+    @classmethod
+    def unpack(cls, data: bytes) -> 'KeySlot':
+        """A slot, or None for an unused (zeroed) one"""
+        if not any(data):
+            return None
+        kdf = unpack_kdf(data[16:16 + KDF_PARAMS_SIZE])
+        return cls(bytes(data[:16]), kdf, bytes(data[16 + KDF_PARAMS_SIZE:KEY_SLOT_SIZE]))
+
+
+class ContainerHeader:
+    """
+    Header of a versioned (non-legacy) encrypted file
+
+    Up to v3 the chunk keys come from the password-derived key. From v4
+    they come from a random data key that the header stores wrapped in
+    key slots, one per password, so a password can be changed, added or
+    removed by rewriting only the header (see crypto.rekey).
+    """
+
+    def __init__(self, version: int, chunk_size: int, salt: bytes, nonce: bytes,
+                 flags: int = 0, file_salt: bytes = None, key_check: bytes = None, kdf=None):
+        self.version = version
+        self.chunk_size = chunk_size
+        self.salt = salt
+        self.nonce = nonce
+        self.flags = flags
+        self.file_salt = file_salt
+        if file_salt is not None:
+            self.flags |= FLAG_FILE_KEY
+        # Password KDF for salt; only non-default ones take space in the header
+        self.kdf = kdf or DEFAULT_KDF
+        if self.kdf != DEFAULT_KDF:
+            self.flags |= FLAG_KDF
+        # Set by seal() once the keys are known; v3 and later only
+        self.key_check = key_check
+        # v4 only: KeySlot or None for each slot, and the one unwrap() opened
+        self.slots = [None] * KEY_SLOTS if version >= VERSION_WRAPPED else []
+        self.unlocked_slot = None
+
+    @property
+    def wrapped(self) -> bool:
+        return self.version >= VERSION_WRAPPED
+
+    @property
+    def size(self) -> int:
+        if self.wrapped:
+            return WRAPPED_HEADER_SIZE
+        size = HEADER_SIZE
+        if self.flags & FLAG_FILE_KEY:
+            size += FILE_SALT_SIZE
+        if self.flags & FLAG_KDF:
+            size += KDF_PARAMS_SIZE
+        if self.version >= VERSION_CHUNKED_V3:
+            size += KEY_CHECK_SIZE
+        return size
+
+    @property
+    def record_size(self) -> int:
+        """On-disk size of one full chunk (ciphertext + tag)"""
+        return self.chunk_size + TAG_SIZE
+
+    def pack(self) -> bytes:
+        header = self._pack_fields()
+        if self.version >= VERSION_CHUNKED_V3:
+            if self.key_check is None:
+                raise Exception("Header has not been sealed")
+            header += self.key_check
+        return header
+
+    def _pack_fields(self) -> bytes:
+        """Everything but the key check"""
+        header = _HEADER.pack(
+            MAGIC, self.version, self.size, self.flags,
+            self.chunk_size, self.salt, self.nonce
+        )
+        if self.flags & FLAG_FILE_KEY:
+            header += self.file_salt
+        if self.flags & FLAG_KDF:
+            header += self.kdf.pack()
+        for slot in self.slots:
+            header += slot.pack() if slot is not None else bytes(KEY_SLOT_SIZE)
+        return header
+
+    def bound_fields(self) -> bytes:
+        """
+        Header bytes that every chunk tag covers
+
+        v4 leaves out the key slots and key check, which change on rekey;
+        those are covered by the key check under the data key instead.
+        """
+        if self.wrapped:
+            return _HEADER.pack(MAGIC, self.version, self.size, self.flags,
+                                self.chunk_size, self.salt, self.nonce)
+        return self.pack()
+
+    def set_slot(self, index: int, data_key: bytes, slot_key: bytes, salt: bytes, kdf: Kdf):
+        """Store data_key wrapped for a password in slot index; seal() again afterwards"""
+        self.slots[index] = KeySlot.wrap(data_key, slot_key, salt, kdf)
+
+    def free_slot(self) -> int:
+        for index, slot in enumerate(self.slots):
+            if slot is None:
+                return index
+        raise Exception(f"All {KEY_SLOTS} key slots are in use")
+
+    def unwrap(self, slot_key_for) -> bytes:
+        """
+        Open the first slot whose key matches and return the data key
+
+        slot_key_for(slot) gives the slot key to try for a slot. Each try
+        usually costs a password KDF run, but a header rarely has more
+        than one or two slots in use.
+        """
+        for index, slot in enumerate(self.slots):
+            if slot is None:
+                continue
+            data_key = slot.unwrap(slot_key_for(slot))
+            if data_key is not None:
+                self.unlocked_slot = index
+                return data_key
+        raise Exception("Wrong password (or corrupted header)")
+
+    def _compute_check(self, mac_key: bytes) -> bytes:
+        mac = hmac.new(mac_key, b'Wh04ami header check', hashlib.sha256)
+        mac.update(self._pack_fields())
+        return mac.digest()[:KEY_CHECK_SIZE]
+
+    def seal(self, mac_key: bytes):
+        """Set the key-check value for a new header"""
+        if self.version >= VERSION_CHUNKED_V3:
+            self.key_check = self._compute_check(mac_key)
+
+    def verify(self, mac_key: bytes):
+        """
+        Reject a wrong password (or tampered header) right after key derivation
+
+        v2 headers carry no check; their first chunk tag catches it instead.
+        """
+        if self.version >= VERSION_CHUNKED_V3 and not hmac.compare_digest(
+                self._compute_check(mac_key), self.key_check):
+            raise Exception("Wrong password (or corrupted header)")
+
+    @classmethod
+    def unpack(cls, data: bytes) -> 'ContainerHeader':
+        if len(data) < HEADER_SIZE:
+            raise Exception("File is too short to be a valid encrypted file")
+
+        magic, version, header_size, flags, chunk_size, salt, nonce = _HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise Exception("Not a versioned encrypted file")
+        if version not in (VERSION_CHUNKED_V2, VERSION_CHUNKED_V3, VERSION_WRAPPED):
+            raise Exception(f"Unsupported container version: {version}")
+        if chunk_size == 0 or chunk_size > 64 * 1024 * 1024:
+            raise Exception("Invalid chunk size in header")
+        if flags & ~(KNOWN_FLAGS_WRAPPED if version >= VERSION_WRAPPED else KNOWN_FLAGS):
+            raise Exception("Unsupported header flags (file written by a newer version?)")
+
+        header = cls(version, chunk_size, salt, nonce, flags)
+        if header_size != header.size:
+            raise Exception("Invalid header size")
+        if len(data) < header_size:
+            raise Exception("File is too short to be a valid encrypted file")
+
+        offset = HEADER_SIZE
+        if flags & FLAG_FILE_KEY:
+            header.file_salt = bytes(data[offset:offset + FILE_SALT_SIZE])
+            offset += FILE_SALT_SIZE
+        if flags & FLAG_KDF:
+            header.kdf = unpack_kdf(data[offset:offset + KDF_PARAMS_SIZE])
+            offset += KDF_PARAMS_SIZE
+        for index in range(len(header.slots)):
+            header.slots[index] = KeySlot.unpack(data[offset:offset + KEY_SLOT_SIZE])
+            offset += KEY_SLOT_SIZE
+        if version >= VERSION_CHUNKED_V3:
+            header.key_check = bytes(data[offset:offset + KEY_CHECK_SIZE])
+        return header
+
+    @property
+    def compressed(self) -> bool:
+        return bool(self.flags & FLAGS_COMPRESSION)
+
+    def plaintext_size(self, file_size: int) -> int:
+        """
+        Compute the plaintext size from the total encrypted file size
+
+        For compressed files this is the size of the compressed stream.
+        """
+        body = file_size - self.size
+        full_chunks, last_record = divmod(body, self.record_size)
+        if body < TAG_SIZE or last_record < TAG_SIZE:
+            raise Exception("Encrypted file is truncated")
+        return full_chunks * self.chunk_size + last_record - TAG_SIZE
+
+
+def read_header(reader) -> ContainerHeader:
+    """Read a complete header, including optional fields, from a reader"""
+    data = reader.read(HEADER_SIZE)
+    if len(data) == HEADER_SIZE:
+        header_size = struct.unpack_from('>H', data, len(MAGIC) + 1)[0]
+        if HEADER_SIZE < header_size <= MAX_HEADER_SIZE:
+            data += reader.read(header_size - HEADER_SIZE)
+    return ContainerHeader.unpack(data)
+
+
+def detect_container(prefix: bytes) -> str:
+    """
+    Detect the container format from the first bytes of a file
+
+    Legacy files start with a random salt, so anything without the
+    magic is treated as legacy.
+    """
+    if len(prefix) >= PREFIX_SIZE and prefix.startswith(MAGIC):
+        if prefix[len(MAGIC)] == VERSION_BUNDLE:
+            return CONTAINER_BUNDLE
+        if prefix[len(MAGIC)] == VERSION_RECORD:
+            return CONTAINER_RECORD
+        return CONTAINER_CHUNKED
+    return CONTAINER_LEGACY
+
+
+def hkdf_sha256(key: bytes, info: bytes, length: int = 32, salt: bytes = b'') -> bytes:
+    """HKDF-SHA256 (RFC 5869) for expanding an already strong key"""
+    prk = hmac.new(salt or bytes(32), key, hashlib.sha256).digest()
+    output = b''
+    block = b''
+    counter = 1
+    while len(output) < length:
+        block = hmac.new(prk, block + info + bytes([counter]), hashlib.sha256).digest()
+        output += block
+        counter += 1
+    return output[:length]
+
+
+def split_key(master_key: bytes) -> tuple:
+    """Derive independent cipher and MAC keys from the password-derived key"""
+    enc_key = hkdf_sha256(master_key, b'Wh04ami chunk encryption')
+    mac_key = hkdf_sha256(master_key, b'Wh04ami chunk authentication')
+    return enc_key, mac_key
+
+
+def derive_file_key(master_key: bytes, file_salt: bytes) -> bytes:
+    """Cheap per-file key derived from an already stretched master key"""
+    return hkdf_sha256(master_key, b'Wh04ami file key', salt=file_salt)
+
+
+def container_keys(header: ContainerHeader, master_key: bytes) -> tuple:
+    """
+    Cipher and MAC keys for a v2/v3 file, given its password-derived key
+
+    Raises straight away if the header's key check does not match.
+    """
+    if header.flags & FLAG_FILE_KEY:
+        master_key = derive_file_key(master_key, header.file_salt)
+    enc_key, mac_key = split_key(master_key)
+    header.verify(mac_key)
+    return enc_key, mac_key
+
+
+def unlock_keys(header: ContainerHeader, get_key) -> tuple:
+    """
+    Cipher and MAC keys for any chunked file
+
+    get_key(salt, kdf) returns the password-derived key for a salt; v4
+    headers call it once per key slot tried, older ones once.
+    """
+    if not header.wrapped:
+        return container_keys(header, get_key(header.salt, header.kdf))
+    data_key = header.unwrap(lambda slot: derive_file_key(get_key(slot.salt, slot.kdf), header.salt))
+    enc_key, mac_key = split_key(data_key)
+    header.verify(mac_key)
+    return enc_key, mac_key
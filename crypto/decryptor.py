@@ -1,78 +1,414 @@
 import os
-import hashlib
-import pyaes  # ← TAMBAH INI!
+import secrets
+
+from crypto.backends import BLOCK_SIZE, get_backend
+from crypto.chunked import decrypt_chunked_stream, default_workers, verify_chunked_stream
+from crypto.compression import DecompressingWriter, codec_for_flags
+from crypto.container import (
+    CONTAINER_BUNDLE, CONTAINER_CHUNKED, CONTAINER_RECORD, PREFIX_SIZE, detect_container, read_header, unlock_keys
+)
+from crypto.kdf import DEFAULT_KDF
+from crypto.keycache import default_key_cache
+from crypto.mmap_io import IO_AUTO, IO_MODES, IO_PIPELINE, decrypt_cbc_mmap, use_mmap
+from crypto.pipeline import decrypt_cbc_pipeline, open_output, pipeline_io
+from crypto.progress import NULL_TRACKER, OperationTracker, make_sink
+from crypto.records import RecordCipher, is_record, record_params
+from crypto.stream import (
+    DEFAULT_CHUNK_SIZE, PrefixedReader, buffer_size, check_cbc_padding, check_chunk_size, decrypt_cbc_stream,
+    padding_length, read_exact
+)
+
+BUNDLE_ERROR = "File is a bundle; list or extract its members with crypto.bundle.Bundle"
+RECORD_ERROR = "File is an encrypted record; decrypt it with FileDecryptor.decrypt_data"
 
 class FileDecryptor:
-    def __init__(self):
-        pass
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE, backend=None, workers: int = None,
+                 key_cache=None, io_mode: str = IO_AUTO, progress_callback=None,
+                 metrics_sink=None, fsync: bool = False, direct_io: bool = False):
+        self.chunk_size = check_chunk_size(chunk_size)
+        self.backend = get_backend(backend)
+        self.workers = workers or default_workers()
+        self.key_cache = default_key_cache if key_cache is None else key_cache
+        if io_mode not in IO_MODES:
+            raise ValueError(f"Unknown I/O mode: {io_mode}")
+        self.io_mode = io_mode
+        # Called with (bytes_done, total_bytes, elapsed) after every chunk
+        self.progress_callback = progress_callback
+        # Receives one record with per-phase timings per file
+        self.metrics_sink = make_sink(metrics_sink)
+        self.fsync = fsync
+        # Pipeline mode only: write the output with O_DIRECT where supported
+        self.direct_io = direct_io
     
-    def _derive_key(self, password: str, salt: bytes) -> bytes:
-        """Derive AES key from password using PBKDF2"""
-        key = hashlib.pbkdf2_hmac(
-            'sha256', 
-            password.encode(), 
-            salt, 
-            100000,  # iterations
-            32  # key length for AES-256
-        )
-        return key
+    def _derive_key(self, password: str, salt: bytes, kdf=DEFAULT_KDF) -> bytes:
+        """Derive AES key from password with the KDF the file records"""
+        return kdf.derive(password, salt)
     
-    def decrypt_file(self, file_path: str, password: str) -> str:
+    def _get_key(self, password: str, salt: bytes, kdf=DEFAULT_KDF) -> bytes:
+        """Derive a key, reusing it from the key cache when possible"""
+        return self.key_cache.get_or_derive(password, salt, kdf.params,
+                                            lambda password, salt: self._derive_key(password, salt, kdf))
+    
+    def decrypt_file(self, file_path: str, password: str, output_path: str = None) -> str:
         """
         Decrypt an encrypted file with password
+        
+        The output goes to output_path, or by default next to the input
+        without the .Wh04ami extension (with a counter if that exists).
         """
+        tracker = NULL_TRACKER
         try:
-            # Read encrypted file
-            with open(file_path, 'rb') as file:
-                file_data = file.read()
-            
-            # Extract salt (16 bytes), IV (16 bytes), and encrypted data
-            if len(file_data) < 32:
+            # Extract salt (16 bytes), IV (16 bytes); the rest is encrypted data
+            file_size = os.path.getsize(file_path)
+            if file_size < 32:
                 raise Exception("File is too short to be a valid encrypted file")
-                
-            salt = file_data[:16]
-            iv = file_data[16:32]
-            encrypted_data = file_data[32:]
             
-            # Derive key from password
-            key = self._derive_key(password, salt)
+            tracker = self._tracker(file_path, file_size)
+            output_path = output_path or self._get_output_path(file_path)
+            # Decrypt next to the target and rename at the end, so a wrong
+            # password or corrupted file never leaves partial output behind
+            temp_path = _temp_path(output_path)
+            try:
+                with open(file_path, 'rb') as file:
+                    # Versioned files start with a magic, legacy ones with the salt
+                    container = detect_container(file.read(PREFIX_SIZE))
+                    if container == CONTAINER_BUNDLE:
+                        raise Exception(BUNDLE_ERROR)
+                    if container == CONTAINER_RECORD:
+                        raise Exception(RECORD_ERROR)
+                    if container == CONTAINER_CHUNKED:
+                        file.seek(0)
+                        self._decrypt_file_chunked(file, temp_path, file_size, password, tracker)
+                    else:
+                        file.seek(0)
+                        self._decrypt_file_legacy(file, file_path, temp_path, file_size, password, tracker)
+                os.replace(temp_path, output_path)
+            except BaseException:
+                _remove(temp_path)
+                raise
             
-            # Create AES cipher in CBC mode
-            aes = pyaes.AESModeOfOperationCBC(key, iv=iv)
+            tracker.finish()
+            return output_path
             
-            # Decrypt data
-            decrypted_data = b""
-            for i in range(0, len(encrypted_data), 16):
-                block = encrypted_data[i:i+16]
-                decrypted_block = aes.decrypt(block)
-                decrypted_data += decrypted_block
+        except Exception as e:
+            tracker.finish('error', str(e))
+            raise Exception(f"Decryption failed: {str(e)}")
+    
+    def decrypt_stream(self, reader, writer, password: str) -> int:
+        """
+        Decrypt everything from a reader into a writer
+        
+        Either container format is detected from the first bytes, so this
+        works on non-seekable streams such as pipes and stdin/stdout, in
+        memory bounded by the chunk size. Chunked containers are verified
+        chunk by chunk; plaintext before a failing chunk has already been
+        written when the error is raised.
+        
+        Args:
+            reader: Binary stream with readinto() and read()
+            writer: Binary stream with write()
+            password: Decryption password
             
-            # Remove padding
-            if decrypted_data:
-                padding_length = decrypted_data[-1]
-                if padding_length <= 16:
-                    decrypted_data = decrypted_data[:-padding_length]
+        Returns:
+            int: Number of plaintext bytes written
+        """
+        tracker = self._tracker(None, 0)
+        try:
+            prefix = read_exact(reader, PREFIX_SIZE)
+            source = PrefixedReader(prefix, reader)
             
-            # Create output path
-            if file_path.endswith('.Wh04ami'):
-                output_path = file_path[:-10]  # Remove .encrypted
+            container = detect_container(prefix)
+            if container == CONTAINER_BUNDLE:
+                raise Exception(BUNDLE_ERROR)
+            if container == CONTAINER_RECORD:
+                raise Exception(RECORD_ERROR)
+            if container == CONTAINER_CHUNKED:
+                header = read_header(source)
+                total = self._decrypt_chunked(source, writer, header, password, self.workers, tracker)
             else:
-                name, ext = os.path.splitext(file_path)
-                output_path = f"{name}_decrypted{ext}"
-            
-            # Add counter if file exists
-            counter = 1
-            original_output = output_path
-            while os.path.exists(output_path):
-                name, ext = os.path.splitext(original_output)
-                output_path = f"{name}_{counter}{ext}"
-                counter += 1
+                salt_iv = read_exact(source, 32)
+                if len(salt_iv) < 32:
+                    raise Exception("Stream is too short to be valid encrypted data")
+                with tracker.phase('kdf'):
+                    key = self._get_key(password, salt_iv[:16])
+                total = decrypt_cbc_stream(source, writer, key, salt_iv[16:], self.chunk_size,
+                                           self.backend, tracker)
+        except Exception as e:
+            tracker.finish('error', str(e))
+            raise Exception(f"Decryption failed: {str(e)}")
+        
+        tracker.finish()
+        return total
+    
+    def _decrypt_file_legacy(self, file, file_path: str, output_path: str, file_size: int, password: str,
+                             tracker) -> str:
+        """Decrypt a salt + IV + AES-CBC file"""
+        salt = file.read(16)
+        iv = file.read(16)
+        # Progress counts ciphertext consumed, padding included
+        tracker.total_bytes = file_size - 32
+        
+        # Derive key from password
+        with tracker.phase('kdf'):
+            key = self._get_key(password, salt)
+        
+        # Large files are decrypted between memory maps without copies
+        if use_mmap(self.io_mode, file_size):
+            decrypt_cbc_mmap(file_path, output_path, key, self.chunk_size, self.backend, tracker)
+            if self.fsync:
+                with open(output_path, 'rb+') as output:
+                    self._sync(output, tracker)
+            return output_path
+        
+        # Most wrong passwords show up as invalid padding in the last block
+        check_cbc_padding(file, key, iv, file_size - 32, self.backend)
+        chunk_size = buffer_size(self.chunk_size, file_size - 32)
+        
+        # Read, cipher and write overlap on separate threads
+        if self.io_mode == IO_PIPELINE:
+            with open_output(output_path, self.direct_io) as output:
+                decrypt_cbc_pipeline(file, output, key, iv, chunk_size, self.backend, tracker, self.fsync)
+            return output_path
+        
+        # Stream decrypted data chunk by chunk
+        with open(output_path, 'wb') as output:
+            decrypt_cbc_stream(file, output, key, iv, chunk_size, self.backend, tracker)
+            self._sync(output, tracker)
+        
+        return output_path
+    
+    def decrypt_data(self, data, password: str) -> bytes:
+        """
+        Decrypt one in-memory blob from encrypt_data() or encrypt_many()
+        
+        Records from encrypt_many() are authenticated; their batch key
+        comes from the key cache, so decrypting records of one batch one
+        at a time runs the KDF only once.
+        
+        Args:
+            data: Encrypted data (bytes or any other buffer-protocol object)
+            password: Decryption password
             
-            # Write decrypted file
-            with open(output_path, 'wb') as file:
-                file.write(decrypted_data)
+        Returns:
+            bytes: Decrypted data
+        """
+        if is_record(data):
+            return self._record_cipher(data, password).decrypt(data)
+        
+        data = memoryview(data).cast('B')
+        if len(data) < 32 + BLOCK_SIZE or len(data) % BLOCK_SIZE:
+            raise Exception("Encrypted data is truncated or not a multiple of the AES block size")
+        key = self._get_key(password, bytes(data[:16]))
+        plaintext = self.backend.cbc(key, bytes(data[16:32]), decrypt=True).update(data[32:])
+        try:
+            return plaintext[:-padding_length(plaintext)]
+        except ValueError as e:
+            raise Exception(str(e))
+    
+    def decrypt_many(self, records, password: str) -> list:
+        """
+        Decrypt many records, deriving each batch key once
+        
+        Consecutive records of the same batch reuse one RecordCipher, so
+        per record the cost is one HMAC and a few AES blocks. Blobs from
+        encrypt_data() are accepted too, at one (cached) KDF run each.
+        
+        Args:
+            records: Iterable of encrypted records (any buffer-protocol object)
+            password: Decryption password
             
-            return output_path
+        Returns:
+            list: Decrypted records, in input order
+        """
+        results = []
+        cipher = None
+        for record in records:
+            if cipher is None or not cipher.matches(record):
+                if not is_record(record):
+                    results.append(self.decrypt_data(record, password))
+                    continue
+                cipher = self._record_cipher(record, password)
+            results.append(cipher.decrypt(record))
+        return results
+    
+    def _record_cipher(self, record, password: str) -> RecordCipher:
+        """RecordCipher for the batch a record belongs to"""
+        salt, kdf = record_params(record)
+        return RecordCipher(self._get_key(password, salt, kdf), salt, kdf, self.backend)
+    
+    def _tracker(self, file_path: str, file_size: int):
+        """Progress/metrics tracker for one file, or a no-op one"""
+        if self.progress_callback is None and self.metrics_sink is None:
+            return NULL_TRACKER
+        return OperationTracker(
+            'decrypt', file_path, file_size, self.progress_callback, self.metrics_sink,
+            backend=self.backend.name
+        )
+    
+    def _sync(self, output, tracker):
+        """fsync the output when durability was requested"""
+        if self.fsync:
+            output.flush()
+            with tracker.phase('fsync'):
+                os.fsync(output.fileno())
+    
+    def open_encrypted(self, file_path: str, password: str):
+        """
+        Open an encrypted file as a seekable, read-only file object
+        
+        Only the parts that are actually read get decrypted.
+        """
+        from crypto.reader import EncryptedReader
+        return EncryptedReader(file_path, password, self)
+    
+    def read_range(self, file_path: str, password: str, offset: int, length: int) -> bytes:
+        """
+        Decrypt a byte range of an encrypted file without decrypting the rest
+        
+        Args:
+            file_path: Path to encrypted file
+            password: Decryption password
+            offset: Plaintext offset to start at (negative counts from the end)
+            length: Number of bytes to return
             
+        Returns:
+            bytes: Decrypted data, shorter than length at end of file
+        """
+        try:
+            with self.open_encrypted(file_path, password) as reader:
+                if offset < 0:
+                    offset = max(0, reader.size + offset)
+                return reader.read_at(offset, length)
         except Exception as e:
             raise Exception(f"Decryption failed: {str(e)}")
+    
+    def verify_file(self, file_path: str, password: str = None) -> dict:
+        """
+        Check that an encrypted file is intact without writing any plaintext
+        
+        With the password, every chunk tag of a chunked file or bundle is
+        checked in one streaming HMAC pass; nothing is decrypted. Legacy
+        files carry no MAC, so for them only the key and the padding of
+        the last block can be checked. Without the password only the
+        structure is checked: header fields and a length that fits the
+        format (32 + 16k bytes for legacy files).
+        
+        Returns:
+            dict: container, plaintext size (None if unknown) and whether
+                the contents were authenticated
+            
+        Raises:
+            Exception: Describing the first problem found
+        """
+        try:
+            file_size = os.path.getsize(file_path)
+            with open(file_path, 'rb') as file:
+                container = detect_container(file.read(PREFIX_SIZE))
+                file.seek(0)
+                if container == CONTAINER_BUNDLE:
+                    return self._verify_bundle(file, file_path, file_size, password)
+                if container == CONTAINER_RECORD:
+                    raise Exception(RECORD_ERROR)
+                if container == CONTAINER_CHUNKED:
+                    header = read_header(file)
+                    size = header.plaintext_size(file_size)
+                    if password is None:
+                        return {'container': container, 'size': size, 'authenticated': False}
+                    _, mac_key = unlock_keys(header, lambda salt, kdf: self._get_key(password, salt, kdf))
+                    workers = self.workers if size > header.chunk_size else 1
+                    if verify_chunked_stream(file, mac_key, header, workers) != size:
+                        raise Exception("Encrypted file is truncated")
+                    return {'container': container, 'size': size, 'authenticated': True}
+                
+                body_size = file_size - 32
+                if body_size < BLOCK_SIZE or body_size % BLOCK_SIZE:
+                    raise Exception(f"Length {file_size} is not 32 + a multiple of 16 bytes (truncated?)")
+                size = None
+                if password is not None:
+                    salt = file.read(16)
+                    iv = file.read(16)
+                    key = self._get_key(password, salt)
+                    size = body_size - check_cbc_padding(file, key, iv, body_size, self.backend)
+                return {'container': container, 'size': size, 'authenticated': False}
+        except Exception as e:
+            raise Exception(f"Verification failed: {str(e)}")
+    
+    def _verify_bundle(self, file, file_path: str, file_size: int, password: str) -> dict:
+        from crypto.bundle import Bundle, check_bundle_structure
+        
+        check_bundle_structure(file, file_size)
+        if password is None:
+            return {'container': CONTAINER_BUNDLE, 'size': None, 'authenticated': False}
+        with Bundle(file_path, password, workers=self.workers, decryptor=self) as bundle:
+            size = bundle.verify()
+        return {'container': CONTAINER_BUNDLE, 'size': size, 'authenticated': True}
+    
+    def _decrypt_file_chunked(self, file, output_path: str, file_size: int, password: str,
+                              tracker=NULL_TRACKER) -> str:
+        """Decrypt a chunked container file, one chunk per worker job"""
+        header = read_header(file)
+        plaintext_size = header.plaintext_size(file_size)
+        tracker.total_bytes = plaintext_size
+        
+        workers = self.workers if plaintext_size > header.chunk_size else 1
+        
+        if self.io_mode == IO_PIPELINE:
+            with open_output(output_path, self.direct_io) as output:
+                with pipeline_io(file, output, header.record_size, tracker, fsync=self.fsync) as stages:
+                    reader, writer, stage = stages
+                    self._decrypt_chunked(reader, writer, header, password, workers, stage)
+            return output_path
+        
+        with open(output_path, 'wb') as output:
+            self._decrypt_chunked(file, output, header, password, workers, tracker)
+            self._sync(output, tracker)
+        
+        return output_path
+    
+    def _decrypt_chunked(self, reader, writer, header, password: str, workers: int, tracker) -> int:
+        """Decrypt chunks after the header, decompressing when the header says so"""
+        codec = codec_for_flags(header.flags)
+        with tracker.phase('kdf'):
+            enc_key, mac_key = unlock_keys(header, lambda salt, kdf: self._get_key(password, salt, kdf))
+        
+        if codec is None:
+            return decrypt_chunked_stream(reader, writer, enc_key, mac_key, header, self.backend,
+                                          workers, tracker)
+        
+        # The decompressing writer times its own writes
+        decompressed = DecompressingWriter(writer, codec, tracker)
+        decrypt_chunked_stream(reader, decompressed, enc_key, mac_key, header, self.backend, workers,
+                               tracker.view(skip=('write',)))
+        decompressed.close()
+        return decompressed.bytes_out
+    
+    def _get_output_path(self, file_path: str) -> str:
+        """Pick a free output path for a decrypted file"""
+        if file_path.endswith('.Wh04ami'):
+            output_path = file_path[:-len('.Wh04ami')]  # Remove .Wh04ami
+        else:
+            name, ext = os.path.splitext(file_path)
+            output_path = f"{name}_decrypted{ext}"
+        
+        # Add counter if file exists
+        counter = 1
+        original_output = output_path
+        while os.path.exists(output_path):
+            name, ext = os.path.splitext(original_output)
+            output_path = f"{name}_{counter}{ext}"
+            counter += 1
+        
+        return output_path
+
+
+def _temp_path(output_path: str) -> str:
+    """Hidden temporary name in the output's folder, so the final rename is atomic"""
+    folder, name = os.path.split(output_path)
+    return os.path.join(folder, f".{name}.{secrets.token_hex(4)}.tmp")
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,482 @@
+import os
+import hmac
+import json
+import zlib
+import hashlib
+import secrets
+from collections import deque
+
+from crypto.backends import get_backend
+from crypto.chunked import default_workers, open_chunk, ordered_map, seal_chunk
+from crypto.container import NONCE_SIZE, TAG_SIZE, hkdf_sha256, split_key
+from crypto.kdf import get_kdf
+from crypto.stream import read_exact
+
+STORE_VERSION = 1
+CONFIG_NAME = 'config.json'
+CHUNKS_DIR = 'chunks'
+RECIPES_DIR = 'recipes'
+
+# Chunk size bounds; past the minimum a boundary turns up every 2**AVG_BITS bytes on average
+MIN_CHUNK_SIZE = 256 * 1024  # 256 KiB
+AVG_BITS = 20  # ~1 MiB
+MAX_CHUNK_SIZE = 4 * 1024 * 1024  # 4 MiB
+
+# The rolling hash works on 4-bit symbols, one per input byte
+SYMBOL_BITS = 4
+# Input is read and translated to symbols in blocks of this size
+READ_SIZE = 16 * 1024 * 1024  # 16 MiB
+
+
+class ContentChunker:
+    """
+    Content-defined chunking with a keyed rolling hash
+
+    Every byte is mapped to a 4-bit symbol through a keyed table, and the
+    hash at a position is the window of the last avg_bits / 4 symbols. A
+    chunk ends where the window equals a keyed target, but never before
+    min_size or after max_size bytes. Inserting or deleting bytes only
+    moves the boundaries next to the edit, so the other chunks of a
+    changed file stay the same and deduplicate.
+
+    The windows are compared with bytes.translate() and bytes.find(), so
+    chunking runs at memory speed without a per-byte Python loop. Keying
+    the table keeps chunk lengths from fingerprinting known files.
+    """
+
+    def __init__(self, key: bytes, min_size: int = MIN_CHUNK_SIZE, avg_bits: int = AVG_BITS,
+                 max_size: int = MAX_CHUNK_SIZE):
+        if avg_bits % SYMBOL_BITS or not 0 < avg_bits <= 32:
+            raise ValueError(f"Average chunk bits must be a multiple of {SYMBOL_BITS} up to 32")
+        if not 0 < min_size < max_size:
+            raise ValueError("Minimum chunk size must be positive and below the maximum")
+        self.min_size = min_size
+        self.max_size = max_size
+        self._width = avg_bits // SYMBOL_BITS
+
+        # A keyed permutation of the byte values, folded onto 16 equally likely symbols
+        order = sorted(range(256), key=lambda byte: hmac.new(key, bytes([byte]), hashlib.sha256).digest())
+        table = bytearray(256)
+        for rank, byte in enumerate(order):
+            table[byte] = rank % (1 << SYMBOL_BITS)
+        self._table = bytes(table)
+        self._target = bytes(byte % (1 << SYMBOL_BITS)
+                             for byte in hkdf_sha256(key, b'Wh04ami dedup boundary', self._width))
+
+    def split(self, reader):
+        """Yield the chunks of a reader as bytes; an empty input yields nothing"""
+        buffer = b''
+        symbols = b''
+        start = 0
+        eof = False
+
+        while True:
+            if not eof and len(buffer) - start < self.max_size:
+                data = read_exact(reader, READ_SIZE)
+                eof = len(data) < READ_SIZE
+                buffer = buffer[start:] + data
+                symbols = symbols[start:] + data.translate(self._table)
+                start = 0
+                continue
+
+            if start == len(buffer):
+                return
+            end = min(start + self.max_size, len(buffer))
+            hit = symbols.find(self._target, start + self.min_size - self._width, end)
+            cut = hit + self._width if hit >= 0 else end
+            yield buffer[start:cut]
+            start = cut
+
+
+class DedupStats:
+    """
+    Counters of a dedup operation or of a whole store
+
+    logical_bytes is what the files add up to, unique_bytes what had to
+    be stored for them (new chunks for an encrypt, distinct chunks for a
+    store) and stored_bytes the encrypted size on disk.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.chunks = 0
+        self.unique_chunks = 0
+        self.logical_bytes = 0
+        self.unique_bytes = 0
+        self.stored_bytes = 0
+
+    @property
+    def saved_bytes(self) -> int:
+        return self.logical_bytes - self.unique_bytes
+
+    @property
+    def ratio(self) -> float:
+        """Logical bytes per unique byte; 1.0 means nothing was deduplicated"""
+        if not self.unique_bytes:
+            return float('inf') if self.logical_bytes else 1.0
+        return self.logical_bytes / self.unique_bytes
+
+    def add(self, other: 'DedupStats'):
+        for name in ('files', 'chunks', 'unique_chunks', 'logical_bytes', 'unique_bytes', 'stored_bytes'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def to_dict(self) -> dict:
+        return {
+            'files': self.files,
+            'chunks': self.chunks,
+            'unique_chunks': self.unique_chunks,
+            'logical_bytes': self.logical_bytes,
+            'unique_bytes': self.unique_bytes,
+            'stored_bytes': self.stored_bytes,
+            'saved_bytes': self.saved_bytes,
+            # None when every byte was already stored
+            'ratio': round(self.ratio, 3) if self.unique_bytes or not self.logical_bytes else None,
+        }
+
+
+class Recipe:
+    """A file as the list of chunk references it is rebuilt from"""
+
+    def __init__(self, name: str, size: int, mtime: float, chunks: list):
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+        # (chunk id hex, plaintext length) in file order
+        self.chunks = chunks
+
+    def to_dict(self) -> dict:
+        return {'name': self.name, 'size': self.size, 'mtime': self.mtime, 'chunks': self.chunks}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Recipe':
+        return cls(data['name'], data['size'], data['mtime'], [tuple(chunk) for chunk in data['chunks']])
+
+
+def _open_verified(backend_name: str, enc_key: bytes, mac_key: bytes, id_key: bytes,
+                   chunk_id: str, nonce: bytes, record: bytes) -> bytes:
+    """Decrypt a stored chunk and check it against its ID"""
+    data = open_chunk(backend_name, enc_key, mac_key, b'chunk' + chunk_id.encode(), nonce, 0, True, record)
+    if hmac.new(id_key, data, hashlib.sha256).hexdigest() != chunk_id:
+        raise Exception(f"Chunk {chunk_id} does not match its ID (corrupted store?)")
+    return data
+
+
+def _write_atomic(path: str, data: bytes):
+    """Write a file under a temporary name and rename it into place"""
+    temp_path = f"{path}.{secrets.token_hex(4)}.tmp"
+    try:
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class DedupStore:
+    """
+    Deduplicating encrypted store for repeated backups of the same data
+
+    Files are cut into content-defined chunks and each distinct chunk is
+    encrypted once into chunks/, named by a keyed hash of its contents so
+    the names reveal nothing without the password. A file becomes an
+    encrypted recipe listing its chunks; recipes are stored under a keyed
+    hash of the file name. Encrypting tonight's snapshot of a dataset
+    only stores the chunks that changed since last night.
+
+    Chunks are sealed like chunked container records (AES-CTR with a
+    random nonce plus HMAC), bound to their ID, and checked against it
+    after decryption.
+
+    Example:
+        with DedupStore('backup.store', password, create=True) as store:
+            stats = store.encrypt_folder('dataset/', prefix='2024-06-01/')
+            print(stats.to_dict())
+            store.decrypt_file('2024-06-01/table.db', 'restored.db')
+    """
+
+    def __init__(self, path: str, password: str, create: bool = False, backend=None,
+                 workers: int = None, decryptor=None, min_size: int = MIN_CHUNK_SIZE,
+                 avg_bits: int = AVG_BITS, max_size: int = MAX_CHUNK_SIZE, kdf=None):
+        if decryptor is None:
+            from crypto.decryptor import FileDecryptor
+            decryptor = FileDecryptor(backend=backend)
+
+        self.path = path
+        self.backend = get_backend(backend)
+        self.workers = workers or default_workers()
+        config_path = os.path.join(path, CONFIG_NAME)
+
+        if os.path.exists(config_path):
+            with open(config_path, 'r') as file:
+                config = json.load(file)
+            if config.get('version') != STORE_VERSION:
+                raise Exception("Unsupported dedup store (written by a newer version?)")
+        elif create:
+            # Validate the chunker parameters before anything is written
+            ContentChunker(b'', min_size, avg_bits, max_size)
+            config = {'version': STORE_VERSION, 'salt': secrets.token_hex(16), 'kdf': str(get_kdf(kdf)),
+                      'min_size': min_size, 'avg_bits': avg_bits, 'max_size': max_size}
+        else:
+            raise Exception(f"Not a dedup store: {path}")
+
+        master_key = decryptor._get_key(password, bytes.fromhex(config['salt']), get_kdf(config.get('kdf')))
+        check = hkdf_sha256(master_key, b'Wh04ami dedup check', 16).hex()
+        if 'check' not in config:
+            config['check'] = check
+            os.makedirs(os.path.join(path, CHUNKS_DIR), exist_ok=True)
+            os.makedirs(os.path.join(path, RECIPES_DIR), exist_ok=True)
+            _write_atomic(config_path, json.dumps(config, indent=2).encode())
+        elif not hmac.compare_digest(config['check'], check):
+            raise Exception("Wrong password for this dedup store")
+
+        self._enc_key, self._mac_key = split_key(master_key)
+        self._id_key = hkdf_sha256(master_key, b'Wh04ami dedup chunk id')
+        self._name_key = hkdf_sha256(master_key, b'Wh04ami dedup recipe name')
+        self.chunker = ContentChunker(hkdf_sha256(master_key, b'Wh04ami dedup chunker'),
+                                      config['min_size'], config['avg_bits'], config['max_size'])
+
+    # Chunks
+
+    def chunk_id(self, data) -> str:
+        """Keyed hash naming a chunk; equal chunks get equal IDs"""
+        return hmac.new(self._id_key, data, hashlib.sha256).hexdigest()
+
+    def _chunk_path(self, chunk_id: str) -> str:
+        return os.path.join(self.path, CHUNKS_DIR, chunk_id[:2], chunk_id)
+
+    def has_chunk(self, chunk_id: str) -> bool:
+        return os.path.exists(self._chunk_path(chunk_id))
+
+    def _write_chunk(self, chunk_id: str, nonce: bytes, record: bytes) -> int:
+        path = self._chunk_path(chunk_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_atomic(path, nonce + record)
+        return NONCE_SIZE + len(record)
+
+    def _read_chunk(self, chunk_id: str) -> tuple:
+        """(nonce, record) of a stored chunk"""
+        try:
+            with open(self._chunk_path(chunk_id), 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            raise Exception(f"Chunk {chunk_id} is missing from the store")
+        if len(data) < NONCE_SIZE + TAG_SIZE:
+            raise Exception(f"Chunk {chunk_id} is truncated")
+        return data[:NONCE_SIZE], data[NONCE_SIZE:]
+
+    # Recipes
+
+    def _recipe_path(self, name: str) -> str:
+        name_id = hmac.new(self._name_key, name.encode(), hashlib.sha256).hexdigest()
+        return os.path.join(self.path, RECIPES_DIR, name_id)
+
+    def _write_recipe(self, recipe: Recipe):
+        path = self._recipe_path(recipe.name)
+        data = zlib.compress(json.dumps(recipe.to_dict(), separators=(',', ':')).encode())
+        nonce = secrets.token_bytes(NONCE_SIZE)
+        context = b'recipe' + os.path.basename(path).encode()
+        record = seal_chunk(self.backend.name, self._enc_key, self._mac_key, context, nonce, 0, True, data)
+        _write_atomic(path, nonce + record)
+
+    def _read_recipe(self, path: str) -> Recipe:
+        with open(path, 'rb') as file:
+            data = file.read()
+        context = b'recipe' + os.path.basename(path).encode()
+        try:
+            data = open_chunk(self.backend.name, self._enc_key, self._mac_key, context,
+                              data[:NONCE_SIZE], 0, True, data[NONCE_SIZE:])
+        except Exception:
+            raise Exception(f"Cannot open recipe {os.path.basename(path)} (corrupted store?)")
+        return Recipe.from_dict(json.loads(zlib.decompress(data)))
+
+    def get(self, name: str) -> Recipe:
+        path = self._recipe_path(name)
+        if not os.path.exists(path):
+            raise Exception(f"No such file in the store: {name}")
+        return self._read_recipe(path)
+
+    def recipes(self) -> list:
+        """All recipes, sorted by name (each one is decrypted)"""
+        folder = os.path.join(self.path, RECIPES_DIR)
+        recipes = [self._read_recipe(os.path.join(folder, name))
+                   for name in os.listdir(folder) if not name.endswith('.tmp')]
+        return sorted(recipes, key=lambda recipe: recipe.name)
+
+    def names(self) -> list:
+        return [recipe.name for recipe in self.recipes()]
+
+    # Encrypting
+
+    def encrypt_file(self, file_path: str, name: str = None) -> DedupStats:
+        """
+        Store a file, encrypting only chunks the store does not have yet
+
+        Storing a name again replaces its recipe; chunks the old version
+        used stay until prune().
+
+        Args:
+            file_path: File to store
+            name: Name in the store; defaults to the file name
+
+        Returns:
+            DedupStats: unique_bytes / stored_bytes count only the new chunks
+        """
+        name = name or os.path.basename(file_path)
+        stat = os.stat(file_path)
+        stats = DedupStats()
+        stats.files = 1
+        refs = []
+        pending = deque()
+        seen = set()
+
+        def jobs():
+            for data in self.chunker.split(source):
+                chunk_id = self.chunk_id(data)
+                refs.append((chunk_id, len(data)))
+                stats.chunks += 1
+                stats.logical_bytes += len(data)
+                if chunk_id in seen or self.has_chunk(chunk_id):
+                    continue
+                seen.add(chunk_id)
+                nonce = secrets.token_bytes(NONCE_SIZE)
+                pending.append((chunk_id, nonce, len(data)))
+                yield (self.backend.name, self._enc_key, self._mac_key, b'chunk' + chunk_id.encode(),
+                       nonce, 0, True, data)
+
+        # Small files are not worth starting a process pool for
+        workers = self.workers if stat.st_size > self.chunker.max_size else 1
+        with open(file_path, 'rb') as source:
+            for record in ordered_map(seal_chunk, jobs(), workers):
+                chunk_id, nonce, size = pending.popleft()
+                stats.stored_bytes += self._write_chunk(chunk_id, nonce, record)
+                stats.unique_chunks += 1
+                stats.unique_bytes += size
+
+        # The recipe is written last, so an interrupted run leaves the old version intact
+        self._write_recipe(Recipe(name, stats.logical_bytes, stat.st_mtime, refs))
+        return stats
+
+    def encrypt_folder(self, folder_path: str, prefix: str = '', recursive: bool = True,
+                       include=None, exclude=None) -> DedupStats:
+        """
+        Store every file below a folder, named prefix + path relative to the folder
+
+        A prefix such as '2024-06-01/' keeps nightly snapshots apart.
+        """
+        from utils.file_handler import FileHandler
+
+        stats = DedupStats()
+        files = FileHandler().walk_files(folder_path, include=include, exclude=exclude,
+                                         recursive=recursive, largest_first=False)
+        for file_path, _ in files:
+            if os.path.abspath(file_path).startswith(os.path.abspath(self.path) + os.sep):
+                continue
+            name = prefix + os.path.relpath(file_path, folder_path).replace(os.sep, '/')
+            stats.add(self.encrypt_file(file_path, name))
+        return stats
+
+    # Decrypting
+
+    def _write_data(self, recipe: Recipe, writer) -> int:
+        def jobs():
+            for chunk_id, _ in recipe.chunks:
+                yield (self.backend.name, self._enc_key, self._mac_key, self._id_key,
+                       chunk_id, *self._read_chunk(chunk_id))
+
+        workers = self.workers if recipe.size > self.chunker.max_size else 1
+        total = 0
+        for data in ordered_map(_open_verified, jobs(), workers):
+            writer.write(data)
+            total += len(data)
+        if total != recipe.size:
+            raise Exception(f"{recipe.name} does not match its recipe")
+        return total
+
+    def read_into(self, name: str, writer) -> int:
+        """Write a stored file to a writer, returning its size"""
+        return self._write_data(self.get(name), writer)
+
+    def decrypt_file(self, name: str, output_path: str = None) -> str:
+        """
+        Rebuild a stored file, restoring its mtime
+
+        The default output path is the name below the current directory.
+        A failed decryption leaves no output behind.
+        """
+        from crypto.bundle import member_path
+
+        recipe = self.get(name)
+        output_path = output_path or member_path(os.curdir, name)
+        folder = os.path.dirname(output_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        try:
+            with open(output_path, 'wb') as output:
+                self._write_data(recipe, output)
+        except BaseException:
+            os.remove(output_path)
+            raise
+        os.utime(output_path, (recipe.mtime, recipe.mtime))
+        return output_path
+
+    def decrypt_all(self, folder: str, prefix: str = '') -> list:
+        """Rebuild every stored file whose name starts with prefix below a folder"""
+        from crypto.bundle import member_path
+
+        return [self.decrypt_file(name, member_path(folder, name[len(prefix):]))
+                for name in self.names() if name.startswith(prefix)]
+
+    # Maintenance
+
+    def remove(self, name: str):
+        """Forget a stored file; its chunks are freed by prune()"""
+        path = self._recipe_path(name)
+        if not os.path.exists(path):
+            raise Exception(f"No such file in the store: {name}")
+        os.remove(path)
+
+    def _chunk_files(self):
+        """(chunk id, path) of every stored chunk"""
+        root = os.path.join(self.path, CHUNKS_DIR)
+        for folder in os.listdir(root):
+            for chunk_id in os.listdir(os.path.join(root, folder)):
+                if not chunk_id.endswith('.tmp'):
+                    yield chunk_id, os.path.join(root, folder, chunk_id)
+
+    def prune(self) -> DedupStats:
+        """Delete chunks no recipe refers to; the stats count what was freed"""
+        used = {chunk_id for recipe in self.recipes() for chunk_id, _ in recipe.chunks}
+        freed = DedupStats()
+        for chunk_id, path in self._chunk_files():
+            if chunk_id not in used:
+                freed.unique_chunks += 1
+                freed.stored_bytes += os.path.getsize(path)
+                os.remove(path)
+        return freed
+
+    def stats(self) -> DedupStats:
+        """Dedup ratio and savings over every file in the store"""
+        stats = DedupStats()
+        unique = {}
+        for recipe in self.recipes():
+            stats.files += 1
+            stats.chunks += len(recipe.chunks)
+            stats.logical_bytes += recipe.size
+            unique.update(recipe.chunks)
+        stats.unique_chunks = len(unique)
+        stats.unique_bytes = sum(unique.values())
+        stats.stored_bytes = sum(os.path.getsize(path) for _, path in self._chunk_files())
+        return stats
+
+    def close(self):
+        """Nothing is held open; kept for symmetry with Bundle"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,98 +1,417 @@
 import os
-import base64
-import pyaes
 import secrets
-import hashlib
+
+from crypto.backends import get_backend
+from crypto.checkpoint import Checkpoint
+from crypto.chunked import default_workers, encrypt_chunked_stream, open_chunk
+from crypto.compression import (
+    COMPRESSION_NONE, SAMPLE_PIECE, CompressingReader, check_compression, choose_codec, sample_file
+)
+from crypto.container import (
+    CONTAINER_CHUNKED, CONTAINER_LEGACY, DATA_KEY_SIZE, NONCE_SIZE, VERSION_CHUNKED,
+    ContainerHeader, derive_file_key, read_header, split_key
+)
+from crypto.kdf import DEFAULT_KDF, get_kdf
+from crypto.keycache import KeySession
+from crypto.mmap_io import IO_AUTO, IO_MODES, IO_PIPELINE, encrypt_cbc_mmap, use_mmap
+from crypto.pipeline import encrypt_cbc_pipeline, open_output, pipeline_io
+from crypto.progress import NULL_TRACKER, OperationTracker, make_sink
+from crypto.records import RecordCipher
+from crypto.stream import (
+    DEFAULT_CHUNK_SIZE, PrefixedReader, buffer_size, check_chunk_size, encrypt_cbc_stream, pkcs7_pad, read_exact
+)
 
 class FileEncryptor:
-    def __init__(self):
-        pass
-    
-    def _derive_key(self, password: str, salt: bytes) -> bytes:
-        """Derive AES key from password using PBKDF2"""
-        # Simple key derivation using SHA256
-        key = hashlib.pbkdf2_hmac(
-            'sha256', 
-            password.encode(), 
-            salt, 
-            100000,  # iterations
-            32  # key length for AES-256
-        )
-        return key
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE, backend=None,
+                 container: str = CONTAINER_CHUNKED, workers: int = None, io_mode: str = IO_AUTO,
+                 progress_callback=None, metrics_sink=None, fsync: bool = False,
+                 compression: str = COMPRESSION_NONE, checkpoint_interval: int = None,
+                 direct_io: bool = False, kdf=None):
+        self.chunk_size = check_chunk_size(chunk_size)
+        self.backend = get_backend(backend)
+        if container not in (CONTAINER_LEGACY, CONTAINER_CHUNKED):
+            raise ValueError(f"Unknown container format: {container}")
+        # Legacy output has no authentication; it is only kept for older readers
+        self.container = container
+        self.workers = workers or default_workers()
+        if io_mode not in IO_MODES:
+            raise ValueError(f"Unknown I/O mode: {io_mode}")
+        self.io_mode = io_mode
+        # Called with (bytes_done, total_bytes, elapsed) after every chunk
+        self.progress_callback = progress_callback
+        # Receives one record with per-phase timings per file
+        self.metrics_sink = make_sink(metrics_sink)
+        self.fsync = fsync
+        # 'none', 'auto' or a codec name; compressed files use the chunked container
+        self.compression = check_compression(compression)
+        if self.compression != COMPRESSION_NONE and self.container == CONTAINER_LEGACY:
+            raise ValueError("The legacy container cannot store compressed data")
+        # Chunked files larger than this are written resumably, checkpointing every interval
+        self.checkpoint_interval = checkpoint_interval
+        # Pipeline mode only: write the output with O_DIRECT where supported
+        self.direct_io = direct_io
+        # Password KDF (a Kdf or a spec like 'scrypt:log_n=17'); anything but the
+        # default is recorded in the header, so it needs the chunked container
+        self.kdf = get_kdf(kdf)
+        if self.kdf != DEFAULT_KDF and self.container == CONTAINER_LEGACY:
+            raise ValueError("The legacy container has no room for KDF parameters")
+    
+    def _derive_key(self, password: str, salt: bytes, kdf=None) -> bytes:
+        """Derive AES key from password with the configured KDF (or the given one)"""
+        return (kdf or self.kdf).derive(password, salt)
+    
+    def start_session(self, password: str) -> KeySession:
+        """
+        Derive one master key for a batch of files
+        
+        Pass the session to encrypt_file() so each file gets its own key
+        from a cheap HKDF step instead of a full PBKDF2 run.
+        """
+        return KeySession(password, self._derive_key)
     
-    def encrypt_file(self, file_path: str, password: str) -> str:
+    def encrypt_file(self, file_path: str, password: str, session: KeySession = None,
+                     output_path: str = None) -> str:
         """
         Encrypt a file with password using AES-256
         
         Args:
             file_path: Path to file to encrypt
             password: Encryption password
+            session: Optional batch key session; session files need the
+                chunked container, so an explicit legacy container raises ValueError
+            output_path: Where to write; defaults to file_path + '.Wh04ami'
             
         Returns:
             str: Path to encrypted file
         """
+        file_size = os.path.getsize(file_path)
+        output_path = output_path or file_path + '.Wh04ami'
+        chunked = self._use_chunked(session)
+        tracker = self._tracker(file_path, file_size, self.container)
+        
+        try:
+            if chunked:
+                self._encrypt_file_chunked(file_path, output_path, file_size, password, session, tracker)
+            else:
+                self._encrypt_file_legacy(file_path, output_path, file_size, password, tracker)
+        except Exception as e:
+            tracker.finish('error', str(e))
+            raise
+        
+        tracker.finish()
+        return output_path
+    
+    def _encrypt_file_legacy(self, file_path: str, output_path: str, file_size: int, password: str,
+                             tracker) -> str:
+        """Encrypt a file into the salt + IV + AES-CBC layout"""
         # Generate random salt and IV
         salt = secrets.token_bytes(16)
         iv = secrets.token_bytes(16)  # AES block size
         
         # Derive key from password
-        key = self._derive_key(password, salt)
+        with tracker.phase('kdf'):
+            key = self._derive_key(password, salt)
+        
+        # Large files are encrypted between memory maps without copies
+        if use_mmap(self.io_mode, file_size):
+            encrypt_cbc_mmap(file_path, output_path, key, salt, iv, self.chunk_size, self.backend, tracker)
+            if self.fsync:
+                with open(output_path, 'rb+') as file:
+                    self._sync(file, tracker)
+            return output_path
+        
+        # Read, cipher and write overlap on separate threads
+        if self.io_mode == IO_PIPELINE:
+            with open(file_path, 'rb') as source, open_output(output_path, self.direct_io) as file:
+                file.write(salt)
+                file.write(iv)
+                encrypt_cbc_pipeline(source, file, key, iv, buffer_size(self.chunk_size, file_size),
+                                     self.backend, tracker, self.fsync)
+            return output_path
+        
+        # Stream encrypted file (salt + iv + encrypted_data) chunk by chunk
+        with open(file_path, 'rb') as source, open(output_path, 'wb') as file:
+            file.write(salt)    # 16 bytes
+            file.write(iv)      # 16 bytes  
+            encrypt_cbc_stream(source, file, key, iv, buffer_size(self.chunk_size, file_size),
+                               self.backend, tracker)
+            self._sync(file, tracker)
         
-        # Read file data
-        with open(file_path, 'rb') as file:
-            file_data = file.read()
+        return output_path
+    
+    def _tracker(self, file_path: str, file_size: int, container: str):
+        """Progress/metrics tracker for one file, or a no-op one"""
+        if self.progress_callback is None and self.metrics_sink is None:
+            return NULL_TRACKER
+        return OperationTracker(
+            'encrypt', file_path, file_size, self.progress_callback, self.metrics_sink,
+            backend=self.backend.name, container=container
+        )
+    
+    def _sync(self, file, tracker):
+        """fsync the output when durability was requested"""
+        if self.fsync:
+            file.flush()
+            with tracker.phase('fsync'):
+                os.fsync(file.fileno())
+    
+    def _use_chunked(self, session: KeySession) -> bool:
+        """Whether the next file goes into the chunked container"""
+        if session is not None and self.container == CONTAINER_LEGACY:
+            raise ValueError("Batch session keys need the chunked container")
+        return self.container == CONTAINER_CHUNKED
+    
+    def _encrypt_file_chunked(self, file_path: str, output_path: str, file_size: int, password: str,
+                              session: KeySession = None, tracker=NULL_TRACKER) -> str:
+        """Encrypt a file into the chunked container, one chunk per worker job"""
+        codec = None
+        if self.compression != COMPRESSION_NONE:
+            codec = choose_codec(self.compression, file_path, sample_file(file_path, file_size))
+        # A compressor cannot restart mid-stream, so only plain chunks are resumable
+        if codec is None and self.checkpoint_interval and file_size > self.checkpoint_interval:
+            return self._encrypt_file_resumable(file_path, output_path, password, session, tracker)
+        keys = self._chunked_keys(password, session, tracker, codec)
         
-        # Create AES cipher in CBC mode
-        aes = pyaes.AESModeOfOperationCBC(key, iv=iv)
+        # Small files are not worth starting a process pool for
+        workers = self.workers if file_size > self.chunk_size else 1
         
-        # Pad data to multiple of 16 bytes (AES block size)
-        padding_length = 16 - (len(file_data) % 16)
-        file_data += bytes([padding_length]) * padding_length
+        if self.io_mode == IO_PIPELINE:
+            with open(file_path, 'rb') as source, open_output(output_path, self.direct_io) as file:
+                with pipeline_io(source, file, self.chunk_size, tracker, fsync=self.fsync) as stages:
+                    reader, writer, stage = stages
+                    self._encrypt_chunked(reader, writer, keys, codec, workers, stage)
+            return output_path
         
-        # Encrypt data
-        encrypted_data = b""
-        for i in range(0, len(file_data), 16):
-            block = file_data[i:i+16]
-            encrypted_block = aes.encrypt(block)
-            encrypted_data += encrypted_block
+        with open(file_path, 'rb') as source, open(output_path, 'wb') as file:
+            self._encrypt_chunked(source, file, keys, codec, workers, tracker)
+            self._sync(file, tracker)
+        
+        return output_path
+    
+    def _encrypt_file_resumable(self, file_path: str, output_path: str, password: str,
+                                session: KeySession, tracker) -> str:
+        """
+        Encrypt into a partial file with checkpoints, continuing an interrupted run
         
-        # Create output path
-        output_path = file_path + '.Wh04ami'
+        Every checkpoint_interval bytes the output is fsynced and the chunk
+        count saved; the partial file is renamed to output_path at the end.
+        """
+        checkpoint = Checkpoint(output_path)
+        source_stat = os.stat(file_path)
+        keys, done = self._resume(checkpoint, source_stat, password, session, tracker)
+        header, enc_key, mac_key = keys
+        every = max(1, self.checkpoint_interval // header.chunk_size)
         
-        # Write encrypted file (salt + iv + encrypted_data)
-        with open(output_path, 'wb') as file:
-            file.write(salt)    # 16 bytes
-            file.write(iv)      # 16 bytes  
-            file.write(encrypted_data)
+        with open(file_path, 'rb') as source, open(checkpoint.part_path, 'rb+' if done else 'wb') as file:
+            if done:
+                # Drop anything written after the last checkpoint
+                file.truncate(header.size + done * header.record_size)
+                file.seek(0, os.SEEK_END)
+                source.seek(done * header.chunk_size)
+                tracker.advance(done * header.chunk_size)
+            else:
+                file.write(header.pack())
+            
+            def on_chunk(chunks: int):
+                if chunks % every == 0:
+                    file.flush()
+                    with tracker.phase('fsync'):
+                        os.fsync(file.fileno())
+                    checkpoint.save(source_stat, chunks, file.tell())
+            
+            encrypt_chunked_stream(source, file, enc_key, mac_key, header, self.backend, self.workers,
+                                   tracker, start_index=done, on_chunk=on_chunk)
+            self._sync(file, tracker)
         
+        checkpoint.commit()
         return output_path
     
-    def encrypt_data(self, data: bytes, password: str) -> bytes:
+    def _resume(self, checkpoint: Checkpoint, source_stat, password: str, session: KeySession,
+                tracker) -> tuple:
+        """Keys and chunk count to continue from, or fresh keys and 0"""
+        done = checkpoint.load(source_stat)
+        if done:
+            try:
+                with open(checkpoint.part_path, 'rb') as file:
+                    header = read_header(file)
+                    keys = self._resume_keys(header, password, session, tracker)
+                    # The last checkpointed chunk must open with these keys
+                    file.seek(header.size + (done - 1) * header.record_size)
+                    record = file.read(header.record_size)
+                if keys is not None:
+                    open_chunk(self.backend.name, keys[1], keys[2], header.bound_fields(), header.nonce,
+                               done - 1, False, record)
+                    return keys, done
+            except Exception:
+                pass
+        checkpoint.clear()
+        return self._chunked_keys(password, session, tracker), 0
+    
+    def _resume_keys(self, header: ContainerHeader, password: str, session: KeySession, tracker):
+        """Keys for a partial file's header, or None if they cannot be rebuilt"""
+        if header.compressed:
+            return None
+        with tracker.phase('kdf'):
+            if header.wrapped:
+                def slot_key_for(slot):
+                    if session is not None and slot.salt == session.salt and slot.kdf == self.kdf:
+                        return session.file_key(header.salt)
+                    return derive_file_key(self._derive_key(password, slot.salt, slot.kdf), header.salt)
+                enc_key, mac_key = split_key(header.unwrap(slot_key_for))
+            elif header.file_salt is None:
+                enc_key, mac_key = split_key(self._derive_key(password, header.salt, header.kdf))
+            elif session is None or session.salt != header.salt or header.kdf != self.kdf:
+                # Per-file keys come from the session master key, so the salt must match
+                return None
+            else:
+                enc_key, mac_key = split_key(session.file_key(header.file_salt))
+        header.verify(mac_key)
+        return header, enc_key, mac_key
+    
+    def _chunked_keys(self, password: str, session: KeySession, tracker, codec=None) -> tuple:
+        """New chunked container header with its encryption and MAC keys"""
+        nonce = secrets.token_bytes(NONCE_SIZE)
+        flags = codec.flag if codec else 0
+        
+        # Chunks are encrypted under a random data key, which the header keeps
+        # wrapped by the password so the password can change without re-encrypting
+        header = ContainerHeader(VERSION_CHUNKED, self.chunk_size, secrets.token_bytes(16), nonce, flags)
+        data_key = secrets.token_bytes(DATA_KEY_SIZE)
+        with tracker.phase('kdf'):
+            if session is None:
+                salt = secrets.token_bytes(16)
+                slot_key = derive_file_key(self._derive_key(password, salt), header.salt)
+            else:
+                # One KDF run per session; the header salt still makes the slot key per-file
+                salt = session.salt
+                slot_key = session.file_key(header.salt)
+        header.set_slot(0, data_key, slot_key, salt, self.kdf)
+        enc_key, mac_key = split_key(data_key)
+        
+        # The key check lets decryption reject a wrong password before any chunk
+        header.seal(mac_key)
+        return header, enc_key, mac_key
+    
+    def _encrypt_chunked(self, reader, writer, keys: tuple, codec, workers: int, tracker) -> int:
+        """Write header and chunks, compressing on the way when a codec is given"""
+        header, enc_key, mac_key = keys
+        writer.write(header.pack())
+        if codec is None:
+            return encrypt_chunked_stream(reader, writer, enc_key, mac_key, header, self.backend,
+                                          workers, tracker)
+        
+        # The compressing reader times raw reads and reports input progress itself
+        compressed = CompressingReader(reader, codec.compressor(), self.chunk_size, tracker)
+        encrypt_chunked_stream(compressed, writer, enc_key, mac_key, header, self.backend, workers,
+                               tracker.view(skip=('read',), progress=False))
+        return compressed.bytes_in
+    
+    def encrypt_stream(self, reader, writer, password: str, session: KeySession = None) -> int:
+        """
+        Encrypt everything from a reader into a writer
+        
+        Works on non-seekable streams such as pipes, sockets and
+        stdin/stdout, in memory bounded by the chunk size (times the
+        queue depth per worker for the chunked container). The output is
+        the same as encrypt_file() would write.
+        
+        Args:
+            reader: Binary stream with readinto() and read()
+            writer: Binary stream with write()
+            password: Encryption password
+            session: Optional batch key session (chunked container only)
+            
+        Returns:
+            int: Number of plaintext bytes encrypted
+        """
+        chunked = self._use_chunked(session)
+        tracker = self._tracker(None, 0, self.container)
+        
+        try:
+            if chunked:
+                codec = None
+                if self.compression != COMPRESSION_NONE:
+                    # No name to go by, so decide from the first bytes
+                    sample = read_exact(reader, 3 * SAMPLE_PIECE)
+                    codec = choose_codec(self.compression, sample=sample)
+                    reader = PrefixedReader(sample, reader)
+                keys = self._chunked_keys(password, session, tracker, codec)
+                total = self._encrypt_chunked(reader, writer, keys, codec, self.workers, tracker)
+            else:
+                salt = secrets.token_bytes(16)
+                iv = secrets.token_bytes(16)
+                with tracker.phase('kdf'):
+                    key = self._derive_key(password, salt)
+                writer.write(salt)
+                writer.write(iv)
+                total = encrypt_cbc_stream(reader, writer, key, iv, self.chunk_size, self.backend, tracker)
+        except Exception as e:
+            tracker.finish('error', str(e))
+            raise
+        
+        tracker.finish()
+        return total
+    
+    def encrypt_data(self, data, password: str) -> bytes:
         """
         Encrypt raw data with password
         
+        Every call runs the full password KDF; for many records use
+        encrypt_many() or record_cipher(), which derive one key per batch.
+        
         Args:
-            data: Data to encrypt
+            data: Data to encrypt (bytes or any other buffer-protocol object)
             password: Encryption password
             
         Returns:
-            bytes: Encrypted data (salt + iv + encrypted_data)
+            bytes: Encrypted data (salt + iv + encrypted_data), keyed with
+                the default KDF since this layout cannot record another
         """
+        data = memoryview(data).cast('B')
         salt = secrets.token_bytes(16)
         iv = secrets.token_bytes(16)
         
-        key = self._derive_key(password, salt)
-        aes = pyaes.AESModeOfOperationCBC(key, iv=iv)
+        key = self._derive_key(password, salt, DEFAULT_KDF)
+        
+        # Pad data into a single preallocated buffer
+        padding = pkcs7_pad(len(data))
+        buffer = bytearray(32 + len(data) + len(padding))
+        buffer[:16] = salt
+        buffer[16:32] = iv
+        buffer[32:32 + len(data)] = data
+        buffer[32 + len(data):] = padding
+        
+        # Encrypt in place after the header
+        body = memoryview(buffer)[32:]
+        self.backend.cbc(key, iv).update_into(body, body)
         
-        # Pad data
-        padding_length = 16 - (len(data) % 16)
-        data += bytes([padding_length]) * padding_length
+        return bytes(buffer)
+    
+    def record_cipher(self, password: str) -> RecordCipher:
+        """
+        Derive one key for a batch of in-memory records
+        
+        The KDF (this encryptor's) runs once; the returned RecordCipher
+        encrypts each record with its own nonce through encrypt() or,
+        without allocating, encrypt_into(data, out_buffer).
+        """
+        salt = secrets.token_bytes(16)
+        return RecordCipher(self._derive_key(password, salt), salt, self.kdf, self.backend)
+    
+    def encrypt_many(self, records, password: str) -> list:
+        """
+        Encrypt many small records with one password KDF run
         
-        # Encrypt
-        encrypted_data = b""
-        for i in range(0, len(data), 16):
-            block = data[i:i+16]
-            encrypted_block = aes.encrypt(block)
-            encrypted_data += encrypted_block
+        Records share the batch key and salt but each gets a random nonce
+        and its own authentication tag, so any one of them can later be
+        decrypted alone with decrypt_data() or in bulk with decrypt_many().
         
-        return salt + iv + encrypted_data
+        Args:
+            records: Iterable of bytes-like records (any buffer-protocol object)
+            password: Encryption password
+            
+        Returns:
+            list: Encrypted records, in input order
+        """
+        encrypt = self.record_cipher(password).encrypt
+        return [encrypt(record) for record in records]
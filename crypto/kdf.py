@@ -0,0 +1,306 @@
+import os
+import math
+import time
+import struct
+import hashlib
+
+KDF_PBKDF2 = 'pbkdf2-sha256'
+KDF_SCRYPT = 'scrypt'
+KDF_ARGON2 = 'argon2id'
+
+KEY_LENGTH = 32  # AES-256
+
+# algorithm id, then three cost fields whose meaning depends on the algorithm
+_PARAMS = struct.Struct('>BIII')
+KDF_PARAMS_SIZE = _PARAMS.size
+
+# Costs a header may ask for; anything above is refused rather than run,
+# so a crafted file cannot pin a CPU for hours or exhaust memory
+MAX_PBKDF2_ITERATIONS = 50_000_000
+MAX_TIME_COST = 1000
+MAX_KDF_MEMORY = 4 * 1024 * 1024 * 1024  # 4 GiB
+
+# Calibration defaults
+DEFAULT_TARGET_SECONDS = 0.25
+DEFAULT_MAX_MEMORY = 256 * 1024 * 1024  # 256 MiB
+MIN_PBKDF2_ITERATIONS = 10_000
+MIN_SCRYPT_LOG_N = 14
+MIN_ARGON2_MEMORY_KIB = 8 * 1024  # 8 MiB
+
+
+class Kdf:
+    """
+    A password KDF with its cost parameters
+
+    Instances are immutable and compare by value, so they can be stored
+    in headers, used in key-cache keys and passed to worker processes.
+    """
+
+    name = None
+    id = None
+    # Names of the three cost fields, in header order
+    fields = ()
+
+    def __init__(self, *costs: int):
+        self.costs = tuple(int(cost) for cost in costs) + (0,) * (3 - len(costs))
+
+    def is_available(self) -> bool:
+        return True
+
+    @property
+    def memory_bytes(self) -> int:
+        return 0
+
+    def check(self) -> 'Kdf':
+        """Refuse costs that are out of range"""
+        if self.memory_bytes > MAX_KDF_MEMORY:
+            raise ValueError(f"{self} needs more than {MAX_KDF_MEMORY // (1024 * 1024)} MiB")
+        return self
+
+    def derive(self, password: str, salt: bytes) -> bytes:
+        raise NotImplementedError
+
+    def scaled(self, factor: float) -> 'Kdf':
+        """Same KDF with its time cost multiplied by factor (at least the minimum)"""
+        raise NotImplementedError
+
+    def pack(self) -> bytes:
+        return _PARAMS.pack(self.id, *self.costs)
+
+    @property
+    def params(self) -> tuple:
+        """Hashable (algorithm, costs..., key length) for key-cache keys"""
+        return (self.name,) + self.costs + (KEY_LENGTH,)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Kdf) and self.params == other.params
+
+    def __hash__(self) -> int:
+        return hash(self.params)
+
+    def __str__(self) -> str:
+        values = ','.join(f"{field}={cost}" for field, cost in zip(self.fields, self.costs))
+        return f"{self.name}:{values}"
+
+    def __repr__(self) -> str:
+        return f"Kdf({str(self)!r})"
+
+
+class Pbkdf2Kdf(Kdf):
+    """PBKDF2-HMAC-SHA256, always available; the cost is CPU time only"""
+
+    name = KDF_PBKDF2
+    id = 1
+    fields = ('iterations',)
+
+    def check(self) -> 'Kdf':
+        if not 1000 <= self.costs[0] <= MAX_PBKDF2_ITERATIONS:
+            raise ValueError(f"PBKDF2 iterations must be between 1000 and {MAX_PBKDF2_ITERATIONS}")
+        return super().check()
+
+    def derive(self, password: str, salt: bytes) -> bytes:
+        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, self.costs[0], KEY_LENGTH)
+
+    def scaled(self, factor: float) -> 'Kdf':
+        iterations = max(MIN_PBKDF2_ITERATIONS, round(self.costs[0] * factor, -3))
+        return Pbkdf2Kdf(min(iterations, MAX_PBKDF2_ITERATIONS))
+
+
+class ScryptKdf(Kdf):
+    """scrypt (hashlib, needs OpenSSL 1.1+); memory = 128 * r * 2**log_n bytes"""
+
+    name = KDF_SCRYPT
+    id = 2
+    fields = ('log_n', 'r', 'p')
+
+    def is_available(self) -> bool:
+        return hasattr(hashlib, 'scrypt')
+
+    @property
+    def memory_bytes(self) -> int:
+        log_n, r, p = self.costs
+        return 128 * r * (2 ** log_n + p)
+
+    def check(self) -> 'Kdf':
+        log_n, r, p = self.costs
+        if not 1 <= log_n <= 30 or not 1 <= r <= 64 or not 1 <= p <= 64:
+            raise ValueError("scrypt parameters must be log_n 1-30, r 1-64, p 1-64")
+        return super().check()
+
+    def derive(self, password: str, salt: bytes) -> bytes:
+        if not self.is_available():
+            raise Exception("scrypt is not available in this Python build")
+        log_n, r, p = self.costs
+        return hashlib.scrypt(password.encode(), salt=salt, n=2 ** log_n, r=r, p=p,
+                              maxmem=self.memory_bytes + 1024 * 1024, dklen=KEY_LENGTH)
+
+    def scaled(self, factor: float) -> 'Kdf':
+        log_n, r, p = self.costs
+        # Time doubles with each step of log_n
+        return ScryptKdf(min(30, max(MIN_SCRYPT_LOG_N, log_n + round(math.log2(factor)))), r, p)
+
+
+class Argon2Kdf(Kdf):
+    """Argon2id through argon2-cffi or cryptography (44+), whichever is installed"""
+
+    name = KDF_ARGON2
+    id = 3
+    fields = ('time_cost', 'memory_kib', 'parallelism')
+
+    def is_available(self) -> bool:
+        return _argon2_backend() is not None
+
+    @property
+    def memory_bytes(self) -> int:
+        return self.costs[1] * 1024
+
+    def check(self) -> 'Kdf':
+        time_cost, memory_kib, parallelism = self.costs
+        if not 1 <= time_cost <= MAX_TIME_COST or not 1 <= parallelism <= 64:
+            raise ValueError(f"Argon2 time cost must be 1-{MAX_TIME_COST} and parallelism 1-64")
+        if memory_kib < 8 * parallelism:
+            raise ValueError("Argon2 memory must be at least 8 KiB per lane")
+        return super().check()
+
+    def derive(self, password: str, salt: bytes) -> bytes:
+        backend = _argon2_backend()
+        if backend is None:
+            raise Exception("Argon2 is not available (pip install argon2-cffi)")
+        time_cost, memory_kib, parallelism = self.costs
+        if backend == 'argon2-cffi':
+            from argon2.low_level import Type, hash_secret_raw
+            return hash_secret_raw(password.encode(), salt, time_cost, memory_kib, parallelism,
+                                   KEY_LENGTH, Type.ID)
+        from cryptography.hazmat.primitives.kdf.argon2 import Argon2id
+        return Argon2id(salt=salt, length=KEY_LENGTH, iterations=time_cost, lanes=parallelism,
+                        memory_cost=memory_kib).derive(password.encode())
+
+    def scaled(self, factor: float) -> 'Kdf':
+        time_cost, memory_kib, parallelism = self.costs
+        return Argon2Kdf(min(MAX_TIME_COST, max(1, round(time_cost * factor))), memory_kib, parallelism)
+
+
+def _argon2_backend():
+    """Name of the installed Argon2 provider, or None"""
+    try:
+        import argon2.low_level  # noqa: F401
+        return 'argon2-cffi'
+    except ImportError:
+        pass
+    try:
+        from cryptography.hazmat.primitives.kdf.argon2 import Argon2id  # noqa: F401
+        return 'cryptography'
+    except ImportError:
+        return None
+
+
+KDFS = {cls.name: cls for cls in (Pbkdf2Kdf, ScryptKdf, Argon2Kdf)}
+_BY_ID = {cls.id: cls for cls in KDFS.values()}
+
+# What files without stored KDF parameters (legacy files, older containers) use
+DEFAULT_KDF = Pbkdf2Kdf(100000)
+
+# Starting points for calibration
+BASELINES = {
+    KDF_PBKDF2: Pbkdf2Kdf(MIN_PBKDF2_ITERATIONS),
+    KDF_SCRYPT: ScryptKdf(MIN_SCRYPT_LOG_N, 8, 1),
+    KDF_ARGON2: Argon2Kdf(1, 64 * 1024, min(4, os.cpu_count() or 1)),
+}
+
+
+def available_kdfs() -> list:
+    return [name for name in KDFS if BASELINES[name].is_available()]
+
+
+def unpack_kdf(data: bytes) -> Kdf:
+    """KDF from its header encoding, checking the costs are sane"""
+    kdf_id, *costs = _PARAMS.unpack_from(data)
+    cls = _BY_ID.get(kdf_id)
+    if cls is None:
+        raise Exception("Unsupported KDF in header (file written by a newer version?)")
+    try:
+        return cls(*costs[:len(cls.fields)]).check()
+    except ValueError as e:
+        raise Exception(f"Invalid KDF parameters in header: {e}")
+
+
+def parse_kdf(text: str) -> Kdf:
+    """
+    KDF from a spec such as 'scrypt:log_n=17,r=8,p=1' or 'pbkdf2-sha256:iterations=600000'
+
+    A bare name gives that KDF with its calibration baseline costs.
+    """
+    name, _, values = text.strip().partition(':')
+    name = {'pbkdf2': KDF_PBKDF2, 'argon2': KDF_ARGON2}.get(name, name)
+    cls = KDFS.get(name)
+    if cls is None:
+        raise ValueError(f"Unknown KDF: {name} (choose from {', '.join(KDFS)})")
+    costs = dict(zip(cls.fields, BASELINES[name].costs))
+    for item in filter(None, values.split(',')):
+        field, _, value = item.partition('=')
+        if field.strip() not in costs:
+            raise ValueError(f"Unknown {name} parameter: {field} (expected {', '.join(cls.fields)})")
+        costs[field.strip()] = int(value)
+    return cls(*costs.values()).check()
+
+
+def get_kdf(kdf=None) -> Kdf:
+    """Accept None (default), a spec string or a Kdf"""
+    if kdf is None:
+        return DEFAULT_KDF
+    if isinstance(kdf, Kdf):
+        return kdf.check()
+    return parse_kdf(kdf)
+
+
+def measure(kdf: Kdf, repeat: int = 1) -> float:
+    """Best of repeat timed derivations, in seconds"""
+    salt = os.urandom(16)
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        kdf.derive('calibration password', salt)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def calibrate(name: str = KDF_PBKDF2, target_seconds: float = DEFAULT_TARGET_SECONDS,
+              max_memory: int = DEFAULT_MAX_MEMORY) -> tuple:
+    """
+    Pick costs that make one derivation take about target_seconds here
+
+    The time cost is scaled from a measured baseline and then checked
+    again. Memory-hard KDFs use up to max_memory: scrypt grows its memory
+    with its cost, Argon2 starts at min(64 MiB, max_memory) and only
+    shrinks it when a single pass is already too slow.
+
+    Returns:
+        tuple: (Kdf, measured seconds)
+    """
+    kdf = BASELINES[name]
+    if not kdf.is_available():
+        raise Exception(f"{name} is not available on this system")
+
+    if name == KDF_ARGON2:
+        time_cost, memory_kib, parallelism = kdf.costs
+        memory_kib = max(MIN_ARGON2_MEMORY_KIB, min(memory_kib, max_memory // 1024))
+        kdf = Argon2Kdf(time_cost, memory_kib, parallelism)
+        elapsed = measure(kdf)
+        while elapsed > target_seconds and memory_kib > MIN_ARGON2_MEMORY_KIB:
+            memory_kib = max(MIN_ARGON2_MEMORY_KIB, memory_kib // 2)
+            kdf = Argon2Kdf(time_cost, memory_kib, parallelism)
+            elapsed = measure(kdf)
+    else:
+        elapsed = measure(kdf)
+
+    # Two rounds: the first estimate is off when the baseline is too short to time well
+    for _ in range(2):
+        candidate = kdf.scaled(target_seconds / max(elapsed, 1e-6))
+        if candidate.memory_bytes > max_memory:
+            # Only scrypt's memory grows with its cost: take the largest that fits
+            log_n, r, p = candidate.costs
+            log_n = int(math.log2(max_memory // (128 * r)))
+            candidate = ScryptKdf(max(MIN_SCRYPT_LOG_N, log_n), r, p)
+        if candidate != kdf:
+            kdf, elapsed = candidate, measure(candidate)
+    return kdf, elapsed
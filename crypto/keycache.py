@@ -0,0 +1,125 @@
+import hmac
+import atexit
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+
+from crypto.container import derive_file_key
+
+DEFAULT_MAX_ENTRIES = 64
+
+# Passwords are only kept as a keyed digest; the key never leaves the process
+_PASSWORD_KEY = secrets.token_bytes(32)
+
+
+def zeroize(buffer: bytearray):
+    """Overwrite key material in place"""
+    buffer[:] = bytes(len(buffer))
+
+
+def password_digest(password: str) -> bytes:
+    return hmac.new(_PASSWORD_KEY, password.encode(), hashlib.sha256).digest()
+
+
+class KeyCache:
+    """
+    Bounded LRU cache of password-derived keys
+
+    Entries are keyed on (password digest, salt, KDF params) and are
+    zeroized when they are evicted or the cache is cleared.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_derive(self, password: str, salt: bytes, params: tuple, derive) -> bytes:
+        """
+        Return the cached key or derive and cache it
+
+        Args:
+            password: Password the key is derived from
+            salt: KDF salt
+            params: Hashable KDF parameters (algorithm, cost, key length)
+            derive: Callable (password, salt) -> bytes run on a cache miss
+        """
+        cache_key = (password_digest(password), bytes(salt), params)
+
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return bytes(entry)
+
+        key = derive(password, salt)
+
+        with self._lock:
+            self.misses += 1
+            if cache_key not in self._entries:
+                self._entries[cache_key] = bytearray(key)
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                zeroize(evicted)
+        return key
+
+    def clear(self):
+        """Zeroize and drop every entry"""
+        with self._lock:
+            for entry in self._entries.values():
+                zeroize(entry)
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Process-wide cache shared by decryptors
+default_key_cache = KeyCache()
+atexit.register(default_key_cache.clear)
+
+
+class KeySession:
+    """
+    One password-derived master key reused for a batch of files
+
+    The expensive KDF runs once per session. Each file then gets its own
+    key through a cheap HKDF step with a random per-file salt.
+    """
+
+    def __init__(self, password: str, derive, salt: bytes = None):
+        self.salt = salt or secrets.token_bytes(16)
+        self._master = bytearray(derive(password, self.salt))
+        self._closed = False
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    @classmethod
+    def from_key(cls, master_key: bytes, salt: bytes) -> 'KeySession':
+        """Rebuild a session from an already derived master key (e.g. in a worker)"""
+        return cls(None, lambda password, salt: master_key, salt)
+
+    def file_key(self, file_salt: bytes) -> bytes:
+        """Derive the key for one file from the master key"""
+        with self._lock:
+            if self._closed:
+                raise Exception("Key session is closed")
+            return derive_file_key(bytes(self._master), file_salt)
+
+    def close(self):
+        """Zeroize the master key"""
+        with self._lock:
+            zeroize(self._master)
+            self._closed = True
+        atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
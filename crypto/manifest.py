@@ -0,0 +1,169 @@
+import os
+import hmac
+import time
+import secrets
+import hashlib
+import sqlite3
+
+from crypto.container import hkdf_sha256
+
+# Default manifest file, kept in the encrypted folder
+MANIFEST_NAME = '.wh04ami-manifest.db'
+
+# Read size for content digests
+DIGEST_BUFFER_SIZE = 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest BLOB NOT NULL,
+    output TEXT NOT NULL,
+    output_size INTEGER NOT NULL,
+    encrypted_at REAL NOT NULL
+);
+"""
+
+
+def content_digest(file_path: str, key: bytes) -> bytes:
+    """
+    Keyed SHA-256 of a file's contents
+
+    Keyed with a password-derived key so the manifest does not reveal
+    which known files the folder contains.
+    """
+    mac = hmac.new(key, digestmod=hashlib.sha256)
+    buffer = bytearray(DIGEST_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(file_path, 'rb', buffering=0) as file:
+        while True:
+            n = file.readinto(buffer)
+            if not n:
+                break
+            mac.update(view[:n])
+    return mac.digest()
+
+
+class ManifestEntry:
+    """What the manifest knows about one encrypted source file"""
+
+    def __init__(self, path: str, size: int, mtime_ns: int, digest: bytes, output: str, output_size: int):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.digest = digest
+        self.output = output
+        self.output_size = output_size
+
+    def matches_stat(self, stat: os.stat_result) -> bool:
+        return self.size == stat.st_size and self.mtime_ns == stat.st_mtime_ns
+
+    def output_intact(self) -> bool:
+        try:
+            return os.path.getsize(self.output) == self.output_size
+        except OSError:
+            return False
+
+
+class Manifest:
+    """
+    SQLite record of files encrypted by earlier batch runs
+
+    Sources are keyed by absolute path with their size, mtime, a keyed
+    content digest and the output written for them. A file whose size
+    and mtime match and whose output is still there is skipped with one
+    stat; a file that was only touched is recognised by its digest.
+
+    The manifest also holds the salt and KDF for the batch master key, so runs
+    over the same folder derive the same key and interrupted large
+    files can resume (see crypto.checkpoint).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.executescript(_SCHEMA)
+        self._hash_key = None
+
+    def _meta(self, key: str) -> bytes:
+        row = self._db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: bytes):
+        self._db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def key_params(self, kdf: str) -> tuple:
+        """
+        Salt and KDF spec for the batch master key, shared by all runs
+
+        Both are recorded together by the first run; later runs get the
+        recorded ones whatever KDF they were configured with.
+        """
+        salt = self._meta('salt')
+        if salt is None:
+            salt = secrets.token_bytes(16)
+            self._set_meta('salt', salt)
+            self._set_meta('kdf', kdf.encode())
+            self._db.commit()
+            return salt, kdf
+        return bytes(salt), bytes(self._meta('kdf')).decode()
+
+    def unlock(self, master_key: bytes) -> bytes:
+        """
+        Check the batch master key against the manifest and derive the digest key
+
+        Raises if the manifest was written with another password, since
+        its skip decisions would not apply to this one.
+        """
+        check = hkdf_sha256(master_key, b'Wh04ami manifest check', 16)
+        stored = self._meta('check')
+        if stored is None:
+            self._set_meta('check', check)
+            self._db.commit()
+        elif not hmac.compare_digest(bytes(stored), check):
+            raise Exception("Manifest was written with a different password")
+        self._hash_key = hkdf_sha256(master_key, b'Wh04ami manifest digest')
+        return self._hash_key
+
+    @property
+    def hash_key(self) -> bytes:
+        if self._hash_key is None:
+            raise Exception("Manifest is locked")
+        return self._hash_key
+
+    def lookup(self, path: str) -> ManifestEntry:
+        row = self._db.execute(
+            'SELECT path, size, mtime_ns, digest, output, output_size FROM files WHERE path = ?',
+            (os.path.abspath(path),)
+        ).fetchone()
+        if row is None:
+            return None
+        return ManifestEntry(row[0], row[1], row[2], bytes(row[3]), row[4], row[5])
+
+    def record(self, path: str, size: int, mtime_ns: int, digest: bytes, output: str, output_size: int):
+        """Remember an encrypted file; call commit() to make it durable"""
+        self._db.execute(
+            'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (os.path.abspath(path), size, mtime_ns, digest, os.path.abspath(output), output_size, time.time())
+        )
+
+    def commit(self):
+        self._db.commit()
+
+    def __len__(self) -> int:
+        return self._db.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,167 @@
+import os
+import mmap
+
+from crypto.backends import BLOCK_SIZE, get_backend
+from crypto.progress import NULL_TRACKER
+from crypto.stream import DEFAULT_CHUNK_SIZE, padding_length, pkcs7_pad
+
+# I/O modes for FileEncryptor / FileDecryptor
+IO_AUTO = 'auto'
+IO_STREAM = 'stream'
+IO_MMAP = 'mmap'
+IO_PIPELINE = 'pipeline'  # threaded reader/cipher/writer, see crypto.pipeline
+IO_MODES = (IO_AUTO, IO_STREAM, IO_MMAP, IO_PIPELINE)
+
+# Files at least this large use memory-mapped I/O in auto mode
+MMAP_THRESHOLD = 64 * 1024 * 1024  # 64 MiB
+
+LEGACY_HEADER_SIZE = 32  # salt + iv
+
+
+def use_mmap(io_mode: str, size: int) -> bool:
+    """Decide whether a file of this size goes through the mmap path"""
+    if io_mode not in IO_MODES:
+        raise ValueError(f"Unknown I/O mode: {io_mode}")
+    if size == 0 or io_mode in (IO_STREAM, IO_PIPELINE):
+        return False  # empty files cannot be mapped
+    return io_mode == IO_MMAP or size >= MMAP_THRESHOLD
+
+
+def _map_output(file, size: int) -> mmap.mmap:
+    """Grow the output file to its final size and map it for writing"""
+    file.truncate(size)
+    return mmap.mmap(file.fileno(), size, access=mmap.ACCESS_WRITE)
+
+
+def _advise_sequential(mapped: mmap.mmap):
+    if hasattr(mapped, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+
+
+def _release(mapped: mmap.mmap, start: int, end: int):
+    """
+    Drop already processed pages from the mapping
+
+    Mapped file pages count towards RSS; releasing them as we go keeps the
+    footprint flat. Both maps are shared file mappings, so written pages
+    stay in the page cache and are not lost.
+    """
+    if not hasattr(mmap, 'MADV_DONTNEED'):
+        return
+    start -= start % mmap.PAGESIZE
+    end -= end % mmap.PAGESIZE
+    if end <= start:
+        return
+    mapped.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+
+def encrypt_cbc_mmap(source_path: str, output_path: str, key: bytes, salt: bytes, iv: bytes,
+                     chunk_size: int = DEFAULT_CHUNK_SIZE, backend=None, tracker=None) -> int:
+    """
+    Encrypt a file into the legacy layout through memory maps
+
+    The output size is known up front (header + data + padding), so the
+    ciphertext is written straight into a mapped output file. Only the
+    final partial block is copied to apply padding.
+
+    Page faults on the maps are part of the cipher phase, as reads and
+    writes are not separate calls here.
+
+    Returns:
+        int: Number of plaintext bytes encrypted
+    """
+    tracker = tracker or NULL_TRACKER
+    cipher = get_backend(backend).cbc(key, iv)
+
+    with open(source_path, 'rb') as source:
+        size = os.fstat(source.fileno()).st_size
+        padding = pkcs7_pad(size)
+        output_size = LEGACY_HEADER_SIZE + size + len(padding)
+        whole = size - (size % BLOCK_SIZE)
+
+        with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as in_map, \
+                open(output_path, 'w+b') as output, \
+                _map_output(output, output_size) as out_map:
+            _advise_sequential(in_map)
+            in_view = memoryview(in_map)
+            out_view = memoryview(out_map)
+            try:
+                out_view[:16] = salt
+                out_view[16:32] = iv
+
+                for offset in range(0, whole, chunk_size):
+                    end = min(offset + chunk_size, whole)
+                    with tracker.phase('cipher'):
+                        cipher.update_into(in_view[offset:end], out_view[LEGACY_HEADER_SIZE + offset:])
+                    _release(in_map, offset, end)
+                    _release(out_map, LEGACY_HEADER_SIZE + offset, LEGACY_HEADER_SIZE + end)
+                    tracker.advance(end - offset)
+
+                # Final block: leftover bytes plus padding
+                tail = bytearray(in_view[whole:]) + padding
+                with tracker.phase('cipher'):
+                    out_view[LEGACY_HEADER_SIZE + whole:] = cipher.update(tail)
+                tracker.advance(size - whole)
+            finally:
+                in_view.release()
+                out_view.release()
+
+    return size
+
+
+def decrypt_cbc_mmap(file_path: str, output_path: str, key: bytes,
+                     chunk_size: int = DEFAULT_CHUNK_SIZE, backend=None, tracker=None) -> int:
+    """
+    Decrypt a legacy-layout file through memory maps
+
+    The last block is decrypted first to learn the padding, which gives
+    the exact output size before anything is written.
+
+    Returns:
+        int: Number of plaintext bytes written
+    """
+    tracker = tracker or NULL_TRACKER
+    backend = get_backend(backend)
+
+    with open(file_path, 'rb') as source, \
+            mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as in_map:
+        in_view = memoryview(in_map)
+        try:
+            iv = in_view[16:32]
+            body = in_view[LEGACY_HEADER_SIZE:]
+            if len(body) < BLOCK_SIZE or len(body) % BLOCK_SIZE:
+                raise ValueError("Encrypted data is not a multiple of the AES block size")
+
+            # Peek at the final block using the previous block as IV
+            last_iv = body[-2 * BLOCK_SIZE:-BLOCK_SIZE] if len(body) > BLOCK_SIZE else iv
+            last_block = backend.cbc(key, bytes(last_iv), decrypt=True).update(body[-BLOCK_SIZE:])
+            padding = padding_length(last_block)
+            output_size = len(body) - padding
+
+            with open(output_path, 'w+b') as output:
+                if output_size == 0:
+                    return 0
+
+                with _map_output(output, output_size) as out_map:
+                    _advise_sequential(in_map)
+                    out_view = memoryview(out_map)
+                    try:
+                        cipher = backend.cbc(key, bytes(iv), decrypt=True)
+                        whole = len(body) - BLOCK_SIZE
+                        for offset in range(0, whole, chunk_size):
+                            end = min(offset + chunk_size, whole)
+                            with tracker.phase('cipher'):
+                                cipher.update_into(body[offset:end], out_view[offset:])
+                            _release(in_map, LEGACY_HEADER_SIZE + offset, LEGACY_HEADER_SIZE + end)
+                            _release(out_map, offset, end)
+                            tracker.advance(end - offset)
+                        out_view[whole:] = last_block[:BLOCK_SIZE - padding]
+                        tracker.advance(BLOCK_SIZE)
+                    finally:
+                        out_view.release()
+        finally:
+            # Views must be released before the map can close
+            iv = body = last_iv = None
+            in_view.release()
+
+    return output_size
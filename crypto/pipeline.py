@@ -0,0 +1,524 @@
+import os
+import mmap
+import errno
+import time
+import queue
+import threading
+from contextlib import contextmanager
+
+from crypto.backends import BLOCK_SIZE, get_backend
+from crypto.progress import NULL_TRACKER, TrackerView, _Phase
+from crypto.stream import DEFAULT_CHUNK_SIZE, padding_length, pkcs7_pad, readinto_full
+
+# Buffers per stage: one being filled, one being processed, one in flight
+PIPELINE_DEPTH = 3
+# With fsync requested, the writer syncs every this many bytes so the final sync is short
+SYNC_INTERVAL = 64 * 1024 * 1024  # 64 MiB
+# O_DIRECT needs block-aligned buffers, offsets and lengths
+DIRECT_ALIGNMENT = 4096
+DIRECT_BUFFER_SIZE = 4 * 1024 * 1024
+
+STAGES = ('read', 'cipher', 'write')
+
+_END = object()
+
+
+class StageStats:
+    """
+    Busy and stalled time of each pipeline stage
+
+    A stage stalls while it waits for a buffer from its neighbour. The
+    stage that is busy the longest and stalls the least is the
+    bottleneck.
+    """
+
+    def __init__(self):
+        self.busy = dict.fromkeys(STAGES, 0.0)
+        self.stalled = dict.fromkeys(STAGES, 0.0)
+        self.fsync = 0.0
+        self.direct = False
+
+    @property
+    def bottleneck(self) -> str:
+        return max(STAGES, key=lambda stage: self.busy[stage])
+
+    def report(self, tracker):
+        """Add busy times as phases and the full breakdown as a detail"""
+        for stage in STAGES:
+            tracker.add(stage, self.busy[stage])
+        tracker.add('fsync', self.fsync)
+        tracker.detail('pipeline', {
+            'busy': {stage: round(seconds, 6) for stage, seconds in self.busy.items()},
+            'stalled': {stage: round(seconds, 6) for stage, seconds in self.stalled.items()},
+            'bottleneck': self.bottleneck,
+            'direct_io': self.direct,
+        })
+
+
+def _advise(file, offset: int, length: int, advice: str):
+    """posix_fadvise where the platform and file support it"""
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        os.posix_fadvise(file.fileno(), offset, length, getattr(os, advice))
+    except (AttributeError, OSError, ValueError):
+        pass  # pipes, sockets, in-memory files
+
+
+class ReadAhead:
+    """
+    Reader thread filling a small pool of reusable buffers ahead of the consumer
+
+    get() hands out (buffer, length) pairs in file order and release()
+    gives a buffer back. read(size) is there for engines that want bytes.
+    The kernel is told the access is sequential and asked to fetch the
+    next buffer's worth while the current one is being processed.
+    """
+
+    def __init__(self, reader, buffer_size: int, stats: StageStats, depth: int = PIPELINE_DEPTH,
+                 spare: int = 0):
+        self._reader = reader
+        self._size = buffer_size
+        self._stats = stats
+        self._free = queue.Queue()
+        for _ in range(depth):
+            self._free.put(bytearray(buffer_size + spare))
+        self._filled = queue.Queue()
+        self._closed = False
+        self._current = None
+        self._offset = 0
+        self._eof = False
+        self._thread = threading.Thread(target=self._run, name='pipeline-read', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        stats = self._stats
+        try:
+            _advise(self._reader, 0, 0, 'POSIX_FADV_SEQUENTIAL')
+            position = _tell(self._reader)
+            while True:
+                start = time.perf_counter()
+                buffer = self._free.get()
+                stats.stalled['read'] += time.perf_counter() - start
+                if buffer is None or self._closed:
+                    return
+
+                if position is not None:
+                    _advise(self._reader, position + self._size, self._size, 'POSIX_FADV_WILLNEED')
+                start = time.perf_counter()
+                n = readinto_full(self._reader, memoryview(buffer)[:self._size])
+                stats.busy['read'] += time.perf_counter() - start
+                if position is not None:
+                    position += n
+
+                self._filled.put((buffer, n))
+                if n < self._size:
+                    return
+        except BaseException as e:
+            self._filled.put(e)
+
+    def get(self) -> tuple:
+        """Next (buffer, length); a length below the buffer size marks the end"""
+        start = time.perf_counter()
+        item = self._filled.get()
+        self._stats.stalled['cipher'] += time.perf_counter() - start
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    def release(self, buffer: bytearray):
+        self._free.put(buffer)
+
+    def read(self, size: int) -> bytes:
+        """Up to size bytes as a new bytes object, short only at EOF"""
+        parts = []
+        while size and not (self._eof and self._current is None):
+            if self._current is None:
+                self._current = self.get()
+                self._offset = 0
+            buffer, n = self._current
+            piece = memoryview(buffer)[self._offset:min(n, self._offset + size)]
+            parts.append(bytes(piece))
+            self._offset += len(piece)
+            size -= len(piece)
+            if self._offset >= n:
+                if n < self._size:
+                    self._eof = True
+                self.release(buffer)
+                self._current = None
+        return b''.join(parts)
+
+    def close(self):
+        self._closed = True
+        self._free.put(None)
+        self._thread.join()
+
+
+class WriteBehind:
+    """
+    Writer thread draining a bounded queue into a file
+
+    write(data, release) queues a buffer and returns at once; release is
+    called with it once written, so buffers can be reused. With
+    sync_interval the thread fsyncs as it goes (batched fsync).
+    """
+
+    def __init__(self, writer, stats: StageStats, depth: int = PIPELINE_DEPTH, sync_interval: int = None):
+        self._writer = writer
+        self._stats = stats
+        self._sync_interval = sync_interval
+        self._queue = queue.Queue(maxsize=depth)
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='pipeline-write', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        stats = self._stats
+        unsynced = 0
+        while True:
+            start = time.perf_counter()
+            item = self._queue.get()
+            stats.stalled['write'] += time.perf_counter() - start
+            if item is _END:
+                return
+            data, release = item
+            if self._error is None:
+                try:
+                    start = time.perf_counter()
+                    self._writer.write(data)
+                    stats.busy['write'] += time.perf_counter() - start
+                    unsynced += len(data)
+                    if self._sync_interval and unsynced >= self._sync_interval:
+                        self.sync()
+                        unsynced = 0
+                except BaseException as e:
+                    # Keep draining so the producer never blocks on a dead writer
+                    self._error = e
+            if release is not None:
+                release(data.obj if isinstance(data, memoryview) else data)
+
+    def sync(self):
+        """Flush and fsync the file; called by the writer thread or after close()"""
+        start = time.perf_counter()
+        self._writer.flush()
+        os.fsync(self._writer.fileno())
+        self._stats.fsync += time.perf_counter() - start
+
+    def write(self, data, release=None) -> int:
+        if self._error is not None:
+            raise self._error
+        if release is None and not isinstance(data, bytes):
+            data = bytes(data)  # the caller may reuse its buffer
+        start = time.perf_counter()
+        self._queue.put((data, release))
+        self._stats.stalled['cipher'] += time.perf_counter() - start
+        return len(data)
+
+    def close(self):
+        """Wait for queued writes and raise any write error"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_END)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+
+def _tell(file):
+    try:
+        return file.tell()
+    except (AttributeError, OSError):
+        return None
+
+
+class DirectWriter:
+    """
+    Output file opened with O_DIRECT, bypassing the page cache
+
+    Writes are staged in a page-aligned buffer and issued in aligned
+    blocks; the unaligned tail is written with O_DIRECT switched off.
+    Use open_direct(), which returns None where O_DIRECT is unsupported
+    (e.g. tmpfs).
+    """
+
+    def __init__(self, fd: int):
+        self._fd = fd
+        self._staging = mmap.mmap(-1, DIRECT_BUFFER_SIZE)
+        self._view = memoryview(self._staging)
+        self._filled = 0
+        self._direct = True
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = memoryview(data).cast('B')
+        total = len(data)
+        while data:
+            n = min(len(data), DIRECT_BUFFER_SIZE - self._filled)
+            self._view[self._filled:self._filled + n] = data[:n]
+            self._filled += n
+            data = data[n:]
+            if self._filled == DIRECT_BUFFER_SIZE:
+                self._write_staged(DIRECT_BUFFER_SIZE)
+        return total
+
+    def _write_staged(self, length: int):
+        written = 0
+        while written < length:
+            try:
+                written += os.write(self._fd, self._view[written:length])
+            except OSError as e:
+                # Some filesystems accept O_DIRECT at open time and refuse the writes
+                if e.errno != errno.EINVAL or not self._direct:
+                    raise
+                self._buffered()
+        self._filled = 0
+
+    def _buffered(self):
+        """Switch O_DIRECT off for the rest of the file"""
+        import fcntl
+        flags = fcntl.fcntl(self._fd, fcntl.F_GETFL)
+        fcntl.fcntl(self._fd, fcntl.F_SETFL, flags & ~os.O_DIRECT)
+        self._direct = False
+
+    def flush(self):
+        """Write whole aligned blocks; the tail waits for finish()"""
+        aligned = self._filled - self._filled % DIRECT_ALIGNMENT
+        if aligned:
+            tail = self._filled - aligned
+            self._write_staged(aligned)
+            self._view[:tail] = self._view[aligned:aligned + tail]
+            self._filled = tail
+
+    def finish(self):
+        """Write everything staged, switching O_DIRECT off for an unaligned tail"""
+        self.flush()
+        if self._filled:
+            if self._direct:
+                self._buffered()
+            self._write_staged(self._filled)
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.finish()
+        finally:
+            self.closed = True
+            self._view.release()
+            self._staging.close()
+            os.close(self._fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_direct(path: str):
+    """DirectWriter for a new file, or None if O_DIRECT is not available here"""
+    if not hasattr(os, 'O_DIRECT'):
+        return None
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_DIRECT, 0o666)
+    except OSError:
+        return None
+    return DirectWriter(fd)
+
+
+def open_output(path: str, direct: bool = False):
+    """Output file for a pipeline, using O_DIRECT when asked and supported"""
+    if direct:
+        writer = open_direct(path)
+        if writer is not None:
+            return writer
+    return open(path, 'wb')
+
+
+class StageTracker:
+    """
+    Tracker for the cipher stage running in the caller's thread
+
+    Read and write phases timed in this thread are only waits on the
+    reader/writer threads (counted as stalls by those), so they stay
+    here; cipher time becomes the stage's busy time; other phases
+    (compress, decompress) and progress go to the operation tracker.
+    """
+
+    def __init__(self, tracker, stats: StageStats):
+        self._tracker = tracker
+        self.stats = stats
+        self.phases = dict.fromkeys(STAGES, 0.0)
+
+    def phase(self, name: str):
+        if name not in self.phases:
+            self.phases[name] = 0.0
+        return _Phase(self, name)
+
+    def add(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def advance(self, nbytes: int):
+        self._tracker.advance(nbytes)
+
+    def detail(self, name: str, value):
+        self._tracker.detail(name, value)
+
+    def view(self, skip: tuple = (), progress: bool = True):
+        return TrackerView(self, skip, progress)
+
+    def flush(self):
+        """Hand the collected timings over to the stats and the operation tracker"""
+        self.stats.busy['cipher'] += self.phases['cipher']
+        for name, seconds in self.phases.items():
+            if name not in STAGES:
+                self._tracker.add(name, seconds)
+
+
+@contextmanager
+def pipeline_io(reader, writer, buffer_size: int, tracker=None, depth: int = PIPELINE_DEPTH,
+                fsync: bool = False, spare: int = 0):
+    """
+    Run a reader thread and a writer thread around the caller's cipher stage
+
+    Yields (read_ahead, write_behind, stage): read from read_ahead, write
+    to write_behind and pass stage as the tracker of the cipher code. On
+    normal exit the queued writes are flushed (fsynced in batches when
+    fsync is set) and the stage timings are reported to the tracker.
+    """
+    tracker = tracker or NULL_TRACKER
+    stats = StageStats()
+    stats.direct = isinstance(writer, DirectWriter)
+    stage = StageTracker(tracker, stats)
+    read_ahead = ReadAhead(reader, buffer_size, stats, depth, spare)
+    write_behind = WriteBehind(writer, stats, depth, SYNC_INTERVAL if fsync else None)
+    try:
+        yield read_ahead, write_behind, stage
+        write_behind.close()
+        if stats.direct:
+            writer.finish()
+        if fsync:
+            write_behind.sync()
+    finally:
+        read_ahead.close()
+        try:
+            write_behind.close()
+        except BaseException:
+            pass  # already failing; the original error wins
+        stage.flush()
+    stats.report(tracker)
+
+
+class _BufferPool:
+    """Reusable output buffers; waiting for one counts as a cipher stall"""
+
+    def __init__(self, size: int, count: int, stats: StageStats):
+        self._free = queue.Queue()
+        for _ in range(count):
+            self._free.put(bytearray(size))
+        self._stats = stats
+
+    def get(self) -> bytearray:
+        start = time.perf_counter()
+        buffer = self._free.get()
+        self._stats.stalled['cipher'] += time.perf_counter() - start
+        return buffer
+
+    def put(self, buffer: bytearray):
+        self._free.put(buffer)
+
+
+def encrypt_cbc_pipeline(reader, writer, key: bytes, iv: bytes, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                         backend=None, tracker=None, fsync: bool = False) -> int:
+    """
+    Pipelined encrypt_cbc_stream: read, cipher and write overlap
+
+    The output is byte for byte what encrypt_cbc_stream writes.
+
+    Returns:
+        int: Number of plaintext bytes consumed
+    """
+    tracker = tracker or NULL_TRACKER
+    cipher = get_backend(backend).cbc(key, iv)
+    total = 0
+
+    with pipeline_io(reader, writer, chunk_size, tracker, fsync=fsync, spare=BLOCK_SIZE) as io:
+        read_ahead, write_behind, stage = io
+        stats = stage.stats
+        outputs = _BufferPool(chunk_size + BLOCK_SIZE, PIPELINE_DEPTH, stats)
+        while True:
+            buffer, n = read_ahead.get()
+            total += n
+            size = n
+            if n < chunk_size:
+                # Final chunk: pad the tail in place (the buffer has room for it)
+                padding = pkcs7_pad(n)
+                buffer[n:n + len(padding)] = padding
+                size = n + len(padding)
+
+            out = outputs.get()
+            with stage.phase('cipher'):
+                cipher.update_into(memoryview(buffer)[:size], out)
+            read_ahead.release(buffer)
+            write_behind.write(memoryview(out)[:size], outputs.put)
+            stage.advance(n)
+            if n < chunk_size:
+                break
+
+    return total
+
+
+def decrypt_cbc_pipeline(reader, writer, key: bytes, iv: bytes, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                         backend=None, tracker=None, fsync: bool = False) -> int:
+    """
+    Pipelined decrypt_cbc_stream: read, cipher and write overlap
+
+    The last plaintext block is held back until EOF so that padding is
+    only removed from the final chunk.
+
+    Returns:
+        int: Number of plaintext bytes written
+    """
+    tracker = tracker or NULL_TRACKER
+    cipher = get_backend(backend).cbc(key, iv, decrypt=True)
+    pending = None
+    total = 0
+
+    with pipeline_io(reader, writer, chunk_size, tracker, fsync=fsync) as io:
+        read_ahead, write_behind, stage = io
+        stats = stage.stats
+        outputs = _BufferPool(chunk_size + BLOCK_SIZE, PIPELINE_DEPTH, stats)
+        while True:
+            buffer, n = read_ahead.get()
+            if n % BLOCK_SIZE:
+                raise ValueError("Encrypted data is not a multiple of the AES block size")
+            if n == 0:
+                break
+
+            out = outputs.get()
+            with stage.phase('cipher'):
+                cipher.update_into(memoryview(buffer)[:n], out)
+            read_ahead.release(buffer)
+
+            if pending is not None:
+                write_behind.write(pending)
+                total += BLOCK_SIZE
+            pending = bytes(out[n - BLOCK_SIZE:n])
+            write_behind.write(memoryview(out)[:n - BLOCK_SIZE], outputs.put)
+            total += n - BLOCK_SIZE
+            stage.advance(n)
+            if n < chunk_size:
+                break
+
+        # Remove padding from the final block
+        if pending is not None:
+            pending = pending[:BLOCK_SIZE - padding_length(pending)]
+            write_behind.write(pending)
+            total += len(pending)
+
+    return total
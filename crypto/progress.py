@@ -0,0 +1,188 @@
+import json
+import time
+import threading
+
+# Phases reported in metrics records
+PHASES = ('kdf', 'read', 'compress', 'cipher', 'decompress', 'write', 'fsync')
+
+
+class _Phase:
+    """Context manager adding elapsed time to one phase of a tracker"""
+
+    __slots__ = ('_tracker', '_name', '_start')
+
+    def __init__(self, tracker, name: str):
+        self._tracker = tracker
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._tracker.phases[self._name] += time.perf_counter() - self._start
+
+
+class _NullPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class OperationTracker:
+    """
+    Progress and timing for one encrypt/decrypt operation
+
+    The progress callback fires after every processed chunk with
+    (bytes_done, total_bytes, elapsed_seconds). When the operation
+    finishes, a record with per-phase timings goes to the metrics sink.
+    """
+
+    def __init__(self, operation: str, path: str = None, total_bytes: int = 0,
+                 callback=None, sink=None, **details):
+        self.operation = operation
+        self.path = path
+        self.total_bytes = total_bytes
+        self.bytes_done = 0
+        self.callback = callback
+        self.sink = sink
+        self.details = details
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.start = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def phase(self, name: str):
+        """Time a block of work under a phase name"""
+        if name not in self.phases:
+            self.phases[name] = 0.0
+        return _Phase(self, name)
+
+    def add(self, name: str, seconds: float):
+        """Add time measured elsewhere to a phase"""
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def advance(self, nbytes: int):
+        """Report nbytes more processed"""
+        self.bytes_done += nbytes
+        if self.callback:
+            self.callback(self.bytes_done, self.total_bytes, self.elapsed)
+
+    def detail(self, name: str, value):
+        """Attach an extra field to the metrics record"""
+        self.details[name] = value
+
+    def view(self, skip: tuple = (), progress: bool = True):
+        """Proxy for a stage whose other phases or progress are counted elsewhere"""
+        return TrackerView(self, skip, progress)
+
+    def record(self, status: str = 'ok', error: str = None) -> dict:
+        elapsed = self.elapsed
+        record = {
+            'timestamp': time.time(),
+            'operation': self.operation,
+            'path': self.path,
+            'status': status,
+            'bytes': self.bytes_done,
+            'total_bytes': self.total_bytes,
+            'elapsed': round(elapsed, 6),
+            'mb_s': round(self.bytes_done / (1024 * 1024) / max(elapsed, 1e-9), 2),
+            'phases': {name: round(seconds, 6) for name, seconds in self.phases.items()},
+            **self.details,
+        }
+        if error:
+            record['error'] = error
+        return record
+
+    def finish(self, status: str = 'ok', error: str = None) -> dict:
+        """Emit the metrics record for this operation"""
+        record = self.record(status, error)
+        if self.sink is not None:
+            self.sink.write(record)
+        return record
+
+
+class NullTracker(OperationTracker):
+    """Tracker used when no callback or sink is configured"""
+
+    def __init__(self):
+        super().__init__('none')
+
+    def phase(self, name: str):
+        return _NULL_PHASE
+
+    def add(self, name: str, seconds: float):
+        pass
+
+    def advance(self, nbytes: int):
+        pass
+
+    def detail(self, name: str, value):
+        pass
+
+    def view(self, skip: tuple = (), progress: bool = True):
+        return self
+
+    def finish(self, status: str = 'ok', error: str = None) -> dict:
+        return {}
+
+
+NULL_TRACKER = NullTracker()
+
+
+class TrackerView:
+    """Forwards phase timings and progress to a tracker, minus skipped parts"""
+
+    def __init__(self, tracker: OperationTracker, skip: tuple = (), progress: bool = True):
+        self._tracker = tracker
+        self._skip = frozenset(skip)
+        self._progress = progress
+
+    @property
+    def phases(self) -> dict:
+        return self._tracker.phases
+
+    def phase(self, name: str):
+        if name in self._skip:
+            return _NULL_PHASE
+        return self._tracker.phase(name)
+
+    def add(self, name: str, seconds: float):
+        if name not in self._skip:
+            self._tracker.add(name, seconds)
+
+    def advance(self, nbytes: int):
+        if self._progress:
+            self._tracker.advance(nbytes)
+
+    def detail(self, name: str, value):
+        self._tracker.detail(name, value)
+
+
+class JsonLinesSink:
+    """Append metrics records to a JSON lines file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, record: dict):
+        line = json.dumps(record, sort_keys=True)
+        with self._lock, open(self.path, 'a') as file:
+            file.write(line + '\n')
+
+
+def make_sink(sink):
+    """Accept a sink object, a JSON lines path or None"""
+    if sink is None or hasattr(sink, 'write'):
+        return sink
+    return JsonLinesSink(sink)
@@ -0,0 +1,193 @@
+import io
+import os
+
+from crypto.backends import BLOCK_SIZE
+from crypto.chunked import open_chunk
+from crypto.container import (
+    CONTAINER_BUNDLE, CONTAINER_CHUNKED, CONTAINER_RECORD, PREFIX_SIZE, detect_container, read_header,
+    unlock_keys
+)
+from crypto.stream import padding_length
+
+LEGACY_HEADER_SIZE = 32  # salt + iv
+
+
+class EncryptedReader(io.RawIOBase):
+    """
+    Seekable, read-only view of the plaintext inside an encrypted file
+
+    Only the chunks (or CBC blocks for legacy files) that cover the
+    requested range are read and decrypted.
+    """
+
+    def __init__(self, file_path: str, password: str, decryptor=None):
+        if decryptor is None:
+            from crypto.decryptor import FileDecryptor
+            decryptor = FileDecryptor()
+
+        self.name = file_path
+        self._backend = decryptor.backend
+        self._file = open(file_path, 'rb')
+        self._position = 0
+        self._cached_index = None
+        self._cached_chunk = b''
+
+        try:
+            file_size = os.fstat(self._file.fileno()).st_size
+            self.container = detect_container(self._file.read(PREFIX_SIZE))
+            self._file.seek(0)
+            if self.container == CONTAINER_BUNDLE:
+                raise Exception("File is a bundle; open its members with crypto.bundle.Bundle")
+            if self.container == CONTAINER_RECORD:
+                raise Exception("File is an encrypted record; decrypt it with FileDecryptor.decrypt_data")
+
+            if self.container == CONTAINER_CHUNKED:
+                self._header = read_header(self._file)
+                if self._header.compressed:
+                    raise Exception("Random access is not supported for compressed files")
+                self._header_bytes = self._header.bound_fields()
+                self.size = self._header.plaintext_size(file_size)
+                self._chunk_count = (file_size - self._header.size) // self._header.record_size + 1
+                self._enc_key, self._mac_key = unlock_keys(
+                    self._header, lambda salt, kdf: decryptor._get_key(password, salt, kdf)
+                )
+            else:
+                body_size = file_size - LEGACY_HEADER_SIZE
+                if body_size < BLOCK_SIZE or body_size % BLOCK_SIZE:
+                    raise Exception("File is not a valid encrypted file")
+                self._salt = self._file.read(16)
+                self._iv = self._file.read(16)
+                self._body_size = body_size
+                self._key = decryptor._get_key(password, self._salt)
+                self.size = body_size - self._legacy_padding()
+        except Exception:
+            self._file.close()
+            raise
+
+    # io.RawIOBase interface
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if position < 0:
+            raise ValueError("Negative seek position")
+        self._position = position
+        return position
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        memoryview(buffer)[:len(data)] = data
+        return len(data)
+
+    def read(self, size: int = -1) -> bytes:
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if size is None or size < 0:
+            size = self.size - self._position
+        data = self.read_at(self._position, size)
+        self._position += len(data)
+        return data
+
+    def readall(self) -> bytes:
+        return self.read()
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+            self._cached_chunk = b''
+        super().close()
+
+    # Random access
+
+    def read_at(self, offset: int, length: int) -> bytes:
+        """Decrypt length bytes starting at a plaintext offset"""
+        if offset >= self.size or length <= 0:
+            return b''
+        length = min(length, self.size - offset)
+
+        if self.container == CONTAINER_CHUNKED:
+            return self._read_chunked(offset, length)
+        return self._read_legacy(offset, length)
+
+    def _read_chunked(self, offset: int, length: int) -> bytes:
+        chunk_size = self._header.chunk_size
+        first = offset // chunk_size
+        last = (offset + length - 1) // chunk_size
+
+        parts = []
+        for index in range(first, last + 1):
+            chunk = self._load_chunk(index)
+            start = offset - index * chunk_size if index == first else 0
+            end = offset + length - index * chunk_size if index == last else len(chunk)
+            parts.append(chunk[start:end])
+        return b''.join(parts)
+
+    def _load_chunk(self, index: int) -> bytes:
+        """Read, verify and decrypt a single chunk, keeping the last one cached"""
+        if index == self._cached_index:
+            return self._cached_chunk
+
+        self._file.seek(self._header.size + index * self._header.record_size)
+        record = self._file.read(self._header.record_size)
+        final = index == self._chunk_count - 1
+        chunk = open_chunk(
+            self._backend.name, self._enc_key, self._mac_key, self._header_bytes,
+            self._header.nonce, index, final, record
+        )
+
+        self._cached_index = index
+        self._cached_chunk = chunk
+        return chunk
+
+    def _read_legacy(self, offset: int, length: int) -> bytes:
+        # CBC can start anywhere: the previous ciphertext block is the IV
+        first = offset // BLOCK_SIZE
+        last = (offset + length - 1) // BLOCK_SIZE
+        plaintext = self._decrypt_blocks(first, last - first + 1)
+
+        start = offset - first * BLOCK_SIZE
+        return plaintext[start:start + length]
+
+    def _decrypt_blocks(self, first: int, count: int) -> bytes:
+        """Decrypt count CBC blocks starting at block index first"""
+        if first == 0:
+            iv = self._iv
+            self._file.seek(LEGACY_HEADER_SIZE)
+        else:
+            self._file.seek(LEGACY_HEADER_SIZE + (first - 1) * BLOCK_SIZE)
+            iv = self._file.read(BLOCK_SIZE)
+
+        ciphertext = self._file.read(count * BLOCK_SIZE)
+        return self._backend.cbc(self._key, iv, decrypt=True).update(ciphertext)
+
+    def _legacy_padding(self) -> int:
+        """Read the padding length from the last CBC block, rejecting a wrong password"""
+        last_block = self._decrypt_blocks(self._body_size // BLOCK_SIZE - 1, 1)
+        return padding_length(last_block)
+
+
+def open_encrypted(file_path: str, password: str, decryptor=None) -> EncryptedReader:
+    """
+    Open an encrypted file for random-access reading
+
+    Example:
+        with open_encrypted('app.log.Wh04ami', password) as reader:
+            reader.seek(-4096, io.SEEK_END)
+            tail = reader.read()
+    """
+    return EncryptedReader(file_path, password, decryptor)
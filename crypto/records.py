@@ -0,0 +1,200 @@
+import hmac
+import struct
+import hashlib
+import secrets
+import threading
+
+from crypto.backends import BLOCK_SIZE, get_backend
+from crypto.container import MAGIC, PREFIX_SIZE, TAG_SIZE, VERSION_RECORD, hkdf_sha256
+from crypto.kdf import DEFAULT_KDF, KDF_PARAMS_SIZE, get_kdf, unpack_kdf
+
+RECORD_NONCE_SIZE = 12  # random per record; the last 4 counter bytes count blocks within it
+MAX_RECORD_SIZE = 2 ** 32 * BLOCK_SIZE
+
+# Records up to this size are XORed with keystream from one shared AES
+# context instead of setting up a CTR cipher each, which costs more than
+# the encryption itself at these sizes
+SMALL_RECORD_SIZE = 512
+
+FLAG_KDF = 0x01  # KDF and costs follow the salt; otherwise DEFAULT_KDF
+KNOWN_FLAGS = FLAG_KDF
+
+# magic, version, flags, batch salt; then the KDF when flagged, the record nonce,
+# the AES-CTR ciphertext and a truncated HMAC-SHA256 of everything before it
+_PREFIX = struct.Struct('>7sBB16s')
+_COUNTER_TAIL = bytes(BLOCK_SIZE - RECORD_NONCE_SIZE)
+_COUNTER_SUFFIXES = [index.to_bytes(BLOCK_SIZE - RECORD_NONCE_SIZE, 'big')
+                     for index in range(SMALL_RECORD_SIZE // BLOCK_SIZE)]
+
+
+def is_record(data) -> bool:
+    """Whether data starts like a record (rather than a legacy salt + IV blob)"""
+    return bytes(memoryview(data)[:PREFIX_SIZE]) == MAGIC + bytes([VERSION_RECORD])
+
+
+def record_params(record) -> tuple:
+    """
+    Salt and KDF a record's batch key was derived with
+
+    Returns:
+        tuple: (salt, Kdf)
+    """
+    record = memoryview(record)
+    if len(record) < _PREFIX.size + RECORD_NONCE_SIZE + TAG_SIZE:
+        raise Exception("Encrypted record is truncated")
+    magic, version, flags, salt = _PREFIX.unpack_from(record)
+    if magic != MAGIC or version != VERSION_RECORD:
+        raise Exception("Not an encrypted record")
+    if flags & ~KNOWN_FLAGS:
+        raise Exception("Unsupported record flags (written by a newer version?)")
+    if not flags & FLAG_KDF:
+        return salt, DEFAULT_KDF
+    if len(record) < _PREFIX.size + KDF_PARAMS_SIZE + RECORD_NONCE_SIZE + TAG_SIZE:
+        raise Exception("Encrypted record is truncated")
+    return salt, unpack_kdf(record[_PREFIX.size:_PREFIX.size + KDF_PARAMS_SIZE])
+
+
+def _as_bytes(data) -> memoryview:
+    """Flat byte view of any buffer-protocol object, without copying"""
+    view = memoryview(data)
+    return view if view.format == 'B' and view.ndim == 1 else view.cast('B')
+
+
+class RecordCipher:
+    """
+    Encrypt and decrypt many small in-memory records under one batch key
+
+    The password KDF runs once for the batch. Every record then gets a
+    fresh random nonce, is encrypted with AES-CTR and authenticated with
+    a truncated HMAC-SHA256, so per record the cost is a few AES blocks
+    and one HMAC: no KDF, no padding and, below SMALL_RECORD_SIZE, not
+    even a cipher setup. Each record carries the batch
+    salt (and the KDF when it is not the default), so it can still be
+    decrypted on its own with just the password.
+
+    Inputs may be any buffer-protocol object (bytes, bytearray,
+    memoryview, array, mmap); encrypt_into() and decrypt_into() write
+    into a caller-provided buffer so a loop over millions of records
+    does not allocate per record. Get one from
+    FileEncryptor.record_cipher(), or use FileEncryptor.encrypt_many()
+    and FileDecryptor.decrypt_many().
+    """
+
+    def __init__(self, master_key: bytes, salt: bytes, kdf=None, backend=None):
+        self.salt = salt
+        self.kdf = get_kdf(kdf)
+        self.backend = get_backend(backend)
+        flags = FLAG_KDF if self.kdf != DEFAULT_KDF else 0
+        # Everything before the nonce is the same for the whole batch
+        self._prefix = _PREFIX.pack(MAGIC, VERSION_RECORD, flags, salt) + (self.kdf.pack() if flags else b'')
+        self._enc_key = hkdf_sha256(master_key, b'Wh04ami record encryption')
+        self._blocks = self.backend.ecb(self._enc_key)
+        self._lock = threading.Lock()
+        # Keyed once; each record continues from a copy
+        self._mac = hmac.new(hkdf_sha256(master_key, b'Wh04ami record authentication'), digestmod=hashlib.sha256)
+        self.overhead = len(self._prefix) + RECORD_NONCE_SIZE + TAG_SIZE
+
+    @classmethod
+    def derive(cls, password: str, kdf=None, salt: bytes = None, backend=None) -> 'RecordCipher':
+        """Run the password KDF once for a new batch"""
+        kdf = get_kdf(kdf)
+        salt = salt or secrets.token_bytes(16)
+        return cls(kdf.derive(password, salt), salt, kdf, backend)
+
+    def sealed_size(self, length: int) -> int:
+        """Size of the record for length bytes of plaintext"""
+        return length + self.overhead
+
+    def matches(self, record) -> bool:
+        """Whether a record belongs to this batch (same salt and KDF)"""
+        return memoryview(record)[:len(self._prefix)] == self._prefix
+
+    def _ctr(self, nonce: bytes, data) -> bytes:
+        """AES-CTR from counter nonce + 0; the same output either way"""
+        length = len(data)
+        if length > SMALL_RECORD_SIZE:
+            return self.backend.ctr(self._enc_key, nonce + _COUNTER_TAIL).update(data)
+        counters = b''.join([nonce + suffix for suffix in _COUNTER_SUFFIXES[:-(-length // BLOCK_SIZE)]])
+        with self._lock:
+            stream = self._blocks.update(counters)
+        return (int.from_bytes(data, 'little') ^ int.from_bytes(stream[:length], 'little')).to_bytes(length, 'little')
+
+    def encrypt(self, data) -> bytes:
+        """Encrypt one record"""
+        data = _as_bytes(data)
+        if len(data) > MAX_RECORD_SIZE:
+            raise ValueError("Record is too large")
+        nonce = secrets.token_bytes(RECORD_NONCE_SIZE)
+        head = self._prefix + nonce
+        ciphertext = self._ctr(nonce, data)
+        mac = self._mac.copy()
+        mac.update(head)
+        mac.update(ciphertext)
+        return b''.join((head, ciphertext, mac.digest()[:TAG_SIZE]))
+
+    def encrypt_into(self, data, out, offset: int = 0) -> int:
+        """
+        Encrypt one record into a writable buffer at offset
+
+        Returns:
+            int: Bytes written, sealed_size(len(data))
+        """
+        data = _as_bytes(data)
+        out = _as_bytes(out)[offset:]
+        length = len(data)
+        size = length + self.overhead
+        if len(out) < size:
+            raise ValueError(f"Output buffer is too small: need {size} bytes")
+        if length > MAX_RECORD_SIZE:
+            raise ValueError("Record is too large")
+
+        start = len(self._prefix) + RECORD_NONCE_SIZE
+        nonce = secrets.token_bytes(RECORD_NONCE_SIZE)
+        out[:len(self._prefix)] = self._prefix
+        out[len(self._prefix):start] = nonce
+        if length > SMALL_RECORD_SIZE:
+            # The tag's room doubles as the slack OpenSSL wants after the output
+            self.backend.ctr(self._enc_key, nonce + _COUNTER_TAIL).update_into(data, out[start:size])
+        else:
+            out[start:start + length] = self._ctr(nonce, data)
+        mac = self._mac.copy()
+        mac.update(out[:start + length])
+        out[start + length:size] = mac.digest()[:TAG_SIZE]
+        return size
+
+    def _open(self, record) -> tuple:
+        """Check a record's tag and return (nonce, ciphertext)"""
+        record = _as_bytes(record)
+        if len(record) < self.overhead:
+            raise Exception("Encrypted record is truncated")
+        if not self.matches(record):
+            raise Exception("Record belongs to another batch key")
+        start = len(self._prefix) + RECORD_NONCE_SIZE
+        mac = self._mac.copy()
+        mac.update(record[:-TAG_SIZE])
+        if not hmac.compare_digest(mac.digest()[:TAG_SIZE], record[-TAG_SIZE:]):
+            raise Exception("Authentication failed for record (wrong password or corrupted data)")
+        return record[len(self._prefix):start], record[start:-TAG_SIZE]
+
+    def decrypt(self, record) -> bytes:
+        """Check and decrypt one record"""
+        nonce, ciphertext = self._open(record)
+        return self._ctr(bytes(nonce), ciphertext)
+
+    def decrypt_into(self, record, out, offset: int = 0) -> int:
+        """
+        Check and decrypt one record into a writable buffer at offset
+
+        Returns:
+            int: Plaintext bytes written
+        """
+        nonce, ciphertext = self._open(record)
+        out = _as_bytes(out)[offset:]
+        length = len(ciphertext)
+        if len(out) < length:
+            raise ValueError(f"Output buffer is too small: need {length} bytes")
+        if length > SMALL_RECORD_SIZE:
+            self.backend.ctr(self._enc_key, bytes(nonce) + _COUNTER_TAIL).update_into(ciphertext, out)
+        else:
+            out[:length] = self._ctr(bytes(nonce), ciphertext)
+        return length
@@ -0,0 +1,103 @@
+import os
+import secrets
+
+from crypto.container import (
+    CONTAINER_CHUNKED, PREFIX_SIZE, derive_file_key, detect_container, read_header, split_key
+)
+from crypto.kdf import get_kdf
+from crypto.keycache import default_key_cache
+
+# What rekey does with the new password
+REKEY_CHANGE = 'change'  # replace the slot the current password opens
+REKEY_ADD = 'add'        # use a free slot; the current password keeps working
+REKEY_REMOVE = 'remove'  # clear the slot the current password opens
+REKEY_ACTIONS = (REKEY_CHANGE, REKEY_ADD, REKEY_REMOVE)
+
+
+def key_slots(file_path: str) -> list:
+    """KDF spec of each key slot of a chunked v4 file (None for unused slots), no password needed"""
+    with open(file_path, 'rb') as file:
+        header = _read_wrapped_header(file, file_path)
+    return [str(slot.kdf) if slot is not None else None for slot in header.slots]
+
+
+def _read_wrapped_header(file, file_path: str):
+    if detect_container(file.read(PREFIX_SIZE)) != CONTAINER_CHUNKED:
+        raise Exception(f"{file_path} is not a chunked container; only those have key slots")
+    file.seek(0)
+    header = read_header(file)
+    if not header.wrapped:
+        raise Exception(f"{file_path} predates key slots (container v{header.version}); "
+                        "decrypt and encrypt it again to make it rekeyable")
+    return header
+
+
+class Rekeyer:
+    """
+    Change, add or remove a password of chunked files by rewriting their header
+
+    v4 files encrypt their body under a random data key that each key
+    slot holds wrapped by one password, so rekeying only rewrites the
+    few hundred bytes of the header in place; the body is never read.
+
+    One Rekeyer can rekey a whole fleet of files for about the cost of
+    two KDF runs: the new password is derived once with one salt for
+    every file (each file's header salt still makes its slot key unique),
+    and the current password's keys are shared through the key cache
+    when files came from the same batch session.
+    """
+
+    def __init__(self, password: str, new_password: str = None, action: str = REKEY_CHANGE,
+                 kdf=None, key_cache=None):
+        if action not in REKEY_ACTIONS:
+            raise ValueError(f"Unknown rekey action: {action}")
+        if action != REKEY_REMOVE and not new_password:
+            raise ValueError(f"Rekey action '{action}' needs a new password")
+        self.password = password
+        self.new_password = new_password
+        self.action = action
+        self.kdf = get_kdf(kdf)
+        self.key_cache = key_cache if key_cache is not None else default_key_cache
+        self._salt = secrets.token_bytes(16)
+        self._new_key = None
+
+    def _get_key(self, password: str, salt: bytes, kdf) -> bytes:
+        return self.key_cache.get_or_derive(password, salt, kdf.params,
+                                            lambda password, salt: kdf.derive(password, salt))
+
+    def rekey_file(self, file_path: str) -> int:
+        """
+        Rewrite one file's header
+
+        Returns:
+            int: Index of the key slot that was written or cleared
+        """
+        with open(file_path, 'rb+') as file:
+            header = _read_wrapped_header(file, file_path)
+            data_key = header.unwrap(lambda slot: derive_file_key(
+                self._get_key(self.password, slot.salt, slot.kdf), header.salt))
+            _, mac_key = split_key(data_key)
+            header.verify(mac_key)
+
+            index = header.unlocked_slot
+            if self.action == REKEY_REMOVE:
+                if sum(slot is not None for slot in header.slots) == 1:
+                    raise Exception("Cannot remove the only password of a file")
+                header.slots[index] = None
+            else:
+                if self.action == REKEY_ADD:
+                    index = header.free_slot()
+                if self._new_key is None:
+                    self._new_key = self.kdf.derive(self.new_password, self._salt)
+                header.set_slot(index, data_key, derive_file_key(self._new_key, header.salt),
+                                self._salt, self.kdf)
+            header.seal(mac_key)
+
+            # Same size as before, so the body stays where it is; a header
+            # this small sits in one disk sector and is written in one go
+            data = header.pack()
+            file.seek(0)
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        return index
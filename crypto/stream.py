@@ -0,0 +1,236 @@
+from crypto.backends import BLOCK_SIZE, get_backend
+from crypto.progress import NULL_TRACKER
+
+SALT_SIZE = 16
+IV_SIZE = 16
+
+# Size of the read/write buffer used by the streaming engine
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024  # 4 MiB
+MIN_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+MAX_CHUNK_SIZE = 16 * 1024 * 1024  # 16 MiB
+
+
+def check_chunk_size(chunk_size: int) -> int:
+    """Validate a streaming buffer size"""
+    if chunk_size < MIN_CHUNK_SIZE or chunk_size > MAX_CHUNK_SIZE:
+        raise ValueError(
+            f"Chunk size must be between {MIN_CHUNK_SIZE} and {MAX_CHUNK_SIZE} bytes"
+        )
+    if chunk_size % BLOCK_SIZE:
+        raise ValueError(f"Chunk size must be a multiple of {BLOCK_SIZE} bytes")
+    return chunk_size
+
+
+def buffer_size(chunk_size: int, data_size: int) -> int:
+    """Shrink the streaming buffer for small inputs so they don't pay for a full chunk"""
+    rounded = max(BLOCK_SIZE, -(-data_size // BLOCK_SIZE) * BLOCK_SIZE)
+    return min(chunk_size, rounded)
+
+
+def pkcs7_pad(length: int) -> bytes:
+    """Return the padding block for data of the given length"""
+    padding_length = BLOCK_SIZE - (length % BLOCK_SIZE)
+    return bytes([padding_length]) * padding_length
+
+
+def padding_length(block) -> int:
+    """
+    Length of the PKCS7 padding at the end of the last decrypted block
+
+    A wrong key turns the padding into random bytes, so anything that is
+    not valid padding is rejected rather than written out as data.
+    """
+    length = block[-1]
+    if not 0 < length <= BLOCK_SIZE or bytes(block[-length:]) != bytes([length]) * length:
+        raise ValueError("Wrong password or corrupted file (invalid padding)")
+    return length
+
+
+def check_cbc_padding(file, key: bytes, iv: bytes, body_size: int, backend=None) -> int:
+    """
+    Decrypt only the last CBC block of a seekable legacy body and validate its padding
+
+    The file must be positioned at the start of the body and is left
+    there. This rejects most wrong passwords before anything is decrypted
+    or written.
+
+    Returns:
+        int: Padding length
+    """
+    if body_size < BLOCK_SIZE or body_size % BLOCK_SIZE:
+        raise ValueError("Encrypted data is not a multiple of the AES block size")
+    start = file.tell()
+    if body_size > BLOCK_SIZE:
+        file.seek(start + body_size - 2 * BLOCK_SIZE)
+        iv = file.read(BLOCK_SIZE)
+    else:
+        file.seek(start + body_size - BLOCK_SIZE)
+    last_block = get_backend(backend).cbc(key, iv, decrypt=True).update(file.read(BLOCK_SIZE))
+    file.seek(start)
+    return padding_length(last_block)
+
+
+def readinto_full(reader, view: memoryview) -> int:
+    """
+    Fill a buffer from a reader, retrying short reads (pipes, sockets)
+
+    Returns:
+        int: Number of bytes read, less than len(view) only at EOF
+    """
+    total = 0
+    size = len(view)
+    while total < size:
+        n = reader.readinto(view[total:])
+        if not n:
+            break
+        total += n
+    return total
+
+
+def read_exact(reader, size: int) -> bytes:
+    """Read exactly size bytes unless EOF comes first, retrying short reads"""
+    data = reader.read(size)
+    if len(data) == size or not data:
+        return data
+
+    parts = [data]
+    remaining = size - len(data)
+    while remaining:
+        part = reader.read(remaining)
+        if not part:
+            break
+        parts.append(part)
+        remaining -= len(part)
+    return b''.join(parts)
+
+
+class PrefixedReader:
+    """
+    Reader that replays bytes already taken from a non-seekable stream
+
+    Used after sniffing the first bytes of a pipe for format detection.
+    read() keeps reading until size bytes or EOF, like a buffered file.
+    """
+
+    def __init__(self, prefix: bytes, reader):
+        self._prefix = memoryview(bytes(prefix))
+        self._reader = reader
+
+    def readinto(self, buffer) -> int:
+        if self._prefix:
+            n = min(len(buffer), len(self._prefix))
+            buffer[:n] = self._prefix[:n]
+            self._prefix = self._prefix[n:]
+            return n
+        return self._reader.readinto(buffer) or 0
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            head, self._prefix = bytes(self._prefix), self._prefix[:0]
+            return head + self._reader.read()
+        if not self._prefix:
+            return read_exact(self._reader, size)
+
+        head = bytes(self._prefix[:size])
+        self._prefix = self._prefix[len(head):]
+        if len(head) == size:
+            return head
+        return head + read_exact(self._reader, size - len(head))
+
+
+def encrypt_cbc_stream(reader, writer, key: bytes, iv: bytes,
+                       chunk_size: int = DEFAULT_CHUNK_SIZE, backend=None, tracker=None) -> int:
+    """
+    Encrypt a reader into a writer with AES-CBC in fixed-size chunks
+
+    Only the last chunk is padded, so memory use stays at two buffers of
+    chunk_size no matter how large the input is.
+
+    Returns:
+        int: Number of plaintext bytes consumed
+    """
+    tracker = tracker or NULL_TRACKER
+    cipher = get_backend(backend).cbc(key, iv)
+    in_buf = bytearray(chunk_size)
+    out_buf = bytearray(chunk_size + BLOCK_SIZE)
+    in_view = memoryview(in_buf)
+    out_view = memoryview(out_buf)
+    total = 0
+
+    while True:
+        with tracker.phase('read'):
+            n = readinto_full(reader, in_view)
+        total += n
+
+        if n == chunk_size:
+            with tracker.phase('cipher'):
+                cipher.update_into(in_view, out_view)
+            with tracker.phase('write'):
+                writer.write(out_view[:n])
+            tracker.advance(n)
+            continue
+
+        # Final chunk: pad the tail in place and flush
+        padding = pkcs7_pad(n)
+        in_view[n:n + len(padding)] = padding
+        size = n + len(padding)
+        with tracker.phase('cipher'):
+            cipher.update_into(in_view[:size], out_view)
+        with tracker.phase('write'):
+            writer.write(out_view[:size])
+        tracker.advance(n)
+        return total
+
+
+def decrypt_cbc_stream(reader, writer, key: bytes, iv: bytes,
+                       chunk_size: int = DEFAULT_CHUNK_SIZE, backend=None, tracker=None) -> int:
+    """
+    Decrypt an AES-CBC reader into a writer in fixed-size chunks
+
+    The last plaintext block is held back until EOF so that padding is
+    only removed from the final chunk.
+
+    Returns:
+        int: Number of plaintext bytes written
+    """
+    tracker = tracker or NULL_TRACKER
+    cipher = get_backend(backend).cbc(key, iv, decrypt=True)
+    in_buf = bytearray(chunk_size)
+    out_buf = bytearray(chunk_size + BLOCK_SIZE)
+    pending = bytearray(BLOCK_SIZE)
+    in_view = memoryview(in_buf)
+    out_view = memoryview(out_buf)
+    has_pending = False
+    total = 0
+
+    while True:
+        with tracker.phase('read'):
+            n = readinto_full(reader, in_view)
+        if n % BLOCK_SIZE:
+            raise ValueError("Encrypted data is not a multiple of the AES block size")
+        if n == 0:
+            break
+
+        with tracker.phase('cipher'):
+            cipher.update_into(in_view[:n], out_view)
+        with tracker.phase('write'):
+            if has_pending:
+                writer.write(pending)
+                total += BLOCK_SIZE
+            writer.write(out_view[:n - BLOCK_SIZE])
+        total += n - BLOCK_SIZE
+        pending[:] = out_view[n - BLOCK_SIZE:n]
+        has_pending = True
+        tracker.advance(n)
+
+        if n < chunk_size:
+            break
+
+    # Remove padding from the final block
+    if has_pending:
+        del pending[-padding_length(pending):]
+        with tracker.phase('write'):
+            writer.write(pending)
+        total += len(pending)
+
+    return total
@@ -0,0 +1,610 @@
+import os
+import time
+import heapq
+import errno
+import select
+import struct
+import secrets
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from crypto.batch import QUEUE_DEPTH, BatchResult
+from crypto.chunked import default_workers
+from crypto.compression import COMPRESSION_NONE, check_compression
+from crypto.container import CONTAINER_CHUNKED, PREFIX_SIZE, detect_container, read_header
+from crypto.kdf import get_kdf
+from crypto.stream import DEFAULT_CHUNK_SIZE
+from utils.file_handler import ENCRYPTED_EXTENSIONS, STATE_SUFFIXES, FileHandler
+
+# Quiet time after the last write before a file is encrypted
+DEFAULT_DEBOUNCE = 2.0
+# Scan interval when inotify is not available (or not wanted)
+DEFAULT_POLL_INTERVAL = 5.0
+# Files waiting to be encrypted before the watcher stops taking new events
+DEFAULT_MAX_QUEUE = 1024
+# Latency samples kept for percentiles
+LATENCY_WINDOW = 1024
+
+# Names writers use while a file is incomplete (downloads, editors, rsync)
+TEMPORARY_PATTERNS = ['.*', '*~', '*.tmp', '*.part', '*.partial', '*.crdownload', '*.download', '*.swp']
+
+BACKEND_INOTIFY = 'inotify'
+BACKEND_POLL = 'poll'
+
+# inotify(7)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+
+# wd, mask, cookie, name length
+_EVENT = struct.Struct('iIII')
+_READ_SIZE = 64 * 1024
+
+
+class Inotify:
+    """
+    Minimal inotify binding through ctypes (Linux only)
+
+    The watcher blocks in select() on the descriptor, so an idle folder
+    costs no CPU at all; events for many files arrive in one read.
+    """
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self._libc = libc
+        self._get_errno = ctypes.get_errno
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error = self._get_errno()
+            raise OSError(error, os.strerror(error))
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = self._get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return wd
+
+    def read(self) -> list:
+        """
+        Pending events, without blocking
+
+        Returns:
+            list: (wd, mask, name) tuples; name is '' for events on the watched folder itself
+        """
+        try:
+            data = os.read(self.fd, _READ_SIZE)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class WatchStats:
+    """Counters and gauges of a running watcher"""
+
+    def __init__(self):
+        self.queued = 0
+        self.encrypted = 0
+        self.failed = 0
+        self.removed = 0
+        self.bytes = 0
+        # Gauges, refreshed by the watcher loop
+        self.pending = 0
+        self.queue_depth = 0
+        self.in_flight = 0
+        self.max_queue_depth = 0
+        # Times the queue was full and the watcher stopped taking events
+        self.backpressure = 0
+        self.started = time.time()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def add_latency(self, seconds: float):
+        self._latencies.append(seconds)
+        self._latency_total += seconds
+        self._latency_max = max(self._latency_max, seconds)
+
+    def latency(self) -> dict:
+        """Seconds from a file's arrival to its encrypted output (percentiles over recent files)"""
+        samples = sorted(self._latencies)
+        if not samples:
+            return {'mean': 0.0, 'p50': 0.0, 'p95': 0.0, 'max': 0.0}
+        done = self.encrypted + self.failed
+        return {
+            'mean': round(self._latency_total / max(done, 1), 3),
+            'p50': round(samples[len(samples) // 2], 3),
+            'p95': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+            'max': round(self._latency_max, 3),
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            'uptime': round(time.time() - self.started, 1),
+            'queued': self.queued,
+            'encrypted': self.encrypted,
+            'failed': self.failed,
+            'removed': self.removed,
+            'bytes': self.bytes,
+            'pending': self.pending,
+            'queue_depth': self.queue_depth,
+            'in_flight': self.in_flight,
+            'max_queue_depth': self.max_queue_depth,
+            'backpressure': self.backpressure,
+            'latency': self.latency(),
+        }
+
+
+class _Pending:
+    """A file seen changing, waiting for its writes to settle"""
+
+    __slots__ = ('arrived', 'due', 'closed', 'signature')
+
+    def __init__(self, arrived: float):
+        self.arrived = arrived
+        self.due = arrived
+        # The writer closed it (or it was moved in or found on a scan)
+        self.closed = False
+        # (size, mtime_ns) when last looked at, or None
+        self.signature = None
+
+
+def _signature(path: str) -> tuple:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _fsync_folder(path: str):
+    """Make a rename into path's folder durable"""
+    fd = os.open(os.path.dirname(path) or os.curdir, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _encrypt_watched(path: str, output: str, password: str, options: dict, session_key: tuple,
+                     remove_source: bool) -> BatchResult:
+    """Encrypt one settled file inside a worker, then securely remove the source if asked"""
+    from crypto.encryptor import FileEncryptor
+    from crypto.keycache import KeySession
+
+    from crypto.decryptor import _remove, _temp_path
+
+    start = time.perf_counter()
+    before = None
+    try:
+        before = os.stat(path)
+        # The source is only removed once its ciphertext is on disk
+        encryptor = FileEncryptor(options['chunk_size'], options['backend'], CONTAINER_CHUNKED, workers=1,
+                                  compression=options['compression'], fsync=remove_source, kdf=options['kdf'])
+        os.makedirs(os.path.dirname(output) or os.curdir, exist_ok=True)
+        # Written under a hidden name (which the watcher ignores) and renamed
+        # only when complete, so a crash or a changed source never leaves a
+        # truncated or stale output that looks finished
+        temp_path = _temp_path(output)
+        try:
+            with KeySession.from_key(*session_key) as session:
+                encryptor.encrypt_file(path, password, session=session, output_path=temp_path)
+            after = os.stat(path)
+            if (after.st_size, after.st_mtime_ns) != (before.st_size, before.st_mtime_ns):
+                raise Exception("Changed while being encrypted; it will be encrypted again once it settles")
+            os.replace(temp_path, output)
+        except BaseException:
+            _remove(temp_path)
+            raise
+        if remove_source:
+            _fsync_folder(output)
+            FileHandler().secure_delete(path)
+        return BatchResult(path, before.st_size, output, elapsed=time.perf_counter() - start,
+                           mtime_ns=before.st_mtime_ns)
+    except Exception as e:
+        # The state that failed, so the watcher retries once the file changes
+        size, mtime_ns = (before.st_size, before.st_mtime_ns) if before is not None else (0, None)
+        return BatchResult(path, size, error=str(e), elapsed=time.perf_counter() - start, mtime_ns=mtime_ns)
+
+
+class FolderWatcher:
+    """
+    Encrypt files as they are dropped into a folder
+
+    Changes are picked up with inotify where available and by scanning
+    every poll_interval otherwise. A file is encrypted once its writer
+    has closed it (or moved it in) and nothing has touched it for
+    debounce seconds; scans only take files whose size and mtime held
+    still for that long, so partially written files are never picked up.
+
+    The password KDF runs once when the watcher starts: settled files go
+    to a process pool with that master key, and each file gets its own
+    key from a cheap HKDF step, like a batch session. At most
+    workers * QUEUE_DEPTH files are in flight; when max_queue settled
+    files are waiting as well, the watcher stops reading events (the
+    kernel keeps them, and an overflow triggers a rescan) until workers
+    catch up. With nothing pending the loop sleeps in select() with no
+    timeout, so an idle watcher uses no CPU.
+
+    Encrypted files are written next to their source, or under
+    output_dir with the same relative path. With remove_source the
+    source is overwritten and deleted once its output has been fsynced.
+    """
+
+    def __init__(self, folder: str, password: str, output_dir: str = None, debounce: float = DEFAULT_DEBOUNCE,
+                 poll: bool = False, poll_interval: float = DEFAULT_POLL_INTERVAL, workers: int = None,
+                 max_queue: int = DEFAULT_MAX_QUEUE, remove_source: bool = False, include=None, exclude=None,
+                 recursive: bool = True, existing: bool = True, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 backend=None, compression: str = COMPRESSION_NONE, kdf=None, on_result=None,
+                 on_stats=None, stats_interval: float = None):
+        if not os.path.isdir(folder):
+            raise Exception(f"Folder not found: {folder}")
+        if debounce < 0 or poll_interval <= 0 or max_queue < 1:
+            raise ValueError("debounce, poll interval and queue size must be positive")
+        self.folder = os.path.abspath(folder)
+        self.password = password
+        self.output_dir = os.path.abspath(output_dir) if output_dir else None
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.workers = workers or default_workers()
+        self.max_queue = max_queue
+        self.remove_source = remove_source
+        self.include = include or []
+        self.exclude = TEMPORARY_PATTERNS if exclude is None else exclude
+        self.recursive = recursive
+        # Encrypt files already in the folder (unless they have a complete, newer output)
+        self.existing = existing
+        # Called with (BatchResult, latency seconds) for every finished file
+        self.on_result = on_result
+        # Called with WatchStats every stats_interval seconds
+        self.on_stats = on_stats
+        self.stats_interval = stats_interval
+        self.options = {
+            'chunk_size': chunk_size,
+            'backend': backend if backend is None or isinstance(backend, str) else backend.name,
+            'compression': check_compression(compression),
+            'kdf': str(get_kdf(kdf)),
+        }
+        self.backend = BACKEND_POLL if poll else BACKEND_INOTIFY
+        self.stats = WatchStats()
+        self._handler = FileHandler()
+        self._pending = {}
+        self._timers = []
+        self._ready = deque()
+        self._active = set()
+        self._futures = {}
+        # Last encrypted (size, mtime_ns) of sources that are kept
+        self._done = {}
+        self._watches = {}
+        self._inotify = None
+        self._stopping = False
+        self._wake_read, self._wake_write = os.pipe()
+        os.set_blocking(self._wake_read, False)
+        os.set_blocking(self._wake_write, False)
+
+    def stop(self):
+        """Ask the loop to finish in-flight files and return; safe from signal handlers"""
+        self._stopping = True
+        self._wake()
+
+    def _wake(self, *_):
+        try:
+            os.write(self._wake_write, b'\0')
+        except (BlockingIOError, OSError):
+            pass
+
+    def run(self):
+        """Watch until stop() is called"""
+        from crypto.encryptor import FileEncryptor
+
+        salt = secrets.token_bytes(16)
+        master_key = FileEncryptor(self.options['chunk_size'], kdf=self.options['kdf'])._derive_key(
+            self.password, salt)
+        self._session_key = (master_key, salt)
+
+        if self.backend == BACKEND_INOTIFY:
+            try:
+                self._inotify = Inotify()
+                self._watch_tree(self.folder)
+            except OSError:
+                # No inotify here, or out of watches: fall back to scanning
+                if self._inotify is not None:
+                    self._inotify.close()
+                    self._inotify = None
+                self._watches.clear()
+                self.backend = BACKEND_POLL
+
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            self._scan(initial=True)
+            next_scan = time.monotonic() + self.poll_interval
+            next_stats = time.monotonic() + self.stats_interval if self.stats_interval else None
+            was_full = False
+            while not self._stopping:
+                now = time.monotonic()
+                self._promote(now)
+                self._submit()
+                self._refresh_gauges()
+
+                if next_stats is not None and now >= next_stats:
+                    self.on_stats(self.stats)
+                    next_stats = now + self.stats_interval
+                full = len(self._ready) >= self.max_queue
+                if self.backend == BACKEND_POLL and not full and now >= next_scan:
+                    self._scan()
+                    next_scan = now + self.poll_interval
+                    continue
+
+                if full:
+                    # Only completions make room: leave events queued in the kernel
+                    # and scans and debounce timers waiting until then
+                    if not was_full:
+                        self.stats.backpressure += 1
+                    deadlines = [next_stats]
+                else:
+                    deadlines = [self._timers[0][0] if self._timers else None,
+                                 next_scan if self.backend == BACKEND_POLL else None, next_stats]
+                was_full = full
+                deadlines = [due for due in deadlines if due is not None]
+                self._wait(max(0.0, min(deadlines) - now) if deadlines else None, full)
+        finally:
+            self._shutdown()
+
+    def _wait(self, timeout: float, full: bool):
+        fds = [self._wake_read]
+        if self._inotify is not None and not full:
+            fds.append(self._inotify.fd)
+        try:
+            readable, _, _ = select.select(fds, [], [], timeout)
+        except InterruptedError:
+            return
+        if self._wake_read in readable:
+            try:
+                while os.read(self._wake_read, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+            self._collect()
+        if self._inotify is not None and self._inotify.fd in readable:
+            self._handle_events(self._inotify.read())
+
+    def _shutdown(self):
+        self._collect()
+        for future in list(self._futures):
+            future.result()
+        self._collect()
+        self._pool.shutdown()
+        if self._inotify is not None:
+            self._inotify.close()
+        os.close(self._wake_read)
+        os.close(self._wake_write)
+
+    def _ignored(self, path: str, is_dir: bool = False) -> bool:
+        name = os.path.basename(path)
+        relative = os.path.relpath(path, self.folder)
+        if self._handler._matches(name, relative, self.exclude):
+            return True
+        if is_dir:
+            return False
+        if name.endswith(ENCRYPTED_EXTENSIONS + STATE_SUFFIXES):
+            return True
+        return bool(self.include) and not self._handler._matches(name, relative, self.include)
+
+    def _watch_tree(self, root: str):
+        """Watch a folder and, when recursive, every folder under it"""
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            try:
+                self._watches[self._inotify.add_watch(directory)] = directory
+            except OSError as e:
+                if directory == self.folder or e.errno == errno.ENOSPC:
+                    raise
+                continue
+            if not self.recursive:
+                continue
+            try:
+                with os.scandir(directory) as entries:
+                    stack.extend(entry.path for entry in entries
+                                 if entry.is_dir(follow_symlinks=False) and not self._ignored(entry.path, True))
+            except OSError:
+                pass
+
+    def _handle_events(self, events: list):
+        now = time.monotonic()
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost while the queue was full: look at everything again
+                self._scan()
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            directory = self._watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if self.recursive and mask & (IN_CREATE | IN_MOVED_TO) and not self._ignored(path, True):
+                    try:
+                        self._watch_tree(path)
+                    except OSError:
+                        pass
+                    # Files may have landed before the watch was in place
+                    self._scan(path)
+                continue
+            if self._ignored(path):
+                continue
+            if mask & (IN_DELETE | IN_MOVED_FROM):
+                self._pending.pop(path, None)
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                self._touch(path, now, closed=True)
+            else:
+                self._touch(path, now, closed=False)
+
+    def _touch(self, path: str, now: float, closed: bool, signature: tuple = None):
+        """Note a change to a file and push back when it may be encrypted"""
+        entry = self._pending.get(path)
+        if entry is None:
+            entry = self._pending[path] = _Pending(now)
+        entry.closed = closed
+        entry.signature = signature
+        entry.due = now + self.debounce
+        heapq.heappush(self._timers, (entry.due, path))
+
+    def _scan(self, folder: str = None, initial: bool = False):
+        """
+        Look for new or changed files by walking the folder
+
+        In polling mode this is how files are found; with inotify it only
+        runs at startup, for new subfolders and after an event overflow.
+        """
+        now = time.monotonic()
+        seen = set()
+        files = self._handler.walk_files(folder or self.folder, include=self.include, exclude=self.exclude,
+                                         recursive=self.recursive, largest_first=False)
+        for path, _ in files:
+            seen.add(path)
+            signature = _signature(path)
+            if signature is None or path in self._active:
+                continue
+            if initial and (not self.existing or self._output_is_current(path, signature)):
+                self._done[path] = signature
+                continue
+            if self._done.get(path) == signature:
+                continue
+            entry = self._pending.get(path)
+            if entry is None or entry.signature != signature:
+                self._touch(path, now, closed=True, signature=signature)
+        if folder is None and self.backend == BACKEND_POLL:
+            # Forget sources that are gone so the record does not grow forever
+            for path in [path for path in self._done if path not in seen]:
+                del self._done[path]
+
+    def _output_path(self, path: str) -> str:
+        if self.output_dir is None:
+            return path + '.Wh04ami'
+        return os.path.join(self.output_dir, os.path.relpath(path, self.folder)) + '.Wh04ami'
+
+    def _output_is_current(self, path: str, signature: tuple) -> bool:
+        """
+        Whether a source already has a complete output from its current version
+
+        The output must be newer than the source, have a chunked header
+        that parses and a size that fits it; without compression the
+        plaintext size it implies must be the source's size. Anything
+        else (including output left by an older, interrupted run) is
+        encrypted again.
+        """
+        output = self._output_path(path)
+        try:
+            with open(output, 'rb') as file:
+                stat = os.fstat(file.fileno())
+                if stat.st_mtime_ns < signature[1]:
+                    return False
+                if detect_container(file.read(PREFIX_SIZE)) != CONTAINER_CHUNKED:
+                    return False
+                file.seek(0)
+                header = read_header(file)
+            size = header.plaintext_size(stat.st_size)
+        except Exception:
+            return False
+        return header.compressed or size == signature[0]
+
+    def _promote(self, now: float):
+        """Move files that have been quiet for the debounce time to the queue"""
+        while self._timers and self._timers[0][0] <= now and len(self._ready) < self.max_queue:
+            due, path = heapq.heappop(self._timers)
+            entry = self._pending.get(path)
+            if entry is None or entry.due != due:
+                continue  # superseded by a later change
+            if not entry.closed or path in self._active:
+                # Still open for writing, or its previous version is being encrypted
+                entry.due = now + self.debounce
+                heapq.heappush(self._timers, (entry.due, path))
+                continue
+            signature = _signature(path)
+            if signature is None:
+                del self._pending[path]
+                continue
+            if entry.signature is not None and signature != entry.signature:
+                self._touch(path, now, closed=True, signature=signature)
+                continue
+            del self._pending[path]
+            if self._done.get(path) == signature:
+                continue  # closed without being changed
+            self._ready.append((path, entry.arrived))
+            self._active.add(path)
+            self.stats.queued += 1
+
+    def _submit(self):
+        while self._ready and len(self._futures) < self.workers * QUEUE_DEPTH:
+            path, arrived = self._ready.popleft()
+            future = self._pool.submit(_encrypt_watched, path, self._output_path(path), self.password,
+                                       self.options, self._session_key, self.remove_source)
+            self._futures[future] = arrived
+            future.add_done_callback(self._wake)
+
+    def _collect(self):
+        for future in [future for future in self._futures if future.done()]:
+            arrived = self._futures.pop(future)
+            result = future.result()
+            latency = time.monotonic() - arrived
+            self._active.discard(result.path)
+            self.stats.add_latency(latency)
+            if result.ok:
+                self.stats.encrypted += 1
+                self.stats.bytes += result.size
+                if self.remove_source:
+                    self.stats.removed += 1
+                else:
+                    self._done[result.path] = (result.size, result.mtime_ns)
+            else:
+                self.stats.failed += 1
+                # Not retried until the file changes again
+                if result.mtime_ns is not None:
+                    self._done[result.path] = (result.size, result.mtime_ns)
+            if self.on_result:
+                self.on_result(result, latency)
+
+    def _refresh_gauges(self):
+        stats = self.stats
+        stats.pending = len(self._pending)
+        stats.queue_depth = len(self._ready)
+        stats.in_flight = len(self._futures)
+        stats.max_queue_depth = max(stats.max_queue_depth, stats.queue_depth + stats.in_flight)
+
+
+def watch_folder(folder: str, password: str, **options):
+    """Encrypt files dropped into a folder until interrupted, see FolderWatcher"""
+    watcher = FolderWatcher(folder, password, **options)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    return watcher.stats
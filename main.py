@@ -1,16 +1,27 @@
 #!/usr/bin/env python3
 import os
 import sys
+
+if __name__ == "__main__" and len(sys.argv) > 1:
+    # Scripted use: argparse subcommands without loading rich or pyfiglet
+    from cli import main as cli_main
+    sys.exit(cli_main(sys.argv[1:]))
+
 from rich.console import Console
 from rich.panel import Panel
 from rich.table import Table
-from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn
+from rich.progress import (
+    Progress, SpinnerColumn, TextColumn, BarColumn, DownloadColumn, TransferSpeedColumn, TimeRemainingColumn
+)
 from rich.prompt import Prompt, Confirm
 from rich import box
 import pyfiglet
 
+from crypto.backends import get_backend, measure_throughput
+from crypto.batch import BatchProcessor
 from crypto.encryptor import FileEncryptor
 from crypto.decryptor import FileDecryptor
+from crypto.manifest import MANIFEST_NAME
 from utils.file_handler import FileHandler
 from utils.validator import Validator
 
@@ -29,6 +40,11 @@ def banner():
         border_style="cyan",
         padding=(1, 2)
     ))
+    
+    # Show which AES provider is active and how fast it runs here
+    backend = get_backend()
+    speed = measure_throughput(backend)
+    console.print(f"[bold cyan]⚙️  Cipher backend: {backend.description} - {speed:.1f} MB/s[/bold cyan]")
 
 def warning():
     """Security warning"""
@@ -56,6 +72,7 @@ def main_menu():
     table.add_row("3", "📁 Batch Encrypt", "Encrypt multiple files")
     table.add_row("4", "🛡️ Password Tools", "Password utilities")
     table.add_row("5", "ℹ️ File Info", "Get file information")
+    table.add_row("6", "📂 Batch Decrypt", "Decrypt multiple files")
     table.add_row("0", "🚪 Exit", "Exit application")
     
     console.print(table)
@@ -93,22 +110,15 @@ def encrypt_file_menu():
             return
     
     # Encrypt file
-    encryptor = FileEncryptor()
-    
-    with Progress(
-        SpinnerColumn(),
-        TextColumn("[progress.description]{task.description}"),
-        BarColumn(),
-        TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
-    ) as progress:
-        task = progress.add_task("[cyan]Encrypting file...", total=100)
+    with transfer_progress() as progress:
+        task = progress.add_task("[cyan]Encrypting file...", total=None)
+        encryptor = FileEncryptor(progress_callback=lambda done, total, elapsed: progress.update(
+            task, completed=done, total=total
+        ))
         
         try:
             output_path = encryptor.encrypt_file(file_path, password)
             
-            for i in range(10):
-                progress.update(task, advance=10)
-            
             console.print(f"[green]✅ File encrypted successfully![/green]")
             console.print(f"[blue]📁 Output: {output_path}[/blue]")
             
@@ -119,6 +129,18 @@ def encrypt_file_menu():
         except Exception as e:
             console.print(f"[red]❌ Encryption failed: {str(e)}[/red]")
 
+def transfer_progress():
+    """Progress bar with bytes done, speed and time left"""
+    return Progress(
+        SpinnerColumn(),
+        TextColumn("[progress.description]{task.description}"),
+        BarColumn(),
+        TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
+        DownloadColumn(),
+        TransferSpeedColumn(),
+        TimeRemainingColumn(),
+    )
+
 def decrypt_file_menu():
     """Decrypt single file"""
     console.print("\n[bold cyan]🔓 DECRYPT FILE[/bold cyan]")
@@ -137,22 +159,15 @@ def decrypt_file_menu():
     password = Prompt.ask("[+] Enter decryption password", password=True)
     
     # Decrypt file
-    decryptor = FileDecryptor()
-    
-    with Progress(
-        SpinnerColumn(),
-        TextColumn("[progress.description]{task.description}"),
-        BarColumn(),
-        TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
-    ) as progress:
-        task = progress.add_task("[cyan]Decrypting file...", total=100)
+    with transfer_progress() as progress:
+        task = progress.add_task("[cyan]Decrypting file...", total=None)
+        decryptor = FileDecryptor(progress_callback=lambda done, total, elapsed: progress.update(
+            task, completed=done, total=total
+        ))
         
         try:
             output_path = decryptor.decrypt_file(file_path, password)
             
-            for i in range(10):
-                progress.update(task, advance=10)
-            
             console.print(f"[green]✅ File decrypted successfully![/green]")
             console.print(f"[blue]📁 Output: {output_path}[/blue]")
             
@@ -170,8 +185,10 @@ def batch_encrypt_menu():
         console.print("[red]❌ Folder not found![/red]")
         return
     
-    # Get files in folder
-    files = file_handler.get_files_in_folder(folder_path)
+    recursive = Confirm.ask("[+] Include subfolders?", default=False)
+    
+    # Get files in folder, largest first, skipping already encrypted ones
+    files = list(file_handler.walk_files(folder_path, recursive=recursive))
     if not files:
         console.print("[red]❌ No files found in folder![/red]")
         return
@@ -184,9 +201,8 @@ def batch_encrypt_menu():
     file_table.add_column("File", style="white")
     file_table.add_column("Size", style="yellow")
     
-    for i, file_path in enumerate(files[:10], 1):  # Show first 10 files
-        info = file_handler.get_file_info(file_path)
-        file_table.add_row(str(i), info['name'], f"{info['size']} MB")
+    for i, (file_path, size) in enumerate(files[:10], 1):  # Show first 10 files
+        file_table.add_row(str(i), os.path.relpath(file_path, folder_path), f"{round(size / (1024 * 1024), 2)} MB")
     
     if len(files) > 10:
         file_table.add_row("...", f"... and {len(files) - 10} more", "...")
@@ -195,11 +211,48 @@ def batch_encrypt_menu():
     
     password = Prompt.ask("[+] Enter encryption password", password=True)
     
+    # The manifest in the folder remembers what earlier runs encrypted
+    manifest = None
+    if Confirm.ask("[+] Skip files unchanged since the last run?", default=True):
+        manifest = os.path.join(folder_path, MANIFEST_NAME)
+    
     if not Confirm.ask(f"[yellow]Encrypt {len(files)} files?[/yellow]"):
         return
     
-    encryptor = FileEncryptor()
-    success_count = 0
+    run_batch(files, password, decrypt=False, manifest=manifest)
+
+def batch_decrypt_menu():
+    """Decrypt multiple files"""
+    console.print("\n[bold cyan]📂 BATCH DECRYPTION[/bold cyan]")
+    
+    folder_path = Prompt.ask("[+] Enter folder path")
+    
+    if not validator.folder_exists(folder_path):
+        console.print("[red]❌ Folder not found![/red]")
+        return
+    
+    recursive = Confirm.ask("[+] Include subfolders?", default=False)
+    
+    files = list(file_handler.walk_files(
+        folder_path, include=['*.Wh04ami'], recursive=recursive, skip_encrypted=False
+    ))
+    if not files:
+        console.print("[red]❌ No .Wh04ami files found in folder![/red]")
+        return
+    
+    console.print(f"[green]📂 Found {len(files)} encrypted files[/green]")
+    
+    password = Prompt.ask("[+] Enter decryption password", password=True)
+    
+    if not Confirm.ask(f"[yellow]Decrypt {len(files)} files?[/yellow]"):
+        return
+    
+    run_batch(files, password, decrypt=True)
+
+def run_batch(files, password, decrypt=False, manifest=None):
+    """Run a batch on the worker pool and show the summary"""
+    processor = BatchProcessor(manifest=manifest)
+    label = "Decrypting" if decrypt else "Encrypting"
     
     with Progress(
         SpinnerColumn(),
@@ -207,18 +260,41 @@ def batch_encrypt_menu():
         BarColumn(),
         TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
     ) as progress:
-        task = progress.add_task("[cyan]Encrypting files...", total=len(files))
+        task = progress.add_task(f"[cyan]{label} files on {processor.workers} workers...", total=len(files))
         
-        for file_path in files:
-            try:
-                encryptor.encrypt_file(file_path, password)
-                success_count += 1
-            except Exception as e:
-                console.print(f"[red]❌ Failed to encrypt {os.path.basename(file_path)}: {str(e)}[/red]")
-            
+        def on_result(result):
+            if not result.ok:
+                progress.console.print(f"[red]❌ Failed: {os.path.basename(result.path)}: {result.error}[/red]")
             progress.update(task, advance=1)
+        
+        if decrypt:
+            summary = processor.decrypt_files(files, password, on_result)
+        else:
+            summary = processor.encrypt_files(files, password, on_result)
     
-    console.print(f"[green]✅ Successfully encrypted {success_count}/{len(files)} files[/green]")
+    show_batch_summary(summary)
+
+def show_batch_summary(summary):
+    """Display results and timings of a batch run"""
+    summary_table = Table(title="Batch Summary", show_header=True)
+    summary_table.add_column("Metric", style="cyan")
+    summary_table.add_column("Value", style="white")
+    
+    summary_table.add_row("Succeeded", f"{len(summary.succeeded)}/{len(summary.results)}")
+    summary_table.add_row("Failed", str(len(summary.failed)))
+    if summary.skipped:
+        summary_table.add_row("Unchanged", str(len(summary.skipped)))
+    summary_table.add_row("Data", f"{summary.total_bytes / (1024 * 1024):.2f} MB")
+    summary_table.add_row("Time", f"{summary.elapsed:.2f} s")
+    summary_table.add_row("Throughput", f"{summary.throughput:.2f} MB/s")
+    
+    for result in summary.slowest(3):
+        summary_table.add_row("Slowest", f"{os.path.basename(result.path)} ({result.elapsed:.2f} s)")
+    
+    console.print(summary_table)
+    
+    verb = "decrypted" if summary.mode == 'decrypt' else "encrypted"
+    console.print(f"[green]✅ Successfully {verb} {len(summary.succeeded)}/{len(summary.results)} files[/green]")
 
 def password_tools_menu():
     """Password utilities"""
@@ -296,7 +372,7 @@ def main():
         
         while True:
             main_menu()
-            choice = Prompt.ask("\n[bold green]Select menu[/bold green]", choices=["1", "2", "3", "4", "5", "0"])
+            choice = Prompt.ask("\n[bold green]Select menu[/bold green]", choices=["1", "2", "3", "4", "5", "6", "0"])
             
             if choice == "1":
                 encrypt_file_menu()
@@ -308,6 +384,8 @@ def main():
                 password_tools_menu()
             elif choice == "5":
                 file_info_menu()
+            elif choice == "6":
+                batch_decrypt_menu()
             elif choice == "0":
                 console.print("[bold red]👋 Goodbye![/bold red]")
                 break
@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+# Tests import the crypto, utils and cli modules from the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+PASSWORD = 'correct horse battery staple'
+
+
+@pytest.fixture
+def password() -> str:
+    return PASSWORD
+
+
+@pytest.fixture
+def make_file(tmp_path):
+    """Write a file of random (or given) bytes under tmp_path and return its path"""
+    def make(name: str = 'plain.bin', size: int = 0, data: bytes = None) -> str:
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(os.urandom(size) if data is None else data)
+        return str(path)
+    return make
+
+
+def read(path: str) -> bytes:
+    with open(path, 'rb') as file:
+        return file.read()
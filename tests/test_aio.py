@@ -0,0 +1,70 @@
+import os
+import asyncio
+
+import pytest
+
+from conftest import PASSWORD, read
+from crypto.aio import AsyncProcessor
+from crypto.container import CONTAINER_CHUNKED, CONTAINER_LEGACY
+from crypto.stream import MIN_CHUNK_SIZE
+
+CHUNK = MIN_CHUNK_SIZE
+
+
+@pytest.mark.parametrize('container', [CONTAINER_LEGACY, CONTAINER_CHUNKED])
+def test_concurrent_files(make_file, container):
+    paths = [make_file(f'file{i}.bin', size=1000 * i + 1) for i in range(6)]
+
+    async def run():
+        async with AsyncProcessor(CHUNK, container=container, max_concurrent=3) as processor:
+            encrypted = await asyncio.gather(*(processor.encrypt_file(path, PASSWORD) for path in paths))
+            return await asyncio.gather(*(processor.decrypt_file(path, PASSWORD, path + '.out')
+                                          for path in encrypted))
+
+    outputs = asyncio.run(run())
+    for path, output in zip(paths, outputs):
+        assert read(output) == read(path)
+
+
+def test_iter_round_trip():
+    data = os.urandom(CHUNK + 12345)
+
+    async def pieces(blob: bytes, size: int):
+        for start in range(0, len(blob), size):
+            yield blob[start:start + size]
+
+    async def run():
+        async with AsyncProcessor(CHUNK, container=CONTAINER_CHUNKED) as processor:
+            encrypted = b''.join([piece async for piece in processor.encrypt_iter(pieces(data, 5000), PASSWORD)])
+            return b''.join([piece async for piece in processor.decrypt_iter(pieces(encrypted, 7777), PASSWORD)])
+
+    assert asyncio.run(run()) == data
+
+
+def test_cancel_removes_partial_output(make_file):
+    # The pure Python backend is slow enough to cancel mid-file
+    path = make_file(size=3 * CHUNK)
+
+    async def run():
+        async with AsyncProcessor(CHUNK, backend='pyaes', container=CONTAINER_CHUNKED, workers=1) as processor:
+            task = asyncio.ensure_future(processor.encrypt_file(path, PASSWORD))
+            await asyncio.sleep(0.3)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+    asyncio.run(run())
+    assert not os.path.exists(path + '.Wh04ami')
+
+
+def test_wrong_password_raises(make_file):
+    path = make_file(size=100)
+
+    async def run():
+        async with AsyncProcessor(container=CONTAINER_CHUNKED) as processor:
+            encrypted = await processor.encrypt_file(path, PASSWORD)
+            await processor.decrypt_file(encrypted, 'wrong password', path + '.out')
+
+    with pytest.raises(Exception):
+        asyncio.run(run())
+    assert not os.path.exists(path + '.out')
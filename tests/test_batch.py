@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from conftest import PASSWORD, read
+from crypto.batch import SMALL_FILE_SIZE, BatchProcessor
+from crypto.container import CONTAINER_CHUNKED, CONTAINER_LEGACY, PREFIX_SIZE, detect_container
+
+# Small files are packed into shared jobs, large ones get their own
+SIZES = [0, 10, 5000, SMALL_FILE_SIZE - 1, SMALL_FILE_SIZE + 1, 3 * SMALL_FILE_SIZE]
+
+
+@pytest.fixture
+def folder(tmp_path):
+    """A folder of files by name, with their contents"""
+    contents = {}
+    for index, size in enumerate(SIZES):
+        path = tmp_path / 'in' / f'sub{index % 2}' / f'file{index}.bin'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        contents[str(path)] = os.urandom(size)
+        path.write_bytes(contents[str(path)])
+    return contents
+
+
+@pytest.mark.parametrize('container, use_session', [(CONTAINER_LEGACY, False), (CONTAINER_CHUNKED, True)])
+@pytest.mark.parametrize('workers', [1, 2])
+def test_round_trip(folder, container, use_session, workers):
+    processor = BatchProcessor(workers=workers, container=container, use_session=use_session)
+    summary = processor.encrypt_files(list(folder), PASSWORD)
+    assert len(summary.succeeded) == len(folder) and not summary.failed
+    assert summary.total_bytes == sum(SIZES)
+
+    encrypted = [result.output for result in summary.results]
+    assert all(detect_container(read(path)[:PREFIX_SIZE]) == container for path in encrypted)
+    for path in folder:
+        os.remove(path)
+    summary = processor.decrypt_files(encrypted, PASSWORD)
+    assert not summary.failed
+    for path, data in folder.items():
+        assert read(path) == data
+
+
+def test_failures_are_reported_per_file(folder, tmp_path):
+    missing = str(tmp_path / 'missing.bin')
+    summary = BatchProcessor(workers=2).encrypt_files(list(folder) + [missing], PASSWORD)
+    assert [result.path for result in summary.failed] == [missing]
+    assert len(summary.succeeded) == len(folder)
+    assert summary.to_dict()['failed'] == 1
+
+
+def test_wrong_password_fails_every_file(folder):
+    processor = BatchProcessor(workers=2, container=CONTAINER_CHUNKED)
+    encrypted = [result.output for result in processor.encrypt_files(list(folder), PASSWORD).results]
+    summary = processor.decrypt_files(encrypted, 'wrong password')
+    assert len(summary.failed) == len(folder)
+
+
+def test_chunked_is_the_default():
+    assert BatchProcessor().options['container'] == CONTAINER_CHUNKED
+    assert BatchProcessor(use_session=False).options['container'] == CONTAINER_CHUNKED
+    with pytest.raises(ValueError):
+        BatchProcessor(container=CONTAINER_LEGACY)
@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from benchmarks.__main__ import main
+from benchmarks.harness import compare, format_size, parse_size, percentile
+
+
+@pytest.mark.parametrize('text, size', [('1K', 1024), ('64M', 64 << 20), ('2G', 2 << 30), ('1MiB', 1 << 20),
+                                        ('512', 512), ('1.5K', 1536)])
+def test_sizes(text, size):
+    assert parse_size(text) == size
+
+
+def test_format_size():
+    assert [format_size(size) for size in (1024, 64 << 20, 1000)] == ['1K', '64M', '1000']
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 50) == 0.0
+
+
+def test_compare_flags_slower_cases():
+    baseline = [{'id': 'a', 'p50_ms': 10.0}, {'id': 'b', 'p50_ms': 10.0}, {'id': 'gone', 'p50_ms': 1.0}]
+    results = [{'id': 'a', 'p50_ms': 10.5}, {'id': 'b', 'p50_ms': 12.0}, {'id': 'new', 'p50_ms': 99.0}]
+    assert [case for case, *_ in compare(results, baseline, 0.10)] == ['b']
+
+
+def test_suite_runs_and_compares(tmp_path, capsys):
+    output = str(tmp_path / 'results.json')
+    argv = ['--ops', 'encrypt_file,decrypt_file', '--sizes', '1K', '--backends', 'cryptography',
+            '--containers', 'legacy,chunked', '--repeat', '1', '--workdir', str(tmp_path), '--output', output]
+    assert main(argv) == 0
+    with open(output) as file:
+        results = json.load(file)['results']
+    assert len(results) == 4
+    assert all('error' not in result and result['p50_ms'] > 0 for result in results)
+
+    # Against a much faster baseline every case is a regression
+    for result in results:
+        result['p50_ms'] /= 100
+    baseline = str(tmp_path / 'baseline.json')
+    with open(baseline, 'w') as file:
+        json.dump({'results': results}, file)
+    assert main(argv + ['--compare', baseline]) == 1
+    assert 'REGRESSION' in capsys.readouterr().out
@@ -0,0 +1,116 @@
+import os
+
+import pytest
+
+from conftest import PASSWORD, read
+from crypto.bundle import MODE_APPEND, MODE_WRITE, Bundle, create_bundle, list_bundle, member_path
+from crypto.decryptor import FileDecryptor
+from crypto.stream import MIN_CHUNK_SIZE
+
+
+@pytest.fixture
+def folder(make_file, tmp_path):
+    make_file('src/a.txt', data=b'alpha')
+    make_file('src/empty.bin')
+    make_file('src/sub/big.bin', size=2 * MIN_CHUNK_SIZE + 5)
+    return str(tmp_path / 'src')
+
+
+def test_create_list_extract(folder, tmp_path):
+    path = str(tmp_path / 'files.Wh04ami')
+    create_bundle(path, folder, PASSWORD, chunk_size=MIN_CHUNK_SIZE)
+
+    entries = {entry.name: entry for entry in list_bundle(path, PASSWORD)}
+    assert sorted(entries) == ['a.txt', 'empty.bin', 'sub/big.bin']
+    assert entries['sub/big.bin'].size == 2 * MIN_CHUNK_SIZE + 5
+
+    with Bundle(path, PASSWORD) as bundle:
+        assert bundle.read('a.txt') == b'alpha'
+        outputs = bundle.extract_all(str(tmp_path / 'out'))
+        assert bundle.verify() == 2 * MIN_CHUNK_SIZE + 10
+    for output in outputs:
+        source = os.path.join(folder, os.path.relpath(output, str(tmp_path / 'out')))
+        assert read(output) == read(source)
+        assert os.path.getmtime(output) == os.path.getmtime(source)
+
+
+def test_append_and_replace(make_file, tmp_path):
+    path = str(tmp_path / 'files.Wh04ami')
+    with Bundle(path, PASSWORD, MODE_WRITE) as bundle:
+        bundle.add(make_file('a.txt', data=b'old'))
+    with Bundle(path, PASSWORD, MODE_APPEND) as bundle:
+        bundle.add(make_file('b.txt', data=b'new'))
+        bundle.add(make_file('a.txt', data=b'replaced'))
+
+    with Bundle(path, PASSWORD) as bundle:
+        assert bundle.names() == ['a.txt', 'b.txt']
+        assert bundle.read('a.txt') == b'replaced'
+
+
+def test_interrupted_append_keeps_previous_members(make_file, tmp_path):
+    path = str(tmp_path / 'files.Wh04ami')
+    with Bundle(path, PASSWORD, MODE_WRITE) as bundle:
+        bundle.add(make_file('a.txt', data=b'alpha'))
+    size = os.path.getsize(path)
+
+    # Members are written but the process dies before the new index
+    bundle = Bundle(path, PASSWORD, MODE_APPEND)
+    bundle.add(make_file('big.bin', size=2 * MIN_CHUNK_SIZE))
+    bundle._file.close()
+    assert os.path.getsize(path) > size
+
+    with Bundle(path, PASSWORD) as bundle:
+        assert bundle.names() == ['a.txt']
+        assert bundle.read('a.txt') == b'alpha'
+    with pytest.raises(Exception):
+        FileDecryptor().verify_file(path, PASSWORD)
+
+    # The next append writes over the incomplete tail
+    with Bundle(path, PASSWORD, MODE_APPEND) as bundle:
+        bundle.add(make_file('b.txt', data=b'beta'))
+    assert os.path.getsize(path) < size + 1024
+    with Bundle(path, PASSWORD) as bundle:
+        assert bundle.read('b.txt') == b'beta'
+    FileDecryptor().verify_file(path, PASSWORD)
+
+
+def test_tampered_member_fails(make_file, tmp_path):
+    path = str(tmp_path / 'files.Wh04ami')
+    with Bundle(path, PASSWORD, MODE_WRITE) as bundle:
+        entry = bundle.add(make_file('a.txt', data=b'alpha' * 100))
+    with open(path, 'r+b') as file:
+        file.seek(entry.offset + 10)
+        byte = file.read(1)
+        file.seek(-1, os.SEEK_CUR)
+        file.write(bytes([byte[0] ^ 1]))
+
+    output = str(tmp_path / 'out.txt')
+    with Bundle(path, PASSWORD) as bundle:
+        with pytest.raises(Exception):
+            bundle.extract('a.txt', output)
+        with pytest.raises(Exception):
+            bundle.verify()
+    assert sorted(os.listdir(tmp_path)) == ['a.txt', 'files.Wh04ami']
+
+    # A file already at the output path is left as it was
+    make_file('out.txt', data=b'keep me')
+    with Bundle(path, PASSWORD) as bundle:
+        with pytest.raises(Exception):
+            bundle.extract('a.txt', output)
+    assert read(output) == b'keep me'
+
+
+def test_wrong_password(folder, tmp_path):
+    path = str(tmp_path / 'files.Wh04ami')
+    create_bundle(path, folder, PASSWORD)
+    with pytest.raises(Exception):
+        list_bundle(path, 'wrong password')
+
+
+@pytest.mark.parametrize('name', ['../escape', '/etc/passwd', 'a//b', 'a/./b', 'C:evil'])
+def test_unsafe_member_names(make_file, tmp_path, name):
+    with pytest.raises(Exception, match='Unsafe'):
+        member_path(str(tmp_path), name)
+    with Bundle(str(tmp_path / 'files.Wh04ami'), PASSWORD, MODE_WRITE) as bundle:
+        with pytest.raises(Exception, match='Unsafe'):
+            bundle.add(make_file(), name)
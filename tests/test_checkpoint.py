@@ -0,0 +1,117 @@
+import os
+
+import pytest
+
+import crypto.encryptor
+from conftest import PASSWORD, read
+from crypto.batch import BatchProcessor
+from crypto.checkpoint import Checkpoint
+from crypto.container import CONTAINER_CHUNKED
+from crypto.decryptor import FileDecryptor
+from crypto.encryptor import FileEncryptor
+from crypto.stream import MIN_CHUNK_SIZE
+
+CHUNK = MIN_CHUNK_SIZE
+SIZE = 6 * CHUNK + 100
+
+_encrypt = crypto.encryptor.encrypt_chunked_stream
+
+
+class Interrupted(Exception):
+    pass
+
+
+def _encrypt_chunked_stream(stop_after: int, starts: list):
+    """encrypt_chunked_stream that dies once stop_after chunks are checkpointed"""
+    def encrypt(*args, start_index=0, on_chunk=None, **kwargs):
+        starts.append(start_index)
+
+        def checkpointed(chunks: int):
+            on_chunk(chunks)
+            if stop_after is not None and chunks == stop_after:
+                raise Interrupted()
+        return _encrypt(*args, start_index=start_index, on_chunk=checkpointed, **kwargs)
+    return encrypt
+
+
+@pytest.fixture
+def encryptor():
+    return FileEncryptor(CHUNK, container=CONTAINER_CHUNKED, checkpoint_interval=CHUNK)
+
+
+def test_resume_after_interruption(monkeypatch, make_file, tmp_path, encryptor):
+    path = make_file(size=SIZE)
+    output = str(tmp_path / 'out.Wh04ami')
+    checkpoint = Checkpoint(output)
+    starts = []
+
+    monkeypatch.setattr(crypto.encryptor, 'encrypt_chunked_stream', _encrypt_chunked_stream(3, starts))
+    with pytest.raises(Interrupted):
+        encryptor.encrypt_file(path, PASSWORD, output_path=output)
+    assert not os.path.exists(output)
+    assert os.path.exists(checkpoint.part_path) and os.path.exists(checkpoint.state_path)
+
+    monkeypatch.setattr(crypto.encryptor, 'encrypt_chunked_stream', _encrypt_chunked_stream(None, starts))
+    assert encryptor.encrypt_file(path, PASSWORD, output_path=output) == output
+    assert starts == [0, 3]
+    assert not os.path.exists(checkpoint.part_path) and not os.path.exists(checkpoint.state_path)
+
+    decrypted = FileDecryptor(CHUNK).decrypt_file(output, PASSWORD, str(tmp_path / 'plain.out'))
+    assert read(decrypted) == read(path)
+
+
+def test_changed_source_starts_over(monkeypatch, make_file, tmp_path, encryptor):
+    path = make_file(size=SIZE)
+    output = str(tmp_path / 'out.Wh04ami')
+    starts = []
+
+    monkeypatch.setattr(crypto.encryptor, 'encrypt_chunked_stream', _encrypt_chunked_stream(3, starts))
+    with pytest.raises(Interrupted):
+        encryptor.encrypt_file(path, PASSWORD, output_path=output)
+    make_file(size=SIZE)
+
+    monkeypatch.setattr(crypto.encryptor, 'encrypt_chunked_stream', _encrypt_chunked_stream(None, starts))
+    encryptor.encrypt_file(path, PASSWORD, output_path=output)
+    assert starts == [0, 0]
+    decrypted = FileDecryptor(CHUNK).decrypt_file(output, PASSWORD, str(tmp_path / 'plain.out'))
+    assert read(decrypted) == read(path)
+
+
+def test_wrong_password_starts_over(monkeypatch, make_file, tmp_path, encryptor):
+    path = make_file(size=SIZE)
+    output = str(tmp_path / 'out.Wh04ami')
+    starts = []
+
+    monkeypatch.setattr(crypto.encryptor, 'encrypt_chunked_stream', _encrypt_chunked_stream(3, starts))
+    with pytest.raises(Interrupted):
+        encryptor.encrypt_file(path, 'another password', output_path=output)
+
+    monkeypatch.setattr(crypto.encryptor, 'encrypt_chunked_stream', _encrypt_chunked_stream(None, starts))
+    encryptor.encrypt_file(path, PASSWORD, output_path=output)
+    assert starts == [0, 0]
+    decrypted = FileDecryptor(CHUNK).decrypt_file(output, PASSWORD, str(tmp_path / 'plain.out'))
+    assert read(decrypted) == read(path)
+
+
+def test_manifest_skips_unchanged_files(make_file, tmp_path):
+    paths = [make_file(f'in/file{index}.bin', size=1000 * index) for index in range(4)]
+    manifest = str(tmp_path / 'manifest.db')
+    processor = BatchProcessor(workers=1, container=CONTAINER_CHUNKED, manifest=manifest)
+
+    summary = processor.encrypt_files(paths, PASSWORD)
+    assert not summary.failed and not any(result.skipped for result in summary.results)
+    outputs = {result.path: result.output for result in summary.results}
+
+    # Only the mtime changes here, so the content digest still matches
+    os.utime(paths[1], (0, 0))
+    make_file('in/file2.bin', size=3000)
+    summary = processor.encrypt_files(paths, PASSWORD)
+    skipped = {result.path for result in summary.results if result.skipped}
+    assert skipped == {paths[0], paths[1], paths[3]}
+    assert all(result.output == outputs[result.path] for result in summary.results)
+
+    # A deleted output is written again
+    os.remove(outputs[paths[3]])
+    summary = processor.encrypt_files(paths, PASSWORD)
+    assert {result.path for result in summary.results if not result.skipped} == {paths[3]}
+    assert os.path.exists(outputs[paths[3]])
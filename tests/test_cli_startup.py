@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import subprocess
+
+import cli
+from conftest import PASSWORD, ROOT, read
+from crypto.container import CONTAINER_CHUNKED, PREFIX_SIZE, detect_container
+
+MAIN = os.path.join(ROOT, 'main.py')
+
+# Interactive-only modules that scripted startup must not load
+UI_MODULES = ('rich', 'pyfiglet')
+
+# Generous ceilings, so only a real regression (such as loading the UI
+# stack again) fails on a slow or busy machine
+HELP_LIMIT = 3.0
+ENCRYPT_LIMIT = 6.0
+
+
+def _run(args: list, env: dict = None) -> tuple:
+    """Run main.py in a fresh interpreter with -X importtime; (seconds, top-level modules imported)"""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', MAIN] + args, env=env, cwd=ROOT,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - start
+    assert result.returncode == 0, result.stderr
+    imported = {line.rsplit('|', 1)[-1].strip().split('.')[0]
+                for line in result.stderr.splitlines() if line.startswith('import time:')}
+    return elapsed, imported
+
+
+def test_encrypt_help_cold_start():
+    elapsed, imported = _run(['encrypt', '--help'])
+    assert not imported.intersection(UI_MODULES)
+    assert elapsed < HELP_LIMIT
+
+
+def test_encrypt_1kb_cold_start(tmp_path):
+    path = tmp_path / 'small.bin'
+    path.write_bytes(os.urandom(1024))
+    elapsed, imported = _run(['encrypt', '-q', str(path)], {**os.environ, cli.PASSWORD_ENV: PASSWORD})
+    assert not imported.intersection(UI_MODULES)
+    assert elapsed < ENCRYPT_LIMIT
+    assert os.path.getsize(str(path) + '.Wh04ami') > 1024
+
+
+def test_encrypt_1kb_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setenv(cli.PASSWORD_ENV, PASSWORD)
+    plain = os.urandom(1024)
+    path = tmp_path / 'small.bin'
+    path.write_bytes(plain)
+
+    start = time.perf_counter()
+    assert cli.main(['encrypt', '-q', str(path)]) == cli.EXIT_OK
+    assert time.perf_counter() - start < ENCRYPT_LIMIT
+    with open(str(path) + '.Wh04ami', 'rb') as file:
+        assert detect_container(file.read(PREFIX_SIZE)) == CONTAINER_CHUNKED
+
+    path.unlink()
+    assert cli.main(['decrypt', '-q', str(path) + '.Wh04ami']) == cli.EXIT_OK
+    assert read(str(path)) == plain
+
+
+def test_wrong_password_fails(tmp_path, monkeypatch):
+    monkeypatch.setenv(cli.PASSWORD_ENV, PASSWORD)
+    path = tmp_path / 'small.bin'
+    path.write_bytes(os.urandom(1024))
+    assert cli.main(['encrypt', '-q', str(path)]) == cli.EXIT_OK
+
+    path.unlink()
+    monkeypatch.setenv(cli.PASSWORD_ENV, 'not the password')
+    assert cli.main(['decrypt', '-q', str(path) + '.Wh04ami']) == cli.EXIT_FAILED
+    assert not path.exists()
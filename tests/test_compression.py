@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+from conftest import PASSWORD, read
+from crypto.batch import BatchProcessor
+from crypto.compression import (
+    COMPRESSED_EXTENSIONS, COMPRESSION_AUTO, DECOMPRESS_LIMIT, available_codecs, choose_codec, get_codec
+)
+from crypto.container import CONTAINER_CHUNKED, CONTAINER_LEGACY, FLAGS_COMPRESSION, read_header
+from crypto.decryptor import FileDecryptor
+from crypto.encryptor import FileEncryptor
+from utils.file_handler import ARCHIVE_EXTENSIONS, ENCRYPTED_EXTENSIONS, IMAGE_EXTENSIONS
+
+TEXT = b'The quick brown fox jumps over the lazy dog. ' * 50000
+
+
+def _compress(codec, data: bytes) -> bytes:
+    compressor = codec.compressor()
+    return compressor.compress(data) + compressor.flush()
+
+
+def _decompress(codec, blob: bytes, step: int) -> list:
+    feed, finish = codec.decompress()
+    pieces = [piece for i in range(0, len(blob), step) for piece in feed(blob[i:i + step])]
+    finish()
+    return pieces
+
+
+@pytest.mark.parametrize('name', available_codecs())
+@pytest.mark.parametrize('step', [1, 4096, 1 << 30])
+def test_codec_round_trip(name, step):
+    codec = get_codec(name)
+    data = TEXT[:100000] if step == 1 else TEXT + os.urandom(100000)
+    assert b''.join(_decompress(codec, _compress(codec, data), step)) == data
+
+
+@pytest.mark.parametrize('name', available_codecs())
+def test_truncated_stream_fails(name):
+    codec = get_codec(name)
+    blob = _compress(codec, TEXT)
+    with pytest.raises(Exception, match='truncated'):
+        _decompress(codec, blob[:-5], 4096)
+
+
+@pytest.mark.parametrize('name', available_codecs())
+def test_output_is_bounded(name):
+    codec = get_codec(name)
+    compressor = codec.compressor()
+    blob = b''.join(compressor.compress(bytes(1 << 20)) for _ in range(256)) + compressor.flush()
+
+    feed, finish = codec.decompress()
+    total = 0
+    for piece in feed(blob):
+        assert len(piece) <= DECOMPRESS_LIMIT
+        total += len(piece)
+    finish()
+    assert total == 256 << 20
+
+
+def test_zstd_one_shot_frame():
+    zstandard = pytest.importorskip('zstandard')
+    codec = get_codec('zstd')
+    blob = zstandard.ZstdCompressor(write_checksum=True, write_content_size=True).compress(TEXT)
+    assert b''.join(_decompress(codec, blob, 1000)) == TEXT
+    with pytest.raises(Exception, match='after the compressed stream'):
+        _decompress(codec, blob + b'junk', 1000)
+
+
+def test_extensions_come_from_file_handler():
+    assert IMAGE_EXTENSIONS <= COMPRESSED_EXTENSIONS
+    assert ARCHIVE_EXTENSIONS <= COMPRESSED_EXTENSIONS
+    for extension in ENCRYPTED_EXTENSIONS:
+        assert extension.lower() in COMPRESSED_EXTENSIONS
+
+
+def test_choose_codec_skips_compressed_input():
+    assert choose_codec(COMPRESSION_AUTO, 'photo.JPG', TEXT) is None
+    assert choose_codec(COMPRESSION_AUTO, 'noise.bin', os.urandom(65536)) is None
+    assert choose_codec(COMPRESSION_AUTO, 'notes.txt', TEXT) is not None
+
+
+@pytest.mark.parametrize('compression', [COMPRESSION_AUTO] + available_codecs())
+def test_file_round_trip(make_file, tmp_path, compression):
+    path = make_file('notes.txt', data=TEXT)
+    encrypted = FileEncryptor(compression=compression).encrypt_file(path, PASSWORD)
+    with open(encrypted, 'rb') as file:
+        assert read_header(file).flags & FLAGS_COMPRESSION
+    assert os.path.getsize(encrypted) < len(TEXT) // 10
+
+    output = FileDecryptor().decrypt_file(encrypted, PASSWORD, str(tmp_path / 'out.txt'))
+    assert read(output) == TEXT
+
+
+def test_legacy_container_cannot_compress():
+    with pytest.raises(ValueError, match='cannot store compressed data'):
+        FileEncryptor(container=CONTAINER_LEGACY, compression=COMPRESSION_AUTO)
+    with pytest.raises(ValueError, match='cannot store compressed data'):
+        BatchProcessor(container=CONTAINER_LEGACY, use_session=False, compression=COMPRESSION_AUTO)
+    assert BatchProcessor(use_session=False, compression=COMPRESSION_AUTO).options['container'] == CONTAINER_CHUNKED
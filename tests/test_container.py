@@ -0,0 +1,190 @@
+import io
+import os
+import secrets
+
+import pytest
+
+from conftest import PASSWORD, read
+from crypto.backends import available_backends
+from crypto.chunked import encrypt_chunked_stream
+from crypto.container import (
+    CONTAINER_CHUNKED, CONTAINER_LEGACY, TAG_SIZE, VERSION_CHUNKED, VERSION_CHUNKED_V2, VERSION_CHUNKED_V3,
+    ContainerHeader,
+    detect_container, read_header, split_key
+)
+from crypto.decryptor import FileDecryptor
+from crypto.encryptor import FileEncryptor
+from crypto.kdf import DEFAULT_KDF
+from crypto.stream import MIN_CHUNK_SIZE
+
+CHUNK = MIN_CHUNK_SIZE
+
+# Empty, one partial chunk, exactly one chunk (plus an empty final one) and several chunks
+SIZES = [0, 1000, CHUNK, 3 * CHUNK + 5]
+
+
+def write_container(path: str, data: bytes, version: int, password: str = PASSWORD) -> str:
+    """Write a chunked file with an older header version the way earlier releases did"""
+    salt = secrets.token_bytes(16)
+    header = ContainerHeader(version, CHUNK, salt, secrets.token_bytes(8))
+    enc_key, mac_key = split_key(DEFAULT_KDF.derive(password, salt))
+    header.seal(mac_key)
+    with open(path, 'wb') as file:
+        file.write(header.pack())
+        encrypt_chunked_stream(io.BytesIO(data), file, enc_key, mac_key, header)
+    return path
+
+
+def _encrypt(path: str, **options) -> str:
+    return FileEncryptor(CHUNK, container=CONTAINER_CHUNKED, **options).encrypt_file(path, PASSWORD)
+
+
+def _decrypt(path: str, output: str = None, **options) -> bytes:
+    return read(FileDecryptor(CHUNK, **options).decrypt_file(path, PASSWORD, output))
+
+
+@pytest.mark.parametrize('size', SIZES)
+@pytest.mark.parametrize('workers', [1, 2])
+def test_round_trip(make_file, size, workers):
+    path = make_file(size=size)
+    encrypted = _encrypt(path, workers=workers)
+    with open(encrypted, 'rb') as file:
+        assert detect_container(file.read(8)) == CONTAINER_CHUNKED
+        file.seek(0)
+        header = read_header(file)
+    assert header.version == VERSION_CHUNKED
+    assert header.plaintext_size(os.path.getsize(encrypted)) == size
+    assert _decrypt(encrypted, workers=workers) == read(path)
+
+
+@pytest.mark.parametrize('backend', available_backends())
+def test_round_trip_backends(make_file, backend):
+    path = make_file(size=5000)
+    encrypted = _encrypt(path, backend=backend)
+    assert _decrypt(encrypted, backend=backend) == read(path)
+
+
+@pytest.mark.parametrize('size', [0, 1000, CHUNK + 5])
+def test_reads_version_2(tmp_path, size):
+    data = os.urandom(size)
+    path = write_container(str(tmp_path / 'v2.Wh04ami'), data, VERSION_CHUNKED_V2)
+    assert _decrypt(path, str(tmp_path / 'out.bin')) == data
+
+
+def test_legacy_files_still_decrypt(make_file):
+    path = make_file(size=1000)
+    encrypted = FileEncryptor(container=CONTAINER_LEGACY).encrypt_file(path, PASSWORD)
+    with open(encrypted, 'rb') as file:
+        assert detect_container(file.read(8)) == CONTAINER_LEGACY
+    assert _decrypt(encrypted) == read(path)
+
+
+def _tampered(make_file, change) -> tuple:
+    """Encrypt a three-chunk file and change its bytes with change(bytearray, header)"""
+    path = make_file(size=2 * CHUNK + 100)
+    encrypted = _encrypt(path)
+    data = bytearray(read(encrypted))
+    with open(encrypted, 'rb') as file:
+        header = read_header(file)
+    data = change(data, header) or data
+    with open(encrypted, 'wb') as file:
+        file.write(data)
+    return encrypted
+
+
+def _flip_ciphertext(data, header):
+    data[header.size + 10] ^= 1
+
+
+def _flip_tag(data, header):
+    data[header.size + header.record_size - 1] ^= 0x80
+
+
+def _flip_last_tag(data, header):
+    data[-1] ^= 1
+
+
+def _flip_nonce(data, header):
+    # magic, version, header size, flags, chunk size and salt come first
+    data[32] ^= 1
+
+
+def _swap_chunks(data, header):
+    first = slice(header.size, header.size + header.record_size)
+    second = slice(header.size + header.record_size, header.size + 2 * header.record_size)
+    data[first], data[second] = data[second], data[first]
+
+
+def _drop_final_chunk(data, header):
+    return data[:header.size + 2 * header.record_size]
+
+
+def _truncate(data, header):
+    return data[:-(TAG_SIZE + 1)]
+
+
+def _append(data, header):
+    return data + b'\0' * 50
+
+
+@pytest.mark.parametrize('change', [_flip_ciphertext, _flip_tag, _flip_last_tag, _flip_nonce, _swap_chunks,
+                                    _drop_final_chunk, _truncate, _append])
+def test_tampering_is_detected(make_file, tmp_path, change):
+    encrypted = _tampered(make_file, change)
+    output = tmp_path / 'out.bin'
+    with pytest.raises(Exception):
+        FileDecryptor(CHUNK).decrypt_file(encrypted, PASSWORD, str(output))
+    # Nothing is left behind, not even the chunks before the bad one
+    assert not output.exists()
+    assert [name for name in os.listdir(tmp_path) if name.endswith('.tmp')] == []
+
+
+@pytest.mark.parametrize('size', [0, 1000, CHUNK + 5])
+def test_reads_version_3(tmp_path, size):
+    data = os.urandom(size)
+    path = write_container(str(tmp_path / 'v3.Wh04ami'), data, VERSION_CHUNKED_V3)
+    with open(path, 'rb') as file:
+        assert read_header(file).key_check is not None
+    assert _decrypt(path, str(tmp_path / 'out.bin')) == data
+
+
+def _version_file(make_file, tmp_path, version) -> str:
+    if version == VERSION_CHUNKED:
+        return _encrypt(make_file(size=CHUNK + 5))
+    return write_container(str(tmp_path / f'v{version}.Wh04ami'), os.urandom(CHUNK + 5), version)
+
+
+@pytest.mark.parametrize('version', [VERSION_CHUNKED_V3, VERSION_CHUNKED])
+def test_wrong_password_fails_key_check(make_file, tmp_path, version):
+    path = _version_file(make_file, tmp_path, version)
+    output = tmp_path / 'out.bin'
+    with pytest.raises(Exception, match='Wrong password'):
+        FileDecryptor(CHUNK).decrypt_file(path, 'wrong password', str(output))
+    assert not output.exists()
+    assert [name for name in os.listdir(tmp_path) if name.endswith('.tmp')] == []
+
+    writer = io.BytesIO()
+    with open(path, 'rb') as reader:
+        with pytest.raises(Exception, match='Wrong password'):
+            FileDecryptor(CHUNK).decrypt_stream(reader, writer, 'wrong password')
+    assert writer.getvalue() == b''
+
+
+def test_wrong_password_fails_version_2_first_chunk(make_file, tmp_path):
+    path = _version_file(make_file, tmp_path, VERSION_CHUNKED_V2)
+    output = tmp_path / 'out.bin'
+    with pytest.raises(Exception):
+        FileDecryptor(CHUNK).decrypt_file(path, 'wrong password', str(output))
+    assert not output.exists()
+
+
+def test_tampered_key_check_is_rejected(tmp_path):
+    path = write_container(str(tmp_path / 'v3.Wh04ami'), os.urandom(1000), VERSION_CHUNKED_V3)
+    with open(path, 'rb') as file:
+        header = read_header(file)
+    data = bytearray(read(path))
+    data[header.size - 1] ^= 1
+    with open(path, 'wb') as file:
+        file.write(data)
+    with pytest.raises(Exception, match='Wrong password'):
+        FileDecryptor(CHUNK).decrypt_file(path, PASSWORD, str(tmp_path / 'out.bin'))
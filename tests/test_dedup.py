@@ -0,0 +1,108 @@
+import io
+import os
+
+import pytest
+
+from conftest import PASSWORD, read
+from crypto.dedup import CHUNKS_DIR, ContentChunker, DedupStore
+
+# Small chunks keep the store tests fast
+CHUNKING = {'min_size': 4096, 'avg_bits': 12, 'max_size': 65536}
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    return str(tmp_path / 'backup.store')
+
+
+def _open(store_path, password=PASSWORD, create=False):
+    return DedupStore(store_path, password, create=create, workers=1, **CHUNKING)
+
+
+def test_chunker_bounds_and_content():
+    data = os.urandom(1 << 20)
+    chunker = ContentChunker(b'key', **CHUNKING)
+    chunks = list(chunker.split(io.BytesIO(data)))
+    assert b''.join(chunks) == data
+    assert all(len(chunk) <= CHUNKING['max_size'] for chunk in chunks)
+    assert all(len(chunk) >= CHUNKING['min_size'] for chunk in chunks[:-1])
+
+
+def test_chunker_boundaries_survive_an_insert():
+    data = os.urandom(1 << 20)
+    chunker = ContentChunker(b'key', **CHUNKING)
+    before = set(chunker.split(io.BytesIO(data)))
+    after = list(chunker.split(io.BytesIO(data[:1000] + b'inserted' + data[1000:])))
+    assert sum(chunk in before for chunk in after) >= len(after) - 2
+
+
+def test_chunker_rejects_bad_parameters():
+    with pytest.raises(ValueError):
+        ContentChunker(b'key', avg_bits=10)
+    with pytest.raises(ValueError):
+        ContentChunker(b'key', min_size=65536, max_size=4096)
+
+
+def test_round_trip_and_dedup(store_path, make_file, tmp_path):
+    data = os.urandom(300000)
+    first = make_file('a.bin', data=data)
+    second = make_file('b.bin', data=data[:150000] + b'edit' + data[150000:])
+
+    with _open(store_path, create=True) as store:
+        stats = store.encrypt_file(first)
+        assert stats.unique_bytes == stats.logical_bytes == len(data)
+        stats = store.encrypt_file(second)
+        assert stats.unique_bytes < stats.logical_bytes // 2
+        assert store.names() == ['a.bin', 'b.bin']
+
+    with _open(store_path) as store:
+        for name, path in (('a.bin', first), ('b.bin', second)):
+            output = store.decrypt_file(name, str(tmp_path / 'out' / name))
+            assert read(output) == read(path)
+            assert os.path.getmtime(output) == os.path.getmtime(path)
+
+
+def test_chunk_ids_hide_content(store_path, make_file):
+    path = make_file(data=b'secret' * 10000)
+    with _open(store_path, create=True) as store:
+        store.encrypt_file(path)
+    for root, _, files in os.walk(os.path.join(store_path, CHUNKS_DIR)):
+        for name in files:
+            assert b'secret' not in read(os.path.join(root, name))
+
+
+def test_wrong_password(store_path, make_file):
+    with _open(store_path, create=True) as store:
+        store.encrypt_file(make_file(size=1000))
+    with pytest.raises(Exception, match='Wrong password'):
+        _open(store_path, password='wrong')
+
+
+def test_corrupted_chunk_leaves_no_output(store_path, make_file, tmp_path):
+    with _open(store_path, create=True) as store:
+        store.encrypt_file(make_file(size=100000))
+        _, chunk = next(store._chunk_files())
+        data = bytearray(read(chunk))
+        data[-1] ^= 1
+        with open(chunk, 'wb') as file:
+            file.write(data)
+
+        output = str(tmp_path / 'out.bin')
+        with pytest.raises(Exception):
+            store.decrypt_file('plain.bin', output)
+        assert not os.path.exists(output)
+
+
+def test_remove_and_prune(store_path, make_file):
+    with _open(store_path, create=True) as store:
+        store.encrypt_file(make_file('a.bin', size=100000))
+        store.encrypt_file(make_file('b.bin', size=100000))
+        before = store.stats()
+        store.remove('a.bin')
+        freed = store.prune()
+        after = store.stats()
+
+    assert store.names() == ['b.bin']
+    assert freed.unique_chunks == before.unique_chunks - after.unique_chunks > 0
+    assert after.stored_bytes == before.stored_bytes - freed.stored_bytes
+
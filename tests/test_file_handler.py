@@ -0,0 +1,46 @@
+import os
+
+from utils.file_handler import FileHandler
+
+
+def _tree(root, files: dict):
+    for name, size in files.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'x' * size)
+
+
+def _names(root, **options) -> list:
+    return [os.path.relpath(path, root).replace(os.sep, '/')
+            for path, _ in FileHandler().walk_files(str(root), **options)]
+
+
+def test_walk_recursive_with_sizes(tmp_path):
+    _tree(tmp_path, {'a.txt': 3, 'sub/b.txt': 5, 'sub/deeper/c.txt': 1})
+    found = {os.path.relpath(path, tmp_path).replace(os.sep, '/'): size
+             for path, size in FileHandler().walk_files(str(tmp_path))}
+    assert found == {'a.txt': 3, 'sub/b.txt': 5, 'sub/deeper/c.txt': 1}
+    assert _names(tmp_path, recursive=False) == ['a.txt']
+
+
+def test_walk_skips_encrypted_and_state_files(tmp_path):
+    _tree(tmp_path, {'a.txt': 1, 'a.txt.Wh04ami': 1, 'b.encrypted': 1, 'big.Wh04ami.part': 1,
+                     'big.Wh04ami.part.ckpt': 1})
+    assert _names(tmp_path) == ['a.txt']
+    assert len(_names(tmp_path, skip_encrypted=False)) == 5
+
+
+def test_walk_include_and_exclude(tmp_path):
+    _tree(tmp_path, {'a.pdf': 1, 'b.txt': 1, 'cache/c.pdf': 1, 'docs/d.pdf': 1})
+    assert sorted(_names(tmp_path, include=['*.pdf'], exclude=['cache'])) == ['a.pdf', 'docs/d.pdf']
+    assert _names(tmp_path, include=['docs/*']) == ['docs/d.pdf']
+
+
+def test_walk_largest_first_within_window(tmp_path):
+    sizes = {f'f{size}': size for size in [5, 1, 9, 3, 7, 2]}
+    _tree(tmp_path, sizes)
+    order = [size for _, size in FileHandler().walk_files(str(tmp_path))]
+    assert order == sorted(sizes.values(), reverse=True)
+    # A small window still yields every file once
+    windowed = [size for _, size in FileHandler().walk_files(str(tmp_path), window=2)]
+    assert sorted(windowed) == sorted(sizes.values())
@@ -0,0 +1,69 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import PASSWORD, read
+from crypto.container import CONTAINER_CHUNKED, CONTAINER_LEGACY
+from crypto.decryptor import FileDecryptor
+from crypto.encryptor import FileEncryptor
+from crypto.mmap_io import IO_AUTO, IO_MMAP, IO_PIPELINE, IO_STREAM, use_mmap
+from crypto.pipeline import DIRECT_BUFFER_SIZE, STAGES, open_output
+from crypto.stream import MIN_CHUNK_SIZE
+
+CHUNK = MIN_CHUNK_SIZE
+MODES = [IO_STREAM, IO_MMAP, IO_PIPELINE]
+SIZES = [0, 15, 16, CHUNK + 3, 2 * CHUNK]
+
+
+@pytest.mark.parametrize('container', [CONTAINER_LEGACY, CONTAINER_CHUNKED])
+@pytest.mark.parametrize('size', SIZES)
+@pytest.mark.parametrize('encrypt_mode', MODES)
+@pytest.mark.parametrize('decrypt_mode', MODES)
+def test_modes_interoperate(make_file, container, size, encrypt_mode, decrypt_mode):
+    path = make_file(size=size)
+    encrypted = FileEncryptor(CHUNK, container=container, io_mode=encrypt_mode).encrypt_file(path, PASSWORD)
+    decryptor = FileDecryptor(CHUNK, io_mode=decrypt_mode)
+    assert read(decryptor.decrypt_file(encrypted, PASSWORD)) == read(path)
+
+
+def test_auto_maps_only_large_files():
+    assert not use_mmap(IO_AUTO, 1024)
+    assert not use_mmap(IO_MMAP, 0)
+    assert use_mmap(IO_MMAP, 1024)
+    assert not use_mmap(IO_STREAM, 1 << 40)
+    with pytest.raises(ValueError):
+        use_mmap('carrier-pigeon', 1)
+
+
+
+@pytest.mark.parametrize('container', [CONTAINER_LEGACY, CONTAINER_CHUNKED])
+@pytest.mark.parametrize('size', [0, 4095, CHUNK + 4097])
+def test_direct_io_round_trip(make_file, tmp_path, container, size):
+    # Falls back to buffered writes where O_DIRECT is not supported
+    path = make_file(size=size)
+    encryptor = FileEncryptor(CHUNK, container=container, io_mode=IO_PIPELINE, direct_io=True)
+    encrypted = encryptor.encrypt_file(path, PASSWORD)
+    decryptor = FileDecryptor(CHUNK, io_mode=IO_PIPELINE, direct_io=True)
+    assert read(decryptor.decrypt_file(encrypted, PASSWORD, str(tmp_path / 'out.bin'))) == read(path)
+
+
+def test_direct_writer_keeps_unaligned_length(tmp_path):
+    data = os.urandom(DIRECT_BUFFER_SIZE + 5000)
+    path = str(tmp_path / 'direct.bin')
+    with open_output(path, direct=True) as file:
+        for offset in range(0, len(data), 100000):
+            file.write(data[offset:offset + 100000])
+    assert read(path) == data
+
+
+@pytest.mark.parametrize('container', [CONTAINER_LEGACY, CONTAINER_CHUNKED])
+def test_pipeline_reports_stages(make_file, container):
+    records = []
+    path = make_file(size=2 * CHUNK)
+    encryptor = FileEncryptor(CHUNK, container=container, io_mode=IO_PIPELINE,
+                              metrics_sink=SimpleNamespace(write=records.append))
+    encryptor.encrypt_file(path, PASSWORD)
+    record, = records
+    assert record['pipeline']['bottleneck'] in STAGES
+    assert set(record['pipeline']['busy']) == set(STAGES)
@@ -0,0 +1,99 @@
+import os
+import struct
+
+import pytest
+
+from conftest import PASSWORD, read
+from crypto.batch import BatchProcessor
+from crypto.container import CONTAINER_LEGACY, read_header
+from crypto.decryptor import FileDecryptor
+from crypto.encryptor import FileEncryptor
+from crypto.kdf import (
+    DEFAULT_KDF, KDF_PBKDF2, KDF_SCRYPT, MAX_PBKDF2_ITERATIONS, Pbkdf2Kdf, ScryptKdf, available_kdfs, calibrate,
+    get_kdf, parse_kdf, unpack_kdf
+)
+from crypto.manifest import Manifest
+
+# Cheap costs keep the file tests fast
+SPECS = {
+    KDF_PBKDF2: 'pbkdf2:iterations=2000',
+    KDF_SCRYPT: 'scrypt:log_n=10,r=8,p=1',
+    'argon2id': 'argon2:time_cost=1,memory_kib=1024,parallelism=1',
+}
+
+
+def test_parse_and_format():
+    kdf = parse_kdf('scrypt:log_n=15,r=8,p=2')
+    assert kdf == ScryptKdf(15, 8, 2)
+    assert parse_kdf(str(kdf)) == kdf
+    assert parse_kdf('pbkdf2') == Pbkdf2Kdf(10_000)
+    assert get_kdf(None) == DEFAULT_KDF
+
+
+@pytest.mark.parametrize('spec', ['md5', 'scrypt:cost=3', 'pbkdf2:iterations=10',
+                                  f'pbkdf2:iterations={MAX_PBKDF2_ITERATIONS + 1}', 'scrypt:log_n=40'])
+def test_parse_rejects_bad_specs(spec):
+    with pytest.raises(ValueError):
+        parse_kdf(spec)
+
+
+def test_header_encoding():
+    kdf = ScryptKdf(15, 8, 1)
+    assert unpack_kdf(kdf.pack()) == kdf
+    # A crafted header cannot ask for absurd costs
+    with pytest.raises(Exception, match='Invalid KDF parameters'):
+        unpack_kdf(struct.pack('>BIII', Pbkdf2Kdf.id, 2 ** 31, 0, 0))
+    with pytest.raises(Exception, match='Unsupported KDF'):
+        unpack_kdf(struct.pack('>BIII', 99, 1, 1, 1))
+
+
+@pytest.mark.parametrize('name', available_kdfs())
+def test_file_round_trip(make_file, tmp_path, name):
+    kdf = parse_kdf(SPECS[name])
+    path = make_file(size=5000)
+    encrypted = FileEncryptor(kdf=kdf).encrypt_file(path, PASSWORD)
+    with open(encrypted, 'rb') as file:
+        header = read_header(file)
+    assert kdf in [slot.kdf for slot in header.slots if slot is not None]
+
+    # The decryptor reads the KDF from the header
+    output = FileDecryptor().decrypt_file(encrypted, PASSWORD, str(tmp_path / 'out.bin'))
+    assert read(output) == read(path)
+    with pytest.raises(Exception, match='Wrong password'):
+        FileDecryptor().decrypt_file(encrypted, 'wrong password', str(tmp_path / 'bad.bin'))
+
+
+def test_encrypt_data_uses_the_default_kdf(tmp_path):
+    blob = FileEncryptor(kdf=SPECS[KDF_PBKDF2]).encrypt_data(b'secret', PASSWORD)
+    path = tmp_path / 'data.Wh04ami'
+    path.write_bytes(blob)
+    assert read(FileDecryptor().decrypt_file(str(path), PASSWORD, str(tmp_path / 'out.bin'))) == b'secret'
+
+
+def test_legacy_container_cannot_record_kdf():
+    kdf = SPECS[KDF_PBKDF2]
+    with pytest.raises(ValueError, match='no room for KDF parameters'):
+        FileEncryptor(container=CONTAINER_LEGACY, kdf=kdf)
+    with pytest.raises(ValueError, match='no room for KDF parameters'):
+        BatchProcessor(container=CONTAINER_LEGACY, use_session=False, kdf=kdf)
+    FileEncryptor(container=CONTAINER_LEGACY, kdf=str(DEFAULT_KDF))
+
+
+def test_manifest_keeps_the_first_kdf(tmp_path):
+    manifest = Manifest(str(tmp_path / 'manifest.db'))
+    salt, kdf = manifest.key_params(SPECS[KDF_PBKDF2])
+    assert kdf == SPECS[KDF_PBKDF2]
+    assert manifest.key_params(str(DEFAULT_KDF)) == (salt, kdf)
+    manifest.close()
+
+
+def test_calibrate_reaches_target():
+    kdf, elapsed = calibrate(KDF_PBKDF2, target_seconds=0.05)
+    assert kdf.name == KDF_PBKDF2
+    assert 0 < elapsed < 0.5
+
+
+def test_derive_depends_on_costs():
+    salt = os.urandom(16)
+    assert Pbkdf2Kdf(2000).derive(PASSWORD, salt) != Pbkdf2Kdf(3000).derive(PASSWORD, salt)
+    assert len(Pbkdf2Kdf(2000).derive(PASSWORD, salt)) == 32
@@ -0,0 +1,68 @@
+import pytest
+
+from conftest import PASSWORD, read
+from crypto.container import CONTAINER_LEGACY
+from crypto.decryptor import FileDecryptor
+from crypto.encryptor import FileEncryptor
+from crypto.keycache import KeyCache
+
+
+def _counting_derive(calls: list):
+    def derive(password, salt):
+        calls.append(salt)
+        return bytes(32)
+    return derive
+
+
+def test_cache_hits_and_misses():
+    cache = KeyCache()
+    calls = []
+    derive = _counting_derive(calls)
+    for _ in range(3):
+        cache.get_or_derive('pw', b'salt', ('p',), derive)
+    cache.get_or_derive('other', b'salt', ('p',), derive)
+    cache.get_or_derive('pw', b'salt', ('q',), derive)
+    assert len(calls) == 3
+    assert (cache.hits, cache.misses) == (2, 3)
+
+
+def test_eviction_zeroizes():
+    cache = KeyCache(max_entries=2)
+    derive = lambda password, salt: b'\x01' * 32
+    cache.get_or_derive('pw', b'a', (), derive)
+    evicted = cache._entries[next(iter(cache._entries))]
+    cache.get_or_derive('pw', b'b', (), derive)
+    cache.get_or_derive('pw', b'c', (), derive)
+    assert len(cache) == 2
+    assert evicted == bytes(32)
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_session_files_decrypt_with_one_kdf_run(make_file):
+    encryptor = FileEncryptor()
+    paths = [make_file(f'file{i}.txt', size=200 * i) for i in range(4)]
+    with encryptor.start_session(PASSWORD) as session:
+        encrypted = [encryptor.encrypt_file(path, PASSWORD, session=session) for path in paths]
+
+    cache = KeyCache()
+    decryptor = FileDecryptor(key_cache=cache)
+    for path, source in zip(encrypted, paths):
+        assert read(decryptor.decrypt_file(path, PASSWORD)) == read(source)
+    # Every file's key slot uses the session salt, so the password KDF ran once
+    assert cache.misses == 1
+
+
+def test_session_needs_chunked_container(make_file):
+    path = make_file(size=100)
+    encryptor = FileEncryptor(container=CONTAINER_LEGACY)
+    with encryptor.start_session(PASSWORD) as session:
+        with pytest.raises(ValueError, match='chunked container'):
+            encryptor.encrypt_file(path, PASSWORD, session=session)
+
+
+def test_closed_session_refuses_keys():
+    session = FileEncryptor().start_session(PASSWORD)
+    session.close()
+    with pytest.raises(Exception):
+        session.file_key(bytes(16))
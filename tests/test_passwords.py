@@ -0,0 +1,81 @@
+import pytest
+
+from utils.breached import BreachedPasswordFilter, build_filter, filter_size
+from utils.validator import Validator
+
+BREACHED = ['hunter2', 'Tr0ub4dor&3', 'correcthorse', 'пароль']
+
+
+@pytest.fixture
+def breached_filter(tmp_path):
+    wordlist = tmp_path / 'breached.txt'
+    wordlist.write_text('\n'.join(BREACHED) + '\n\n', encoding='utf-8')
+    path = str(tmp_path / 'breached.blf')
+    assert build_filter([str(wordlist)], path) == len(BREACHED)
+    with BreachedPasswordFilter(path) as filter_:
+        yield filter_
+
+
+def test_filter_membership(breached_filter):
+    assert len(breached_filter) == len(BREACHED)
+    for password in BREACHED:
+        assert password in breached_filter
+    assert 'a much longer unlisted passphrase' not in breached_filter
+    # Lookups also take bytes, as read from a wordlist
+    assert b'hunter2' in breached_filter
+
+
+def test_false_positive_rate(tmp_path):
+    wordlist = tmp_path / 'words.txt'
+    wordlist.write_text('\n'.join(f'word{i}' for i in range(10000)))
+    path = str(tmp_path / 'words.blf')
+    build_filter([str(wordlist)], path, fp_rate=0.01)
+    with BreachedPasswordFilter(path) as filter_:
+        assert all(f'word{i}' in filter_ for i in range(0, 10000, 7))
+        false_positives = sum(f'other{i}' in filter_ for i in range(10000))
+    assert false_positives < 300
+
+
+def test_filter_size():
+    bits, hashes = filter_size(1000, 0.001)
+    assert 14000 < bits < 15000 and hashes == 10
+    with pytest.raises(ValueError):
+        filter_size(1000, 1.5)
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'not-a-filter'
+    path.write_bytes(b'x' * 100)
+    with pytest.raises(Exception, match='Not a breached-password filter'):
+        BreachedPasswordFilter(str(path))
+
+
+def test_breached_passwords_fail_validation(breached_filter):
+    validator = Validator(breached_filter)
+    assert validator.is_breached('Tr0ub4dor&3')
+    assert validator.is_breached('HUNTER2')
+    assert not validator.is_strong_password('Tr0ub4dor&3')
+    assert validator.is_strong_password('Xk9#mPq2vL')
+
+
+def test_audit_reports_without_passwords(breached_filter, tmp_path):
+    export = tmp_path / 'export.txt'
+    export.write_text('hunter2\nXk9#mPq2vL!7zR\n12345678\n')
+    findings = []
+    audit = Validator(breached_filter).audit_files([str(export)], findings.append)
+
+    assert (audit.checked, audit.breached) == (3, 1)
+    assert audit.weak == len(findings) == 2
+    assert [finding['source'] for finding in findings] == [f'{export}:1', f'{export}:3']
+    assert 'breached' in findings[0]['issues']
+    assert 'all_numbers' in findings[1]['issues']
+    assert 'hunter2' not in str(findings) and 'hunter2' not in str(audit.to_dict())
+
+
+# Scores from before the patterns were compiled and named; audits must not change them
+@pytest.mark.parametrize('password, score', [
+    ('12345678', 26), ('letters', 10), ('LETTERS', 10), ('x123456y', 36), ('MyPassword1!', 60),
+    ('Qwerty#2024', 60), ('iloveyou99!', 70), ('zzzz9999Aa', 70), ('abcd1234!X', 80), ('Xk9#mPq2vL', 80),
+])
+def test_strength_scores_unchanged(password, score):
+    assert Validator().check_password_strength(password)['overall']['score'] == score
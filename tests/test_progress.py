@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from conftest import PASSWORD
+from crypto.container import CONTAINER_CHUNKED, CONTAINER_LEGACY
+from crypto.decryptor import FileDecryptor
+from crypto.encryptor import FileEncryptor
+from crypto.stream import MIN_CHUNK_SIZE
+
+CHUNK = MIN_CHUNK_SIZE
+SIZE = 3 * CHUNK + 100
+
+
+class ListSink:
+    def __init__(self):
+        self.records = []
+
+    def write(self, record: dict):
+        self.records.append(record)
+
+
+@pytest.mark.parametrize('container', [CONTAINER_LEGACY, CONTAINER_CHUNKED])
+def test_progress_reaches_total(make_file, container):
+    path = make_file(size=SIZE)
+    calls = []
+    encryptor = FileEncryptor(CHUNK, container=container, progress_callback=lambda *args: calls.append(args))
+    encrypted = encryptor.encrypt_file(path, PASSWORD)
+    assert len(calls) > 1
+    done = [call[0] for call in calls]
+    assert done == sorted(done) and done[-1] == SIZE
+    assert all(call[1] == SIZE for call in calls)
+
+    calls.clear()
+    decryptor = FileDecryptor(CHUNK, progress_callback=lambda *args: calls.append(args))
+    decryptor.decrypt_file(encrypted, PASSWORD)
+    # Legacy files count padded ciphertext, as the padding is only known at the end
+    assert calls[-1][0] == calls[-1][1] == (SIZE if container == CONTAINER_CHUNKED else SIZE + 16 - SIZE % 16)
+
+
+def test_metrics_records(make_file, tmp_path):
+    path = make_file(size=SIZE)
+    sink = ListSink()
+    encrypted = FileEncryptor(CHUNK, container=CONTAINER_CHUNKED, metrics_sink=sink).encrypt_file(path, PASSWORD)
+    record, = sink.records
+    assert (record['operation'], record['status'], record['bytes']) == ('encrypt', 'ok', SIZE)
+    assert record['container'] == CONTAINER_CHUNKED
+    assert record['phases']['kdf'] > 0 and record['phases']['cipher'] > 0
+
+    # Failures are recorded too, to a JSON lines file
+    log = tmp_path / 'metrics.jsonl'
+    with pytest.raises(Exception):
+        FileDecryptor(CHUNK, metrics_sink=str(log)).decrypt_file(encrypted, 'wrong')
+    record = json.loads(log.read_text().splitlines()[-1])
+    assert (record['operation'], record['status']) == ('decrypt', 'error')
+    assert 'error' in record
+
+
+def test_metrics_record_the_container_written(make_file):
+    sink = ListSink()
+    legacy = FileEncryptor(CHUNK, container=CONTAINER_LEGACY, metrics_sink=sink)
+    legacy.encrypt_file(make_file('legacy.bin', size=100), PASSWORD)
+    encryptor = FileEncryptor(CHUNK, metrics_sink=sink)
+    with encryptor.start_session(PASSWORD) as session:
+        encryptor.encrypt_file(make_file('other.bin', size=100), PASSWORD, session=session)
+    assert [record['container'] for record in sink.records] == [CONTAINER_LEGACY, CONTAINER_CHUNKED]
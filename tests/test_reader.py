@@ -0,0 +1,60 @@
+import io
+import os
+import random
+
+import pytest
+
+from conftest import PASSWORD
+from crypto.container import CONTAINER_CHUNKED, CONTAINER_LEGACY
+from crypto.decryptor import FileDecryptor
+from crypto.encryptor import FileEncryptor
+from crypto.stream import MIN_CHUNK_SIZE
+
+CHUNK = MIN_CHUNK_SIZE
+SIZE = 2 * CHUNK + 1000
+
+
+@pytest.fixture(scope='module', params=[CONTAINER_LEGACY, CONTAINER_CHUNKED])
+def encrypted(request, tmp_path_factory):
+    """(encrypted path, plaintext) in each container"""
+    plain = os.urandom(SIZE)
+    path = tmp_path_factory.mktemp(request.param) / 'data.bin'
+    path.write_bytes(plain)
+    return FileEncryptor(CHUNK, container=request.param).encrypt_file(str(path), PASSWORD), plain
+
+
+@pytest.mark.parametrize('offset, length', [
+    (0, 1), (0, 16), (15, 2), (100, 5000),
+    (CHUNK - 3, 6), (CHUNK, CHUNK), (CHUNK - 1, CHUNK + 2),  # across chunk boundaries
+    (SIZE - 10, 10), (SIZE - 10, 100), (SIZE, 10), (0, SIZE + 1),  # at and past the end
+])
+def test_read_range(encrypted, offset, length):
+    path, plain = encrypted
+    assert FileDecryptor(CHUNK).read_range(path, PASSWORD, offset, length) == plain[offset:offset + length]
+
+
+def test_read_range_from_end(encrypted):
+    path, plain = encrypted
+    assert FileDecryptor(CHUNK).read_range(path, PASSWORD, -4096, 4096) == plain[-4096:]
+
+
+def test_reader_seek_and_read(encrypted):
+    path, plain = encrypted
+    rng = random.Random(4)
+    with FileDecryptor(CHUNK).open_encrypted(path, PASSWORD) as reader:
+        assert reader.size == SIZE
+        for _ in range(20):
+            offset = rng.randrange(SIZE)
+            length = rng.randrange(1, 3 * CHUNK // 2)
+            reader.seek(offset)
+            assert reader.read(length) == plain[offset:offset + length]
+            assert reader.tell() == min(SIZE, offset + length)
+        reader.seek(-5, io.SEEK_END)
+        assert reader.read() == plain[-5:]
+
+
+def test_reader_wrong_password(make_file):
+    # Legacy files have only padding to check, so use the chunked container
+    path = FileEncryptor(CHUNK, container=CONTAINER_CHUNKED).encrypt_file(make_file(size=100), PASSWORD)
+    with pytest.raises(Exception):
+        FileDecryptor(CHUNK).read_range(path, 'wrong password', 0, 10)
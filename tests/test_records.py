@@ -0,0 +1,100 @@
+import os
+import array
+
+import pytest
+
+from conftest import PASSWORD
+from crypto.backends import available_backends, get_backend
+from crypto.decryptor import FileDecryptor
+from crypto.encryptor import FileEncryptor
+from crypto.keycache import KeyCache
+from crypto.records import SMALL_RECORD_SIZE, RecordCipher, is_record, record_params
+
+# A cheap KDF keeps the tests fast; it is recorded in every record
+KDF = 'pbkdf2:iterations=2000'
+# Around the shared-keystream cutoff, plus a multi-block record
+SIZES = [0, 1, 15, 16, 17, SMALL_RECORD_SIZE - 1, SMALL_RECORD_SIZE, SMALL_RECORD_SIZE + 1, 100000]
+
+
+@pytest.fixture
+def cipher():
+    return RecordCipher.derive(PASSWORD, KDF)
+
+
+def _records():
+    return [os.urandom(size) for size in SIZES]
+
+
+@pytest.mark.parametrize('backend', available_backends())
+def test_many_round_trip(backend):
+    records = _records()
+    encrypted = FileEncryptor(backend=backend, kdf=KDF).encrypt_many(records, PASSWORD)
+    assert all(is_record(record) for record in encrypted)
+    decryptor = FileDecryptor(backend=backend, key_cache=KeyCache())
+    assert decryptor.decrypt_many(encrypted, PASSWORD) == records
+    # Each record also decrypts on its own
+    assert decryptor.decrypt_data(encrypted[3], PASSWORD) == records[3]
+
+
+def test_backends_agree():
+    # Records sealed with one backend open with every other, on both sides of SMALL_RECORD_SIZE
+    backends = [get_backend(name) for name in available_backends()]
+    salt = os.urandom(16)
+    ciphers = [RecordCipher(bytes(32), salt, KDF, backend) for backend in backends]
+    for record in _records():
+        encrypted = ciphers[0].encrypt(record)
+        assert all(cipher.decrypt(encrypted) == record for cipher in ciphers)
+
+    # The shared ECB keystream matches a real CTR cipher
+    nonce, ciphertext = bytes(12), os.urandom(SMALL_RECORD_SIZE)
+    for cipher in ciphers:
+        expected = cipher.backend.ctr(cipher._enc_key, nonce + bytes(4)).update(ciphertext)
+        assert cipher._ctr(nonce, ciphertext) == expected
+
+
+def test_into_buffers(cipher):
+    out = bytearray(cipher.sealed_size(100000) + 10)
+    plain = bytearray(100000 + 10)
+    for record in _records():
+        size = cipher.encrypt_into(record, out, offset=10)
+        assert size == cipher.sealed_size(len(record))
+        assert cipher.decrypt(out[10:10 + size]) == record
+        assert cipher.decrypt_into(out[10:10 + size], plain, offset=10) == len(record)
+        assert plain[10:10 + len(record)] == record
+
+    with pytest.raises(ValueError, match='too small'):
+        cipher.encrypt_into(b'x' * 100, bytearray(cipher.sealed_size(99)))
+
+
+def test_buffer_protocol_inputs(cipher):
+    values = array.array('I', range(1000))
+    assert cipher.decrypt(cipher.encrypt(values)) == values.tobytes()
+    assert cipher.decrypt(memoryview(cipher.encrypt(b'abc'))) == b'abc'
+
+
+def test_nonces_are_fresh(cipher):
+    assert cipher.encrypt(b'same') != cipher.encrypt(b'same')
+
+
+@pytest.mark.parametrize('position', [0, 30, -17, -1])
+def test_tampering_is_detected(cipher, position):
+    record = bytearray(cipher.encrypt(os.urandom(1000)))
+    record[position] ^= 1
+    with pytest.raises(Exception):
+        cipher.decrypt(record)
+
+
+def test_truncated_record(cipher):
+    with pytest.raises(Exception, match='truncated'):
+        cipher.decrypt(cipher.encrypt(b'')[:-1])
+
+
+def test_other_batch_and_wrong_password(cipher):
+    other = RecordCipher.derive(PASSWORD, KDF)
+    with pytest.raises(Exception, match='another batch'):
+        other.decrypt(cipher.encrypt(b'data'))
+
+    record = cipher.encrypt(b'data')
+    assert record_params(record) == (cipher.salt, cipher.kdf)
+    with pytest.raises(Exception, match='Authentication failed'):
+        FileDecryptor(key_cache=KeyCache()).decrypt_data(record, 'wrong password')
@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+from conftest import PASSWORD, read
+from crypto.container import CONTAINER_CHUNKED, CONTAINER_LEGACY, KEY_SLOTS, WRAPPED_HEADER_SIZE
+from crypto.decryptor import FileDecryptor
+from crypto.encryptor import FileEncryptor
+from crypto.kdf import parse_kdf
+from crypto.keycache import KeyCache
+from crypto.rekey import REKEY_ADD, REKEY_CHANGE, REKEY_REMOVE, Rekeyer, key_slots
+
+NEW_PASSWORD = 'a brand new passphrase'
+# A cheap KDF for the new slots keeps the tests fast
+KDF = 'pbkdf2:iterations=2000'
+
+
+@pytest.fixture
+def encrypted(make_file):
+    path = make_file(size=100000)
+    return path, FileEncryptor(container=CONTAINER_CHUNKED).encrypt_file(path, PASSWORD)
+
+
+def _rekey(path: str, password: str, new_password: str = None, action: str = REKEY_CHANGE) -> int:
+    return Rekeyer(password, new_password, action, kdf=KDF, key_cache=KeyCache()).rekey_file(path)
+
+
+def _opens(path: str, password: str, tmp_path) -> bool:
+    output = str(tmp_path / 'out.bin')
+    try:
+        FileDecryptor(key_cache=KeyCache()).decrypt_file(path, password, output)
+    except Exception:
+        return False
+    os.remove(output)
+    return True
+
+
+def test_change_password(encrypted, tmp_path):
+    source, path = encrypted
+    body = read(path)[WRAPPED_HEADER_SIZE:]
+    assert _rekey(path, PASSWORD, NEW_PASSWORD) == 0
+
+    # Only the header is rewritten
+    assert read(path)[WRAPPED_HEADER_SIZE:] == body
+    assert not _opens(path, PASSWORD, tmp_path)
+    output = FileDecryptor().decrypt_file(path, NEW_PASSWORD, str(tmp_path / 'out.bin'))
+    assert read(output) == read(source)
+    assert key_slots(path) == [str(parse_kdf(KDF))] + [None] * (KEY_SLOTS - 1)
+
+
+def test_add_and_remove_password(encrypted, tmp_path):
+    _, path = encrypted
+    assert _rekey(path, PASSWORD, NEW_PASSWORD, REKEY_ADD) == 1
+    assert _opens(path, PASSWORD, tmp_path) and _opens(path, NEW_PASSWORD, tmp_path)
+
+    assert _rekey(path, PASSWORD, action=REKEY_REMOVE) == 0
+    assert key_slots(path)[0] is None
+    assert not _opens(path, PASSWORD, tmp_path) and _opens(path, NEW_PASSWORD, tmp_path)
+
+    with pytest.raises(Exception, match='only password'):
+        _rekey(path, NEW_PASSWORD, action=REKEY_REMOVE)
+
+
+def test_slots_run_out(encrypted):
+    _, path = encrypted
+    for index in range(1, KEY_SLOTS):
+        assert _rekey(path, PASSWORD, f'{NEW_PASSWORD} {index}', REKEY_ADD) == index
+    with pytest.raises(Exception, match='key slots are in use'):
+        _rekey(path, PASSWORD, NEW_PASSWORD, REKEY_ADD)
+
+
+def test_wrong_password_leaves_file_alone(encrypted):
+    _, path = encrypted
+    before = read(path)
+    with pytest.raises(Exception, match='Wrong password'):
+        _rekey(path, 'not the password', NEW_PASSWORD)
+    assert read(path) == before
+
+
+def test_legacy_files_cannot_be_rekeyed(make_file):
+    path = FileEncryptor(container=CONTAINER_LEGACY).encrypt_file(make_file(size=100), PASSWORD)
+    with pytest.raises(Exception, match='not a chunked container'):
+        _rekey(path, PASSWORD, NEW_PASSWORD)
+
+
+def test_bad_arguments():
+    with pytest.raises(ValueError):
+        Rekeyer(PASSWORD, NEW_PASSWORD, 'rotate')
+    with pytest.raises(ValueError):
+        Rekeyer(PASSWORD, action=REKEY_ADD)
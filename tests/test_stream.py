@@ -0,0 +1,123 @@
+import io
+import os
+import sys
+import hashlib
+import subprocess
+
+import pyaes
+import pytest
+
+from conftest import PASSWORD, ROOT, read
+from crypto.container import CONTAINER_CHUNKED, CONTAINER_LEGACY
+from crypto.decryptor import FileDecryptor
+from crypto.encryptor import FileEncryptor
+from crypto.stream import MIN_CHUNK_SIZE
+
+CHUNK = MIN_CHUNK_SIZE
+
+# Around the padding block and the streaming chunk boundaries
+SIZES = [0, 1, 15, 16, 17, CHUNK - 1, CHUNK, CHUNK + 1, 3 * CHUNK + 7]
+
+
+def _original_format(data: bytes, password: str) -> bytes:
+    """A legacy file the way the first release wrote it: salt, IV, AES-CBC with PKCS#7 padding"""
+    salt, iv = os.urandom(16), os.urandom(16)
+    key = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, 100000, 32)
+    aes = pyaes.AESModeOfOperationCBC(key, iv=iv)
+    padding = 16 - len(data) % 16
+    data += bytes([padding]) * padding
+    return salt + iv + b''.join(aes.encrypt(data[i:i + 16]) for i in range(0, len(data), 16))
+
+
+def _original_decrypt(blob: bytes, password: str) -> bytes:
+    key = hashlib.pbkdf2_hmac('sha256', password.encode(), blob[:16], 100000, 32)
+    aes = pyaes.AESModeOfOperationCBC(key, iv=blob[16:32])
+    data = b''.join(aes.decrypt(blob[i:i + 16]) for i in range(32, len(blob), 16))
+    return data[:-data[-1]]
+
+
+@pytest.mark.parametrize('size', SIZES)
+def test_round_trip(make_file, size):
+    path = make_file(size=size)
+    encrypted = FileEncryptor(CHUNK, container=CONTAINER_LEGACY).encrypt_file(path, PASSWORD)
+    assert os.path.getsize(encrypted) == 32 + (size // 16 + 1) * 16
+
+    output = FileDecryptor(CHUNK).decrypt_file(encrypted, PASSWORD)
+    assert read(output) == read(path)
+
+
+def test_decrypts_original_format(make_file, tmp_path):
+    data = os.urandom(5000)
+    path = make_file('old.Wh04ami', data=_original_format(data, PASSWORD))
+    output = FileDecryptor().decrypt_file(path, PASSWORD)
+    assert output == str(tmp_path / 'old') and read(output) == data
+
+
+def test_output_readable_by_original_format(make_file):
+    path = make_file(size=20000)
+    encrypted = FileEncryptor(CHUNK, container=CONTAINER_LEGACY).encrypt_file(path, PASSWORD)
+    assert _original_decrypt(read(encrypted), PASSWORD) == read(path)
+
+
+def test_default_output_path_keeps_source(make_file, tmp_path):
+    path = make_file('report.pdf', size=100)
+    encrypted = FileEncryptor().encrypt_file(path, PASSWORD)
+    assert encrypted == path + '.Wh04ami'
+    # The source is still there, so decryption picks a free name
+    output = FileDecryptor().decrypt_file(encrypted, PASSWORD)
+    assert output != path and read(output) == read(path)
+
+
+def test_truncated_file_fails(make_file, tmp_path):
+    path = make_file(size=1000)
+    encrypted = FileEncryptor().encrypt_file(path, PASSWORD)
+    with open(encrypted, 'rb+') as file:
+        file.truncate(os.path.getsize(encrypted) - 5)
+    with pytest.raises(Exception):
+        FileDecryptor().decrypt_file(encrypted, PASSWORD, str(tmp_path / 'out.bin'))
+    assert not (tmp_path / 'out.bin').exists()
+
+
+class _Pipe(io.RawIOBase):
+    """Non-seekable reader that hands out at most a few bytes per call, like a pipe"""
+
+    def __init__(self, data: bytes, piece: int = 7000):
+        self._data = memoryview(data)
+        self._piece = piece
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        count = min(len(buffer), self._piece, len(self._data))
+        buffer[:count] = self._data[:count]
+        self._data = self._data[count:]
+        return count
+
+
+@pytest.mark.parametrize('container', [CONTAINER_LEGACY, CONTAINER_CHUNKED])
+@pytest.mark.parametrize('size', [0, 17, CHUNK + 1])
+def test_stream_round_trip(tmp_path, container, size):
+    data = os.urandom(size)
+    encrypted = io.BytesIO()
+    assert FileEncryptor(CHUNK, container=container).encrypt_stream(_Pipe(data), encrypted, PASSWORD) == size
+
+    output = io.BytesIO()
+    assert FileDecryptor(CHUNK).decrypt_stream(_Pipe(encrypted.getvalue()), output, PASSWORD) == size
+    assert output.getvalue() == data
+
+    # Stream output is an ordinary encrypted file
+    path = tmp_path / 'stream.Wh04ami'
+    path.write_bytes(encrypted.getvalue())
+    assert read(FileDecryptor(CHUNK).decrypt_file(str(path), PASSWORD)) == data
+
+
+def test_cli_pipes(tmp_path):
+    data = os.urandom(CHUNK + 1000)
+    env = {**os.environ, 'WH04AMI_PASSWORD': PASSWORD}
+    main = os.path.join(ROOT, 'main.py')
+    encrypted = subprocess.run([sys.executable, main, 'encrypt', '-', '--container', 'chunked'], input=data,
+                               env=env, stdout=subprocess.PIPE, check=True).stdout
+    decrypted = subprocess.run([sys.executable, main, 'decrypt', '-'], input=encrypted, env=env,
+                               stdout=subprocess.PIPE, check=True).stdout
+    assert decrypted == data
@@ -0,0 +1,88 @@
+import os
+
+import pytest
+
+from conftest import PASSWORD
+from crypto.batch import verify_files
+from crypto.container import CONTAINER_CHUNKED, CONTAINER_LEGACY
+from crypto.decryptor import FileDecryptor
+from crypto.encryptor import FileEncryptor
+from crypto.stream import MIN_CHUNK_SIZE
+
+CHUNK = MIN_CHUNK_SIZE
+SIZE = 3 * CHUNK + 100
+
+
+def _encrypt(make_file, container: str, size: int = SIZE, name: str = 'plain.bin') -> str:
+    return FileEncryptor(CHUNK, container=container).encrypt_file(make_file(name, size=size), PASSWORD)
+
+
+def _flip(path: str, offset: int):
+    with open(path, 'r+b') as file:
+        file.seek(offset)
+        byte = file.read(1)
+        file.seek(offset)
+        file.write(bytes([byte[0] ^ 1]))
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_chunked_is_authenticated(make_file, tmp_path, workers):
+    path = _encrypt(make_file, CONTAINER_CHUNKED)
+    before = sorted(os.listdir(tmp_path))
+    result = FileDecryptor(CHUNK, workers=workers).verify_file(path, PASSWORD)
+    assert result == {'container': CONTAINER_CHUNKED, 'size': SIZE, 'authenticated': True}
+    # Nothing is decrypted to disk
+    assert sorted(os.listdir(tmp_path)) == before
+
+
+def test_keyless_checks_structure_only(make_file):
+    path = _encrypt(make_file, CONTAINER_CHUNKED)
+    _flip(path, os.path.getsize(path) - 100)
+    result = FileDecryptor(CHUNK).verify_file(path)
+    assert result == {'container': CONTAINER_CHUNKED, 'size': SIZE, 'authenticated': False}
+    with pytest.raises(Exception, match='Verification failed'):
+        FileDecryptor(CHUNK).verify_file(path, PASSWORD)
+
+
+@pytest.mark.parametrize('offset', [-1, -CHUNK, 2 * CHUNK])
+def test_tampered_chunk_fails(make_file, offset):
+    path = _encrypt(make_file, CONTAINER_CHUNKED)
+    _flip(path, offset % os.path.getsize(path))
+    with pytest.raises(Exception, match='Verification failed'):
+        FileDecryptor(CHUNK, workers=2).verify_file(path, PASSWORD)
+
+
+def test_truncated_chunked_fails(make_file):
+    path = _encrypt(make_file, CONTAINER_CHUNKED)
+    with open(path, 'r+b') as file:
+        file.truncate(os.path.getsize(path) - CHUNK)
+    with pytest.raises(Exception, match='Verification failed'):
+        FileDecryptor(CHUNK).verify_file(path, PASSWORD)
+
+
+def test_wrong_password_fails(make_file):
+    path = _encrypt(make_file, CONTAINER_CHUNKED)
+    with pytest.raises(Exception, match='Wrong password'):
+        FileDecryptor(CHUNK).verify_file(path, 'wrong password')
+
+
+def test_legacy(make_file):
+    path = _encrypt(make_file, CONTAINER_LEGACY, size=1000)
+    assert FileDecryptor().verify_file(path) == {'container': CONTAINER_LEGACY, 'size': None,
+                                                 'authenticated': False}
+    # Legacy files have no MAC; the key and padding give the plaintext size
+    assert FileDecryptor().verify_file(path, PASSWORD)['size'] == 1000
+
+    with open(path, 'ab') as file:
+        file.write(b'x')
+    with pytest.raises(Exception, match='not 32 \\+ a multiple of 16'):
+        FileDecryptor().verify_file(path)
+
+
+def test_batch_reports_each_file(make_file):
+    good = _encrypt(make_file, CONTAINER_CHUNKED, size=1000, name='good.bin')
+    bad = _encrypt(make_file, CONTAINER_CHUNKED, size=1000, name='bad.bin')
+    _flip(bad, os.path.getsize(bad) - 1)
+    summary = verify_files([good, bad], PASSWORD, workers=1)
+    assert [result.path for result in summary.succeeded] == [good]
+    assert [result.path for result in summary.failed] == [bad]
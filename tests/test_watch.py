@@ -0,0 +1,135 @@
+import os
+import time
+import threading
+
+import pytest
+
+import crypto.encryptor
+from conftest import PASSWORD, read
+from crypto.container import CONTAINER_CHUNKED
+from crypto.decryptor import FileDecryptor
+from crypto.encryptor import FileEncryptor
+from crypto.watch import BACKEND_INOTIFY, BACKEND_POLL, FolderWatcher, _encrypt_watched, _signature
+from utils.file_handler import FileHandler
+
+# Generous, the watcher runs a KDF and starts a process pool first
+TIMEOUT = 30.0
+
+
+def _watcher(folder, **options) -> FolderWatcher:
+    return FolderWatcher(str(folder), PASSWORD, debounce=0.1, poll_interval=0.1, workers=1, **options)
+
+
+def _options(watcher: FolderWatcher) -> tuple:
+    """Options and session key as the watcher hands them to its workers"""
+    salt = os.urandom(16)
+    return watcher.options, (FileEncryptor()._derive_key(PASSWORD, salt), salt)
+
+
+def _decrypt(path: str, tmp_path) -> bytes:
+    return read(FileDecryptor().decrypt_file(path, PASSWORD, str(tmp_path / 'decrypted.bin')))
+
+
+def test_output_is_current(make_file, tmp_path):
+    path = make_file('in/data.bin', size=5000)
+    watcher = _watcher(tmp_path / 'in')
+    output = watcher._output_path(path)
+    assert not watcher._output_is_current(path, _signature(path))
+
+    FileEncryptor(container=CONTAINER_CHUNKED).encrypt_file(path, PASSWORD, output_path=output)
+    assert watcher._output_is_current(path, _signature(path))
+
+    # An output cut short by a crash is not taken as done
+    with open(output, 'r+b') as file:
+        file.truncate(os.path.getsize(output) - 100)
+    assert not watcher._output_is_current(path, _signature(path))
+
+    # Nor is one older than the source
+    FileEncryptor(container=CONTAINER_CHUNKED).encrypt_file(path, PASSWORD, output_path=output)
+    os.utime(output, (0, 0))
+    assert not watcher._output_is_current(path, _signature(path))
+
+
+def test_encrypt_watched(make_file, tmp_path):
+    path = make_file('in/data.bin', size=5000)
+    watcher = _watcher(tmp_path / 'in', output_dir=str(tmp_path / 'out'))
+    output = watcher._output_path(path)
+    result = _encrypt_watched(path, output, PASSWORD, *_options(watcher), remove_source=True)
+
+    assert result.ok and result.output == output
+    assert os.listdir(tmp_path / 'out') == ['data.bin.Wh04ami']
+    assert not os.path.exists(path)
+    assert len(_decrypt(output, tmp_path)) == 5000
+
+
+def test_failed_encryption_leaves_nothing(monkeypatch, make_file, tmp_path):
+    path = make_file('in/data.bin', size=5000)
+    watcher = _watcher(tmp_path / 'in', output_dir=str(tmp_path / 'out'))
+
+    def encrypt_file(self, file_path, password, session=None, output_path=None):
+        with open(output_path, 'wb') as file:
+            file.write(b'partial')
+        raise OSError("disk full")
+
+    monkeypatch.setattr(crypto.encryptor.FileEncryptor, 'encrypt_file', encrypt_file)
+    result = _encrypt_watched(path, watcher._output_path(path), PASSWORD, *_options(watcher), remove_source=True)
+    assert result.error == "disk full"
+    assert os.listdir(tmp_path / 'out') == []
+    assert os.path.exists(path)
+
+
+def _run_until(watcher: FolderWatcher, results: list, count: int, linger: float = 0.0):
+    """Run the watcher until count files are done, plus linger seconds for any extra ones"""
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    try:
+        deadline = time.monotonic() + TIMEOUT
+        while len(results) < count and time.monotonic() < deadline:
+            time.sleep(0.05)
+        time.sleep(linger)
+    finally:
+        watcher.stop()
+        thread.join()
+
+
+@pytest.mark.parametrize('backend', [BACKEND_POLL, BACKEND_INOTIFY])
+def test_watch_encrypts_new_files(make_file, tmp_path, backend):
+    make_file('in/existing.txt', data=b'already here')
+    make_file('in/.hidden.tmp', data=b'ignored')
+    results = []
+    watcher = _watcher(tmp_path / 'in', output_dir=str(tmp_path / 'out'), poll=backend == BACKEND_POLL,
+                       on_result=lambda result, latency: results.append(result))
+
+    def drop():
+        time.sleep(0.5)
+        make_file('in/sub/new.txt', data=b'dropped in')
+    threading.Thread(target=drop).start()
+    _run_until(watcher, results, 2)
+
+    assert sorted(os.path.basename(result.path) for result in results) == ['existing.txt', 'new.txt']
+    assert all(result.ok for result in results)
+    assert _decrypt(str(tmp_path / 'out' / 'sub' / 'new.txt.Wh04ami'), tmp_path) == b'dropped in'
+    assert not os.path.exists(tmp_path / 'out' / '.hidden.tmp.Wh04ami')
+    assert watcher.stats.encrypted == 2
+
+
+def test_restart_skips_complete_outputs(make_file, tmp_path):
+    path = make_file('in/data.bin', size=5000)
+    watcher = _watcher(tmp_path / 'in', poll=True)
+    output = watcher._output_path(path)
+    FileEncryptor(container=CONTAINER_CHUNKED).encrypt_file(path, PASSWORD, output_path=output)
+    leftover = make_file('in/other.bin', size=5000)
+    with open(watcher._output_path(leftover), 'wb') as file:
+        file.write(b'truncated by a crash')
+
+    results = []
+    watcher.on_result = lambda result, latency: results.append(result)
+    _run_until(watcher, results, 1, linger=0.5)
+    assert [result.path for result in results] == [leftover]
+    assert _decrypt(watcher._output_path(leftover), tmp_path) == read(leftover)
+
+
+def test_secure_delete(make_file):
+    path = make_file(size=100000)
+    FileHandler().secure_delete(path)
+    assert not os.path.exists(path)
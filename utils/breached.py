@@ -0,0 +1,147 @@
+import os
+import math
+import mmap
+import struct
+import hashlib
+import secrets
+
+MAGIC = b'WH04BLF'
+VERSION = 1
+
+# magic, version, hash count, bit count, entry count
+_HEADER = struct.Struct('>7sBB7xQQ')
+HEADER_SIZE = _HEADER.size
+
+DEFAULT_FP_RATE = 0.001
+MAX_HASHES = 30
+
+
+def _hashes(word: bytes) -> tuple:
+    """Two independent 64-bit hashes; the k probe positions are h1 + i * h2"""
+    digest = hashlib.blake2b(word, digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+
+def filter_size(entries: int, fp_rate: float = DEFAULT_FP_RATE) -> tuple:
+    """
+    Optimal Bloom filter shape for a number of entries
+
+    Returns:
+        tuple: (bit count, hash count)
+    """
+    if not 0 < fp_rate < 1:
+        raise ValueError("False positive rate must be between 0 and 1")
+    entries = max(1, entries)
+    bits = max(64, math.ceil(-entries * math.log(fp_rate) / math.log(2) ** 2))
+    hashes = min(MAX_HASHES, max(1, round(bits / entries * math.log(2))))
+    return bits, hashes
+
+
+class BreachedPasswordFilter:
+    """
+    Memory-mapped Bloom filter of breached or common passwords
+
+    A lookup hashes the password once and tests a fixed number of bits,
+    so it costs the same for ten thousand entries as for a hundred
+    million. The file is mapped read-only and only the pages a lookup
+    touches are read, so opening is instant and resident memory stays
+    small however large the list. A miss is certain; a hit is wrong with
+    the false positive rate the filter was built for (0.1% by default).
+
+    Build a filter from a plain wordlist with build_filter() or
+    `main.py passwd build-filter`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as file:
+            header = file.read(HEADER_SIZE)
+            if len(header) < HEADER_SIZE:
+                raise Exception(f"Not a breached-password filter: {path}")
+            magic, version, self.hashes, self.bits, self.entries = _HEADER.unpack(header)
+            if magic != MAGIC:
+                raise Exception(f"Not a breached-password filter: {path}")
+            if version != VERSION:
+                raise Exception(f"Unsupported filter version {version}")
+            size = os.fstat(file.fileno()).st_size
+            if not 1 <= self.hashes <= MAX_HASHES or HEADER_SIZE + (self.bits + 7) // 8 > size:
+                raise Exception(f"Corrupted breached-password filter: {path}")
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(self._map, 'madvise'):
+            # Lookups land on random pages; readahead would only pull in unused ones
+            self._map.madvise(mmap.MADV_RANDOM)
+
+    def __contains__(self, password) -> bool:
+        # surrogateescape round-trips passwords read from files that are not valid UTF-8
+        word = password.encode('utf-8', 'surrogateescape') if isinstance(password, str) else password
+        h1, h2 = _hashes(word)
+        bits, data = self.bits, self._map
+        for i in range(self.hashes):
+            position = (h1 + i * h2) % bits
+            if not data[HEADER_SIZE + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def __len__(self) -> int:
+        return self.entries
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _wordlist_lines(paths: list):
+    """Non-empty lines of the wordlists as bytes, without line endings"""
+    for path in paths:
+        with open(path, 'rb') as file:
+            for line in file:
+                line = line.rstrip(b'\r\n')
+                if line:
+                    yield line
+
+
+def build_filter(wordlists: list, output_path: str, fp_rate: float = DEFAULT_FP_RATE,
+                 expected: int = None) -> int:
+    """
+    Build a breached-password filter from plain wordlists (one password per line)
+
+    The wordlists are read twice, once to count the entries and once to
+    set their bits, unless expected gives the count up front. Bits are
+    set directly in a memory map of the output, so building a filter
+    for 100M entries does not need the filter in RAM. The file is
+    written under a temporary name and renamed into place when complete.
+
+    Returns:
+        int: Number of entries added
+    """
+    if expected is None:
+        expected = sum(1 for _ in _wordlist_lines(wordlists))
+    bits, hashes = filter_size(expected, fp_rate)
+
+    temp_path = f"{output_path}.{secrets.token_hex(4)}.tmp"
+    added = 0
+    try:
+        with open(temp_path, 'w+b') as file:
+            file.truncate(HEADER_SIZE + (bits + 7) // 8)
+            with mmap.mmap(file.fileno(), 0) as data:
+                for word in _wordlist_lines(wordlists):
+                    h1, h2 = _hashes(word)
+                    for i in range(hashes):
+                        position = (h1 + i * h2) % bits
+                        data[HEADER_SIZE + (position >> 3)] |= 1 << (position & 7)
+                    added += 1
+                data[:HEADER_SIZE] = _HEADER.pack(MAGIC, VERSION, hashes, bits, added)
+                data.flush()
+        os.replace(temp_path, output_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    return added
@@ -1,8 +1,34 @@
 import os
+import heapq
+import fnmatch
 import datetime
-from rich.console import Console
 
-console = Console()
+ENCRYPTED_EXTENSIONS = ('.Wh04ami', '.encrypted')
+# Partial outputs and checkpoints of resumable encryptions, plus the batch manifest
+STATE_SUFFIXES = ('.Wh04ami.part', '.Wh04ami.part.ckpt', '.wh04ami-manifest.db', '.wh04ami-manifest.db-journal')
+
+# Formats whose contents are compressed already, by kind (lower case)
+IMAGE_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic'})
+VIDEO_EXTENSIONS = frozenset({'.mp4', '.mkv', '.avi', '.mov', '.webm'})
+AUDIO_EXTENSIONS = frozenset({'.mp3', '.m4a', '.ogg'})
+# Zip-based document and package formats count as archives
+ARCHIVE_EXTENSIONS = frozenset({'.zip', '.docx', '.xlsx', '.pptx', '.apk', '.jar',
+                                '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.zst', '.lz4'})
+
+# Entries held back for largest-first ordering while walking
+SCHEDULE_WINDOW = 4096
+# Write size when overwriting a file before deleting it
+SECURE_DELETE_BLOCK = 1024 * 1024
+
+_console_instance = None
+
+def _console():
+    """rich console, created on first use to keep it out of CLI startup"""
+    global _console_instance
+    if _console_instance is None:
+        from rich.console import Console
+        _console_instance = Console()
+    return _console_instance
 
 class FileHandler:
     def __init__(self):
@@ -43,19 +69,111 @@ class FileHandler:
         except Exception as e:
             return {'error': str(e)}
     
-    def get_files_in_folder(self, folder_path: str) -> list:
-        """Get all files in a folder (excluding subdirectories)"""
+    def get_files_in_folder(self, folder_path: str, recursive: bool = False) -> list:
+        """Get all files in a folder (subdirectories only when recursive)"""
         try:
-            files = []
-            for item in os.listdir(folder_path):
-                item_path = os.path.join(folder_path, item)
-                if os.path.isfile(item_path):
-                    files.append(item_path)
-            return files
+            return [path for path, size in self.walk_files(
+                folder_path, recursive=recursive, skip_encrypted=False, largest_first=False
+            )]
         except Exception as e:
-            console.print(f"[red]Error reading folder: {str(e)}[/red]")
+            _console().print(f"[red]Error reading folder: {str(e)}[/red]")
             return []
     
+    def walk_files(self, folder_path: str, include=None, exclude=None, recursive: bool = True,
+                   skip_encrypted: bool = True, largest_first: bool = True,
+                   window: int = SCHEDULE_WINDOW):
+        """
+        Walk a folder tree with os.scandir, yielding (path, size) pairs
+        
+        Sizes come from the cached DirEntry stat, so no extra stat call is
+        made per file. Discovery streams: with largest_first, files are
+        held in a bounded window and the largest is yielded first, which
+        keeps parallel workers finishing at about the same time.
+        
+        Args:
+            folder_path: Root folder
+            include: Glob patterns a file name or relative path must match
+            exclude: Glob patterns for files and folders to skip
+            recursive: Descend into subdirectories
+            skip_encrypted: Skip files that are already encrypted
+            largest_first: Order files by size, largest first, within the window
+            window: Number of files held back for ordering
+        """
+        files = self._scan(folder_path, include or [], exclude or [], recursive, skip_encrypted)
+        if not largest_first:
+            yield from files
+            return
+        
+        heap = []
+        for path, size in files:
+            heapq.heappush(heap, (-size, path))
+            if len(heap) > window:
+                negative_size, largest = heapq.heappop(heap)
+                yield largest, -negative_size
+        while heap:
+            negative_size, largest = heapq.heappop(heap)
+            yield largest, -negative_size
+    
+    def _scan(self, folder_path: str, include: list, exclude: list, recursive: bool, skip_encrypted: bool):
+        """Iterative scandir walk yielding (path, size) in directory order"""
+        stack = [folder_path]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        relative = os.path.relpath(entry.path, folder_path)
+                        if self._matches(entry.name, relative, exclude):
+                            continue
+                        
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive:
+                                stack.append(entry.path)
+                            continue
+                        if not entry.is_file():
+                            continue
+                        
+                        if skip_encrypted and entry.name.endswith(ENCRYPTED_EXTENSIONS + STATE_SUFFIXES):
+                            continue
+                        if include and not self._matches(entry.name, relative, include):
+                            continue
+                        
+                        try:
+                            size = entry.stat().st_size
+                        except OSError:
+                            continue
+                        yield entry.path, size
+            except (PermissionError, FileNotFoundError) as e:
+                if directory == folder_path:
+                    raise
+                _console().print(f"[yellow]Skipping {directory}: {e.strerror}[/yellow]")
+    
+    def secure_delete(self, file_path: str, passes: int = 1):
+        """
+        Overwrite a file with random bytes, fsync it and delete it
+        
+        This only helps where writes land on the blocks the file already
+        uses: copy-on-write filesystems (btrfs, ZFS), snapshots, journals
+        that keep data and SSD wear levelling can all keep the old
+        contents around. Full-disk encryption is the reliable answer there.
+        """
+        size = os.path.getsize(file_path)
+        with open(file_path, 'r+b', buffering=0) as file:
+            for _ in range(passes):
+                file.seek(0)
+                remaining = size
+                while remaining:
+                    n = min(remaining, SECURE_DELETE_BLOCK)
+                    file.write(os.urandom(n))
+                    remaining -= n
+                os.fsync(file.fileno())
+        os.remove(file_path)
+    
+    def _matches(self, name: str, relative: str, patterns: list) -> bool:
+        """Check a file name or relative path against glob patterns"""
+        return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relative, pattern)
+                   for pattern in patterns)
+    
     def _get_file_type(self, file_path: str) -> str:
         """Determine file type based on extension"""
         ext = os.path.splitext(file_path)[1].lower()
@@ -71,10 +189,22 @@ class FileHandler:
             '.xls': 'Excel Spreadsheet',
             '.xlsx': 'Excel Spreadsheet',
             '.zip': 'Zip Archive',
-            '.encrypted': 'Encrypted File',
             '.py': 'Python Script',
             '.json': 'JSON File',
             '.xml': 'XML File'
         }
+        if ext in file_types:
+            return file_types[ext]
         
-        return file_types.get(ext, 'Unknown File Type')
+        # Other known formats by kind
+        kinds = (
+            ('Encrypted File', {extension.lower() for extension in ENCRYPTED_EXTENSIONS}),
+            ('Image', IMAGE_EXTENSIONS),
+            ('Video', VIDEO_EXTENSIONS),
+            ('Audio', AUDIO_EXTENSIONS),
+            ('Archive', ARCHIVE_EXTENSIONS),
+        )
+        for kind, extensions in kinds:
+            if ext in extensions:
+                return kind
+        return 'Unknown File Type'
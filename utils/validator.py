@@ -1,12 +1,68 @@
 import os
 import re
+import time
 import secrets
 import string
 import hashlib
 
-class Validator:
+# Compiled once at import; the names are reported by audit_passwords()
+_COMMON_PATTERNS = [
+    ('all_numbers', re.compile(r'^[0-9]+$')),
+    ('all_letters', re.compile(r'^[a-zA-Z]+$')),
+    ('all_lowercase', re.compile(r'^[a-z]+$')),
+    ('all_uppercase', re.compile(r'^[A-Z]+$')),
+    ('sequence', re.compile(r'123456')),  # Sequential numbers
+    ('common_word', re.compile(r'password')),
+    ('keyboard', re.compile(r'qwerty')),
+]
+_SPECIAL_CHARS = frozenset(string.punctuation)
+
+# Passwords weaker than this are counted as weak in audits
+AUDIT_MIN_SCORE = 50
+
+
+class PasswordAudit:
+    """Outcome of auditing many passwords"""
+
     def __init__(self):
-        pass
+        self.checked = 0
+        self.weak = 0
+        self.breached = 0
+        self.issues = {}
+        self.elapsed = 0.0
+
+    def add(self, finding: dict):
+        self.checked += 1
+        if finding['weak']:
+            self.weak += 1
+        if 'breached' in finding['issues']:
+            self.breached += 1
+        for issue in finding['issues']:
+            self.issues[issue] = self.issues.get(issue, 0) + 1
+
+    @property
+    def rate(self) -> float:
+        """Passwords checked per second"""
+        return self.checked / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            'checked': self.checked,
+            'weak': self.weak,
+            'breached': self.breached,
+            'issues': dict(sorted(self.issues.items(), key=lambda item: -item[1])),
+            'elapsed': round(self.elapsed, 3),
+            'passwords_per_second': round(self.rate),
+        }
+
+
+class Validator:
+    def __init__(self, breached_filter=None):
+        # Optional BreachedPasswordFilter (or its path); listed passwords fail the common patterns check
+        if isinstance(breached_filter, str):
+            from utils.breached import BreachedPasswordFilter
+            breached_filter = BreachedPasswordFilter(breached_filter)
+        self.breached_filter = breached_filter
     
     def file_exists(self, file_path: str) -> bool:
         """Check if file exists"""
@@ -32,11 +88,11 @@ class Validator:
         has_upper = any(c.isupper() for c in password)
         has_lower = any(c.islower() for c in password)
         has_digit = any(c.isdigit() for c in password)
-        has_special = any(c in string.punctuation for c in password)
+        has_special = any(c in _SPECIAL_CHARS for c in password)
         
         # At least 3 of 4 criteria
         criteria_met = sum([has_upper, has_lower, has_digit, has_special])
-        return criteria_met >= 3
+        return criteria_met >= 3 and not self.is_breached(password)
     
     def check_password_strength(self, password: str) -> dict:
         """Comprehensive password strength analysis"""
@@ -45,7 +101,7 @@ class Validator:
             'uppercase': {'passed': any(c.isupper() for c in password), 'score': 10},
             'lowercase': {'passed': any(c.islower() for c in password), 'score': 10},
             'numbers': {'passed': any(c.isdigit() for c in password), 'score': 10},
-            'special_chars': {'passed': any(c in string.punctuation for c in password), 'score': 10},
+            'special_chars': {'passed': any(c in _SPECIAL_CHARS for c in password), 'score': 10},
             'common_patterns': {'passed': not self._is_common_pattern(password), 'score': 20}
         }
         
@@ -84,17 +140,63 @@ class Validator:
         """Generate SHA-256 hash of password"""
         return hashlib.sha256(password.encode()).hexdigest()
     
+    def is_breached(self, password: str) -> bool:
+        """Check the password (and its lowercase form) against the breached-password filter"""
+        if self.breached_filter is None:
+            return False
+        return password in self.breached_filter or password.lower() in self.breached_filter
+    
+    def _common_patterns(self, password: str) -> list:
+        """Names of the common patterns the password matches"""
+        password_lower = password.lower()
+        return [name for name, pattern in _COMMON_PATTERNS if pattern.search(password_lower)]
+    
     def _is_common_pattern(self, password: str) -> bool:
-        """Check for common password patterns"""
-        common_patterns = [
-            r'^[0-9]+$',  # All numbers
-            r'^[a-zA-Z]+$',  # All letters
-            r'^[a-z]+$',  # All lowercase
-            r'^[A-Z]+$',  # All uppercase
-            r'123456',  # Sequential numbers
-            r'password',  # Common words
-            r'qwerty',  # Keyboard patterns
-        ]
-        
+        """Check for common password patterns and breached passwords"""
         password_lower = password.lower()
-        return any(re.search(pattern, password_lower) for pattern in common_patterns)
+        return (any(pattern.search(password_lower) for _, pattern in _COMMON_PATTERNS)
+                or self.is_breached(password))
+    
+    def audit_passwords(self, passwords, on_finding=None) -> PasswordAudit:
+        """
+        Check many passwords, e.g. every line of a password export
+        
+        Args:
+            passwords: Iterable of passwords, or of (source, password) pairs
+            on_finding: Called with a dict for each weak password: source,
+                score, rating and the names of the failed checks; the
+                password itself is not included
+            
+        Returns:
+            PasswordAudit: Counts of weak and breached passwords and of each issue
+        """
+        audit = PasswordAudit()
+        start = time.perf_counter()
+        for index, item in enumerate(passwords):
+            source, password = item if isinstance(item, tuple) else (index, item)
+            strength = self.check_password_strength(password)
+            overall = strength.pop('overall')
+            issues = [metric for metric, data in strength.items() if not data['passed']]
+            if 'common_patterns' in issues:
+                issues.remove('common_patterns')
+                issues.extend(self._common_patterns(password))
+                if self.is_breached(password):
+                    issues.append('breached')
+            finding = {'source': source, 'score': overall['score'], 'rating': overall['rating'],
+                       'issues': issues, 'weak': overall['score'] < AUDIT_MIN_SCORE or 'breached' in issues}
+            audit.add(finding)
+            if finding['weak'] and on_finding is not None:
+                on_finding(finding)
+        audit.elapsed = time.perf_counter() - start
+        return audit
+    
+    def audit_files(self, paths: list, on_finding=None) -> PasswordAudit:
+        """Audit password files with one password per line; sources are 'path:line'"""
+        def lines():
+            for path in paths:
+                with open(path, 'r', encoding='utf-8', errors='surrogateescape') as file:
+                    for number, line in enumerate(file, 1):
+                        password = line.rstrip('\r\n')
+                        if password:
+                            yield f"{path}:{number}", password
+        return self.audit_passwords(lines(), on_finding)